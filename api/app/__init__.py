@@ -32,7 +32,28 @@ COUNT_MODE = os.getenv("COUNT_MODE", "FULL")
 COUNT_ESTIMATE_THRESHOLD = int(os.getenv("COUNT_ESTIMATE_THRESHOLD", 10000))
 TOP_VALUE = int(os.getenv("TOP_VALUE", 100))
 PARTITION_CHUNK = int(os.getenv("PARTITION_CHUNK", 10000))
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", 1024))
+AGGREGATE_ROLLUPS = int(os.getenv("AGGREGATE_ROLLUPS", "1"), 0)
+DEFERRED_RANGES = int(os.getenv("DEFERRED_RANGES", "0"), 0)
+INGEST_QUEUE = int(os.getenv("INGEST_QUEUE", "0"), 0)
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 1000))
+INGEST_FLUSH_INTERVAL = float(os.getenv("INGEST_FLUSH_INTERVAL", 0.05))
+INGEST_ACK = os.getenv("INGEST_ACK", "ACCEPTED")
+DELETE_BATCH_SIZE = int(os.getenv("DELETE_BATCH_SIZE", 10000))
+LIVE_OBSERVATIONS = int(os.getenv("LIVE_OBSERVATIONS", "0"), 0)
+LIVE_QUEUE_SIZE = int(os.getenv("LIVE_QUEUE_SIZE", 1000))
+LIVE_FLUSH_INTERVAL = float(os.getenv("LIVE_FLUSH_INTERVAL", 0.1))
 REDIS = int(os.getenv("REDIS", "0"), 0)
+REDIS_HOST = os.getenv("REDIS_HOST", "redis")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_POOL_SIZE = int(os.getenv("REDIS_POOL_SIZE", 50))
+REDIS_TIMEOUT = float(os.getenv("REDIS_TIMEOUT", 0.25))
+REDIS_BREAKER_THRESHOLD = int(os.getenv("REDIS_BREAKER_THRESHOLD", 5))
+REDIS_BREAKER_COOLDOWN = float(os.getenv("REDIS_BREAKER_COOLDOWN", 30))
+RESPONSE_CACHE = int(os.getenv("RESPONSE_CACHE", "0"), 0)
+RESPONSE_CACHE_TTL = int(os.getenv("RESPONSE_CACHE_TTL", 300))
+RESPONSE_CACHE_MAX_SIZE = int(os.getenv("RESPONSE_CACHE_MAX_SIZE", 1048576))
 EPSG = int(os.getenv("EPSG", 4326))
 ST_AGGREGATE = os.getenv("ST_AGGREGATE", "CONVEX_HULL")
 AUTHORIZATION = int(os.getenv("AUTHORIZATION", 0))
@@ -12,12 +12,146 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import redis
+import logging
+import time
+from contextlib import asynccontextmanager
 
-redis = redis.Redis(host="redis")
+from app import (
+    REDIS_BREAKER_COOLDOWN,
+    REDIS_BREAKER_THRESHOLD,
+    REDIS_HOST,
+    REDIS_POOL_SIZE,
+    REDIS_PORT,
+    REDIS_TIMEOUT,
+)
+from redis import asyncio as aioredis
+from redis.exceptions import ConnectionError, RedisError
 
+logger = logging.getLogger(__name__)
 
-def remove_cache(path):
+redis: aioredis.Redis | None = None
+
+
+class RedisUnavailable(ConnectionError):
+    """
+    Raised without contacting Redis while the circuit breaker is open.
+    """
+
+
+class CircuitBreaker:
+    """
+    Stop calling Redis after repeated failures.
+
+    After `threshold` consecutive failures the breaker opens and every call
+    fails immediately for `cooldown` seconds. Then a single trial call is
+    let through, while the others keep failing: its success closes the
+    breaker, its failure opens it again.
+
+    Attributes:
+        threshold (int): The consecutive failures that open the breaker.
+        cooldown (float): The seconds the breaker stays open.
+        failures (int): The current consecutive failures.
+        opened_at (float): The monotonic time the breaker opened, or None.
+        trial (bool): Whether the trial call is in flight.
+    """
+
+    def __init__(self, threshold, cooldown):
+        self.threshold = threshold
+        self.cooldown = cooldown
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def allow(self):
+        """
+        Return whether a call may be made.
+
+        Returns:
+            bool: False while the breaker is open, except for the trial
+                call once the cooldown is over.
+        """
+        if self.opened_at is None:
+            return True
+        if self.trial or time.monotonic() - self.opened_at < self.cooldown:
+            return False
+        self.trial = True
+        return True
+
+    def success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.trial = False
+
+    def failure(self):
+        self.failures += 1
+        if self.trial:
+            # The trial call failed: wait for another cooldown
+            self.trial = False
+            self.opened_at = time.monotonic()
+        elif self.failures >= self.threshold and self.opened_at is None:
+            logger.warning(
+                "Redis failed %s times, not calling it for %s seconds",
+                self.failures,
+                self.cooldown,
+            )
+            self.opened_at = time.monotonic()
+
+    def release(self):
+        """
+        End a call that neither succeeded nor failed on Redis, so that the
+        next call can be the trial if this one was.
+        """
+        self.trial = False
+
+
+breaker = CircuitBreaker(REDIS_BREAKER_THRESHOLD, REDIS_BREAKER_COOLDOWN)
+
+
+def get_redis():
+    global redis
+    if redis is None:
+        pool = aioredis.BlockingConnectionPool(
+            host=REDIS_HOST,
+            port=REDIS_PORT,
+            max_connections=REDIS_POOL_SIZE,
+            timeout=REDIS_TIMEOUT,
+            socket_timeout=REDIS_TIMEOUT,
+            socket_connect_timeout=REDIS_TIMEOUT,
+        )
+        redis = aioredis.Redis(connection_pool=pool)
+    return redis
+
+
+async def close_redis():
+    global redis
+    if redis is not None:
+        await redis.aclose(close_connection_pool=True)
+        redis = None
+
+
+@asynccontextmanager
+async def redis_client():
+    """
+    Yield the Redis client, guarded by the circuit breaker.
+
+    Raises:
+        RedisUnavailable: If the circuit breaker is open.
+        RedisError: If a command of the block fails or times out.
+    """
+    if not breaker.allow():
+        raise RedisUnavailable("Redis is unavailable")
+    try:
+        yield get_redis()
+    except RedisError:
+        breaker.failure()
+        raise
+    except BaseException:
+        breaker.release()
+        raise
+    breaker.success()
+
+
+async def remove_cache(path):
     """
     Remove the cache for the specified path.
 
@@ -27,15 +161,9 @@ def remove_cache(path):
     Returns:
         None
     """
-    # Pattern da cercare nelle chiavi (ad esempio 'testop')
     pattern = "*{}*".format(path)
 
-    # Itera su tutte le chiavi che corrispondono al pattern
-    cursor = 0
-    while True:
-        cursor, keys = redis.scan(cursor=cursor, match=pattern)
+    async with redis_client() as client:
+        keys = [key async for key in client.scan_iter(match=pattern)]
         if keys:
-            # Cancella le chiavi trovate
-            redis.delete(*keys)
-        if cursor == 0:
-            break
+            await client.delete(*keys)
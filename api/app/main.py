@@ -17,10 +17,20 @@ import logging
 from contextlib import asynccontextmanager
 
 import asyncpg
-from app import HOSTNAME, POSTGRES_PORT_WRITE, SUBPATH, VERSION
+from app import (
+    HOSTNAME,
+    INGEST_QUEUE,
+    LIVE_OBSERVATIONS,
+    POSTGRES_PORT_WRITE,
+    SUBPATH,
+    VERSION,
+)
 from app.db.asyncpg_db import get_pool, get_pool_w
+from app.db.redis_db import close_redis
 from app.settings import serverSettings, tables
 from app.v1 import api
+from app.v1.endpoints.create.ingest_queue import ingest_queue
+from app.v1.endpoints.read.live_observations import observation_hub
 from fastapi import FastAPI
 
 logger = logging.getLogger(__name__)
@@ -58,7 +68,14 @@ async def initialize_pool():
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await initialize_pool()
+    if INGEST_QUEUE:
+        ingest_queue.start()
+    if LIVE_OBSERVATIONS:
+        observation_hub.start()
     yield
+    await observation_hub.stop()
+    await ingest_queue.stop()
+    await close_redis()
 
 
 app = FastAPI(
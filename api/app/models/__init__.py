@@ -24,6 +24,7 @@ from .location_traveltime import LocationTravelTime
 from .network import Network
 from .network_traveltime import NetworkTravelTime
 from .observation import Observation
+from .observation_rollup import ObservationDaily, ObservationHourly
 from .observation_traveltime import ObservationTravelTime
 from .observed_property import ObservedProperty
 from .observed_property_traveltime import ObservedPropertyTravelTime
@@ -52,4 +53,6 @@ __all__ = [
     "DatastreamTravelTime",
     "FeaturesOfInterestTravelTime",
     "ObservationTravelTime",
+    "ObservationHourly",
+    "ObservationDaily",
 ]
@@ -0,0 +1,53 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from app.db.sqlalchemy_db import SCHEMA_NAME, Base
+from sqlalchemy.dialects.postgresql.base import TIMESTAMP
+from sqlalchemy.orm import relationship
+from sqlalchemy.sql.schema import Column, ForeignKey
+from sqlalchemy.sql.sqltypes import BigInteger, Float, Integer
+
+
+class ObservationRollup:
+    """
+    The columns of a continuous aggregate of the Observation results, one
+    row per Datastream and time bucket.
+    """
+
+    datastream_id = Column(
+        Integer,
+        ForeignKey(f"{SCHEMA_NAME}.Datastream.id"),
+        primary_key=True,
+    )
+    phenomenon_time_start = Column(
+        "phenomenonTimeStart", TIMESTAMP, primary_key=True
+    )
+    result_sum = Column("resultSum", Float)
+    result_count = Column("resultCount", BigInteger)
+    result_min = Column("resultMin", Float)
+    result_max = Column("resultMax", Float)
+
+
+class ObservationHourly(ObservationRollup, Base):
+    __tablename__ = "Observation_hourly"
+    __table_args__ = {"schema": SCHEMA_NAME}
+
+    datastream = relationship("Datastream", viewonly=True)
+
+
+class ObservationDaily(ObservationRollup, Base):
+    __tablename__ = "Observation_daily"
+    __table_args__ = {"schema": SCHEMA_NAME}
+
+    datastream = relationship("Datastream", viewonly=True)
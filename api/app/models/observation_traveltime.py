@@ -32,7 +32,7 @@ class ObservationTravelTime(Base):
     commit_navigation_link = Column("Commit@iot.navigationLink", Text)
     phenomenon_time_start = Column("phenomenonTimeStart", TIMESTAMP)
     phenomenon_time_end = Column("phenomenonTimeEnd", TIMESTAMP)
-    result_time = Column("resultTime", TIMESTAMP, nullable=False)
+    result_time = Column("resultTime", TIMESTAMP)
     result = Column(JSON, nullable=True)
     result_string = Column("resultString", Text)
     result_number = Column("resultNumber", Float)
@@ -28,10 +28,11 @@ from app import (
     SECRET_KEY,
 )
 from app.db.asyncpg_db import get_pool
-from app.db.redis_db import redis
+from app.db.redis_db import redis_client
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
 from jwt.exceptions import InvalidTokenError
+from redis.exceptions import RedisError
 
 logger = logging.getLogger(__name__)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="Login")
@@ -171,6 +172,44 @@ def decode_token(token: str):
     return jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
 
 
+def revocation_unavailable():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Token revocation list unavailable",
+    )
+
+
+async def is_token_revoked(token: str) -> bool:
+    """
+    Return whether a token has been revoked by a logout or a refresh.
+
+    A token cannot be trusted while the revocation list is unreachable, so
+    the lookup fails with 503 instead of accepting it.
+    """
+    if not REDIS:
+        return False
+    try:
+        async with redis_client() as client:
+            return await client.get(token) is not None
+    except RedisError:
+        logger.exception("Could not read the token revocation list")
+        raise revocation_unavailable()
+
+
+async def revoke_token(token: str, reason: str, ttl: int):
+    """
+    Revoke a token until it expires.
+    """
+    if not REDIS:
+        return
+    try:
+        async with redis_client() as client:
+            await client.set(token, reason, ex=ttl)
+    except RedisError:
+        logger.exception("Could not write the token revocation list")
+        raise revocation_unavailable()
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -179,7 +218,7 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     )
 
     try:
-        if REDIS and redis.get(token) is not None:
+        if await is_token_revoked(token):
             raise HTTPException(
                 status_code=status.HTTP_401_UNAUTHORIZED,
                 detail="Token has been revoked",
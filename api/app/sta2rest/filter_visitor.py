@@ -748,25 +748,26 @@ class FilterVisitor(visitor.NodeVisitor):
     # Math Functions
     ####################################################################################
 
+    def result_number(self):
+        """The numeric result of the root model, if it has one."""
+        attribute = getattr(globals()[self.root_model], "result_number", None)
+        if attribute is None:
+            raise ex.InvalidFieldException("result")
+        return attribute
+
     def func_ceiling(self, field: ast._Node) -> functions.Function:
         if isinstance(field, ast.Identifier) and field.name == "result":
-            return functions.func.ceil(
-                getattr(globals()[self.root_model], "result_number")
-            )
+            return functions.func.ceil(self.result_number())
         return functions.func.ceil(self.visit(field))
 
     def func_floor(self, field: ast._Node) -> functions.Function:
         if isinstance(field, ast.Identifier) and field.name == "result":
-            return functions.func.floor(
-                getattr(globals()[self.root_model], "result_number")
-            )
+            return functions.func.floor(self.result_number())
         return functions.func.floor(self.visit(field))
 
     def func_round(self, field: ast._Node) -> functions.Function:
         if isinstance(field, ast.Identifier) and field.name == "result":
-            return functions.func.round(
-                getattr(globals()[self.root_model], "result_number")
-            )
+            return functions.func.round(self.result_number())
         return functions.func.round(self.visit(field))
 
     ####################################################################################
@@ -32,6 +32,7 @@ from .odata_query.exceptions import InvalidCollectionException
 from .sta_parser.ast import *
 from .sta_parser.lexer import Lexer
 from .sta_parser.parser import Parser
+from .translation_cache import translation_cache
 from .visitors import NodeVisitor
 
 
@@ -361,7 +362,21 @@ class STA2REST:
         return entity + "_id"
 
     @staticmethod
-    def convert_query(full_path: str) -> str:
+    def convert_query(full_path: str) -> dict:
+        """
+        Converts a STA query to SQL, reusing the cached translation of a
+        previous request with the same query shape when possible.
+
+        Args:
+            full_path (str): The STA request path, including the query.
+
+        Returns:
+            dict: The translated query.
+        """
+        return translation_cache.translate(full_path, STA2REST.translate_query)
+
+    @staticmethod
+    def translate_query(full_path: str) -> str:
         """
         Converts a STA query to a PostgREST query.
 
@@ -391,8 +406,7 @@ class STA2REST:
             None, None, None, None, None, None, None, None, None, None, False
         )
         if query:
-            lexer = Lexer(query)
-            tokens = lexer.tokenize()
+            tokens = Lexer(query).tokens
             parser = Parser(tokens)
             query_ast = parser.parse()
 
@@ -653,7 +667,9 @@ class STA2REST:
         return query_converted
 
     @staticmethod
-    def convert_filter_to_ids_query(full_path: str) -> str:
+    def convert_filter_to_ids_query(
+        full_path: str, distinct: bool = True
+    ) -> str:
         """
         Build a SQL statement that selects the DISTINCT primary-key ids of the
         entities a GET on ``full_path`` would return, using the SAME filter
@@ -672,13 +688,21 @@ class STA2REST:
         visitor raise, which the caller maps to HTTP 400 (never 500), mirroring
         the GET error handling.
 
+        Args:
+            full_path (str): The path and query of the request.
+            distinct (bool): Whether to select the ids with ``DISTINCT``.
+                The ids are unique either way, as cross-entity filters are
+                semi-joins; without it a ``LIMIT`` over the query can stop
+                early.
+
         Returns:
             str: a ``SELECT DISTINCT "<table>".id FROM ... WHERE <filter>`` SQL
             string (literal-bound), or ``None`` when there is no filter.
         """
         import app.models as models
         from app.db.sqlalchemy_db import engine
-        from sqlalchemy import distinct, select
+        from sqlalchemy import select
+        from sqlalchemy import distinct as sql_distinct
 
         path = full_path
         query = None
@@ -695,8 +719,7 @@ class STA2REST:
             None, None, None, None, None, None, None, None, None, None, False
         )
         if query:
-            lexer = Lexer(query)
-            tokens = lexer.tokenize()
+            tokens = Lexer(query).tokens
             parser = Parser(tokens)
             query_ast = parser.parse()
 
@@ -715,7 +738,7 @@ class STA2REST:
             query_ast.filter, main_entity
         )
 
-        id_query = select(distinct(id_attr))
+        id_query = select(sql_distinct(id_attr) if distinct else id_attr)
 
         if join_relationships:
             # Identical semi-join semantics to NodeVisitor.visit_QueryNode: a
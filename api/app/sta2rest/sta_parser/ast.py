@@ -228,6 +228,26 @@ class SkipNode(Node):
         self.count = count
 
 
+class SkipTokenNode(Node):
+    """
+    A class representing a skip token node.
+
+    Inherits from Node.
+
+    Attributes:
+    token (str): The opaque continuation token.
+    """
+
+    def __init__(self, token):
+        """
+        Initializes a SkipTokenNode object.
+
+        Args:
+        token (str): The opaque continuation token.
+        """
+        self.token = token
+
+
 class TopNode(Node):
     """
     A class representing a top node.
@@ -330,6 +350,46 @@ class ResultFormatNode(Node):
         self.value = value
 
 
+class AggregateNode(Node):
+    """
+    A class representing an aggregate node.
+
+    Inherits from Node.
+
+    Attributes:
+    functions (list): The names of the aggregate functions.
+    """
+
+    def __init__(self, functions):
+        """
+        Initializes an AggregateNode object.
+
+        Args:
+        functions (list): The names of the aggregate functions.
+        """
+        self.functions = functions
+
+
+class IntervalNode(Node):
+    """
+    A class representing an interval node.
+
+    Inherits from Node.
+
+    Attributes:
+    value (str): The ISO 8601 duration of the interval.
+    """
+
+    def __init__(self, value):
+        """
+        Initializes an IntervalNode object.
+
+        Args:
+        value (str): The ISO 8601 duration of the interval.
+        """
+        self.value = value
+
+
 class QueryNode(Node):
     """
     A class representing a query node.
@@ -345,6 +405,9 @@ class QueryNode(Node):
     top (TopNode, optional): The top node.
     count (CountNode, optional): The count node.
     is_subquery (bool): Indicates if the query is a subquery.
+    skip_token (SkipTokenNode, optional): The skip token node.
+    aggregate (AggregateNode, optional): The aggregate node.
+    interval (IntervalNode, optional): The interval node.
     """
 
     def __init__(
@@ -360,6 +423,9 @@ class QueryNode(Node):
         from_to=None,
         result_format=None,
         is_subquery=False,
+        skip_token=None,
+        aggregate=None,
+        interval=None,
     ):
         """
         Initializes a QueryNode object.
@@ -373,6 +439,9 @@ class QueryNode(Node):
         top (TopNode, optional): The top node.
         count (CountNode, optional): The count node.
         is_subquery (bool): Indicates if the query is a subquery.
+        skip_token (SkipTokenNode, optional): The skip token node.
+        aggregate (AggregateNode, optional): The aggregate node.
+        interval (IntervalNode, optional): The interval node.
         """
         self.select = select
         self.filter = filter
@@ -385,3 +454,6 @@ class QueryNode(Node):
         self.from_to = from_to
         self.result_format = result_format
         self.is_subquery = is_subquery
+        self.skip_token = skip_token
+        self.aggregate = aggregate
+        self.interval = interval
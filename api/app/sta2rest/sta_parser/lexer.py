@@ -26,6 +26,7 @@ TOKEN_TYPES = {
     "COUNT": r"\$count=",
     "TOP": r"\$top=",
     "SKIP": r"\$skip=",
+    "SKIPTOKEN": r"\$skiptoken=",
     "SELECT": r"\$select=",
     "FILTER": r"\$filter=",
     "EXPAND": r"\$expand=",
@@ -34,6 +35,8 @@ TOKEN_TYPES = {
     "FROMTO": r"\$from_to=",
     "RESULT_FORMAT": r"\$resultFormat=",
     "RESULT_FORMAT_VALUE": r"\bdataArray\b",
+    "AGGREGATE": r"\$aggregate=",
+    "INTERVAL": r"\$interval=",
     "SUBQUERY_SEPARATOR": r";",
     "VALUE_SEPARATOR": r",",
     "OPTIONS_SEPARATOR": r"&",
@@ -55,6 +58,15 @@ TOKEN_TYPES = {
     "MINUS": r"-",
 }
 
+# A single alternation of the token types, tried in the order above: the
+# first alternative that matches wins, as with one match per type.
+TOKEN_REGEX = re.compile(
+    "|".join(
+        f"(?P<{token_type}>{pattern})"
+        for token_type, pattern in TOKEN_TYPES.items()
+    )
+)
+
 
 class Token:
     """A class representing a token."""
@@ -116,26 +128,21 @@ class Lexer:
         """
         tokens = []
         position = 0
+        text = self.text
+        match_token = TOKEN_REGEX.match
 
-        while position < len(self.text):
-            match = None
-
-            for token_type, pattern in TOKEN_TYPES.items():
-                regex = re.compile(pattern)
-                match = regex.match(self.text, position)
-
-                if match:
-                    value = match.group(0)
-                    token = Token(token_type, value)
-                    tokens.append(token)
-                    position = match.end(0)
-                    break
+        while position < len(text):
+            match = match_token(text, position)
 
             if not match:
                 raise Exception(
-                    f"Invalid character at position {position}: {self.text[position]}"
+                    f"Invalid character at position {position}: {text[position]}"
                 )
 
+            # The outer named group closes last, so it is the last group
+            tokens.append(Token(match.lastgroup, match.group()))
+            position = match.end()
+
         return tokens
 
     def __str__(self):
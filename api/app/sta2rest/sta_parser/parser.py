@@ -21,6 +21,9 @@ Author: Filippo Finke
 from . import ast
 from .lexer import Lexer
 
+# $resultFormat values returned as typed columns instead of JSON
+COLUMNAR_RESULT_FORMATS = ("csv", "arrow", "parquet")
+
 
 class Parser:
     def __init__(self, tokens):
@@ -231,6 +234,25 @@ class Parser:
         self.match("INTEGER")
         return ast.SkipNode(count)
 
+    def parse_skiptoken(self):
+        """
+        Parse a skiptoken expression.
+
+        Returns:
+            ast.SkipTokenNode: The parsed skiptoken expression.
+        """
+        self.match("SKIPTOKEN")
+        token = ""
+
+        # The token is opaque: join whatever the lexer split it into
+        while self.current_token != None and not self.check_token(
+            "OPTIONS_SEPARATOR"
+        ):
+            token += self.current_token.value
+            self.next_token()
+
+        return ast.SkipTokenNode(token)
+
     def parse_top(self):
         """
         Parse a top expression.
@@ -313,9 +335,47 @@ class Parser:
         """
         self.match("RESULT_FORMAT")
         value = self.current_token.value
-        self.match("RESULT_FORMAT_VALUE")
+        # The columnar formats are plain identifiers to the lexer, so that
+        # properties with the same name are still lexed as identifiers
+        if (
+            self.current_token
+            and self.current_token.type == "EXPAND_IDENTIFIER"
+            and value in COLUMNAR_RESULT_FORMATS
+        ):
+            self.match("EXPAND_IDENTIFIER")
+        else:
+            self.match("RESULT_FORMAT_VALUE")
         return ast.ResultFormatNode(value)
 
+    def parse_aggregate(self):
+        """
+        Parse an aggregate expression.
+
+        Returns:
+            ast.AggregateNode: The parsed aggregate expression.
+        """
+        self.match("AGGREGATE")
+        functions = [
+            identifier.name for identifier in self.parse_identifier_list()
+        ]
+        return ast.AggregateNode(functions)
+
+    def parse_interval(self):
+        """
+        Parse an interval expression.
+
+        Returns:
+            ast.IntervalNode: The parsed interval expression.
+        """
+        self.match("INTERVAL")
+        value = self.current_token.value
+        # An ISO 8601 duration such as P1D or PT15M lexes as an identifier
+        if self.check_token("EXPAND_IDENTIFIER"):
+            self.match("EXPAND_IDENTIFIER")
+        else:
+            self.match("IDENTIFIER")
+        return ast.IntervalNode(value)
+
     def parse_subquery(self):
         """
         Parse a subquery.
@@ -402,6 +462,9 @@ class Parser:
         asof = None
         fromto = None
         result_format = None
+        skip_token = None
+        aggregate = None
+        interval = None
 
         # continue parsing until we reach the end of the query
         while self.current_token != None:
@@ -425,6 +488,12 @@ class Parser:
                 fromto = self.parse_fromto()
             elif self.current_token.type == "RESULT_FORMAT":
                 result_format = self.parse_result_format()
+            elif self.current_token.type == "SKIPTOKEN":
+                skip_token = self.parse_skiptoken()
+            elif self.current_token.type == "AGGREGATE":
+                aggregate = self.parse_aggregate()
+            elif self.current_token.type == "INTERVAL":
+                interval = self.parse_interval()
             else:
                 raise Exception(f"Unexpected token: {self.current_token.type}")
 
@@ -442,6 +511,9 @@ class Parser:
             asof,
             fromto,
             result_format,
+            skip_token=skip_token,
+            aggregate=aggregate,
+            interval=interval,
         )
 
     def parse(self):
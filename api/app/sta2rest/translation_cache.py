@@ -0,0 +1,530 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Per-worker cache of STA query translations keyed on the query shape.
+
+The shape of a request is its path and query options with the literal
+values lifted out: entity ids in the path, numbers and datetimes in $filter,
+the $skip value and the seek key values of a $skiptoken. Options are sorted,
+so their order does not matter. Integers of 32 bits or more are a kind of
+their own, as they are bound as BIGINT rather than INTEGER.
+String literals, $top, $expand, $select and $orderby are part of the shape,
+because the translator renders them into the SQL text.
+
+On a miss the shape is translated twice, once with the request literals and
+once with unique sentinel literals. Comparing the two translations tells
+which bind parameter slot each literal fills; if the translations differ in
+any other way the shape is remembered as uncacheable. A hit then only has to
+convert the request literals and drop them into the cached parameter vector.
+
+A shape can look uncacheable only because of the literals of the request
+that probed it, so the uncacheable mark expires: after
+UNCACHEABLE_RETRY_SECONDS a request of the shape probes it again, with the
+literals of that request and shifted sentinels.
+"""
+
+import json
+import re
+import time
+import urllib.parse
+from collections import OrderedDict
+
+from app import TRANSLATION_CACHE_SIZE
+from app.utils.utils import decode_skiptoken, encode_skiptoken
+from app.v1.endpoints.exceptions import BadRequest
+from dateutil.parser import isoparse
+
+# Options whose literals are lifted out of the shape
+LIFTED_OPTIONS = {"$filter", "$skip"}
+
+# Literals of a query option value, in the order the OData lexer sees them.
+# Typed literals (duration'...', geography'...'), strings, dates and names
+# are matched only to be skipped, so that digits inside them are not lifted.
+LITERAL_PATTERN = re.compile(
+    r"(?P<typed>(?:duration|geography)'(?:[^']|'')*')"
+    r"|(?P<string>'(?:[^']|'')*')"
+    r"|(?P<datetime>\d{4}-\d{2}-\d{2}(?:T|\s+)\d{2}:\d{2}(?::\d{2}(?:\.\d+)?)?"
+    r"(?:Z|[+-]\d{2}:?\d{2})?)"
+    r"|(?P<date>\d{4}-\d{2}-\d{2})"
+    r"|(?P<name>[a-z_@$][\w.@$]*)"
+    r"|(?P<number>-?\d+(?:\.\d+)?(?:e[-+]?\d+)?)",
+    re.I,
+)
+PATH_ID_PATTERN = re.compile(r"\((\d+)\)")
+OPTION_PATTERN = re.compile(r"'(?:[^']|'')*'|&|[^'&]+|'")
+DIGITS_PATTERN = re.compile(r"\d+")
+
+SENTINEL_NUMBER = 1900000000
+SENTINEL_BIGINT = 190000000000
+SENTINEL_YEAR = 1000
+
+UNCACHEABLE_RETRY_SECONDS = 60
+
+
+class QueryShape:
+    """
+    The shape of a request path and the literals lifted out of it.
+
+    Attributes:
+        key (str): The normalized shape, used as the cache key.
+        url (str): The request path with its options in normalized order.
+        literals (list): (kind, text) pairs of the lifted literals.
+    """
+
+    def __init__(self, full_path):
+        path = full_path
+        query = ""
+        if "?" in full_path:
+            path, query = full_path.split("?", 1)
+
+        self.literals = []
+        self.seek = None
+        self.path = path
+        path_key = PATH_ID_PATTERN.sub(self._lift_path_id, path)
+
+        options = sorted(
+            split_options(urllib.parse.unquote_plus(query)),
+            key=lambda option: option.split("=", 1)[0],
+        )
+        self.options = options
+        option_keys = [self._lift_option(option) for option in options]
+
+        self.key = path_key + "?" + "&".join(option_keys)
+        self.url = self.build_url([text for _, text in self.literals])
+
+    def _lift_path_id(self, match):
+        kind = int_kind(match.group(1))
+        self.literals.append((kind, match.group(1)))
+        return f"(\x00{kind})"
+
+    def _lift_option(self, option):
+        name, _, value = option.partition("=")
+        if name == "$skiptoken":
+            return self._lift_skiptoken(option, value)
+        if name not in LIFTED_OPTIONS:
+            return option
+
+        parts = []
+        position = 0
+        for match in LITERAL_PATTERN.finditer(value):
+            kind = match.lastgroup
+            if kind == "number":
+                text = match.group()
+                kind = (
+                    "float"
+                    if re.search("[.e]", text, re.I)
+                    else int_kind(text)
+                )
+            elif kind == "datetime":
+                text = match.group()
+            else:
+                continue
+            self.literals.append((kind, text))
+            parts.append(value[position : match.start()])
+            parts.append(f"\x00{kind}:{DIGITS_PATTERN.sub('9', text)}\x00")
+            position = match.end()
+        parts.append(value[position:])
+        return f"{name}={''.join(parts)}"
+
+    def _lift_skiptoken(self, option, token):
+        try:
+            seek = decode_skiptoken(token)
+        except BadRequest:
+            # Left in the shape; the translation reports the bad token
+            return option
+
+        self.seek = []
+        kinds = []
+        for value in seek:
+            kind = None
+            if type(value) is int:
+                kind, text = int_kind(str(value)), str(value)
+            elif type(value) is float:
+                kind, text = "float", repr(value)
+            elif isinstance(value, str):
+                match = LITERAL_PATTERN.fullmatch(value)
+                kind = (
+                    "datetime"
+                    if match and match.lastgroup == "datetime"
+                    else "string"
+                )
+                text = value
+            if kind is None:
+                kinds.append(json.dumps(value))
+            else:
+                self.literals.append((kind, text))
+                kinds.append(kind)
+            self.seek.append((kind, value))
+        return f"$skiptoken=\x00seek:{','.join(kinds)}\x00"
+
+    def build_url(self, texts):
+        """
+        Rebuild the request path with the given literal texts.
+
+        Args:
+            texts (list): One literal text per lifted literal, in order.
+
+        Returns:
+            str: The request path in normalized option order.
+        """
+        texts = iter(texts)
+        path = PATH_ID_PATTERN.sub(lambda _: f"({next(texts)})", self.path)
+        options = []
+        for option in self.options:
+            name, _, value = option.partition("=")
+            if name == "$skiptoken" and self.seek is not None:
+                seek = [
+                    value if kind is None else seek_value(kind, next(texts))
+                    for kind, value in self.seek
+                ]
+                option = f"{name}={encode_skiptoken(json.dumps(seek))}"
+            elif name in LIFTED_OPTIONS:
+                value = LITERAL_PATTERN.sub(
+                    lambda match: (
+                        next(texts)
+                        if match.lastgroup in ("number", "datetime")
+                        else match.group()
+                    ),
+                    value,
+                )
+                option = f"{name}={value}"
+            options.append(option)
+        if not options:
+            return path
+        # Re-encode so that the lexer's unquote_plus restores the exact text
+        return path + "?" + urllib.parse.quote("&".join(options), safe="")
+
+    def sentinel_texts(self, probe=0):
+        """
+        Return a unique sentinel literal for each lifted literal.
+
+        Sentinels keep the format of the original literal, and only the
+        first run of digits (the integer part or the year) is replaced.
+        Strings, which the translator renders inline, get a suffix.
+
+        Args:
+            probe (int): The number of earlier probes of the shape; each
+                probe gets a different set of sentinels.
+        """
+        texts = []
+        for index, (kind, text) in enumerate(self.literals):
+            unique = index + probe * len(self.literals)
+            if kind == "string":
+                texts.append(f"{text}#{unique}")
+                continue
+            if kind == "datetime":
+                sentinel = f"{SENTINEL_YEAR + unique:04d}"
+            elif kind == "bigint":
+                sentinel = str(SENTINEL_BIGINT + unique)
+            else:
+                sentinel = str(SENTINEL_NUMBER + unique)
+            texts.append(DIGITS_PATTERN.sub(sentinel, text, count=1))
+        return texts
+
+    def values(self, texts=None):
+        """
+        Convert literal texts to the values the translator binds for them.
+
+        Args:
+            texts (list, optional): The literal texts; defaults to the
+                request literals.
+
+        Returns:
+            list: The converted values.
+        """
+        if texts is None:
+            texts = [text for _, text in self.literals]
+        return [
+            convert_literal(kind, text)
+            for (kind, _), text in zip(self.literals, texts)
+        ]
+
+
+def split_options(query):
+    """
+    Split a decoded query string on the '&' that are not inside a string.
+
+    Args:
+        query (str): The decoded query string.
+
+    Returns:
+        list: The query options.
+    """
+    options = []
+    current = ""
+    for match in OPTION_PATTERN.finditer(query):
+        if match.group() == "&":
+            options.append(current)
+            current = ""
+        else:
+            current += match.group()
+    if current or options:
+        options.append(current)
+    return [option for option in options if option]
+
+
+def int_kind(text):
+    """
+    Return the kind of an integer literal. SQLAlchemy binds the integers of
+    32 bits or more as BIGINT and the others as INTEGER, so the two kinds
+    translate to different SQL.
+    """
+    return "bigint" if int(text).bit_length() >= 32 else "int"
+
+
+def convert_literal(kind, text):
+    if kind in ("int", "bigint"):
+        return int(text)
+    if kind == "float":
+        return float(text)
+    if kind == "string":
+        return text
+    return isoparse(text)
+
+
+def seek_value(kind, text):
+    # Seek key values travel as JSON, so datetimes stay strings
+    if kind in ("int", "bigint", "float"):
+        return convert_literal(kind, text)
+    return text
+
+
+def same_value(a, b):
+    return type(a) is type(b) and a == b
+
+
+def find_slots(original, sentinel, values, sentinel_values):
+    """
+    Map bind parameter positions to the literal that fills them.
+
+    Args:
+        original (list): Parameters translated with the request literals.
+        sentinel (list): Parameters translated with the sentinel literals.
+        values (list): The request literal values.
+        sentinel_values (list): The sentinel literal values.
+
+    Returns:
+        list: (position, literal index) pairs, or None if a parameter
+        differs between the translations without being a lifted literal.
+    """
+    if len(original) != len(sentinel):
+        return None
+    slots = []
+    for position, (param, sentinel_param) in enumerate(
+        zip(original, sentinel)
+    ):
+        for index, sentinel_value in enumerate(sentinel_values):
+            if same_value(sentinel_param, sentinel_value):
+                if not same_value(param, values[index]):
+                    return None
+                slots.append((position, index))
+                break
+        else:
+            if not same_value(param, sentinel_param):
+                return None
+    return slots
+
+
+def fill_slots(params, slots, values):
+    params = list(params)
+    for position, index in slots:
+        params[position] = values[index]
+    return params
+
+
+class TranslationEntry:
+    """
+    A cached translation and the parameter slots of its literals.
+    """
+
+    def __init__(self, data, main_slots, count_slots):
+        self.data = data
+        self.main_slots = main_slots
+        self.count_slots = count_slots
+
+    @classmethod
+    def build(cls, data, sentinel_data, values, sentinel_values):
+        """
+        Compare the request and sentinel translations of a shape.
+
+        Returns:
+            TranslationEntry: The entry, or None if the shape is not
+            cacheable.
+        """
+        if data.keys() != sentinel_data.keys():
+            return None
+        for key in data:
+            if key not in ("main_query_params", "count_queries"):
+                if data[key] != sentinel_data[key]:
+                    return None
+
+        main_slots = find_slots(
+            data["main_query_params"],
+            sentinel_data["main_query_params"],
+            values,
+            sentinel_values,
+        )
+        if main_slots is None:
+            return None
+
+        count_queries = data["count_queries"]
+        sentinel_count_queries = sentinel_data["count_queries"]
+        if len(count_queries) != len(sentinel_count_queries):
+            return None
+        count_slots = []
+        for (sql, params), (sentinel_sql, sentinel_params) in zip(
+            count_queries, sentinel_count_queries
+        ):
+            if sql != sentinel_sql:
+                return None
+            slots = find_slots(
+                params, sentinel_params, values, sentinel_values
+            )
+            if slots is None:
+                return None
+            count_slots.append(slots)
+
+        return cls(data, main_slots, count_slots)
+
+    def bind(self, values):
+        """
+        Return a copy of the cached translation bound to new literal values.
+        """
+        data = dict(self.data)
+        data["main_query_params"] = fill_slots(
+            self.data["main_query_params"], self.main_slots, values
+        )
+        data["count_queries"] = [
+            [sql, fill_slots(params, slots, values)]
+            for (sql, params), slots in zip(
+                self.data["count_queries"], self.count_slots
+            )
+        ]
+        return data
+
+
+class UncacheableShape:
+    """
+    The mark of a shape whose translations could not be compared.
+
+    Attributes:
+        probes (int): The times the shape was probed.
+        retry_at (float): The monotonic time after which it is probed again.
+    """
+
+    def __init__(self, probes, retry_after):
+        self.probes = probes
+        self.retry_at = time.monotonic() + retry_after
+
+
+class TranslationCache:
+    """
+    Bounded LRU cache of query translations keyed on the query shape.
+
+    Attributes:
+        maxsize (int): The maximum number of shapes kept; 0 disables it.
+        retry_after (float): The seconds a shape stays marked uncacheable.
+        hits (int): Lookups answered from the cache.
+        misses (int): Lookups that required a translation.
+        evictions (int): Shapes dropped to stay within maxsize.
+        uncacheable (int): Lookups of shapes that cannot be cached.
+    """
+
+    def __init__(self, maxsize, retry_after=UNCACHEABLE_RETRY_SECONDS):
+        self.maxsize = maxsize
+        self.retry_after = retry_after
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.uncacheable = 0
+
+    def translate(self, full_path, translate):
+        """
+        Translate a request path, reusing the translation of its shape.
+
+        Args:
+            full_path (str): The request path, including the query string.
+            translate (callable): The uncached translation function.
+
+        Returns:
+            dict: The translated query.
+        """
+        if not self.maxsize:
+            return translate(full_path)
+
+        shape = QueryShape(full_path)
+
+        probes = 0
+        if shape.key in self.entries:
+            entry = self.entries[shape.key]
+            self.entries.move_to_end(shape.key)
+            if not isinstance(entry, UncacheableShape):
+                self.hits += 1
+                return entry.bind(shape.values())
+            if time.monotonic() < entry.retry_at:
+                self.uncacheable += 1
+                return translate(shape.url)
+            probes = entry.probes
+
+        self.misses += 1
+        data = translate(shape.url)
+        entry = self.build_entry(shape, data, translate, probes)
+        if entry is None:
+            entry = UncacheableShape(probes + 1, self.retry_after)
+        self.put(shape.key, entry)
+        return data
+
+    def build_entry(self, shape, data, translate, probes=0):
+        try:
+            sentinel_texts = shape.sentinel_texts(probes)
+            sentinel_data = translate(shape.build_url(sentinel_texts))
+            return TranslationEntry.build(
+                data,
+                sentinel_data,
+                shape.values(),
+                shape.values(sentinel_texts),
+            )
+        except Exception:
+            return None
+
+    def put(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.maxsize:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        """
+        Return the cache counters.
+
+        Returns:
+            dict: The size, capacity and hit/miss/eviction counters.
+        """
+        return {
+            "size": len(self.entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "uncacheable": self.uncacheable,
+        }
+
+
+translation_cache = TranslationCache(TRANSLATION_CACHE_SIZE)
@@ -12,47 +12,188 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
+import re
 
 from app import (
+    AGGREGATE_ROLLUPS,
+    AUTHORIZATION,
     COUNT_ESTIMATE_THRESHOLD,
     COUNT_MODE,
+    DEFERRED_RANGES,
     HOSTNAME,
-    REDIS,
     SUBPATH,
     TOP_VALUE,
     VERSION,
     VERSIONING,
 )
-from app.db.redis_db import redis
 from app.db.sqlalchemy_db import engine
 from app.models import *
 from app.sta2rest import sta2rest
-from app.utils.utils import build_expand
+from app.utils.utils import build_expand, decode_skiptoken
+from app.v1.endpoints.exceptions import BadRequest
+from dateutil.parser import isoparse
 from geoalchemy2 import Geometry
 from sqlalchemy import (
+    and_,
     asc,
     case,
     desc,
     func,
     literal,
     literal_column,
+    or_,
     select,
     text,
+    true,
+    tuple_,
 )
-from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.dialects.postgresql import ARRAY, INTERVAL, JSON
 from sqlalchemy.dialects.postgresql.base import TIMESTAMP
 from sqlalchemy.dialects.postgresql.json import JSONB
 from sqlalchemy.dialects.postgresql.ranges import TSTZRANGE
 from sqlalchemy.orm.attributes import InstrumentedAttribute
 from sqlalchemy.sql.expression import cast
-from sqlalchemy.sql.sqltypes import Integer, String, Text
+from sqlalchemy.sql.sqltypes import (
+    BigInteger,
+    DateTime,
+    Integer,
+    Numeric,
+    String,
+    Text,
+)
 
 from .filter_visitor import FilterVisitor, resolve_field
+from .odata_query.exceptions import InvalidFieldException
 from .odata_query.grammar import ODataLexer, ODataParser
 from .sta_parser.ast import *
 from .sta_parser.visitor import Visitor
 
+RESULT_FORMATS = {
+    "dataArray": "DataArray",
+    "csv": "CSV",
+    "arrow": "Arrow",
+    "parquet": "Parquet",
+}
+
+# Result formats streamed as typed columns instead of JSON rows
+COLUMNAR_FORMATS = {"CSV", "Arrow", "Parquet"}
+
+# The typed columns of each Observation property in a columnar result
+# format, as (name, expression, type) triples.
+COLUMNAR_PROPERTIES = {
+    "id": [("@iot.id", lambda entity: entity.id, "int64")],
+    "phenomenonTime": [
+        (
+            "phenomenonTimeStart",
+            lambda entity: entity.phenomenon_time_start,
+            "timestamp",
+        ),
+        (
+            "phenomenonTimeEnd",
+            lambda entity: entity.phenomenon_time_end,
+            "timestamp",
+        ),
+    ],
+    "resultTime": [
+        ("resultTime", lambda entity: entity.result_time, "timestamp")
+    ],
+    # A numeric result stays a number; any other result is its text
+    "result": [
+        ("result", lambda entity: entity.result_number, "float64"),
+        (
+            "resultText",
+            lambda entity: func.coalesce(
+                entity.result_string,
+                cast(entity.result_boolean, Text),
+                cast(entity.result_json, Text),
+            ),
+            "string",
+        ),
+    ],
+    "resultQuality": [
+        (
+            "resultQuality",
+            lambda entity: cast(entity.result_quality, Text),
+            "string",
+        )
+    ],
+    "validTime": [
+        (
+            "validTimeStart",
+            lambda entity: func.lower(entity.valid_time),
+            "timestamp",
+        ),
+        (
+            "validTimeEnd",
+            lambda entity: func.upper(entity.valid_time),
+            "timestamp",
+        ),
+    ],
+    "parameters": [
+        (
+            "parameters",
+            lambda entity: cast(entity.parameters, Text),
+            "string",
+        )
+    ],
+    "Datastream": [
+        (
+            "Datastream@iot.id",
+            lambda entity: entity.datastream_id,
+            "int64",
+        )
+    ],
+    "FeatureOfInterest": [
+        (
+            "FeatureOfInterest@iot.id",
+            lambda entity: entity.featuresofinterest_id,
+            "int64",
+        )
+    ],
+}
+COLUMNAR_PROPERTIES["@iot.id"] = COLUMNAR_PROPERTIES["id"]
+
+COLUMNAR_DEFAULT_SELECT = [
+    "id",
+    "phenomenonTime",
+    "resultTime",
+    "result",
+    "Datastream",
+    "FeatureOfInterest",
+]
+
+# The $aggregate functions of Observations, applied to their numeric result
+AGGREGATE_FUNCTIONS = {
+    "avg": lambda entity: func.avg(entity.result_number),
+    "min": lambda entity: func.min(entity.result_number),
+    "max": lambda entity: func.max(entity.result_number),
+    "sum": lambda entity: func.sum(entity.result_number),
+    "count": lambda entity: func.count(entity.result_number),
+}
+
+# The same functions over the buckets of a rollup
+ROLLUP_AGGREGATE_FUNCTIONS = {
+    "avg": lambda entity: func.sum(entity.result_sum)
+    / func.nullif(func.sum(entity.result_count), 0),
+    "min": lambda entity: func.min(entity.result_min),
+    "max": lambda entity: func.max(entity.result_max),
+    "sum": lambda entity: func.sum(entity.result_sum),
+    "count": lambda entity: cast(func.sum(entity.result_count), BigInteger),
+}
+
+# The continuous aggregates of Observations and their bucket in seconds,
+# coarsest first
+ROLLUPS = [
+    ("ObservationDaily", 86400),
+    ("ObservationHourly", 3600),
+]
+
+# An ISO 8601 duration, as accepted by $interval
+INTERVAL_PATTERN = re.compile(
+    r"P(?:(\d+)Y)?(?:(\d+)M)?(?:(\d+)W)?(?:(\d+)D)?"
+    r"(?:T(?:(\d+)H)?(?:(\d+)M)?(?:(\d+(?:\.\d+)?)S)?)?"
+)
+
 
 class NodeVisitor(Visitor):
     """
@@ -223,37 +364,53 @@ class NodeVisitor(Visitor):
         """
         Visit an expand node.
 
+        Each expanded entity becomes a subquery of the parent query that is
+        correlated with the parent row, so that a single statement expands
+        every row of the page.
+
         Args:
             node (ExpandNode): The expand node to visit.
             parent (str): The parent entity name.
 
         Returns:
-            list: A list of tuples containing the sub-query and the identifier of each expand node.
+            list: A list of tuples containing the label, the column and the
+                count flag of each expand node. The count flag is None when
+                the expanded entity is a single object.
         """
 
-        expand_queries = []
+        expand_columns = []
 
         # Process each identifier in the expand node
         for expand_identifier in node.identifiers:
-            relationship_entity = None
-            fk_parent = None
+            subquery = expand_identifier.subquery
+            # The options are read before the visit converts their names
+            link_options = get_expand_link_options(subquery)
+
             expand_identifier.identifier = sta2rest.STA2REST.convert_entity(
                 expand_identifier.identifier
             )
             sub_entity = globals()[expand_identifier.identifier]
-            sub_query = None
-            show_id = False
+            sub_name = expand_identifier.identifier.replace(
+                "TravelTime", ""
+            ).lower()
+            parent_entity = globals()[parent]
+            parent_name = parent.replace("TravelTime", "").lower()
+
+            relationship = getattr(
+                globals()[parent.replace("TravelTime", "")], sub_name
+            ).property
+            direction = relationship.direction.name
+            label_name = getattr(
+                parent_entity, f"{sub_name}_navigation_link"
+            ).name.split("@")[0]
 
             # Process select clause if exists
-            select_fields = []
-            # Check for identifiers in the subquery's select or use default columns
             identifiers = (
                 [
                     self.visit(identifier)
-                    for identifier in expand_identifier.subquery.select.identifiers
+                    for identifier in subquery.select.identifiers
                 ]
-                if expand_identifier.subquery
-                and expand_identifier.subquery.select
+                if subquery and subquery.select
                 else [
                     identifier
                     for identifier in sta2rest.STA2REST.get_default_column_names(
@@ -264,11 +421,10 @@ class NodeVisitor(Visitor):
                 ]
             )
 
-            show_id = "id" not in identifiers
-            if show_id:
-                identifiers.append("id")
-
+            select_fields = [getattr(sub_entity, "id").label("@iot.id")]
             for identifier in identifiers:
+                if identifier == "id":
+                    continue
                 sub_attr = resolve_field(sub_entity, identifier)
                 select_fields.append(
                     get_select_attr(
@@ -278,190 +434,155 @@ class NodeVisitor(Visitor):
                     )
                 )
 
-            if parent:
-                # Determine the relationship entity for the parent class and identifier
-                parent_class = globals()[parent.replace("TravelTime", "")]
-                attribute_name = expand_identifier.identifier.replace(
-                    "TravelTime", ""
-                ).lower()
-                relationship_entity = getattr(
-                    parent_class, attribute_name
-                ).property
-
-                # Check for ONETOMANY relationship and get the foreign key attribute
-                if relationship_entity.direction.name == "ONETOMANY":
-                    fk_attr = f"{parent.replace('TravelTime', '').lower()}_id"
-                    fk_parent = getattr(sub_entity, fk_attr)
+            # Handle nested expand if exists
+            labels = {}
+            if subquery and subquery.expand:
+                for (
+                    nested_label,
+                    nested_column,
+                    nested_count,
+                ) in self.visit_ExpandNode(
+                    subquery.expand, expand_identifier.identifier
+                ):
+                    select_fields.append(nested_column)
+                    if nested_count is not None:
+                        labels[nested_label] = nested_count
+
+            # The key of the parent row each expanded row belongs to
+            parent_key = getattr(parent_entity, "id")
+            if direction == "MANYTOONE":
+                fk = getattr(sub_entity, "id")
+                parent_key = getattr(parent_entity, f"{sub_name}_id")
+            elif direction == "ONETOMANY":
+                fk = getattr(sub_entity, f"{parent_name}_id")
+            else:
+                fk = relationship.secondary.c[f"{parent_name}_id"]
+
+            sub_query = select(*select_fields)
+            count_query = select(fk.label("fk"))
+            if direction == "MANYTOMANY":
+                onclause = relationship.secondary.c[
+                    f"{sub_name}_id"
+                ] == getattr(sub_entity, "id")
+                sub_query = sub_query.join(relationship.secondary, onclause)
+                count_query = count_query.select_from(sub_entity).join(
+                    relationship.secondary, onclause
+                )
+
+            # Process filter clause if exists
+            if subquery and subquery.filter:
+                filter, join_relationships = self.visit_FilterNode(
+                    subquery.filter,
+                    expand_identifier.identifier,
+                )
+                sub_query = sub_query.filter(filter)
+                count_query = count_query.filter(filter)
+                if join_relationships:
+                    for join_relationship in join_relationships:
+                        sub_query = sub_query.join(join_relationship)
+                        count_query = count_query.join(join_relationship)
 
             # Process orderby clause if exists
-            ordering = []
-            if (
-                expand_identifier.subquery
-                and expand_identifier.subquery.orderby
-            ):
+            if subquery and subquery.orderby:
                 attrs, orders = self.visit_OrderByNode(
-                    expand_identifier.subquery.orderby,
+                    subquery.orderby,
                     expand_identifier.identifier,
                 )
                 ordering = get_orderby_attr(attrs, orders)
             else:
                 ordering = [asc(getattr(sub_entity, "id"))]
 
-            # Process skip clause  if exists
+            # Process skip clause if exists
             skip_value = (
-                self.visit_SkipNode(expand_identifier.subquery.skip)
-                if expand_identifier.subquery
-                and expand_identifier.subquery.skip
+                self.visit_SkipNode(subquery.skip)
+                if subquery and subquery.skip
                 else 0
             )
 
-            # Process top clause  if exists
+            # Process top clause if exists
             top_value = (
-                self.visit_TopNode(expand_identifier.subquery.top) + 1
-                if expand_identifier.subquery
-                and expand_identifier.subquery.top
+                self.visit_TopNode(subquery.top) + 1
+                if subquery and subquery.top
                 else TOP_VALUE + 1
             )
 
-            # Process count clause  if exists
+            # Process count clause if exists
             is_count = (
-                self.visit_CountNode(expand_identifier.subquery.count)
-                if expand_identifier.subquery
-                and expand_identifier.subquery.count
+                self.visit_CountNode(subquery.count)
+                if subquery and subquery.count
                 else False
             )
 
-            # Handle nested expand  if exists
-            labels = {}
-            json_expands = []
-            if (
-                expand_identifier.subquery
-                and expand_identifier.subquery.expand
-            ):
-                for i in expand_identifier.subquery.expand.identifiers:
-                    select_node = ""
-                    if i.subquery and i.subquery.select:
-                        select_node = ",".join(
-                            j.name for j in i.subquery.select.identifiers
-                        )
-                    filter_node = ""
-                    if i.subquery and i.subquery.filter:
-                        filter_node = i.subquery.filter.filter
-                    orderby_node = ""
-                    if i.subquery and i.subquery.orderby:
-                        orderby_node = ",".join(
-                            f"{j.identifier} {j.order}"
-                            for j in i.subquery.orderby.identifiers
-                        )
-                    expand_node = ""
-                    if i.subquery and i.subquery.expand:
-                        expand_node = build_expand(i.subquery.expand)
-
-                nested_expand_queries = self.visit_ExpandNode(
-                    expand_identifier.subquery.expand,
-                    expand_identifier.identifier,
-                )
-                for nested_expand_query in nested_expand_queries:
-                    entity = nested_expand_query[2].replace("TravelTime", "")
-                    attribute_sub_entity = (
-                        nested_expand_query[5]
-                        .replace("TravelTime", "")
-                        .lower()
-                    )
-                    relationship_nested = getattr(
-                        globals()[entity],
-                        attribute_sub_entity,
-                    ).property
-
-                    navigation_link_attr = (
-                        f"{attribute_sub_entity}_navigation_link"
-                    )
-
-                    navigation_link_value = getattr(
-                        sub_entity, navigation_link_attr
-                    )
-                    label_name = navigation_link_value.name.split("@")[0]
-                    if relationship_nested.direction.name != "MANYTOONE":
-                        labels[label_name] = nested_expand_query[8]
-
-                    json_expands.append(
-                        get_expand_function(
-                            relationship_nested,
-                            get_query_compiled(nested_expand_query[0]),
-                            nested_expand_query,
-                            label_name,
-                            select_node,
-                            filter_node,
-                            orderby_node,
-                            expand_node,
-                        )
-                    )
-
-            if fk_parent is not None:
-                select_fields.append(fk_parent)
-
-            # Combine select fields and json expands
-            query_fields = (
-                select_fields + json_expands if json_expands else select_fields
+            # Order and limit the rows of each parent in the same query
+            # level as the nested expands, so that these are only computed
+            # for the rows of the page.
+            sub_query = (
+                sub_query.where(fk == parent_key)
+                .order_by(*ordering)
+                .limit(top_value if direction != "MANYTOONE" else 1)
+                .offset(skip_value)
+                .correlate(parent_entity)
+                .subquery()
             )
+            rows = select(
+                *unwrap_expand_columns(sub_query.columns, labels)
+            ).subquery(label_name)
+            row = func.row_to_json(rows.table_valued())
 
-            sub_query = select(*query_fields).order_by(*ordering)
-
-            # Process filter clause if exists
-            if (
-                expand_identifier.subquery
-                and expand_identifier.subquery.filter
-            ):
-                filter, join_relationships = self.visit_FilterNode(
-                    expand_identifier.subquery.filter,
-                    expand_identifier.identifier,
-                )
-                sub_query = sub_query.filter(filter)
-                if join_relationships:
-                    for relationship in join_relationships:
-                        sub_query = sub_query.join(relationship)
-
-            columns_to_select = []
-            for column in sub_query.columns:
-                if column.name not in labels:
-                    columns_to_select.append(column)
-                else:
-                    columns_to_select.append(
-                        column.op("->")(column.name).label(column.name)
-                    )
-                    columns_to_select.append(
-                        column.op("->")(column.name + "@iot.nextLink").label(
-                            column.name + "@iot.nextLink"
-                        )
-                    )
-                    if labels[column.name]:
-                        columns_to_select.append(
-                            column.op("->")(column.name + "@iot.count").label(
-                                column.name + "@iot.count"
-                            )
-                        )
-
-            if columns_to_select is not None:
-                sub_query = select(*columns_to_select).select_from(sub_query)
-
-            expand_queries.append(
-                [
-                    sub_query,
-                    fk_parent,
-                    parent,
-                    skip_value,
-                    top_value,
-                    expand_identifier.identifier,
+            if direction == "MANYTOONE":
+                expand_columns.append(
                     (
-                        True
-                        if relationship_entity.direction.name == "MANYTOMANY"
-                        else False
+                        label_name,
+                        func.coalesce(
+                            select(row).scalar_subquery(),
+                            literal_column("'{}'::json"),
+                        ).label(label_name),
+                        None,
+                    )
+                )
+                continue
+
+            page_size = top_value - 1
+            next_link = (
+                HOSTNAME
+                + SUBPATH
+                + VERSION
+                + getattr(parent_entity, "self_link")
+                + f"/{label_name}?$top={page_size}"
+                + f"&$skip={skip_value + page_size}"
+                + link_options
+            )
+            expand_object = [
+                label_name,
+                func.coalesce(
+                    func.array_to_json(
+                        func.array_agg(row, type_=ARRAY(JSON))[1:page_size]
+                    ),
+                    literal_column("'[]'::json"),
+                ),
+                f"{label_name}@iot.nextLink",
+                case((func.count() > page_size, next_link), else_=None),
+            ]
+            if is_count:
+                expand_object += [
+                    f"{label_name}@iot.count",
+                    get_expand_count(
+                        count_query.subquery("d"), parent_key, parent_entity
                     ),
-                    show_id,
-                    is_count,
                 ]
+
+            expand_columns.append(
+                (
+                    label_name,
+                    select(func.json_build_object(*expand_object))
+                    .select_from(rows)
+                    .correlate(parent_entity)
+                    .scalar_subquery()
+                    .label(label_name),
+                    is_count,
+                )
             )
-        return expand_queries
+        return expand_columns
 
     def resolve_select_field(self, main_entity, field_name):
         """Resolve a single $select field name to a column attribute.
@@ -501,87 +622,176 @@ class NodeVisitor(Visitor):
         """
 
         result_format = (
-            "DataArray"
-            if node.result_format and node.result_format.value == "dataArray"
+            RESULT_FORMATS[node.result_format.value]
+            if node.result_format
             else None
         )
+        columnar = result_format in COLUMNAR_FORMATS
+        if columnar and self.main_entity not in (
+            "Observation",
+            "ObservationTravelTime",
+        ):
+            raise BadRequest(
+                f"$resultFormat={node.result_format.value} is only supported "
+                "on Observations"
+            )
+        if (
+            columnar
+            and node.expand
+            and any(e.expand for e in node.expand.identifiers)
+        ):
+            raise BadRequest(
+                "$expand is not supported with "
+                f"$resultFormat={node.result_format.value}"
+            )
+        if columnar and node.count and self.visit_CountNode(node.count):
+            raise BadRequest(
+                "$count is not supported with "
+                f"$resultFormat={node.result_format.value}"
+            )
+
+        entity_name = self.main_entity
+        aggregate = node.aggregate is not None or node.interval is not None
+        rollup = None
+        if aggregate:
+            check_aggregate_options(
+                node, self.main_entity, self.single_result or self.value
+            )
+            # The rollups have no row level security, so with AUTHORIZATION
+            # the Observations are aggregated under the policies of the role
+            if (
+                AGGREGATE_ROLLUPS
+                and not AUTHORIZATION
+                and self.main_entity == "Observation"
+            ):
+                rollup = get_rollup(node.interval.value)
+            if rollup and node.filter:
+                # A filter on anything but the Datastream and the time of
+                # the buckets is applied to the raw Observations
+                try:
+                    self.visit_FilterNode(node.filter, rollup)
+                except InvalidFieldException:
+                    rollup = None
+            if rollup:
+                self.main_entity = rollup
 
         main_entity = globals()[self.main_entity]
         main_query = None
-        query_count = (
-            select(func.count(getattr(main_entity, "id").distinct()))
-            if "TravelTime" not in self.main_entity
-            else select(
-                func.count(
+        if aggregate:
+            # Replaced by a count of the buckets once the query is grouped
+            query_count = query_estimate_count = select(
+                getattr(main_entity, "datastream_id")
+            )
+        else:
+            query_count = (
+                select(func.count(getattr(main_entity, "id").distinct()))
+                if "TravelTime" not in self.main_entity
+                else select(
+                    func.count(
+                        func.distinct(
+                            getattr(main_entity, "id"),
+                            getattr(main_entity, "system_time_validity"),
+                        )
+                    )
+                )
+            )
+
+            query_estimate_count = (
+                select(getattr(main_entity, "id").distinct())
+                if "TravelTime" not in self.main_entity
+                else select(
                     func.distinct(
                         getattr(main_entity, "id"),
                         getattr(main_entity, "system_time_validity"),
                     )
                 )
             )
-        )
 
-        query_estimate_count = (
-            select(getattr(main_entity, "id").distinct())
-            if "TravelTime" not in self.main_entity
-            else select(
-                func.distinct(
-                    getattr(main_entity, "id"),
-                    getattr(main_entity, "system_time_validity"),
-                )
+        columns = []
+        if aggregate:
+            # One row per Datastream and time bucket, computed by TimescaleDB
+            # The duration is a string literal that PostgreSQL casts itself
+            interval = cast(
+                literal(get_bucket_interval(node.interval.value), Text),
+                INTERVAL,
             )
-        )
-
-        if self.ref:
-            node.select = SelectNode([])
-            node.select.identifiers.append(IdentifierNode("self_link"))
-
-        # Process select clause if exists
-        if not node.select:
-            node.select = SelectNode([])
-            default_columns = sta2rest.STA2REST.get_default_column_names(
-                self.main_entity
-                if not result_format
-                else self.main_entity + result_format
+            bucket = func.time_bucket(
+                interval, getattr(main_entity, "phenomenon_time_start")
             )
-            for column in default_columns:
-                node.select.identifiers.append(IdentifierNode(column))
-
-        if node.select:
-            select_query = []
-
-            # Iterate over fields in node.select when fields have a nested path
-            for field in self.visit(node.select):
-                field_name = field.split(".", 1)[-1]
-                if "/" in field_name:
-                    field, *field_parts = field_name.split("/", 1)
-                    field_parts = (
-                        field_parts[0].split("/") if field_parts else []
-                    )
-                    json_path = self.resolve_select_field(main_entity, field)
-                    for part in field_parts:
-                        json_path = json_path.op("->")(part)
-                    select_query.append(json_path)
-                else:
-                    select_query.append(
-                        self.resolve_select_field(main_entity, field_name)
+            datastream_id = getattr(main_entity, "datastream_id")
+            select_args = [
+                datastream_id.label("Datastream@iot.id"),
+                (
+                    func.to_char(bucket, 'YYYY-MM-DD"T"HH24:MI:SS"Z"')
+                    + "/"
+                    + func.to_char(
+                        bucket + interval, 'YYYY-MM-DD"T"HH24:MI:SS"Z"'
                     )
-
-        components = [
-            sta2rest.STA2REST.REVERSE_SELECT_MAPPING.get(
-                identifier.name, identifier.name
+                ).label("phenomenonTime"),
+            ]
+            functions = (
+                ROLLUP_AGGREGATE_FUNCTIONS if rollup else AGGREGATE_FUNCTIONS
             )
-            for identifier in node.select.identifiers
-        ]
+            for name in dict.fromkeys(node.aggregate.functions):
+                select_args.append(functions[name](main_entity).label(name))
+        elif columnar:
+            columns = get_columnar_columns(main_entity, node.select)
+            select_args = [column for column, _, _ in columns]
+        else:
+            if self.ref:
+                node.select = SelectNode([])
+                node.select.identifiers.append(IdentifierNode("self_link"))
 
-        select_args = []
-        for attr in select_query:
-            name = (
-                attr.name
-                if isinstance(attr, InstrumentedAttribute)
-                else attr.right.value
-            )
-            select_args.append(get_select_attr(attr, name, as_of=node.as_of))
+            # Process select clause if exists
+            if not node.select:
+                node.select = SelectNode([])
+                default_columns = sta2rest.STA2REST.get_default_column_names(
+                    self.main_entity
+                    if not result_format
+                    else self.main_entity + result_format
+                )
+                for column in default_columns:
+                    node.select.identifiers.append(IdentifierNode(column))
+
+            if node.select:
+                select_query = []
+
+                # Iterate over fields in node.select when fields have a nested path
+                for field in self.visit(node.select):
+                    field_name = field.split(".", 1)[-1]
+                    if "/" in field_name:
+                        field, *field_parts = field_name.split("/", 1)
+                        field_parts = (
+                            field_parts[0].split("/") if field_parts else []
+                        )
+                        json_path = self.resolve_select_field(
+                            main_entity, field
+                        )
+                        for part in field_parts:
+                            json_path = json_path.op("->")(part)
+                        select_query.append(json_path)
+                    else:
+                        select_query.append(
+                            self.resolve_select_field(main_entity, field_name)
+                        )
+
+            components = [
+                sta2rest.STA2REST.REVERSE_SELECT_MAPPING.get(
+                    identifier.name, identifier.name
+                )
+                for identifier in node.select.identifiers
+            ]
+
+            select_args = []
+            for attr in select_query:
+                name = (
+                    attr.name
+                    if isinstance(attr, InstrumentedAttribute)
+                    else attr.right.value
+                )
+                select_args.append(
+                    get_select_attr(attr, name, as_of=node.as_of)
+                )
 
         joins = []
         filters = []
@@ -691,63 +901,14 @@ class NodeVisitor(Visitor):
 
             # here we create the sub queries for the expand identifiers
             if node.expand.identifiers:
-                for i in node.expand.identifiers:
-                    select_node = ""
-                    if i.subquery and i.subquery.select:
-                        select_node = ",".join(
-                            j.name for j in i.subquery.select.identifiers
-                        )
-                    filter_node = ""
-                    if i.subquery and i.subquery.filter:
-                        filter_node = i.subquery.filter.filter
-                    orderby_node = ""
-                    if i.subquery and i.subquery.orderby:
-                        orderby_node = ",".join(
-                            f"{j.identifier} {j.order}"
-                            for j in i.subquery.orderby.identifiers
-                        )
-                    expand_node = ""
-                    if i.subquery and i.subquery.expand:
-                        expand_node = build_expand(i.subquery.expand)
-
-                # Visit the expand node
-                expand_queries = self.visit_ExpandNode(
-                    node.expand, self.main_entity
-                )
-                for expand_query in expand_queries:
-                    entity = self.main_entity.replace("TravelTime", "")
-                    attribute_sub_entity = (
-                        expand_query[5].replace("TravelTime", "").lower()
-                    )
-                    relationship = getattr(
-                        globals()[entity],
-                        attribute_sub_entity,
-                    ).property
-
-                    navigation_link_attr = (
-                        f"{attribute_sub_entity}_navigation_link"
-                    )
-
-                    navigation_link_value = getattr(
-                        main_entity, navigation_link_attr
-                    )
-                    label_name = navigation_link_value.name.split("@")[0]
-
-                    if relationship.direction.name != "MANYTOONE":
-                        labels[label_name] = expand_query[8]
-
-                    select_args.append(
-                        get_expand_function(
-                            relationship,
-                            get_query_compiled(expand_query[0]),
-                            expand_query,
-                            label_name,
-                            select_node,
-                            filter_node,
-                            orderby_node,
-                            expand_node,
-                        )
-                    )
+                for (
+                    label_name,
+                    expand_column,
+                    expand_count,
+                ) in self.visit_ExpandNode(node.expand, self.main_entity):
+                    select_args.append(expand_column)
+                    if expand_count is not None:
+                        labels[label_name] = expand_count
 
                 main_query = select(*select_args)
 
@@ -820,11 +981,26 @@ class NodeVisitor(Visitor):
 
         # Process orderby clause if exists
         ordering = []
-        if node.orderby:
+        seek_keys, seek_orders = [], []
+        if aggregate:
+            group_by = [datastream_id, bucket]
+            ordering = [asc(column) for column in group_by]
+            main_query = main_query.group_by(*group_by)
+            # $count counts the buckets
+            query_estimate_count = query_estimate_count.with_only_columns(
+                *group_by
+            ).group_by(*group_by)
+            query_count = select(func.count()).select_from(
+                query_estimate_count.subquery()
+            )
+        elif node.orderby:
             attrs, orders = self.visit_OrderByNode(
                 node.orderby, self.main_entity
             )
             ordering = get_orderby_attr(attrs, orders)
+            for attr, order in zip(attrs, orders):
+                seek_keys.extend(attr)
+                seek_orders.extend([order] * len(attr))
         else:
             ordering = [asc(getattr(main_entity, "id"))]
             if VERSIONING and node.from_to:
@@ -832,8 +1008,51 @@ class NodeVisitor(Visitor):
                     asc(getattr(main_entity, "system_time_validity"))
                 )
 
+        # A collection page ordered by scalar columns is paged with a seek
+        # key, the order by values and the id of its last row, so that the
+        # next page starts after that row instead of skipping an offset.
+        keyset = (
+            not result_format
+            and not aggregate
+            and not self.value
+            and not self.single_result
+            and not node.from_to
+            and all(is_seek_key(key) for key in seek_keys)
+        )
+        if keyset:
+            id_attr = getattr(main_entity, "id")
+            if not any(key.key == "id" for key in seek_keys):
+                # The id breaks ties, so the seek key identifies one row. It
+                # follows the last order so that one row comparison can
+                # express the seek when every key has the same order.
+                order = seek_orders[-1] if seek_orders else "asc"
+                if seek_keys:
+                    ordering.append(
+                        asc(id_attr) if order == "asc" else desc(id_attr)
+                    )
+                seek_keys.append(id_attr)
+                seek_orders.append(order)
+
         main_query = main_query.order_by(*ordering)
 
+        if node.skip_token:
+            if not keyset:
+                raise BadRequest(
+                    "$skiptoken is not supported for this request"
+                )
+            main_query = main_query.filter(
+                get_seek_filter(
+                    seek_keys,
+                    seek_orders,
+                    decode_skiptoken(node.skip_token.token),
+                )
+            )
+
+        if keyset:
+            main_query = main_query.add_columns(
+                func.json_build_array(*seek_keys).label("seek")
+            )
+
         # Process skip clause  if exists
         skip_value = self.visit_SkipNode(node.skip) if node.skip else 0
 
@@ -841,6 +1060,10 @@ class NodeVisitor(Visitor):
         top_value = (
             self.visit_TopNode(node.top) + 1 if node.top else TOP_VALUE + 1
         )
+        if columnar:
+            # A columnar result has no next link: it is the whole collection,
+            # or its first $top rows
+            top_value = self.visit_TopNode(node.top) if node.top else None
 
         # Process count clause  if exists
         is_count = self.visit_CountNode(node.count) if node.count else False
@@ -848,37 +1071,30 @@ class NodeVisitor(Visitor):
         count_queries = []
         if is_count:
             if COUNT_MODE in {"LIMIT_ESTIMATE", "ESTIMATE_LIMIT"}:
-                estimate_query_str = str(
-                    query_estimate_count.compile(
-                        dialect=engine.dialect,
-                        compile_kwargs={"literal_binds": True},
-                    )
-                )
-                limited_count_query_str = str(
-                    select(func.count())
-                    .select_from(
-                        query_estimate_count.limit(COUNT_ESTIMATE_THRESHOLD)
-                    )
-                    .compile(
-                        dialect=engine.dialect,
-                        compile_kwargs={"literal_binds": True},
+                # The estimate is computed by sensorthings.count_estimate(),
+                # which EXPLAINs the statement text it receives, so that one
+                # query must stay literal-bound.
+                estimate_query = [
+                    str(get_query_compiled(query_estimate_count)),
+                    [],
+                ]
+                limited_count_query = list(
+                    compile_query(
+                        select(func.count()).select_from(
+                            query_estimate_count.limit(
+                                COUNT_ESTIMATE_THRESHOLD
+                            )
+                        )
                     )
                 )
                 if COUNT_MODE == "LIMIT_ESTIMATE":
-                    count_queries.append(limited_count_query_str)
-                    count_queries.append(str(estimate_query_str))
+                    count_queries.append(limited_count_query)
+                    count_queries.append(estimate_query)
                 elif COUNT_MODE == "ESTIMATE_LIMIT":
-                    count_queries.append(str(estimate_query_str))
-                    count_queries.append(limited_count_query_str)
+                    count_queries.append(estimate_query)
+                    count_queries.append(limited_count_query)
             else:
-                count_queries.append(
-                    str(
-                        query_count.compile(
-                            dialect=engine.dialect,
-                            compile_kwargs={"literal_binds": True},
-                        )
-                    )
-                )
+                count_queries.append(list(compile_query(query_count)))
 
         if result_format == "DataArray" and node.expand:
             if top_value > 1:
@@ -897,27 +1113,28 @@ class NodeVisitor(Visitor):
             # truncated.
             top_value += 1
 
-        columns_to_select = []
-        for column in main_query.columns:
-            if column.name not in labels:
-                columns_to_select.append(column)
-            else:
-                columns_to_select.append(
-                    column.op("->")(column.name).label(column.name)
-                )
-                columns_to_select.append(
-                    column.op("->")(column.name + "@iot.nextLink").label(
-                        column.name + "@iot.nextLink"
-                    )
-                )
-                if labels[column.name]:
-                    columns_to_select.append(
-                        column.op("->")(column.name + "@iot.count").label(
-                            column.name + "@iot.count"
-                        )
-                    )
+        columns_to_select = unwrap_expand_columns(main_query.columns, labels)
 
-        if columns_to_select is not None:
+        if keyset:
+            # Keep the seek key out of the row JSON: the rows are built by a
+            # lateral subquery over every column except it.
+            keyset_query = (
+                select(*columns_to_select)
+                .select_from(main_query)
+                .alias("keyset_query")
+            )
+            main_query = (
+                select(
+                    *[
+                        column
+                        for column in keyset_query.columns
+                        if column.name != "seek"
+                    ]
+                )
+                .correlate(keyset_query)
+                .lateral("main_query")
+            )
+        elif columns_to_select is not None:
             main_query = (
                 select(*columns_to_select)
                 .select_from(main_query)
@@ -979,9 +1196,17 @@ class NodeVisitor(Visitor):
                     ).label("dataArray"),
                 ).alias("main_query")
 
-        main_query = select(
-            func.row_to_json(literal_column("main_query")).label("json")
-        ).select_from(main_query)
+        if columnar:
+            main_query = select(*main_query.columns)
+        elif keyset:
+            main_query = select(
+                func.row_to_json(literal_column("main_query")).label("json"),
+                keyset_query.c.seek,
+            ).select_from(keyset_query.join(main_query, true()))
+        else:
+            main_query = select(
+                func.row_to_json(literal_column("main_query")).label("json")
+            ).select_from(main_query)
 
         as_of_value = node.as_of.value if node.as_of else None
 
@@ -1004,16 +1229,12 @@ class NodeVisitor(Visitor):
                 main_query.c.json.op("->>")(text(f"'{value}'")).label("json")
             ).select_from(main_query)
 
-        main_query_str = str(
-            main_query.compile(
-                dialect=engine.dialect,
-                compile_kwargs={"literal_binds": True},
-            )
-        )
+        main_query_str, main_query_params = compile_query(main_query)
 
         main_query = {
-            "main_entity": self.main_entity,
+            "main_entity": entity_name,
             "main_query": main_query_str,
+            "main_query_params": main_query_params,
             "top_value": top_value,
             "is_count": is_count,
             "count_queries": count_queries,
@@ -1021,14 +1242,156 @@ class NodeVisitor(Visitor):
             "from_to_value": from_to_value,
             "single_result": self.single_result,
             "value": self.value,
+            "keyset": keyset,
+            "result_format": result_format,
+            "columns": [[name, type] for _, name, type in columns],
         }
 
-        if REDIS:
-            redis.set(self.full_path, json.dumps(main_query))
-
         return main_query
 
 
+def check_aggregate_options(node, entity, single_result):
+    """
+    Check that the options of a query can be combined with $aggregate.
+
+    Args:
+        node (ast.QueryNode): The query.
+        entity (str): The main entity of the query.
+        single_result (bool): Whether the query returns a single entity.
+
+    Raises:
+        BadRequest: If the query cannot be aggregated.
+    """
+    if node.aggregate is None or node.interval is None:
+        raise BadRequest("$aggregate and $interval must be used together")
+    if entity not in ("Observation", "ObservationTravelTime") or single_result:
+        raise BadRequest(
+            "$aggregate is only supported on collections of Observations"
+        )
+    unknown = [
+        name
+        for name in node.aggregate.functions
+        if name not in AGGREGATE_FUNCTIONS
+    ]
+    if unknown:
+        raise BadRequest(
+            f"Unknown aggregate function {unknown[0]}, expected one of "
+            + ", ".join(AGGREGATE_FUNCTIONS)
+        )
+    options = {
+        "$select": node.select,
+        "$orderby": node.orderby,
+        "$resultFormat": node.result_format,
+        "$skiptoken": node.skip_token,
+        "$from_to": node.from_to,
+        "$expand": node.expand
+        and any(e.expand for e in node.expand.identifiers),
+    }
+    for option, value in options.items():
+        if value:
+            raise BadRequest(f"{option} is not supported with $aggregate")
+
+
+def get_bucket_interval(value):
+    """
+    Validate the ISO 8601 duration of $interval.
+
+    PostgreSQL reads the duration as an interval. TimescaleDB buckets by
+    months or by a fixed length, so the two cannot be mixed.
+
+    Args:
+        value (str): The duration, e.g. P1D or PT15M.
+
+    Returns:
+        str: The duration.
+
+    Raises:
+        BadRequest: If the duration is invalid.
+    """
+    match = INTERVAL_PATTERN.fullmatch(value)
+    if not match or value.endswith("T"):
+        raise BadRequest(
+            f"Invalid $interval {value}, expected an ISO 8601 duration "
+            "such as P1D or PT15M"
+        )
+    years, months, *fixed = match.groups()
+    if not any(part and float(part) for part in match.groups()):
+        raise BadRequest("$interval must be longer than zero")
+    if (years or months) and any(fixed):
+        raise BadRequest(
+            "$interval cannot mix years or months with weeks, days or time"
+        )
+    return value
+
+
+def get_rollup(value):
+    """
+    Return the coarsest rollup of Observations that can serve an interval.
+
+    A rollup serves the intervals that are a multiple of its bucket, whose
+    buckets are then unions of whole rollup buckets. Months and years are
+    unions of days.
+
+    Args:
+        value (str): The ISO 8601 duration of $interval.
+
+    Returns:
+        str: The name of the rollup model, or None.
+    """
+    years, months, weeks, days, hours, minutes, seconds = (
+        INTERVAL_PATTERN.fullmatch(value).groups()
+    )
+    if years or months:
+        return ROLLUPS[0][0]
+    length = (
+        int(weeks or 0) * 604800
+        + int(days or 0) * 86400
+        + int(hours or 0) * 3600
+        + int(minutes or 0) * 60
+        + float(seconds or 0)
+    )
+    for rollup, bucket in ROLLUPS:
+        if length % bucket == 0:
+            return rollup
+    return None
+
+
+def get_columnar_columns(entity, select_node):
+    """
+    Return the typed columns of Observations in a columnar result format.
+
+    Args:
+        entity: The Observation model.
+        select_node (ast.SelectNode): The $select of the query, or None.
+
+    Returns:
+        list: (column, name, type) triples, in the order of the properties.
+    """
+    names = (
+        [identifier.name for identifier in select_node.identifiers]
+        if select_node
+        else COLUMNAR_DEFAULT_SELECT
+    )
+    columns = []
+    for name in names:
+        if name not in COLUMNAR_PROPERTIES:
+            raise BadRequest(
+                f"Property {name} cannot be selected in a columnar "
+                "$resultFormat"
+            )
+        for label, expression, column_type in COLUMNAR_PROPERTIES[name]:
+            columns.append(
+                (expression(entity).label(label), label, column_type)
+            )
+    return columns
+
+
+PENDING_RANGES = {
+    "phenomenonTime": func.sensorthings.pending_phenomenon_time,
+    "resultTime": func.sensorthings.pending_result_time,
+}
+
+
 def get_select_attr(attr, label, nested=False, as_of=None):
     table_name = getattr(getattr(attr, "table", None), "name", None)
 
@@ -1051,6 +1414,13 @@ def get_select_attr(attr, label, nested=False, as_of=None):
     if isinstance(attr.type, Geometry):
         return func.ST_AsGeoJSON(attr).cast(JSONB).label(label)
     elif isinstance(attr.type, TSTZRANGE):
+        if (
+            DEFERRED_RANGES
+            and table_name == "Datastream"
+            and attr.name in PENDING_RANGES
+        ):
+            # Widen the range with the bounds not merged into the row yet
+            attr = PENDING_RANGES[attr.name](attr.table.c.id, attr)
         lower_bound = func.lower(attr)
         upper_bound = func.upper(attr)
         if VERSIONING and attr.name == "systemTimeValidity":
@@ -1115,6 +1485,96 @@ def get_orderby_attr(attrs, orders):
     return ordering
 
 
+def is_seek_key(attr):
+    """
+    Check if an order by attribute can be part of a seek key.
+
+    Only scalar columns qualify: their JSON values can be bound back as
+    parameters and compared with the row order PostgreSQL uses.
+    """
+    return isinstance(attr, InstrumentedAttribute) and isinstance(
+        attr.type, (Integer, Numeric, String, DateTime)
+    )
+
+
+def get_seek_value(attr, value):
+    """
+    Convert a seek key value decoded from a $skiptoken to a bind literal.
+
+    Raises:
+        BadRequest: If the value does not fit the column type.
+    """
+    if value is None:
+        return None
+    if isinstance(attr.type, DateTime) and isinstance(value, str):
+        try:
+            return literal(isoparse(value))
+        except ValueError:
+            raise BadRequest("Invalid $skiptoken")
+    if isinstance(attr.type, Integer) and type(value) is int:
+        return literal(value, BigInteger)
+    if isinstance(attr.type, Numeric) and type(value) in (int, float):
+        return literal(value)
+    if isinstance(attr.type, String) and isinstance(value, str):
+        return literal(value)
+    raise BadRequest("Invalid $skiptoken")
+
+
+def get_seek_filter(attrs, orders, values):
+    """
+    Build the predicate that selects the rows after a seek key.
+
+    Args:
+        attrs (list): The seek key attributes, ending with the id.
+        orders (list): The order ("asc" or "desc") of each attribute.
+        values (list): The seek key values of the last row of the page.
+
+    Returns:
+        The filter clause.
+
+    Raises:
+        BadRequest: If the values do not match the seek key.
+    """
+    if len(values) != len(attrs):
+        raise BadRequest("Invalid $skiptoken")
+
+    values = [get_seek_value(a, value) for a, value in zip(attrs, values)]
+    nullable = [a.expression.nullable for a in attrs]
+    # Compare strings with the collation get_orderby_attr orders them by
+    attrs = [
+        a.collate("C") if isinstance(a.type, (String, Text)) else a
+        for a in attrs
+    ]
+
+    if (
+        len(set(orders)) == 1
+        and all(value is not None for value in values)
+        and not any(nullable)
+    ):
+        # A single row comparison can use a matching index as a range
+        if orders[0] == "asc":
+            return tuple_(*attrs) > tuple_(*values)
+        return tuple_(*attrs) < tuple_(*values)
+
+    # PostgreSQL sorts NULL after every value in ascending order and before
+    # every value in descending order.
+    clauses = []
+    equal = []
+    for a, order, value, is_nullable in zip(attrs, orders, values, nullable):
+        if value is None:
+            # Nothing sorts after NULL in ascending order
+            after = a.isnot(None) if order == "desc" else None
+            equal.append(a.is_(None))
+        else:
+            after = a > value if order == "asc" else a < value
+            if order == "asc" and is_nullable:
+                after = or_(after, a.is_(None))
+            equal.append(a == value)
+        if after is not None:
+            clauses.append(and_(*equal[:-1], after))
+    return or_(*clauses)
+
+
 def get_query_compiled(query):
     return query.compile(
         dialect=engine.dialect,
@@ -1122,114 +1582,177 @@ def get_query_compiled(query):
     )
 
 
-def get_expand_function(
-    relationship,
-    compiled_query,
-    sub_query,
-    label,
-    select_node,
-    filter_node,
-    orderby_node,
-    expand_node,
-):
-    if relationship.direction.name != "MANYTOMANY":
-        return expand_function(
-            compiled_query,
-            sub_query,
-            label,
-            select_node,
-            filter_node,
-            orderby_node,
-            expand_node,
-        )
-    return expand_many2many_function(
-        compiled_query,
-        sub_query,
-        label,
-        relationship,
-        select_node,
-        filter_node,
-        orderby_node,
-        expand_node,
+class ParameterizedCompiler(engine.dialect.statement_compiler):
+    """
+    Statement compiler that renders string bind parameters inline.
+
+    The asyncpg dialect casts every placeholder to the type of its bind
+    ($1::VARCHAR), but $filter string literals are routinely compared with
+    timestamp, JSON path and range expressions, which PostgreSQL only accepts
+    from an untyped literal. Typed values (ids, numbers, datetimes, durations,
+    limits) are still sent as positional parameters.
+    """
+
+    def visit_bindparam(self, bindparam, **kw):
+        if isinstance(bindparam.type, String):
+            kw["literal_binds"] = True
+        return super().visit_bindparam(bindparam, **kw)
+
+
+def compile_query(query):
+    """
+    Compile a query to SQL with positional bind parameters.
+
+    Typed literals are lifted out of the statement as $n placeholders, so
+    requests with the same URL shape produce the same SQL text and can reuse
+    the asyncpg statement cache and the PostgreSQL plan.
+
+    Args:
+        query: The SQLAlchemy query to compile.
+
+    Returns:
+        tuple: The SQL string and the list of positional parameter values.
+    """
+    compiled = ParameterizedCompiler(
+        engine.dialect,
+        query,
+        compile_kwargs={"render_postcompile": True},
     )
+    params = compiled.construct_params(escape_names=False)
+    return str(compiled), [params[name] for name in compiled.positiontup]
 
 
-def expand_function(
-    compiled_query,
-    sub_query,
-    label_name,
-    select_node,
-    filter_node,
-    orderby_node,
-    expand_node,
-):
-    return func.sensorthings.expand(
-        str(compiled_query),
-        ("{}".format(sub_query[1].name) if sub_query[1] is not None else "id"),
-        (
-            text(
-                '"{}".id::integer'.format(
-                    globals()[sub_query[2]].__tablename__
+def get_expand_link_options(subquery):
+    """
+    Build the query options of the next link of an expanded collection.
+
+    Args:
+        subquery (QueryNode): The subquery of the expand identifier.
+
+    Returns:
+        str: The $filter, $select, $orderby, $count and $expand options.
+    """
+    options = ""
+    if not subquery:
+        return options
+    if subquery.filter:
+        options += f"&$filter={subquery.filter.filter}"
+    if subquery.select:
+        options += "&$select=" + ",".join(
+            identifier.name for identifier in subquery.select.identifiers
+        )
+    if subquery.orderby:
+        options += "&$orderby=" + ",".join(
+            f"{identifier.identifier} {identifier.order}"
+            for identifier in subquery.orderby.identifiers
+        )
+    if subquery.count and subquery.count.value:
+        options += "&$count=true"
+    if subquery.expand:
+        options += f"&$expand={build_expand(subquery.expand)}"
+    return options
+
+
+def unwrap_expand_columns(columns, labels):
+    """
+    Split each expanded collection column into its value, next link and
+    count columns.
+
+    Args:
+        columns: The columns of the query.
+        labels (dict): The count flag of each expanded collection label.
+
+    Returns:
+        list: The columns to select.
+    """
+    columns_to_select = []
+    for column in columns:
+        if column.name not in labels:
+            columns_to_select.append(column)
+            continue
+        columns_to_select.append(
+            column.op("->")(column.name).label(column.name)
+        )
+        columns_to_select.append(
+            column.op("->")(column.name + "@iot.nextLink").label(
+                column.name + "@iot.nextLink"
+            )
+        )
+        if labels[column.name]:
+            columns_to_select.append(
+                column.op("->")(column.name + "@iot.count").label(
+                    column.name + "@iot.count"
                 )
             )
-            if sub_query[1] is not None
-            else text(
-                '"{}".{}_id::integer'.format(
-                    globals()[sub_query[2]].__tablename__,
-                    sub_query[5].replace("TravelTime", ""),
+    return columns_to_select
+
+
+def get_expand_count(count_query, parent_key, parent_entity):
+    """
+    Count the related entities of a parent row according to COUNT_MODE.
+
+    Args:
+        count_query: The subquery of the related entities, with the key of
+            their parent row as the fk column.
+        parent_key: The parent row column matched by the fk column.
+        parent_entity: The parent entity the count is correlated with.
+
+    Returns:
+        The count expression.
+    """
+    exact_count = (
+        select(func.count())
+        .select_from(count_query)
+        .where(count_query.c.fk == parent_key)
+        .correlate(parent_entity)
+        .scalar_subquery()
+    )
+    if COUNT_MODE not in {"LIMIT_ESTIMATE", "ESTIMATE_LIMIT"}:
+        return exact_count
+
+    limited_count = select(func.count().label("count")).select_from(
+        select(count_query.c.fk)
+        .where(count_query.c.fk == parent_key)
+        .limit(COUNT_ESTIMATE_THRESHOLD)
+        .correlate(parent_entity)
+        .subquery()
+    )
+    # sensorthings.count_estimate() EXPLAINs the statement text it
+    # receives, so the parent key is written into that text.
+    estimate_count = select(
+        func.sensorthings.count_estimate(
+            func.concat(
+                str(
+                    get_query_compiled(
+                        select(literal_column("1")).select_from(count_query)
+                    )
                 )
+                + " WHERE d.fk = ",
+                parent_key,
             )
-        ),
-        sub_query[4],
-        sub_query[3],
-        (True if sub_query[1] is not None else False),
-        sub_query[7],
-        label_name,
-        HOSTNAME
-        + SUBPATH
-        + VERSION
-        + getattr(globals()[sub_query[2]], "self_link")
-        + "/",
-        sub_query[8],
-        COUNT_MODE,
-        COUNT_ESTIMATE_THRESHOLD,
-        select_node,
-        filter_node,
-        orderby_node,
-        expand_node,
-    ).label(label_name)
-
-
-def expand_many2many_function(
-    compiled_query,
-    sub_query,
-    label_name,
-    relationship,
-    select_node,
-    filter_node,
-    orderby_node,
-    expand_node,
-):
-    return func.sensorthings.expand_many2many(
-        str(compiled_query),
-        f'{relationship.secondary.schema}."{relationship.secondary.name}"',
-        text('"{}".id::integer'.format(globals()[sub_query[2]].__tablename__)),
-        "{}_id".format(sub_query[5].replace("TravelTime", "")),
-        "{}_id".format(sub_query[2].replace("TravelTime", "")),
-        sub_query[4],
-        sub_query[3],
-        sub_query[7],
-        label_name,
-        HOSTNAME
-        + SUBPATH
-        + VERSION
-        + getattr(globals()[sub_query[2]], "self_link")
-        + "/",
-        sub_query[8],
-        COUNT_MODE,
-        COUNT_ESTIMATE_THRESHOLD,
-        select_node,
-        filter_node,
-        orderby_node,
-        expand_node,
-    ).label(label_name)
+        ).label("count")
+    )
+    if COUNT_MODE == "LIMIT_ESTIMATE":
+        counts = limited_count.correlate(parent_entity).subquery()
+        count = case(
+            (
+                counts.c.count == COUNT_ESTIMATE_THRESHOLD,
+                estimate_count.correlate(parent_entity).scalar_subquery(),
+            ),
+            else_=counts.c.count,
+        )
+    else:
+        counts = estimate_count.correlate(parent_entity).subquery()
+        count = case(
+            (
+                counts.c.count < COUNT_ESTIMATE_THRESHOLD,
+                limited_count.correlate(parent_entity).scalar_subquery(),
+            ),
+            else_=counts.c.count,
+        )
+    return (
+        select(count)
+        .select_from(counts)
+        .correlate(parent_entity)
+        .scalar_subquery()
+    )
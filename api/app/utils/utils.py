@@ -12,6 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import base64
 import json
 import re
 from urllib.parse import parse_qs, quote, urlencode, urlparse, urlunparse
@@ -298,7 +299,22 @@ def build_self_link(entity_name, entity_id):
     return f"{HOSTNAME}{SUBPATH}{VERSION}/{url_name}({entity_id})"
 
 
-def build_nextLink(full_path, count_links):
+def build_nextLink(full_path, count_links, seek=None):
+    """
+    Build the @iot.nextLink of a collection page.
+
+    With a seek key the link carries it as an opaque $skiptoken, so the next
+    page continues after the last row instead of skipping an offset;
+    otherwise $skip is advanced by $top.
+
+    Args:
+        full_path (str): The request path, including the query.
+        count_links (int): The number of rows fetched for the page.
+        seek (str, optional): JSON array of the last row's seek key.
+
+    Returns:
+        str: The nextLink, or None if there is no next page.
+    """
     nextLink = f"{HOSTNAME}{full_path}"
     new_top_value = TOP_VALUE
 
@@ -316,8 +332,13 @@ def build_nextLink(full_path, count_links):
     else:
         query_params["$top"] = [str(new_top_value)]
 
+    if seek is not None:
+        # ---- Handle $skiptoken ----
+        # The seek predicate already starts after the last row
+        query_params.pop("$skip", None)
+        query_params["$skiptoken"] = [encode_skiptoken(seek)]
     # ---- Handle $skip ----
-    if "$skip" in query_params:
+    elif "$skip" in query_params:
         skip_value = int(query_params["$skip"][0])
         query_params["$skip"] = [str(skip_value + new_top_value)]
     else:
@@ -338,6 +359,43 @@ def build_nextLink(full_path, count_links):
     return None
 
 
+def encode_skiptoken(seek):
+    """
+    Encode a seek key as an opaque, URL-safe $skiptoken.
+
+    Args:
+        seek (str): JSON array of the order by values and the id of a row.
+
+    Returns:
+        str: The base64url encoded token, without padding.
+    """
+    return base64.urlsafe_b64encode(seek.encode()).rstrip(b"=").decode()
+
+
+def decode_skiptoken(token):
+    """
+    Decode a $skiptoken back to the seek key values.
+
+    Args:
+        token (str): The token produced by encode_skiptoken.
+
+    Returns:
+        list: The order by values followed by the id.
+
+    Raises:
+        BadRequest: If the token is malformed.
+    """
+    try:
+        seek = json.loads(
+            base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        )
+    except ValueError:
+        raise BadRequest("Invalid $skiptoken")
+    if not isinstance(seek, list) or not seek:
+        raise BadRequest("Invalid $skiptoken")
+    return seek
+
+
 def validate_payload_keys(payload, keys):
     invalid_keys = [key for key in payload.keys() if key not in keys]
     if invalid_keys:
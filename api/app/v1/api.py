@@ -12,7 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from app import AUTHORIZATION, NETWORK, VERSIONING
+from app import (
+    AUTHORIZATION,
+    LIVE_OBSERVATIONS,
+    NETWORK,
+    REDIS,
+    RESPONSE_CACHE,
+    VERSIONING,
+)
+from app.v1.endpoints import response_cache
 from app.v1.endpoints.exception_handlers import register_exception_handlers
 from app.v1.endpoints.create import bulk_observation, data_array_observation
 from app.v1.endpoints.create import datastream as create_datastream
@@ -66,6 +74,8 @@ from app.v1.endpoints.read import observed_property as read_observed_property
 from app.v1.endpoints.read import policy as read_policy
 from app.v1.endpoints.read import read
 from app.v1.endpoints.read import sensor as read_sensor
+from app.v1.endpoints.read import storage as read_storage
+from app.v1.endpoints.read import subscription
 from app.v1.endpoints.read import thing as read_thing
 from app.v1.endpoints.read import user as read_user
 from app.v1.endpoints.update import datastream as update_datastream
@@ -83,9 +93,10 @@ from app.v1.endpoints.update import (
 )
 from app.v1.endpoints.update import policy as update_policy
 from app.v1.endpoints.update import sensor as update_sensor
+from app.v1.endpoints.update import storage as update_storage
 from app.v1.endpoints.update import thing as update_thing
 from app.v1.endpoints.update import user as update_user
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 
 if AUTHORIZATION:
     tags_metadata = [
@@ -154,8 +165,20 @@ tags_metadata += [
         "name": "Observations",
         "description": "Individual measurements recorded at a given point in time.",
     },
+    {
+        "name": "Storage",
+        "description": "Compression and retention of the stored Observations.",
+    },
 ]
 
+if LIVE_OBSERVATIONS:
+    tags_metadata += [
+        {
+            "name": "Subscriptions",
+            "description": "New Observations pushed as they are created.",
+        },
+    ]
+
 v1 = FastAPI(
     title="OGC SensorThings API",
     description="A SensorThings API implementation in Python using FastAPI.",
@@ -169,6 +192,24 @@ v1 = FastAPI(
 # bodies. See app/v1/endpoints/exception_handlers.py.
 register_exception_handlers(v1)
 
+if RESPONSE_CACHE and REDIS:
+
+    @v1.middleware("http")
+    async def invalidate_response_cache(request: Request, call_next):
+        """
+        Invalidate the cached GET responses affected by a successful write.
+        """
+        if request.method not in ("POST", "PUT", "PATCH", "DELETE"):
+            return await call_next(request)
+        body = await request.body()
+        response = await call_next(request)
+        if response.status_code < 400:
+            await response_cache.invalidate(
+                response_cache.get_write_tags(request.url.path, body)
+            )
+        return response
+
+
 # Register the authorization endpoints (login, user, policy)
 if AUTHORIZATION:
     v1.include_router(login.v1)
@@ -191,6 +232,14 @@ if NETWORK:
     v1.include_router(update_network.v1)
     v1.include_router(delete_network.v1)
 
+# Register the storage endpoints, before the catch-all read endpoint
+v1.include_router(read_storage.v1)
+v1.include_router(update_storage.v1)
+
+# Register the subscription endpoints, before the catch-all read endpoint
+if LIVE_OBSERVATIONS:
+    v1.include_router(subscription.v1)
+
 # Register the read endpoints
 v1.include_router(read_location.v1)
 v1.include_router(read_thing.v1)
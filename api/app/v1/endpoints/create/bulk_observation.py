@@ -20,10 +20,19 @@ from app.utils.utils import safe_parse_datetime
 from app.v1.endpoints.exceptions import BadRequest
 from app.v1.endpoints.functions import set_role
 from asyncpg.types import Range
-from fastapi import APIRouter, Body, Depends, Header, status
+from fastapi import APIRouter, Body, Depends, Header, Query, status
 from fastapi.responses import Response
 
-from .functions import create_entity, set_commit, update_datastream_last_foi_id
+from .functions import (
+    check_on_conflict,
+    copy_observations,
+    count_written,
+    create_entity,
+    get_conflict_headers,
+    set_commit,
+    update_datastream_last_foi_id,
+    update_datastream_time_ranges,
+)
 
 v1 = APIRouter()
 
@@ -82,10 +91,18 @@ PAYLOAD_EXAMPLE = [
 )
 async def bulk_observations(
     payload: list = Body(examples=[PAYLOAD_EXAMPLE]),
+    on_conflict: str = Query(
+        None,
+        alias="onConflict",
+        description="skip or update the Observations that already exist",
+    ),
     commit_message=message,
     current_user=user,
     pgpool=Depends(get_pool_w) if POSTGRES_PORT_WRITE else Depends(get_pool),
 ):
+    check_on_conflict(on_conflict)
+    counts = {}
+
     async with pgpool.acquire() as conn:
         async with conn.transaction():
             if current_user is not None:
@@ -123,22 +140,34 @@ async def bulk_observations(
                 foi_id = await get_foi_id(
                     datastream_id, conn, commit_id=commit_id
                 )
-                await insertBulkObservation(
+                set_counts = await insertBulkObservation(
                     data_array,
                     conn,
                     foi_id,
                     datastream_id=datastream_id,
                     components=components,
                     commit_id=commit_id,
+                    on_conflict=on_conflict,
                 )
+                for name, count in (set_counts or {}).items():
+                    counts[name] = counts.get(name, 0) + count
 
             if current_user is not None:
                 await conn.execute("RESET ROLE;")
-    return Response(status_code=status.HTTP_201_CREATED)
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        headers=get_conflict_headers(counts),
+    )
 
 
 async def insertBulkObservation(
-    payload, conn, foi_id, datastream_id, components=None, commit_id=None
+    payload,
+    conn,
+    foi_id,
+    datastream_id,
+    components=None,
+    commit_id=None,
+    on_conflict=None,
 ):
     """
     Inserts observation data into the database.
@@ -147,9 +176,10 @@ async def insertBulkObservation(
         payload (dict or list): The payload containing the observation(s) to be inserted.
         conn (connection): The database connection object.
         datastream_id (int, optional): The ID of the datastream associated with the observation. Defaults to None.
+        on_conflict (str, optional): Skip ("skip") or update ("update") the observations that already exist. Defaults to None.
 
     Returns:
-        tuple: A tuple containing the ID and selfLink of the inserted observation.
+        dict: The inserted, updated and skipped counts with on_conflict, else None.
 
     Raises:
         Exception: If an error occurs during the insertion process.
@@ -283,59 +313,22 @@ async def insertBulkObservation(
             for val in reversed(inserts):
                 item.insert(0, val)
 
-        column_names = ", ".join(f'"{col}"' for col in cols)
-
-        values_placeholders = ", ".join(
-            f"({', '.join(['$' + str(i + 1 + j * len(data[0])) for i in range(len(data[0]))])})"
-            for j in range(len(data))
-        )
-
-        query = f"""
-            INSERT INTO sensorthings."Observation"
-            ({column_names})
-            VALUES {values_placeholders};
-        """
+        written = await copy_observations(conn, cols, data, on_conflict)
 
-        flattened_values = [item for row in data for item in row]
-
-        await conn.execute(query, *flattened_values)
-
-        update_query = """
-            UPDATE sensorthings."Datastream"
-            SET "phenomenonTime" = tstzrange(
-                LEAST($1::timestamptz, lower("phenomenonTime")),
-                GREATEST($2::timestamptz, upper("phenomenonTime")),
-                '[]'
-            ),
-            "resultTime" =
-                CASE
-                    WHEN $3::timestamptz IS NOT NULL
-                    AND $4::timestamptz IS NOT NULL THEN
-                        CASE
-                            WHEN "resultTime" IS NULL THEN
-                                tstzrange($3::timestamptz, $4::timestamptz, '[]')
-                            ELSE
-                                tstzrange(
-                                    LEAST($3::timestamptz, lower("resultTime")),
-                                    GREATEST($4::timestamptz, upper("resultTime")),
-                                    '[]'
-                                )
-                        END
-                    ELSE "resultTime"
-                END
-            WHERE id = $5::bigint;
-        """
-        await conn.execute(
-            update_query,
+        await update_datastream_time_ranges(
+            conn,
+            datastream_id,
             ph_min_start,
             ph_max_end,
             rt_interval.lower if rt_interval else None,
             rt_interval.upper if rt_interval else None,
-            datastream_id,
         )
 
         await update_datastream_last_foi_id(conn, foi_id, datastream_id)
 
+        if written is not None:
+            return count_written(written, len(data))
+
 
 async def get_foi_id(datastream_id, conn, commit_id=None):
     """
@@ -12,32 +12,23 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
-from datetime import datetime
-
 import asyncpg
 from app import AUTHORIZATION, POSTGRES_PORT_WRITE, VERSIONING
 from app.db.asyncpg_db import get_pool, get_pool_w
-from app.utils.utils import (
-    build_self_link,
-    check_iot_id_in_payload,
-    check_missing_properties,
-    handle_datetime_fields,
-    handle_result_field,
-)
+from app.utils.utils import build_self_link
 from app.v1.endpoints.error_response import error_response
+from app.v1.endpoints.exceptions import BadRequest
 from app.v1.endpoints.functions import set_role
 from asyncpg.exceptions import InsufficientPrivilegeError
-from fastapi import APIRouter, Body, Depends, Header, status
+from fastapi import APIRouter, Body, Depends, Header, Query, status
 from fastapi.responses import JSONResponse
 
 from .functions import (
-    generate_feature_of_interest,
-    handle_associations,
-    insert_datastream_entity,
-    insert_feature_of_interest_entity,
+    check_on_conflict,
+    get_conflict_headers,
+    insert_observation_batch,
+    prepare_observation,
     set_commit,
-    update_datastream_last_foi_id,
 )
 
 v1 = APIRouter()
@@ -53,6 +44,16 @@ if AUTHORIZATION:
 if VERSIONING or AUTHORIZATION:
     message = Header(alias="commit-message")
 
+COMPONENTS = {
+    "result",
+    "phenomenonTime",
+    "resultTime",
+    "resultQuality",
+    "validTime",
+    "parameters",
+    "FeatureOfInterest/id",
+}
+
 PAYLOAD_EXAMPLE = [
     {
         "Datastream": {"@iot.id": 1},
@@ -96,274 +97,170 @@ PAYLOAD_EXAMPLE = [
 )
 async def data_array_observation(
     payload: list = Body(examples=[PAYLOAD_EXAMPLE]),
+    on_conflict: str = Query(
+        None,
+        alias="onConflict",
+        description="skip or update the Observations that already exist",
+    ),
     commit_message=message,
     current_user=user,
     pool=Depends(get_pool_w) if POSTGRES_PORT_WRITE else Depends(get_pool),
 ):
-    response_urls = []
+    check_on_conflict(on_conflict)
+    observation_sets = []
+    counts = {}
+
+    for observation_set in payload:
+        datastream_id = observation_set.get("Datastream", {}).get("@iot.id")
+        components = observation_set.get("components", [])
+        data_array = observation_set.get("dataArray", [])
+
+        if not datastream_id:
+            return error_response(
+                status.HTTP_400_BAD_REQUEST,
+                "Missing 'datastream_id' in Datastream.",
+            )
+
+        # Check that at least phenomenonTime and result are present
+        if "phenomenonTime" not in components or "result" not in components:
+            return error_response(
+                status.HTTP_400_BAD_REQUEST,
+                "Missing required properties 'phenomenonTime' or 'result' in components.",
+            )
+
+        unknown = [c for c in components if c not in COMPONENTS]
+        if unknown:
+            return error_response(
+                status.HTTP_400_BAD_REQUEST,
+                f"Unknown components: {', '.join(map(str, unknown))}.",
+            )
+
+        observation_sets.append((datastream_id, components, data_array))
 
     async with pool.acquire() as conn:
         async with conn.transaction():
             if current_user is not None:
                 await set_role(conn, current_user)
 
-            commit_id = await set_commit(
-                conn, commit_message, current_user
-            )
+            commit_id = await set_commit(conn, commit_message, current_user)
 
-            for observation_set in payload:
-                datastream_id = observation_set.get("Datastream", {}).get(
-                    "@iot.id"
+            try:
+                response_urls = await insert_data_array_observations(
+                    conn,
+                    observation_sets,
+                    commit_id=commit_id,
+                    on_conflict=on_conflict,
+                    counts=counts,
+                )
+            except InsufficientPrivilegeError:
+                return JSONResponse(
+                    status_code=status.HTTP_403_FORBIDDEN,
+                    content={
+                        "code": 403,
+                        "type": "error",
+                        "message": "Insufficient privileges.",
+                    },
+                )
+            except (
+                asyncpg.PostgresConnectionError,
+                asyncpg.TooManyConnectionsError,
+            ):
+                # conformance: req/request-data/status-code — DB unavailable is 503 (mirror read.py), not 400
+                return error_response(
+                    status.HTTP_503_SERVICE_UNAVAILABLE,
+                    "Database temporarily unavailable",
                 )
-                components = observation_set.get("components", [])
-                data_array = observation_set.get("dataArray", [])
-
-                if not datastream_id:
-                    return error_response(
-                        status.HTTP_400_BAD_REQUEST,
-                        "Missing 'datastream_id' in Datastream.",
-                    )
-
-                # Check that at least phenomenonTime and result are present
-                if (
-                    "phenomenonTime" not in components
-                    or "result" not in components
-                ):
-                    return error_response(
-                        status.HTTP_400_BAD_REQUEST,
-                        "Missing required properties 'phenomenonTime' or 'result' in components.",
-                    )
-
-                for data in data_array:
-                    try:
-                        observation_payload = {
-                            components[i]: (
-                                data[i] if i < len(data) else None
-                            )
-                            for i in range(len(components))
-                        }
-
-                        observation_payload["datastream_id"] = (
-                            datastream_id
-                        )
-
-                        if "FeatureOfInterest/id" in observation_payload:
-                            observation_payload["FeatureOfInterest"] = {
-                                "@iot.id": observation_payload.pop(
-                                    "FeatureOfInterest/id"
-                                )
-                            }
-                        else:
-                            await generate_feature_of_interest(
-                                observation_payload,
-                                conn,
-                                commit_id=commit_id,
-                            )
-
-                        _, observation_selfLink = (
-                            await insertDataArrayObservation(
-                                observation_payload,
-                                conn,
-                                commit_id=commit_id,
-                            )
-                        )
-                        response_urls.append(observation_selfLink)
-                    except InsufficientPrivilegeError:
-                        return JSONResponse(
-                            status_code=status.HTTP_403_FORBIDDEN,
-                            content={
-                                "code": 403,
-                                "type": "error",
-                                "message": "Insufficient privileges.",
-                            },
-                        )
-                    except (
-                        asyncpg.PostgresConnectionError,
-                        asyncpg.TooManyConnectionsError,
-                    ):
-                        # conformance: req/request-data/status-code — DB unavailable is 503 (mirror read.py), not 400
-                        return error_response(
-                            status.HTTP_503_SERVICE_UNAVAILABLE,
-                            "Database temporarily unavailable",
-                        )
-                    except Exception as e:
-                        response_urls.append("error")
 
             if current_user is not None:
                 await conn.execute("RESET ROLE;")
     return JSONResponse(
-        status_code=status.HTTP_201_CREATED, content=response_urls
+        status_code=status.HTTP_201_CREATED,
+        content=response_urls,
+        headers=get_conflict_headers(counts),
     )
 
 
-async def insertDataArrayObservation(
-    payload, conn, datastream_id=None, commit_id=None
-):
+def get_row_observation(components, data):
     """
-    Inserts observation data into the database.
+    Convert a dataArray row into the Observation columns it sets.
 
     Args:
-        payload (dict or list): The payload containing the observation(s) to be inserted.
-        conn (connection): The database connection object.
-        datastream_id (int, optional): The ID of the datastream associated with the observation. Defaults to None.
+        components (list): The components of the dataArray.
+        data (list): The values of the row.
 
     Returns:
-        tuple: A tuple containing the ID and selfLink of the inserted observation.
+        dict: The values of the Observation columns.
 
     Raises:
-        Exception: If an error occurs during the insertion process.
+        BadRequest, ValueError, TypeError: If the row cannot be stored.
     """
+    observation = {
+        component: data[i] if i < len(data) else None
+        for i, component in enumerate(components)
+    }
 
-    async with conn.transaction():
-        if isinstance(payload, dict):
-            payload = [payload]
-
-        observations = []
-
-        all_keys = set()
-
-        for obs in payload:
-            if datastream_id:
-                obs["datastream_id"] = datastream_id
-
-            await handle_associations(
-                obs,
-                "Datastream",
-                datastream_id,
-                insert_datastream_entity,
-                conn,
-                commit_id=commit_id,
-            )
-
-            if "FeatureOfInterest" in obs:
-                if "@iot.id" in obs["FeatureOfInterest"]:
-                    features_of_interest_id = obs["FeatureOfInterest"][
-                        "@iot.id"
-                    ]
-                    check_iot_id_in_payload(
-                        obs["FeatureOfInterest"], "FeatureOfInterest"
-                    )
-                    select_query = f"""
-                        SELECT last_foi_id
-                        FROM sensorthings."Datastream"
-                        WHERE id = $1::bigint;
-                    """
-                    last_foi_id = await conn.fetchval(
-                        select_query, obs["datastream_id"]
-                    )
-                    if last_foi_id != features_of_interest_id:
-                        await update_datastream_last_foi_id(
-                            conn,
-                            features_of_interest_id,
-                            obs["datastream_id"],
-                        )
-                else:
-                    features_of_interest_id, _ = (
-                        await insert_feature_of_interest_entity(
-                            conn,
-                            obs["FeatureOfInterest"],
-                            obs["datastream_id"],
-                            commit_id=commit_id,
-                        )
-                    )
-                obs.pop("FeatureOfInterest", None)
-                obs["featuresofinterest_id"] = features_of_interest_id
-            else:
-                await generate_feature_of_interest(
-                    obs, conn, commit_id=commit_id
-                )
-
-            check_missing_properties(obs, ["Datastream", "FeaturesOfInterest"])
-            handle_datetime_fields(obs)
-            handle_result_field(obs)
+    if "FeatureOfInterest/id" in observation:
+        observation["featuresofinterest_id"] = int(
+            observation.pop("FeatureOfInterest/id")
+        )
 
-            if obs.get("phenomenonTimeStart") is None:
-                current_time = datetime.now()
-                obs["phenomenonTimeStart"] = current_time
-                obs["phenomenonTimeEnd"] = current_time
+    if observation["phenomenonTime"] is None:
+        raise ValueError("Missing phenomenonTime")
 
-            for key, value in obs.items():
-                if isinstance(value, dict):
-                    obs[key] = json.dumps(value)
-                all_keys.add(key)
+    return prepare_observation(observation)
 
-        all_keys = list(all_keys)
 
-        for obs in payload:
-            obs_tuple = []
-            for key in all_keys:
-                obs_tuple.append(obs.get(key))
-            observations.append(tuple(obs_tuple))
+async def insert_data_array_observations(
+    conn, observation_sets, commit_id=None, on_conflict=None, counts=None
+):
+    """
+    Inserts the rows of the dataArrays into the database in a single COPY.
 
-        keys = ", ".join(f'"{key}"' for key in all_keys)
-        values_placeholders = ", ".join(
-            f"({', '.join(f'${i * len(all_keys) + j + 1}' for j in range(len(all_keys)))})"
-            for i in range(len(observations))
-        )
+    Each invalid row, row linked to a Datastream or FeatureOfInterest that
+    does not exist, or row the database rejects, such as one with the
+    phenomenonTime of an existing Observation of its Datastream, is reported
+    as an error without failing the others.
+    With on_conflict, the rows matching an existing Observation are reported
+    with its selfLink.
 
-        insert_query = f"""
-            INSERT INTO sensorthings."Observation" ({keys})
-            VALUES {values_placeholders}
-            RETURNING
-                id,
-                "phenomenonTimeStart",
-                "phenomenonTimeEnd",
-                "resultTime",
-                datastream_id,
-                featuresofinterest_id;
-        """
-
-        values = [
-            value for observation in observations for value in observation
-        ]
-        result = await conn.fetch(insert_query, *values)
-
-        min_phenomenon_times = [
-            record["phenomenonTimeStart"] for record in result
-        ]
-        max_phenomenon_times = [
-            record["phenomenonTimeEnd"] for record in result
-        ]
-        result_times = [
-            record["resultTime"]
-            for record in result
-            if record["resultTime"] is not None
-        ]
-        update_query = """
-            UPDATE sensorthings."Datastream"
-            SET "phenomenonTime" = tstzrange(
-                LEAST($1::timestamptz, lower("phenomenonTime")),
-                GREATEST($2::timestamptz, upper("phenomenonTime")),
-                '[]'
-            ),
-            "resultTime" =
-                CASE
-                    WHEN $3::timestamptz IS NOT NULL
-                    AND $4::timestamptz IS NOT NULL THEN
-                        CASE
-                            WHEN "resultTime" IS NULL THEN
-                                tstzrange($3::timestamptz, $4::timestamptz, '[]')
-                            ELSE
-                                tstzrange(
-                                    LEAST($3::timestamptz, lower("resultTime")),
-                                    GREATEST($4::timestamptz, upper("resultTime")),
-                                    '[]'
-                                )
-                        END
-                    ELSE "resultTime"
-                END
-            WHERE id = $5::bigint;
-        """
-        await conn.execute(
-            update_query,
-            min(min_phenomenon_times),
-            max(max_phenomenon_times),
-            min(result_times) if result_times else None,
-            max(result_times) if result_times else None,
-            result[0]["datastream_id"],
-        )
+    Args:
+        conn (connection): The database connection object.
+        observation_sets (list): The (datastream_id, components, dataArray)
+            of each set of Observations.
+        commit_id (int, optional): The ID of the commit. Defaults to None.
+        on_conflict (str, optional): "skip", "update" or None.
+        counts (dict, optional): Filled with the inserted, updated and
+            skipped counts when on_conflict is given.
 
-        observation_id = result[0]["id"]
-        observation_selfLink = build_self_link("Observation", observation_id)
+    Returns:
+        list: The selfLink of each row, in the order of the payload, or
+            "error" for the rows that were not inserted.
+    """
+    response_urls = []
+    rows = []
+
+    for datastream_id, components, data_array in observation_sets:
+        for data in data_array:
+            try:
+                observation = get_row_observation(components, data)
+            except (BadRequest, ValueError, TypeError):
+                pass
+            else:
+                observation["datastream_id"] = datastream_id
+                rows.append((len(response_urls), observation))
+            response_urls.append("error")
+
+    observation_ids = await insert_observation_batch(
+        conn,
+        [observation for _, observation in rows],
+        commit_id=commit_id,
+        on_conflict=on_conflict,
+        counts=counts,
+    )
+    for (index, _), observation_id in zip(rows, observation_ids):
+        if observation_id is not None:
+            response_urls[index] = build_self_link(
+                "Observation", observation_id
+            )
 
-        return observation_id, observation_selfLink
+    return response_urls
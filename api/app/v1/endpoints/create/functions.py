@@ -13,9 +13,15 @@
 # limitations under the License.
 
 import json
-from datetime import datetime
-
-from app import AUTHORIZATION, NETWORK, ST_AGGREGATE, VERSIONING
+from datetime import datetime, timezone
+
+from app import (
+    AUTHORIZATION,
+    DEFERRED_RANGES,
+    NETWORK,
+    ST_AGGREGATE,
+    VERSIONING,
+)
 from app.utils.utils import (
     build_self_link,
     check_iot_id_in_payload,
@@ -26,8 +32,25 @@ from app.utils.utils import (
 )
 from app.v1.endpoints.functions import insert_commit
 from app.v1.endpoints.update.datastream import update_datastream_entity
-from app.v1.endpoints.update.observation import update_observation_entity
+from app.v1.endpoints.update.functions import update_observation_entity
 from app.v1.endpoints.exceptions import BadRequest, Forbidden
+from asyncpg.exceptions import (
+    DataError,
+    IntegrityConstraintViolationError,
+    InvalidColumnReferenceError,
+    RaiseError,
+)
+from asyncpg.types import Range
+
+JSON_COLUMNS = ("resultJSON", "resultQuality", "parameters")
+
+# The unique key of the Observations, used by the onConflict modes
+CONFLICT_KEY = ("phenomenonTimeStart", "phenomenonTimeEnd", "datastream_id")
+ON_CONFLICT = ("skip", "update")
+
+# The errors a single Observation can cause: invalid values, constraint
+# violations and the exceptions raised by the triggers
+ROW_ERRORS = (DataError, IntegrityConstraintViolationError, RaiseError)
 
 
 def normalize_geojson_geometry(value):
@@ -109,6 +132,462 @@ async def create_entity(connection, entity_name, payload):
         return inserted_id, inserted_self_link
 
 
+async def copy_observations(connection, columns, records, on_conflict=None):
+    """
+    Insert Observations with COPY, with no limit on their number.
+
+    The rows are copied into a temporary table, which is not subject to the
+    row level security of Observation, and moved into Observation with one
+    INSERT ... SELECT, so that its policies and triggers still apply.
+
+    With on_conflict, a row with the phenomenonTime and Datastream of an
+    existing Observation is skipped ("skip") or overwrites its other columns
+    ("update"), instead of failing the statement. When updating, only the
+    last of the rows sharing a key is written.
+
+    Args:
+        connection: The database connection.
+        columns (list): The Observation columns of the records.
+        records (iterable): The rows, in the order of the columns.
+        on_conflict (str, optional): "skip", "update" or None.
+
+    Returns:
+        list: With on_conflict, the id, the key and whether it was inserted
+            of each Observation written, else None.
+
+    Raises:
+        BadRequest: If on_conflict is used without the unique constraint.
+    """
+    column_names = ", ".join(f'"{column}"' for column in columns)
+    await connection.execute(f"""
+            CREATE TEMP TABLE observation_copy ON COMMIT DROP AS
+            SELECT {column_names} FROM sensorthings."Observation"
+            WITH NO DATA;
+        """)
+    await connection.copy_records_to_table(
+        "observation_copy", records=records, columns=columns
+    )
+
+    if on_conflict is None:
+        await connection.execute(f"""
+                INSERT INTO sensorthings."Observation" ({column_names})
+                SELECT {column_names} FROM observation_copy;
+                DROP TABLE observation_copy;
+            """)
+        return None
+
+    key = ", ".join(f'"{column}"' for column in CONFLICT_KEY)
+    if on_conflict == "update":
+        # A statement cannot update the same row twice, the last row wins
+        select = f"""
+            SELECT DISTINCT ON ({key}) {column_names}
+            FROM observation_copy
+            ORDER BY {key}, ctid DESC
+        """
+    else:
+        select = f"SELECT {column_names} FROM observation_copy"
+
+    try:
+        written = await connection.fetch(f"""
+                INSERT INTO sensorthings."Observation" ({column_names})
+                {select}
+                {get_conflict_clause(columns, on_conflict)}
+                RETURNING id, {key}, (xmax = 0) AS inserted;
+            """)
+    except InvalidColumnReferenceError:
+        raise_missing_constraint()
+    await connection.execute("DROP TABLE observation_copy;")
+    return written
+
+
+async def insert_observation_rows(
+    connection, columns, records, on_conflict=None
+):
+    """
+    Insert Observations one at a time, each in its own savepoint, so that
+    an Observation that cannot be stored fails alone.
+
+    Used when copy_observations fails for one of the rows. A row with the
+    key of an existing Observation fails without on_conflict, and is
+    skipped or updated as by copy_observations with it.
+
+    Args:
+        connection: The database connection.
+        columns (list): The Observation columns of the records.
+        records (list): The rows, in the order of the columns.
+        on_conflict (str, optional): "skip", "update" or None.
+
+    Returns:
+        tuple: The id, the key and whether it was inserted of each
+            Observation written, and the positions of the failed rows.
+    """
+    column_names = ", ".join(f'"{column}"' for column in columns)
+    values = ", ".join(f"${i}" for i in range(1, len(columns) + 1))
+    key = ", ".join(f'"{column}"' for column in CONFLICT_KEY)
+    query = f"""
+        INSERT INTO sensorthings."Observation" ({column_names})
+        VALUES ({values})
+        {get_conflict_clause(columns, on_conflict)}
+        RETURNING id, {key}, (xmax = 0) AS inserted;
+    """
+
+    written = []
+    failed = []
+    for position, record in enumerate(records):
+        try:
+            async with connection.transaction():
+                row = await connection.fetchrow(query, *record)
+        except InvalidColumnReferenceError:
+            raise_missing_constraint()
+        except ROW_ERRORS:
+            failed.append(position)
+            continue
+        if row is not None:
+            written.append(row)
+    return written, failed
+
+
+def get_conflict_clause(columns, on_conflict):
+    if on_conflict is None:
+        return ""
+    key = ", ".join(f'"{column}"' for column in CONFLICT_KEY)
+    if on_conflict == "update":
+        updates = ", ".join(
+            f'"{column}" = EXCLUDED."{column}"'
+            for column in columns
+            if column != "id" and column not in CONFLICT_KEY
+        )
+        return f"ON CONFLICT ({key}) DO UPDATE SET {updates}"
+    return f"ON CONFLICT ({key}) DO NOTHING"
+
+
+def raise_missing_constraint():
+    raise BadRequest(
+        "onConflict requires the unique phenomenonTime and Datastream "
+        "of the Observations, which this database does not enforce."
+    )
+
+
+def check_on_conflict(on_conflict):
+    if on_conflict is not None and on_conflict not in ON_CONFLICT:
+        raise BadRequest(
+            f"Invalid onConflict '{on_conflict}', use one of: "
+            f"{', '.join(ON_CONFLICT)}."
+        )
+
+
+def get_conflict_headers(counts):
+    """
+    Return the response headers reporting the counts of an upsert.
+    """
+    return {
+        f"Observations-{name.capitalize()}": str(count)
+        for name, count in counts.items()
+    }
+
+
+def count_written(written, total):
+    """
+    Count the Observations inserted, updated and skipped by an upsert.
+
+    Args:
+        written (list): The records returned by copy_observations.
+        total (int): The number of rows copied.
+
+    Returns:
+        dict: The inserted, updated and skipped counts.
+    """
+    inserted = sum(1 for record in written if record["inserted"])
+    return {
+        "inserted": inserted,
+        "updated": len(written) - inserted,
+        "skipped": total - len(written),
+    }
+
+
+def to_utc(value):
+    return value.astimezone(timezone.utc)
+
+
+def prepare_observation(observation):
+    """
+    Convert the properties of an Observation into the columns it sets.
+
+    Args:
+        observation (dict): The properties, with the Datastream and the
+            FeatureOfInterest already turned into their IDs.
+
+    Returns:
+        dict: The same dictionary, holding the values of the columns.
+
+    Raises:
+        BadRequest, ValueError, TypeError: If the Observation cannot be
+            stored.
+    """
+    handle_datetime_fields(observation)
+    handle_result_field(observation)
+
+    if observation.get("phenomenonTimeStart") is None:
+        current_time = datetime.now(timezone.utc)
+        observation["phenomenonTimeStart"] = current_time
+        observation["phenomenonTimeEnd"] = current_time
+
+    if not isinstance(observation.get("validTime"), (Range, type(None))):
+        raise ValueError("validTime must be an interval")
+
+    # COPY sends jsonb values as text, which the server parses
+    for column in JSON_COLUMNS:
+        value = observation.get(column)
+        if isinstance(value, str):
+            json.loads(value)
+        elif value is not None:
+            observation[column] = json.dumps(value)
+
+    return observation
+
+
+async def get_existing_ids(connection, table, ids):
+    """
+    Return which of the given IDs exist in a table.
+    """
+    if not ids:
+        return set()
+    query = f"""
+        SELECT id
+        FROM sensorthings."{table}"
+        WHERE id = ANY($1::bigint[]);
+    """
+    records = await connection.fetch(query, list(ids))
+    return {record["id"] for record in records}
+
+
+async def insert_observation_batch(
+    connection, observations, commit_id=None, on_conflict=None, counts=None
+):
+    """
+    Insert a batch of prepared Observations with a single COPY.
+
+    The Observations linked to a Datastream or FeatureOfInterest that does
+    not exist are skipped. The FeatureOfInterest generated from the Location
+    of a Datastream is resolved once per Datastream, the IDs are drawn from
+    the Observation sequence up front, and the time ranges and the last
+    FeatureOfInterest of each Datastream are updated once per batch.
+
+    With on_conflict, an Observation matching an existing one is skipped or
+    updated as by copy_observations, and takes the ID of the existing one.
+    If the COPY fails because of some of the Observations, such as one
+    with the key of an existing Observation without on_conflict, they are
+    inserted one at a time and only those that fail are left out.
+
+    Args:
+        connection: The database connection.
+        observations (list): The Observations, as returned by
+            prepare_observation, with their datastream_id and, optionally,
+            featuresofinterest_id.
+        commit_id (int, optional): The ID of the commit. Defaults to None.
+        on_conflict (str, optional): "skip", "update" or None.
+        counts (dict, optional): Filled with the inserted, updated and
+            skipped counts when on_conflict is given.
+
+    Returns:
+        list: The ID of each Observation, or None if it was skipped or
+            could not be stored.
+    """
+    async with connection.transaction():
+        datastream_ids = await get_existing_ids(
+            connection,
+            "Datastream",
+            {obs["datastream_id"] for obs in observations},
+        )
+        foi_ids = await get_existing_ids(
+            connection,
+            "FeaturesOfInterest",
+            {
+                obs["featuresofinterest_id"]
+                for obs in observations
+                if "featuresofinterest_id" in obs
+            },
+        )
+
+        generated_foi_ids = {}
+        linked = set()
+        inserted = []
+
+        for index, obs in enumerate(observations):
+            datastream_id = obs["datastream_id"]
+            if datastream_id not in datastream_ids:
+                continue
+
+            if "featuresofinterest_id" in obs:
+                if obs["featuresofinterest_id"] not in foi_ids:
+                    continue
+                linked.add(index)
+            else:
+                if datastream_id not in generated_foi_ids:
+                    foi_payload = {"datastream_id": datastream_id}
+                    try:
+                        await generate_feature_of_interest(
+                            foi_payload, connection, commit_id=commit_id
+                        )
+                    except BadRequest:
+                        pass
+                    generated_foi_ids[datastream_id] = foi_payload.get(
+                        "featuresofinterest_id"
+                    )
+                if generated_foi_ids[datastream_id] is None:
+                    continue
+                obs["featuresofinterest_id"] = generated_foi_ids[datastream_id]
+
+            if commit_id is not None:
+                obs["commit_id"] = commit_id
+            inserted.append(index)
+
+        observation_ids = [None] * len(observations)
+        if not inserted:
+            return observation_ids
+
+        ids = await connection.fetch(
+            """
+                SELECT nextval(
+                    pg_get_serial_sequence('sensorthings."Observation"', 'id')
+                ) AS id
+                FROM generate_series(1, $1::int);
+            """,
+            len(inserted),
+        )
+
+        columns = ["id"]
+        for index in inserted:
+            for key in observations[index]:
+                if key not in columns:
+                    columns.append(key)
+
+        records = []
+        for index, record in zip(inserted, ids):
+            obs = observations[index]
+            obs["id"] = observation_ids[index] = record["id"]
+            records.append([obs.get(column) for column in columns])
+
+        try:
+            async with connection.transaction():
+                written = await copy_observations(
+                    connection, columns, records, on_conflict
+                )
+        except ROW_ERRORS:
+            written, failed = await insert_observation_rows(
+                connection, columns, records, on_conflict
+            )
+            for position in failed:
+                observation_ids[inserted[position]] = None
+            inserted = [
+                index
+                for index in inserted
+                if observation_ids[index] is not None
+            ]
+
+        if on_conflict is not None:
+            if counts is not None:
+                counts.update(count_written(written, len(inserted)))
+            ids_by_key = {
+                get_conflict_key(record): record["id"] for record in written
+            }
+            skipped = {
+                get_conflict_key(observations[index]) for index in inserted
+            }.difference(ids_by_key)
+            ids_by_key.update(
+                await get_observation_ids_by_key(connection, skipped)
+            )
+            for index in inserted:
+                obs = observations[index]
+                obs["id"] = observation_ids[index] = ids_by_key.get(
+                    get_conflict_key(obs)
+                )
+
+        by_datastream = {}
+        linked_foi_ids = {}
+        for index in inserted:
+            obs = observations[index]
+            by_datastream.setdefault(obs["datastream_id"], []).append(obs)
+            if index in linked:
+                linked_foi_ids.setdefault(obs["datastream_id"], []).append(
+                    obs["featuresofinterest_id"]
+                )
+
+        for datastream_id, group in by_datastream.items():
+            result_times = [
+                obs["resultTime"]
+                for obs in group
+                if obs.get("resultTime") is not None
+            ]
+            await update_datastream_time_ranges(
+                connection,
+                datastream_id,
+                min((obs["phenomenonTimeStart"] for obs in group), key=to_utc),
+                max((obs["phenomenonTimeEnd"] for obs in group), key=to_utc),
+                min(result_times, key=to_utc, default=None),
+                max(result_times, key=to_utc, default=None),
+            )
+
+        for datastream_id, linked in linked_foi_ids.items():
+            last_foi_id = await connection.fetchval(
+                """
+                    SELECT last_foi_id
+                    FROM sensorthings."Datastream"
+                    WHERE id = $1::bigint;
+                """,
+                datastream_id,
+            )
+            # Each FeatureOfInterest once, the one of the last row last
+            for foi_id in reversed(dict.fromkeys(reversed(linked))):
+                if foi_id != last_foi_id:
+                    await update_datastream_last_foi_id(
+                        connection, foi_id, datastream_id
+                    )
+                    last_foi_id = foi_id
+
+        return observation_ids
+
+
+def get_conflict_key(observation):
+    return (
+        to_utc(observation["phenomenonTimeStart"]),
+        to_utc(observation["phenomenonTimeEnd"]),
+        observation["datastream_id"],
+    )
+
+
+async def get_observation_ids_by_key(connection, keys):
+    """
+    Return the IDs of the Observations with the given unique keys.
+
+    Args:
+        connection: The database connection.
+        keys (iterable): The (phenomenonTimeStart, phenomenonTimeEnd,
+            datastream_id) of the Observations.
+
+    Returns:
+        dict: The ID of each key that matches an Observation.
+    """
+    keys = list(keys)
+    if not keys:
+        return {}
+    records = await connection.fetch(
+        """
+            SELECT o.id, o."phenomenonTimeStart", o."phenomenonTimeEnd",
+                o."datastream_id"
+            FROM sensorthings."Observation" o
+            JOIN unnest(
+                $1::timestamptz[], $2::timestamptz[], $3::bigint[]
+            ) AS k (ph_start, ph_end, datastream_id)
+            ON o."phenomenonTimeStart" = k.ph_start
+            AND o."phenomenonTimeEnd" = k.ph_end
+            AND o."datastream_id" = k.datastream_id;
+        """,
+        *[list(column) for column in zip(*keys)],
+    )
+    return {get_conflict_key(record): record["id"] for record in records}
+
+
 async def insert_location_entity(connection, payload, commit_id):
     async with connection.transaction():
         thing_id = None
@@ -559,20 +1038,11 @@ async def insert_observation_entity(
             connection, "Observation", payload
         )
 
-        update_query = """
-            UPDATE sensorthings."Datastream"
-            SET "phenomenonTime" = tstzrange(
-                LEAST($1::timestamptz, lower("phenomenonTime")),
-                GREATEST($2::timestamptz, upper("phenomenonTime")),
-                '[]'
-            )
-            WHERE id = $3::bigint;
-        """
-        await connection.execute(
-            update_query,
+        await update_datastream_time_ranges(
+            connection,
+            payload["datastream_id"],
             payload["phenomenonTimeStart"],
             payload["phenomenonTimeEnd"],
-            payload["datastream_id"],
         )
 
         return observation_id, observation_self_link
@@ -602,6 +1072,91 @@ async def insert_network_entity(connection, payload, commit_id):
         return network_id, network_selfLink
 
 
+async def update_datastream_time_ranges(
+    conn,
+    datastream_id,
+    phenomenon_time_start,
+    phenomenon_time_end,
+    result_time_start=None,
+    result_time_end=None,
+):
+    """
+    Widen the phenomenonTime and resultTime of a Datastream to include the
+    bounds of a batch of its Observations.
+
+    With DEFERRED_RANGES the bounds are appended to the pending ranges,
+    which the database merges into the Datastream on a schedule, so that
+    concurrent writers do not wait on the lock of the Datastream row.
+
+    Args:
+        conn (asyncpg.Connection): The database connection.
+        datastream_id (int): The ID of the Datastream.
+        phenomenon_time_start (datetime): The earliest phenomenonTimeStart.
+        phenomenon_time_end (datetime): The latest phenomenonTimeEnd.
+        result_time_start (datetime, optional): The earliest resultTime.
+        result_time_end (datetime, optional): The latest resultTime.
+    """
+    if DEFERRED_RANGES:
+        await conn.execute(
+            """
+                INSERT INTO sensorthings."Datastream_pending_range" (
+                    "phenomenonTimeStart",
+                    "phenomenonTimeEnd",
+                    "resultTimeStart",
+                    "resultTimeEnd",
+                    "datastream_id"
+                )
+                VALUES (
+                    $1::timestamptz,
+                    $2::timestamptz,
+                    $3::timestamptz,
+                    $4::timestamptz,
+                    $5::bigint
+                );
+            """,
+            phenomenon_time_start,
+            phenomenon_time_end,
+            result_time_start,
+            result_time_end,
+            datastream_id,
+        )
+        return
+
+    update_query = """
+        UPDATE sensorthings."Datastream"
+        SET "phenomenonTime" = tstzrange(
+            LEAST($1::timestamptz, lower("phenomenonTime")),
+            GREATEST($2::timestamptz, upper("phenomenonTime")),
+            '[]'
+        ),
+        "resultTime" =
+            CASE
+                WHEN $3::timestamptz IS NOT NULL
+                AND $4::timestamptz IS NOT NULL THEN
+                    CASE
+                        WHEN "resultTime" IS NULL THEN
+                            tstzrange($3::timestamptz, $4::timestamptz, '[]')
+                        ELSE
+                            tstzrange(
+                                LEAST($3::timestamptz, lower("resultTime")),
+                                GREATEST($4::timestamptz, upper("resultTime")),
+                                '[]'
+                            )
+                    END
+                ELSE "resultTime"
+            END
+        WHERE id = $5::bigint;
+    """
+    await conn.execute(
+        update_query,
+        phenomenon_time_start,
+        phenomenon_time_end,
+        result_time_start,
+        result_time_end,
+        datastream_id,
+    )
+
+
 async def update_datastream_last_foi_id(conn, foi_id, datastream_id):
     async with conn.transaction():
         update_query = """
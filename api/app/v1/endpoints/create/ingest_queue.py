@@ -0,0 +1,385 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Group commit of the Observations created one at a time.
+
+With INGEST_QUEUE enabled, an Observation posted on its own that only links
+an existing Datastream, and optionally an existing FeatureOfInterest, is
+validated by the request and put in a bounded in-process queue. A background
+writer takes the queued Observations in batches of up to INGEST_BATCH_SIZE,
+or whatever arrived within INGEST_FLUSH_INTERVAL seconds of the first one,
+and inserts each batch in one transaction with insert_observation_batch.
+If the Observations of a user and commit message cannot be written
+together, they are written one at a time, each in its own savepoint, so
+that only those that fail are lost.
+
+With INGEST_ACK=ACCEPTED the request is answered with 202 as soon as the
+Observation is queued, so it is lost if the worker stops before writing it.
+With INGEST_ACK=COMMITTED the request waits for its batch to commit and is
+answered with 201 and the Location of the Observation.
+"""
+
+import asyncio
+import logging
+
+from app import (
+    AUTHORIZATION,
+    INGEST_ACK,
+    INGEST_BATCH_SIZE,
+    INGEST_FLUSH_INTERVAL,
+    INGEST_QUEUE,
+    INGEST_QUEUE_SIZE,
+    POSTGRES_PORT_WRITE,
+    REDIS,
+    RESPONSE_CACHE,
+    VERSIONING,
+)
+from app.db.asyncpg_db import get_pool, get_pool_w
+from app.utils.utils import build_self_link
+from app.v1.endpoints import response_cache
+from app.v1.endpoints.exceptions import BadRequest, ServiceUnavailable
+from app.v1.endpoints.functions import set_role
+from fastapi import status
+from fastapi.responses import Response
+
+from .functions import (
+    insert_observation_batch,
+    prepare_observation,
+    set_commit,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueue:
+    """
+    A bounded queue of Observations written in batches by a background task.
+
+    Each item is the prepared Observation, the user and the commit message
+    of its request, and the future the request waits on, if any. Every
+    batch is split by user and commit message, as each group is written with
+    the role and in the Commit of its requests.
+
+    Attributes:
+        queue (asyncio.Queue): The queued items, None asks the writer to stop.
+        batch_size (int): The most Observations written in one batch.
+        flush_interval (float): The seconds a batch waits to fill up.
+        task (asyncio.Task): The writer, while it is running.
+    """
+
+    def __init__(self, size, batch_size, flush_interval):
+        self.queue = asyncio.Queue(size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.task = None
+
+    def start(self):
+        if self.task is None:
+            self.task = asyncio.create_task(self.run())
+
+    async def stop(self):
+        """
+        Write the queued Observations and stop the writer.
+        """
+        if self.task is None:
+            return
+        await self.queue.put(None)
+        await self.task
+        self.task = None
+
+    def submit(self, observation, current_user, commit_message, wait=False):
+        """
+        Queue a prepared Observation.
+
+        Args:
+            observation (dict): The Observation, as returned by
+                prepare_observation, with its datastream_id.
+            current_user (dict): The user of the request, or None.
+            commit_message (str): The commit message of the request.
+            wait (bool): Whether the request waits for the commit.
+
+        Returns:
+            asyncio.Future: Resolved with the ID of the Observation once it
+                is committed, or None if the request does not wait.
+
+        Raises:
+            ServiceUnavailable: If the queue is full.
+        """
+        future = None
+        if wait:
+            future = asyncio.get_running_loop().create_future()
+        try:
+            self.queue.put_nowait(
+                (observation, current_user, commit_message, future)
+            )
+        except asyncio.QueueFull:
+            raise ServiceUnavailable("The ingestion queue is full")
+        return future
+
+    async def get_batch(self):
+        """
+        Wait for the next batch of queued items.
+
+        Returns:
+            list: The items, ending with None if the writer has to stop.
+        """
+        batch = [await self.queue.get()]
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + self.flush_interval
+        while batch[-1] is not None and len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+                continue
+            except asyncio.QueueEmpty:
+                pass
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self.queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def run(self):
+        while True:
+            batch = await self.get_batch()
+            items = [item for item in batch if item is not None]
+            if items:
+                try:
+                    await self.flush(items)
+                except Exception:
+                    logger.exception(
+                        "Could not write %s queued Observations", len(items)
+                    )
+            if batch[-1] is None:
+                return
+
+    async def flush(self, items):
+        """
+        Write a batch of queued items in one transaction.
+
+        The futures are resolved after the commit, with the ID of each
+        Observation or the error that prevented writing it.
+
+        Args:
+            items (list): The queued items.
+        """
+        outcomes = []
+        try:
+            groups = {}
+            for item in items:
+                _, current_user, commit_message, _ = item
+                current_user = get_user(current_user)
+                user_id = current_user["id"] if current_user else None
+                groups.setdefault((user_id, commit_message), []).append(item)
+
+            pool = await (get_pool_w() if POSTGRES_PORT_WRITE else get_pool())
+            async with pool.acquire() as connection:
+                async with connection.transaction():
+                    for group in groups.values():
+                        outcomes.append(
+                            (group, await write_group(connection, group))
+                        )
+        except Exception as e:
+            resolve(items, e)
+            raise
+
+        for group, outcome in outcomes:
+            resolve(group, outcome)
+
+        if RESPONSE_CACHE and REDIS:
+            await response_cache.invalidate(
+                response_cache.get_write_tags("/Observations")
+            )
+
+
+async def write_group(connection, group):
+    """
+    Insert the Observations of one user and commit message.
+
+    If the group fails as a whole, its Observations are retried one at a
+    time, each in its own savepoint.
+
+    Returns:
+        list: The ID of each Observation, None for those that were skipped,
+            or the error that prevented writing it.
+    """
+    try:
+        outcome = await write_items(connection, group)
+    except Exception as e:
+        if len(group) == 1:
+            outcome = [e]
+        else:
+            logger.info(
+                "Writing %s queued Observations one at a time: %s",
+                len(group),
+                e,
+            )
+            outcome = []
+            for item in group:
+                try:
+                    outcome.extend(await write_items(connection, [item]))
+                except Exception as error:
+                    outcome.append(error)
+
+    errors = [result for result in outcome if isinstance(result, Exception)]
+    if errors:
+        logger.warning(
+            "Could not write %s of %s queued Observations: %r",
+            len(errors),
+            len(group),
+            errors[0],
+        )
+    return outcome
+
+
+async def write_items(connection, items):
+    _, current_user, commit_message, _ = items[0]
+    current_user = get_user(current_user)
+    async with connection.transaction():
+        if current_user is not None:
+            await set_role(connection, current_user)
+
+        commit_id = await set_commit(connection, commit_message, current_user)
+        observation_ids = await insert_observation_batch(
+            connection,
+            [observation for observation, _, _, _ in items],
+            commit_id=commit_id,
+        )
+
+        if current_user is not None:
+            await connection.execute("RESET ROLE;")
+    return observation_ids
+
+
+def get_user(current_user):
+    """
+    Return the authenticated user of a request, or None. Without
+    AUTHORIZATION the user is the value of a header, not a user.
+    """
+    return current_user if isinstance(current_user, dict) else None
+
+
+def resolve(group, outcome):
+    for index, (_, _, _, future) in enumerate(group):
+        if future is None or future.done():
+            continue
+        if isinstance(outcome, Exception):
+            future.set_exception(outcome)
+        elif isinstance(outcome[index], Exception):
+            future.set_exception(outcome[index])
+        elif outcome[index] is None:
+            future.set_exception(
+                BadRequest(
+                    "The Datastream or FeatureOfInterest of the "
+                    "Observation does not exist."
+                )
+            )
+        else:
+            future.set_result(outcome[index])
+
+
+ingest_queue = IngestQueue(
+    INGEST_QUEUE_SIZE, INGEST_BATCH_SIZE, INGEST_FLUSH_INTERVAL
+)
+
+
+def get_queued_observation(
+    payload, commit_message, current_user, datastream_id=None
+):
+    """
+    Return the Observation to queue for a POST, if it can be queued.
+
+    Only Observations that link existing entities by their @iot.id are
+    queued. The others, and requests whose commit would be refused, are
+    created by the request itself.
+
+    Args:
+        payload (dict): The payload of the request.
+        commit_message (str): The commit message of the request.
+        current_user (dict): The user of the request, or None.
+        datastream_id (int, optional): The Datastream of the URL.
+
+    Returns:
+        dict: The prepared Observation, or None.
+    """
+    if not INGEST_QUEUE or "@iot.id" in payload:
+        return None
+
+    current_user = get_user(current_user)
+
+    if VERSIONING or AUTHORIZATION:
+        is_sensor = current_user is not None and (
+            current_user["role"] == "sensor"
+        )
+        if is_sensor == bool(commit_message):
+            return None
+
+    observation = dict(payload)
+    datastream = observation.pop("Datastream", None)
+    feature_of_interest = observation.pop("FeatureOfInterest", None)
+
+    if datastream_id is None:
+        datastream_id = get_linked_id(datastream)
+    elif datastream is not None:
+        return None
+    if datastream_id is None:
+        return None
+    observation["datastream_id"] = datastream_id
+
+    if feature_of_interest is not None:
+        feature_of_interest_id = get_linked_id(feature_of_interest)
+        if feature_of_interest_id is None:
+            return None
+        observation["featuresofinterest_id"] = feature_of_interest_id
+
+    try:
+        return prepare_observation(observation)
+    except TypeError:
+        return None
+
+
+def get_linked_id(entity):
+    if not isinstance(entity, dict) or list(entity) != ["@iot.id"]:
+        return None
+    entity_id = entity["@iot.id"]
+    if isinstance(entity_id, bool) or not isinstance(entity_id, int):
+        return None
+    return entity_id
+
+
+async def queue_observation(observation, commit_message, current_user):
+    """
+    Queue an Observation and answer its request.
+
+    Returns:
+        Response: 202 once queued, or 201 with the Location once committed
+            if INGEST_ACK is COMMITTED.
+    """
+    future = ingest_queue.submit(
+        observation,
+        get_user(current_user),
+        commit_message,
+        wait=INGEST_ACK == "COMMITTED",
+    )
+    if future is None:
+        return Response(status_code=status.HTTP_202_ACCEPTED)
+
+    observation_id = await future
+    return Response(
+        status_code=status.HTTP_201_CREATED,
+        headers={"location": build_self_link("Observation", observation_id)},
+    )
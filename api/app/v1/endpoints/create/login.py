@@ -14,13 +14,13 @@
 
 import time
 
-from app import REDIS
-from app.db.redis_db import redis
 from app.oauth import (
     authenticate_user,
     create_access_token,
     create_refresh_token,
     decode_token,
+    is_token_revoked,
+    revoke_token,
 )
 from fastapi import APIRouter, Depends, Header, HTTPException, status
 from fastapi.responses import JSONResponse
@@ -89,14 +89,7 @@ async def login(
 async def refresh_token(authorization: str | None = Header(default=None)):
     token = extract_bearer_token(authorization)
 
-    if REDIS and redis.get(token) is not None:
-        raise HTTPException(
-            status_code=status.HTTP_401_UNAUTHORIZED,
-            detail="Token has been revoked",
-            headers={"WWW-Authenticate": "Bearer"},
-        )
-
-    if REDIS and redis.get(token) is not None:
+    if await is_token_revoked(token):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Token has been revoked",
@@ -111,9 +104,7 @@ async def refresh_token(authorization: str | None = Header(default=None)):
             detail="Invalid token",
         )
 
-    if REDIS:
-        expire = payload.get("exp")
-        redis.set(token, "refreshed", ex=ttl_from_exp(expire))
+    await revoke_token(token, "refreshed", ttl_from_exp(payload.get("exp")))
 
     access_token, expire = create_refresh_token(payload)
 
@@ -145,9 +136,7 @@ async def logout(authorization: str | None = Header(default=None)):
             detail="Invalid token",
         )
 
-    if REDIS:
-        expire = payload.get("exp")
-        redis.set(token, "logged_out", ex=ttl_from_exp(expire))
+    await revoke_token(token, "logged_out", ttl_from_exp(payload.get("exp")))
 
     return JSONResponse(
         status_code=status.HTTP_200_OK,
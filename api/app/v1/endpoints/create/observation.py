@@ -20,6 +20,7 @@ from fastapi import APIRouter, Body, Depends, Header, Request, status
 from fastapi.responses import Response
 
 from .functions import insert_observation_entity, set_commit
+from .ingest_queue import get_queued_observation, queue_observation
 from app.v1.endpoints.exceptions import BadRequest
 
 v1 = APIRouter()
@@ -74,6 +75,12 @@ async def create_observation(
 
     validate_payload_keys(payload, ALLOWED_KEYS)
 
+    observation = get_queued_observation(payload, commit_message, current_user)
+    if observation is not None:
+        return await queue_observation(
+            observation, commit_message, current_user
+        )
+
     async with pool.acquire() as connection:
         async with connection.transaction():
             if current_user is not None:
@@ -128,6 +135,14 @@ async def create_observation_for_datastream(
 
     validate_payload_keys(payload, ALLOWED_KEYS)
 
+    observation = get_queued_observation(
+        payload, commit_message, current_user, datastream_id=datastream_id
+    )
+    if observation is not None:
+        return await queue_observation(
+            observation, commit_message, current_user
+        )
+
     async with pool.acquire() as connection:
         async with connection.transaction():
             if current_user is not None:
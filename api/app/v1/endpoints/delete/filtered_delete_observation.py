@@ -12,9 +12,19 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from app import AUTHORIZATION, POSTGRES_PORT_WRITE, VERSIONING
+from datetime import datetime
+
+from app import (
+    AGGREGATE_ROLLUPS,
+    AUTHORIZATION,
+    DELETE_BATCH_SIZE,
+    POSTGRES_PORT_WRITE,
+    VERSIONING,
+)
 from app.db.asyncpg_db import get_pool, get_pool_w
 from app.sta2rest import sta2rest
+from app.sta2rest.odata_query import ast
+from app.sta2rest.odata_query.grammar import ODataLexer, ODataParser
 from app.v1.endpoints.error_response import error_response
 from app.v1.endpoints.functions import set_role, update_datastream_observedArea
 from fastapi import APIRouter, Depends, Header, Request, status
@@ -35,6 +45,22 @@ if AUTHORIZATION:
 if VERSIONING or AUTHORIZATION:
     message = Header(None, alias="commit-message")
 
+# The phenomenonTime comparisons of a chunk filter: the bound they set and
+# whether it is inclusive. Like the GET translator, lower bounds apply to
+# phenomenonTimeStart and upper bounds to phenomenonTimeEnd.
+TIME_BOUNDS = {
+    ast.GtE: ("lower", True),
+    ast.Gt: ("lower", False),
+    ast.LtE: ("upper", True),
+    ast.Lt: ("upper", False),
+}
+
+# The continuous aggregates of Observations
+ROLLUP_VIEWS = (
+    'sensorthings."Observation_hourly"',
+    'sensorthings."Observation_daily"',
+)
+
 
 @v1.api_route(
     "/Observations",
@@ -91,70 +117,283 @@ async def delete_observations_filtered(
     if request.url.query:
         full_path += "?" + request.url.query
 
-    # Reuse the GET filter translator: build a SELECT DISTINCT id query with the
-    # SAME $filter parsing + cross-entity semi-join the GET path uses (mirrors
-    # read/observation.py calling convert_query). No LIMIT/OFFSET, so the FULL
-    # match set is collected — not just one $top page.
+    # Reuse the GET filter translator: build a SELECT id query with the SAME
+    # $filter parsing + cross-entity semi-join the GET path uses (mirrors
+    # read/observation.py calling convert_query). No $top LIMIT/OFFSET, so the
+    # FULL match set is selected — not just one $top page. Without DISTINCT, so
+    # each batch below stops as soon as it has DELETE_BATCH_SIZE ids.
     #
     # A malformed/invalid $filter makes the translator raise. We catch that HERE
     # and return 400 — exactly the GET contract (never 500 for a bad filter) —
     # while keeping the DB work in a separate try so that genuine internal
     # errors there still map to 500, not 400.
-    ids_query = sta2rest.STA2REST.convert_filter_to_ids_query(full_path)
+    ids_query = sta2rest.STA2REST.convert_filter_to_ids_query(
+        full_path, distinct=False
+    )
+
+    # Observations deleted per touched datastream
+    touched_datastreams = {}
+    dropped_ranges = []
 
     async with pool.acquire() as connection:
-        async with connection.transaction():
-            if current_user is not None:
-                await set_role(connection, current_user)
+        # Chunk-level fast path: whole hypertable chunks that only hold
+        # matching Observations are dropped instead of deleted row by row.
+        # Dropping bypasses row level security and the versioning triggers,
+        # so it is only taken for unauthenticated, unversioned deletes.
+        chunk_filter = None
+        if current_user is None and not VERSIONING:
+            chunk_filter = get_chunk_filter(request.query_params["$filter"])
+        if chunk_filter is not None:
+            async with connection.transaction():
+                dropped_ranges = await drop_matching_chunks(
+                    connection, chunk_filter, touched_datastreams
+                )
+
+        # The remaining matches are deleted entirely in SQL, in batches of
+        # at most DELETE_BATCH_SIZE rows, each in its own transaction so
+        # that its row locks are released before the next one. The ids
+        # never leave the database: each batch only returns how many
+        # Observations of each datastream it deleted.
+        while True:
+            async with connection.transaction():
+                if current_user is not None:
+                    await set_role(connection, current_user)
 
-            matched_ids = [
-                row["id"] for row in await connection.fetch(ids_query)
-            ]
+                deleted_rows = await connection.fetch(
+                    f"""
+                    WITH deleted AS (
+                        DELETE FROM sensorthings."Observation"
+                        WHERE id IN (
+                            SELECT id FROM ({ids_query}) AS matched
+                            LIMIT $1::bigint
+                        )
+                        RETURNING datastream_id
+                    )
+                    SELECT datastream_id, count(*) AS deleted
+                    FROM deleted
+                    GROUP BY datastream_id;
+                    """,
+                    DELETE_BATCH_SIZE,
+                )
 
-            if not matched_ids:
-                # Empty match set is success, not an error: 200 + count 0.
                 if current_user is not None:
                     await connection.execute("RESET ROLE;")
-                return JSONResponse(
-                    status_code=status.HTTP_200_OK,
-                    content={"deleted": 0},
-                )
 
-            # Single bulk DELETE (NOT a per-id loop). RETURNING the
-            # datastream_id lets us recompute datastream aggregates once per
-            # DISTINCT touched datastream below.
-            deleted_rows = await connection.fetch(
-                """
-                DELETE FROM sensorthings."Observation"
-                WHERE id = ANY($1::bigint[])
-                RETURNING datastream_id;
-                """,
-                matched_ids,
-            )
+            add_deleted(touched_datastreams, deleted_rows)
+            if sum(row["deleted"] for row in deleted_rows) < DELETE_BATCH_SIZE:
+                break
 
-            deleted_count = len(deleted_rows)
-            touched_datastreams = {
-                row["datastream_id"] for row in deleted_rows
-            }
+        # Post-delete maintenance — aggregated equivalent of the
+        # single-entity delete's per-row fix-up, run ONCE per DISTINCT
+        # touched datastream at the end. We recompute phenomenonTime/
+        # resultTime from the REMAINING observations (FoI variant) and the
+        # observedArea. We deliberately do NOT touch FeaturesOfInterest /
+        # gen_foi_id: deleting Observations does not delete their FoI.
+        if touched_datastreams:
+            async with connection.transaction():
+                if current_user is not None:
+                    await set_role(connection, current_user)
 
-            # Post-delete maintenance — aggregated equivalent of the
-            # single-entity delete's per-row fix-up, run ONCE per DISTINCT
-            # touched datastream. We recompute phenomenonTime/resultTime from
-            # the REMAINING observations (FoI variant) and the observedArea.
-            # We deliberately do NOT touch FeaturesOfInterest / gen_foi_id:
-            # deleting Observations does not delete their FoI.
-            for datastream_id in touched_datastreams:
-                await update_datastream_phenomenon_time_from_foi(
-                    connection, datastream_id
-                )
-                await update_datastream_observedArea(
-                    connection, datastream_id
-                )
+                for datastream_id in touched_datastreams:
+                    await update_datastream_phenomenon_time_from_foi(
+                        connection, datastream_id
+                    )
+                    await update_datastream_observedArea(
+                        connection, datastream_id
+                    )
 
-            if current_user is not None:
-                await connection.execute("RESET ROLE;")
+                if current_user is not None:
+                    await connection.execute("RESET ROLE;")
+
+        # Dropped chunks leave no invalidation for the continuous
+        # aggregates, so their buckets are refreshed explicitly. A refresh
+        # cannot run inside a transaction.
+        if dropped_ranges and AGGREGATE_ROLLUPS:
+            await refresh_rollups(
+                connection,
+                min(start for start, _ in dropped_ranges),
+                max(end for _, end in dropped_ranges),
+            )
 
+    # An empty match set is success, not an error: 200 + count 0.
     return JSONResponse(
         status_code=status.HTTP_200_OK,
-        content={"deleted": deleted_count},
+        content={"deleted": sum(touched_datastreams.values())},
+    )
+
+
+def add_deleted(touched_datastreams, rows):
+    for row in rows:
+        datastream_id = row["datastream_id"]
+        touched_datastreams[datastream_id] = (
+            touched_datastreams.get(datastream_id, 0) + row["deleted"]
+        )
+
+
+def get_chunk_filter(filter_expression):
+    """
+    Return the bounds of a $filter that only restricts phenomenonTime and,
+    optionally, the Datastream, or None for any other filter.
+
+    Such a filter is a conjunction of at most one lower and one upper
+    phenomenonTime bound and at most one Datastream/id eq or in.
+
+    Args:
+        filter_expression (str): The $filter of the request.
+
+    Returns:
+        dict: The lower and upper bounds, whether they are inclusive, and
+            the ids of the Datastreams or None, or None.
+    """
+    try:
+        tree = ODataParser().parse(ODataLexer().tokenize(filter_expression))
+    except Exception:
+        return None
+
+    comparisons = []
+    nodes = [tree]
+    while nodes:
+        node = nodes.pop()
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            nodes += [node.left, node.right]
+        elif isinstance(node, ast.Compare):
+            comparisons.append(node)
+        else:
+            return None
+
+    chunk_filter = {}
+    for node in comparisons:
+        left, right = node.left, node.right
+        if (
+            isinstance(left, ast.Identifier)
+            and left.name == "phenomenonTime"
+            and type(node.comparator) in TIME_BOUNDS
+            and isinstance(right, ast.DateTime)
+        ):
+            bound, inclusive = TIME_BOUNDS[type(node.comparator)]
+            try:
+                value = datetime.fromisoformat(right.val)
+            except ValueError:
+                return None
+            if bound in chunk_filter or value.tzinfo is None:
+                return None
+            chunk_filter[bound] = value
+            chunk_filter[f"{bound}_inc"] = inclusive
+        elif (
+            isinstance(left, ast.Attribute)
+            and isinstance(left.owner, ast.Identifier)
+            and left.owner.name == "Datastream"
+            and left.attr in ("id", "@iot.id")
+        ):
+            if isinstance(node.comparator, ast.Eq):
+                values = [right]
+            elif isinstance(node.comparator, ast.In) and isinstance(
+                right, ast.List
+            ):
+                values = right.val
+            else:
+                return None
+            if "datastreams" in chunk_filter or not all(
+                isinstance(value, ast.Integer) for value in values
+            ):
+                return None
+            chunk_filter["datastreams"] = [int(value.val) for value in values]
+        else:
+            return None
+
+    if "lower" not in chunk_filter and "upper" not in chunk_filter:
+        return None
+    chunk_filter.setdefault("lower", None)
+    chunk_filter.setdefault("upper", None)
+    chunk_filter.setdefault("datastreams", None)
+    return chunk_filter
+
+
+async def drop_matching_chunks(connection, chunk_filter, touched_datastreams):
+    """
+    Drop the Observation chunks that only hold Observations matching a
+    filter returned by get_chunk_filter.
+
+    Only the chunks whose time range lies within the bounds are candidates.
+    Each of them is dropped if every Observation it holds matches the
+    filter, in which case its Observations are counted per Datastream.
+
+    Args:
+        connection: The database connection.
+        chunk_filter (dict): The bounds of the filter.
+        touched_datastreams (dict): Updated with the Observations deleted
+            per Datastream.
+
+    Returns:
+        list: The (start, end) time range of each dropped chunk.
+    """
+    chunks = await connection.fetch(
+        """
+        SELECT chunk_schema, chunk_name, range_start, range_end
+        FROM timescaledb_information.chunks
+        WHERE hypertable_schema = 'sensorthings'
+        AND hypertable_name = 'Observation'
+        AND ($1::timestamptz IS NULL OR range_start >= $1::timestamptz)
+        AND ($2::timestamptz IS NULL OR range_end <= $2::timestamptz)
+        ORDER BY range_start;
+        """,
+        chunk_filter["lower"],
+        chunk_filter["upper"],
     )
+
+    lower_op = ">=" if chunk_filter.get("lower_inc") else ">"
+    upper_op = "<=" if chunk_filter.get("upper_inc") else "<"
+    dropped_ranges = []
+    for chunk in chunks:
+        chunk_table = f'"{chunk["chunk_schema"]}"."{chunk["chunk_name"]}"'
+        # Keep Observations from being written to the chunk until it is
+        # dropped, so that none is dropped without having been checked
+        await connection.execute(f"LOCK TABLE {chunk_table} IN SHARE MODE;")
+        rows = await connection.fetch(
+            f"""
+            SELECT
+                datastream_id,
+                count(*) AS deleted,
+                bool_and(coalesce(
+                    ($1::timestamptz IS NULL
+                        OR "phenomenonTimeStart" {lower_op} $1::timestamptz)
+                    AND ($2::timestamptz IS NULL
+                        OR "phenomenonTimeEnd" {upper_op} $2::timestamptz)
+                    AND ($3::bigint[] IS NULL
+                        OR datastream_id = ANY($3::bigint[])),
+                    FALSE
+                )) AS matched
+            FROM {chunk_table}
+            GROUP BY datastream_id;
+            """,
+            chunk_filter["lower"],
+            chunk_filter["upper"],
+            chunk_filter["datastreams"],
+        )
+        if not rows or not all(row["matched"] for row in rows):
+            continue
+
+        await connection.execute(
+            """
+            SELECT drop_chunks(
+                'sensorthings."Observation"',
+                older_than => $2::timestamptz,
+                newer_than => $1::timestamptz
+            );
+            """,
+            chunk["range_start"],
+            chunk["range_end"],
+        )
+        add_deleted(touched_datastreams, rows)
+        dropped_ranges.append((chunk["range_start"], chunk["range_end"]))
+
+    return dropped_ranges
+
+
+async def refresh_rollups(connection, start, end):
+    for rollup in ROLLUP_VIEWS:
+        await connection.execute(
+            f"CALL refresh_continuous_aggregate('{rollup}', "
+            f"'{start.isoformat()}'::timestamptz, "
+            f"'{end.isoformat()}'::timestamptz);"
+        )
@@ -12,7 +12,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from app import AUTHORIZATION, VERSIONING
+from app import AUTHORIZATION, DEFERRED_RANGES, VERSIONING
 from app.v1.endpoints.functions import insert_commit
 from app.v1.endpoints.exceptions import BadRequest, Forbidden
 
@@ -81,6 +81,22 @@ async def unlink_foi_from_location(connection, feature_of_interest_id):
         await connection.execute(query, feature_of_interest_id)
 
 
+async def recompute_datastream_ranges(conn, datastream_id):
+    """
+    Ask the database to recompute the phenomenonTime and resultTime of a
+    Datastream from its Observations, when it next merges the pending
+    ranges.
+    """
+    await conn.execute(
+        """
+            INSERT INTO sensorthings."Datastream_pending_range"
+                ("datastream_id", "recompute")
+            VALUES ($1::bigint, TRUE);
+        """,
+        datastream_id,
+    )
+
+
 async def update_datastream_phenomenon_time(
     conn,
     obs_phenomenon_start,
@@ -88,6 +104,10 @@ async def update_datastream_phenomenon_time(
     datastream_id,
     obs_result_time=None,
 ):
+    if DEFERRED_RANGES:
+        await recompute_datastream_ranges(conn, datastream_id)
+        return
+
     async with conn.transaction():
         query = """
             WITH datastream AS (
@@ -147,6 +167,10 @@ async def update_datastream_phenomenon_time(
 
 
 async def update_datastream_phenomenon_time_from_foi(connection, ds_id):
+    if DEFERRED_RANGES:
+        await recompute_datastream_ranges(connection, ds_id)
+        return
+
     async with connection.transaction():
         query = """
             WITH first_asc_ph AS (
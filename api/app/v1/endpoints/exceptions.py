@@ -64,6 +64,11 @@ class Conflict(STAError):
     default_message = "Entity already exists."
 
 
+class NotSupported(STAError):
+    status_code = 501
+    default_message = "Not implemented"
+
+
 class ServiceUnavailable(STAError):
     status_code = 503
     default_message = "Database temporarily unavailable"
@@ -12,17 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
-
-from app import ANONYMOUS_VIEWER, AUTHORIZATION, REDIS
+from app import ANONYMOUS_VIEWER, AUTHORIZATION
 from app.db.asyncpg_db import get_pool
-from app.db.redis_db import redis
 from app.sta2rest import sta2rest
+from app.v1.endpoints.response_cache import ResponseCache
 from fastapi import APIRouter, Depends, Header, Request, status
-from fastapi.responses import JSONResponse, StreamingResponse
+from fastapi.responses import JSONResponse
 
 from .query_parameters import CommonQueryParams, get_common_query_params
-from .read import asyncpg_stream_results, wrapped_result_generator
+from .read import asyncpg_stream_results
 
 v1 = APIRouter()
 
@@ -53,27 +51,23 @@ async def get_features_of_interest(
         if request.url.query:
             full_path += "?" + request.url.query
 
-        data = None
-
-        if REDIS:
-            result = redis.get(full_path)
-            if result:
-                data = json.loads(result)
-                print("Cache hit")
-            else:
-                print("Cache miss")
+        data = sta2rest.STA2REST.convert_query(full_path)
 
-        if not data:
-            data = sta2rest.STA2REST.convert_query(full_path)
+        cache = ResponseCache(request, full_path, data, current_user)
+        cached_response = await cache.lookup()
+        if cached_response is not None:
+            return cached_response
 
         main_entity = data.get("main_entity")
         main_query = data.get("main_query")
+        main_query_params = data.get("main_query_params")
         top_value = data.get("top_value")
         is_count = data.get("is_count")
         count_queries = data.get("count_queries")
         as_of_value = data.get("as_of_value")
         from_to_value = data.get("from_to_value")
         single_result = data.get("single_result")
+        keyset = data.get("keyset")
 
         result = asyncpg_stream_results(
             main_entity,
@@ -87,15 +81,13 @@ async def get_features_of_interest(
             single_result,
             full_path,
             current_user,
+            query_params=main_query_params,
+            keyset=keyset,
         )
 
         try:
             first_item = await anext(result)
-            return StreamingResponse(
-                wrapped_result_generator(first_item, result),
-                media_type="application/json",
-                status_code=status.HTTP_200_OK,
-            )
+            return await cache.response(first_item, result, "application/json")
         except Exception as e:
             return JSONResponse(
                 status_code=status.HTTP_404_NOT_FOUND,
@@ -0,0 +1,406 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Push of the new Observations to the clients subscribed to them.
+
+A client subscribes to SensorThings MQTT topics: the Observations of a
+Datastream, of a FeatureOfInterest or all of them, optionally with $select,
+e.g. "v1.1/Datastreams(1)/Observations?$select=result,phenomenonTime".
+
+With LIVE_OBSERVATIONS enabled, the database notifies the id, Datastream and
+FeatureOfInterest of every inserted Observation on the
+sensorthings_observation channel when its transaction commits. Each worker
+listens on a dedicated connection and gathers the notifications for
+LIVE_FLUSH_INTERVAL seconds. The new Observations of each topic are then
+read with the translation of the topic restricted to their ids, once per
+role of its subscribers, so that they are the entities a GET of the topic
+returns to each of them.
+
+Every subscription has a bounded queue of messages; the Observations that
+do not fit are dropped, as MQTT does with QoS 0. So are those notified
+while the listening connection is down.
+"""
+
+import asyncio
+import logging
+import re
+import urllib.parse
+
+import asyncpg
+import ujson
+from app import (
+    ANONYMOUS_VIEWER,
+    ISTSOS_ADMIN,
+    ISTSOS_ADMIN_PASSWORD,
+    LIVE_FLUSH_INTERVAL,
+    LIVE_QUEUE_SIZE,
+    POSTGRES_DB,
+    POSTGRES_HOST,
+    POSTGRES_PORT,
+    POSTGRES_PORT_WRITE,
+    VERSION,
+)
+from app.db.asyncpg_db import get_pool, get_pool_w
+from app.sta2rest import sta2rest
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.functions import set_role
+
+logger = logging.getLogger(__name__)
+
+CHANNEL = "sensorthings_observation"
+
+TOPIC_PATTERN = re.compile(
+    r"(?:(?P<collection>Datastreams|FeaturesOfInterest)\((?P<id>\d+)\)/)?"
+    r"Observations(?:\?\$select=(?P<select>[^&]+))?"
+)
+
+# The position in the notification of the id each collection is matched on
+NOTIFIED_IDS = {"Datastreams": 1, "FeaturesOfInterest": 2}
+
+# The most Observations read with one query
+READ_BATCH_SIZE = 1024
+
+RECONNECT_DELAY = 1
+
+
+class Subscription:
+    """
+    The topics a client is subscribed to and the messages pushed to it.
+
+    Attributes:
+        current_user (dict): The user the Observations are read as, or None.
+        topics (dict): The key of each subscribed topic.
+        queue (asyncio.Queue): The JSON messages not sent yet.
+        dropped (int): The messages dropped because the queue was full.
+    """
+
+    def __init__(self, current_user, size=LIVE_QUEUE_SIZE):
+        self.current_user = current_user
+        self.topics = {}
+        self.queue = asyncio.Queue(size)
+        self.dropped = 0
+
+    def put(self, topic, observation):
+        """
+        Queue an Observation, unless the queue is full.
+
+        Args:
+            topic (str): The topic the Observation is published on.
+            observation (str): The JSON of the Observation.
+        """
+        name = ujson.dumps(get_topic_name(topic), escape_forward_slashes=False)
+        message = f'{{"topic": {name}, "message": {observation}}}'
+        try:
+            self.queue.put_nowait(message)
+        except asyncio.QueueFull:
+            self.dropped += 1
+
+
+class ObservationHub:
+    """
+    The subscriptions of a worker and the tasks feeding them.
+
+    Attributes:
+        flush_interval (float): The seconds the notifications are gathered.
+        subscriptions (dict): The (topic, subscription) pairs by topic key.
+        pending (list): The notified Observations not pushed yet, as
+            (id, datastream_id, featuresofinterest_id) tuples.
+        notified (asyncio.Event): Set when an Observation is pending.
+        tasks (list): The listener and the pusher, while they are running.
+    """
+
+    def __init__(self, flush_interval):
+        self.flush_interval = flush_interval
+        self.subscriptions = {}
+        self.pending = []
+        self.notified = asyncio.Event()
+        self.tasks = []
+
+    def start(self):
+        if not self.tasks:
+            self.tasks = [
+                asyncio.create_task(self.listen()),
+                asyncio.create_task(self.run()),
+            ]
+
+    async def stop(self):
+        for task in self.tasks:
+            task.cancel()
+        await asyncio.gather(*self.tasks, return_exceptions=True)
+        self.tasks = []
+
+    def subscribe(self, subscription, topic):
+        """
+        Subscribe to a topic.
+
+        Args:
+            subscription (Subscription): The subscription of the client.
+            topic (str): The SensorThings MQTT topic.
+
+        Returns:
+            str: The topic, with the version.
+
+        Raises:
+            BadRequest: If the topic is not supported.
+        """
+        topic, key = parse_topic(topic)
+        subscription.topics[topic] = key
+        self.subscriptions.setdefault(key, set()).add((topic, subscription))
+        return get_topic_name(topic)
+
+    def unsubscribe(self, subscription, topic=None):
+        """
+        Unsubscribe from a topic, or from all of them.
+
+        Args:
+            subscription (Subscription): The subscription of the client.
+            topic (str): The SensorThings MQTT topic, or None.
+
+        Returns:
+            str: The topic, with the version, or None.
+        """
+        if topic is None:
+            for name in list(subscription.topics):
+                self.remove(subscription, name)
+            return None
+        name = parse_topic(topic)[0]
+        self.remove(subscription, name)
+        return get_topic_name(name)
+
+    def remove(self, subscription, topic):
+        key = subscription.topics.pop(topic, None)
+        subscribers = self.subscriptions.get(key)
+        if subscribers is None:
+            return
+        subscribers.discard((topic, subscription))
+        if not subscribers:
+            del self.subscriptions[key]
+
+    def notify(self, connection, pid, channel, payload):
+        observation = tuple(int(value) for value in payload.split(","))
+        if any(key in self.subscriptions for key in get_keys(observation)):
+            self.pending.append(observation)
+            self.notified.set()
+
+    async def listen(self):
+        """
+        Listen to the notified Observations, reconnecting when the
+        connection is lost.
+        """
+        port = POSTGRES_PORT_WRITE or POSTGRES_PORT
+        dsn = f"postgresql://{ISTSOS_ADMIN}:{ISTSOS_ADMIN_PASSWORD}@{POSTGRES_HOST}:{port}/{POSTGRES_DB}"
+        while True:
+            try:
+                connection = await asyncpg.connect(dsn=dsn)
+            except (OSError, asyncpg.PostgresError) as error:
+                logger.warning("Could not listen to Observations: %s", error)
+                await asyncio.sleep(RECONNECT_DELAY)
+                continue
+
+            closed = asyncio.get_running_loop().create_future()
+            connection.add_termination_listener(
+                lambda _: closed.done() or closed.set_result(None)
+            )
+            try:
+                await connection.add_listener(CHANNEL, self.notify)
+                await closed
+            finally:
+                if not connection.is_closed():
+                    await connection.close()
+            logger.warning("Lost the connection listening to Observations")
+            await asyncio.sleep(RECONNECT_DELAY)
+
+    async def run(self):
+        while True:
+            await self.notified.wait()
+            await asyncio.sleep(self.flush_interval)
+            self.notified.clear()
+            pending, self.pending = self.pending, []
+            try:
+                await self.push(pending)
+            except Exception:
+                logger.exception(
+                    "Could not push %s new Observations", len(pending)
+                )
+
+    async def push(self, observations):
+        """
+        Read the notified Observations and queue them to their subscribers.
+
+        Args:
+            observations (list): The notified Observations.
+        """
+        ids = {}
+        for observation in observations:
+            for key in get_keys(observation):
+                if key in self.subscriptions:
+                    ids.setdefault(key, []).append(observation[0])
+
+        pool = await (get_pool_w() if POSTGRES_PORT_WRITE else get_pool())
+        for key, key_ids in ids.items():
+            # The subscribers of a topic that read it with the same role
+            groups = {}
+            for topic, subscription in self.subscriptions.get(key, ()):
+                user = subscription.current_user
+                username = user["username"] if user is not None else None
+                groups.setdefault((topic, username), []).append(subscription)
+
+            for (topic, username), subscriptions in groups.items():
+                # A failed read only misses the Observations of its group
+                try:
+                    await push_group(topic, subscriptions, key_ids, pool)
+                except Exception:
+                    logger.exception(
+                        "Could not push %s new Observations of %s to %s",
+                        len(key_ids),
+                        topic,
+                        username,
+                    )
+
+
+async def push_group(topic, subscriptions, ids, pool):
+    """
+    Read the new Observations of a topic and queue them to the subscribers
+    that read it with the same role.
+
+    Args:
+        topic (str): The topic, without the version.
+        subscriptions (list): The subscriptions of the same role.
+        ids (list): The ids of the new Observations.
+        pool: The database connection pool.
+    """
+    for start in range(0, len(ids), READ_BATCH_SIZE):
+        batch = ids[start : start + READ_BATCH_SIZE]
+        for observation in await read_observations(
+            pool, topic, batch, subscriptions[0].current_user
+        ):
+            for subscription in subscriptions:
+                subscription.put(topic, observation)
+
+
+def parse_topic(topic):
+    """
+    Parse a SensorThings MQTT topic.
+
+    Args:
+        topic (str): The topic, with or without the version.
+
+    Returns:
+        tuple: The topic without the version, and its key: the collection
+            and id of the entity whose Observations it publishes, or
+            (None, None) for all the Observations.
+
+    Raises:
+        BadRequest: If the topic is not supported.
+    """
+    name = urllib.parse.unquote(topic).lstrip("/")
+    version = VERSION.strip("/") + "/"
+    if name.startswith(version):
+        name = name[len(version) :]
+    match = TOPIC_PATTERN.fullmatch(name)
+    if match is None:
+        raise BadRequest(f"Unsupported topic: {topic}")
+
+    # The $select of the topic is checked by translating it once
+    try:
+        sta2rest.STA2REST.convert_query(get_query_path(name, [0]))
+    except Exception as e:
+        raise BadRequest(f"Invalid topic {topic}: {e}")
+
+    entity_id = match["id"]
+    return name, (
+        match["collection"],
+        int(entity_id) if entity_id is not None else None,
+    )
+
+
+def get_topic_name(topic):
+    return f"{VERSION.strip('/')}/{topic}"
+
+
+def get_keys(observation):
+    """
+    Return the keys of the topics an Observation is published on.
+
+    Args:
+        observation (tuple): The notified id, datastream_id and
+            featuresofinterest_id.
+
+    Returns:
+        list: The topic keys.
+    """
+    return [(None, None)] + [
+        (collection, observation[index])
+        for collection, index in NOTIFIED_IDS.items()
+    ]
+
+
+def get_query_path(topic, ids):
+    """
+    Return the request path that reads the Observations of a topic.
+
+    The ids are padded to a power of two by repeating the last one, so that
+    the translations of a topic are cached for a few query shapes.
+
+    Args:
+        topic (str): The topic, without the version.
+        ids (list): The ids of the Observations.
+
+    Returns:
+        str: The request path.
+    """
+    size = 1 << (len(ids) - 1).bit_length()
+    ids = list(ids) + [ids[-1]] * (size - len(ids))
+    path, _, select = topic.partition("?")
+    options = (
+        f"$filter=id in ({','.join(map(str, ids))})"
+        f"&$orderby=id&$top={size}"
+    )
+    if select:
+        options = f"{select}&{options}"
+    return f"{VERSION}/{path}?{options}"
+
+
+async def read_observations(pool, topic, ids, current_user):
+    """
+    Read the Observations of a topic as a user.
+
+    Args:
+        pool: The database connection pool.
+        topic (str): The topic, without the version.
+        ids (list): The ids of the Observations.
+        current_user (dict): The user, or None.
+
+    Returns:
+        list: The JSON of the Observations the user can read.
+    """
+    data = sta2rest.STA2REST.convert_query(get_query_path(topic, ids))
+    async with pool.acquire() as connection:
+        async with connection.transaction():
+            if current_user is None and ANONYMOUS_VIEWER:
+                current_user = {"username": "guest"}
+            if current_user is not None:
+                await set_role(connection, current_user)
+
+            records = await connection.fetch(
+                data["main_query"], *data["main_query_params"]
+            )
+
+            if current_user is not None:
+                await connection.execute("RESET ROLE")
+    return [record["json"] for record in records]
+
+
+observation_hub = ObservationHub(LIVE_FLUSH_INTERVAL)
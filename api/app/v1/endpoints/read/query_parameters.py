@@ -25,6 +25,11 @@ class CommonQueryParams:
             alias="$skip",
             description="The number of elements to skip from the collection",
         ),
+        skip_token: str = Query(
+            None,
+            alias="$skiptoken",
+            description="An opaque token, taken from @iot.nextLink, to continue after the last element of the previous page",
+        ),
         top: int = Query(
             None, alias="$top", description="The number of elements to return"
         ),
@@ -65,6 +70,7 @@ class CommonQueryParams:
         ),
     ):
         self.skip = skip
+        self.skip_token = skip_token
         self.top = top
         self.count = count
         self.order = order
@@ -84,6 +90,11 @@ class ObservationQueryParams(CommonQueryParams):
             alias="$skip",
             description="The number of elements to skip from the collection",
         ),
+        skip_token: str = Query(
+            None,
+            alias="$skiptoken",
+            description="An opaque token, taken from @iot.nextLink, to continue after the last element of the previous page",
+        ),
         top: int = Query(
             None, alias="$top", description="The number of elements to return"
         ),
@@ -113,7 +124,17 @@ class ObservationQueryParams(CommonQueryParams):
         result_format: str = Query(
             None,
             alias="$resultFormat",
-            description="Return observations using the Data Array result format",
+            description="Return observations using the Data Array result format (dataArray), or as typed columns in CSV, Arrow IPC stream or Parquet (csv, arrow, parquet)",
+        ),
+        aggregate: str = Query(
+            None,
+            alias="$aggregate",
+            description="Aggregate the numeric results of each Datastream per $interval with the listed functions (avg, min, max, sum, count)",
+        ),
+        interval: str = Query(
+            None,
+            alias="$interval",
+            description="The length of the $aggregate time buckets (ISO 8601 duration, e.g. P1D or PT15M)",
         ),
         as_of: str = Query(
             None,
@@ -130,6 +151,7 @@ class ObservationQueryParams(CommonQueryParams):
     ):
         super().__init__(
             skip,
+            skip_token,
             top,
             count,
             order,
@@ -140,6 +162,8 @@ class ObservationQueryParams(CommonQueryParams):
             from_to,
         )
         self.result_format = result_format
+        self.aggregate = aggregate
+        self.interval = interval
 
 
 def get_common_query_params(
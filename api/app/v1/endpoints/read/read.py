@@ -12,7 +12,6 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-import json
 import logging
 from datetime import datetime, timezone
 
@@ -25,13 +24,11 @@ from app import (
     COUNT_MODE,
     HOSTNAME,
     PARTITION_CHUNK,
-    REDIS,
     SUBPATH,
     VERSION,
     VERSIONING,
 )
 from app.db.asyncpg_db import get_pool
-from app.db.redis_db import redis
 from app.oauth import get_current_user
 from app.settings import serverSettings, tables
 from app.sta2rest import sta2rest
@@ -40,11 +37,17 @@ from app.sta2rest.odata_query.exceptions import (
     InvalidFieldException,
 )
 from app.utils.utils import build_nextLink
+from app.v1.endpoints.exceptions import STAError
 from app.v1.endpoints.functions import set_role
+from app.v1.endpoints.response_cache import (
+    ResponseCache,
+    wrapped_result_generator,
+)
 from fastapi import APIRouter, Depends, Header, HTTPException, Request, status
 from fastapi.responses import JSONResponse, StreamingResponse
 
 from .query_parameters import CommonQueryParams, get_common_query_params
+from .result_format import FILE_EXTENSIONS, MEDIA_TYPES, get_writer
 
 v1 = APIRouter()
 logger = logging.getLogger(__name__)
@@ -85,15 +88,6 @@ def __handle_root():
     return response
 
 
-async def wrapped_result_generator(first_item, result):
-    try:
-        yield first_item
-        async for item in result:
-            yield item
-    finally:
-        await result.aclose()
-
-
 @v1.api_route(
     "/{path_name:path}",
     methods=["GET"],
@@ -117,21 +111,19 @@ async def catch_all_get(
         if request.url.query:
             full_path += "?" + request.url.query
 
-        data = None
+        data = sta2rest.STA2REST.convert_query(full_path)
 
-        if REDIS:
-            result = redis.get(full_path)
-            if result:
-                data = json.loads(result)
-                print("Cache hit")
-            else:
-                print("Cache miss")
+        if data.get("columns"):
+            return await columnar_response(data, pool, current_user)
 
-        if not data:
-            data = sta2rest.STA2REST.convert_query(full_path)
+        cache = ResponseCache(request, full_path, data, current_user)
+        cached_response = await cache.lookup()
+        if cached_response is not None:
+            return cached_response
 
         main_entity = data.get("main_entity")
         main_query = data.get("main_query")
+        main_query_params = data.get("main_query_params")
         top_value = data.get("top_value")
         is_count = data.get("is_count")
         count_queries = data.get("count_queries")
@@ -139,6 +131,7 @@ async def catch_all_get(
         from_to_value = data.get("from_to_value")
         single_result = data.get("single_result")
         value = data.get("value")
+        keyset = data.get("keyset")
 
         result = asyncpg_stream_results(
             main_entity,
@@ -153,16 +146,18 @@ async def catch_all_get(
             full_path,
             current_user,
             value,
+            main_query_params,
+            keyset,
         )
 
         try:
             first_item = await anext(result)
             # 18-088 §9.2 Usage 5: a $value response is the raw property literal,
             # served as text/plain rather than the JSON media type.
-            return StreamingResponse(
-                wrapped_result_generator(first_item, result),
-                media_type="text/plain" if value else "application/json",
-                status_code=status.HTTP_200_OK,
+            return await cache.response(
+                first_item,
+                result,
+                "text/plain" if value else "application/json",
             )
         except StopAsyncIteration:
             return JSONResponse(
@@ -209,7 +204,7 @@ async def catch_all_get(
                 },
             )
 
-    except HTTPException:
+    except (HTTPException, STAError):
         raise
     except (InvalidFieldException, InvalidCollectionException) as e:
         # req/resource-path (18-088 §9.2): an unknown collection / entity / a
@@ -261,6 +256,8 @@ async def asyncpg_stream_results(
     full_path,
     current_user,
     value=False,
+    query_params=None,
+    keyset=False,
 ):
     async with pgpool.acquire() as connection:
         async with connection.transaction():
@@ -272,31 +269,44 @@ async def asyncpg_stream_results(
                     await set_role(connection, current_user)
 
             if is_count:
+                # Each count query is a [sql, params] pair; the estimate
+                # query is literal-bound because count_estimate() EXPLAINs
+                # its text.
                 if COUNT_MODE == "LIMIT_ESTIMATE":
-                    query_count = await connection.fetchval(count_queries[0])
+                    count_query, count_params = count_queries[0]
+                    query_count = await connection.fetchval(
+                        count_query, *count_params
+                    )
                     if query_count == COUNT_ESTIMATE_THRESHOLD:
                         query_count = await connection.fetchval(
                             "SELECT sensorthings.count_estimate($1) AS estimated_count",
-                            count_queries[1],
+                            count_queries[1][0],
                         )
                 elif COUNT_MODE == "ESTIMATE_LIMIT":
                     query_count = await connection.fetchval(
                         "SELECT sensorthings.count_estimate($1) AS estimated_count",
-                        count_queries[0],
+                        count_queries[0][0],
                     )
                     if query_count < COUNT_ESTIMATE_THRESHOLD:
+                        count_query, count_params = count_queries[1]
                         query_count = await connection.fetchval(
-                            count_queries[1]
+                            count_query, *count_params
                         )
                 else:
-                    query_count = await connection.fetchval(count_queries[0])
+                    count_query, count_params = count_queries[0]
+                    query_count = await connection.fetchval(
+                        count_query, *count_params
+                    )
 
             iot_count = (
                 '"@iot.count": ' + str(query_count) + ","
                 if is_count and not single_result
                 else ""
             )
-            await connection.execute(f"DECLARE my_cursor CURSOR FOR {query}")
+            # Run the translated query as a prepared, server-side cursor:
+            # asyncpg caches the statement by its text, so requests with the
+            # same URL shape skip parsing and planning.
+            cursor = await connection.cursor(query, *(query_params or []))
 
             if value:
                 # 18-088 §9.2 Usage 5 ($value): emit the raw scalar literal as
@@ -308,14 +318,11 @@ async def asyncpg_stream_results(
                 # entity/property yields no row at all, which the caller maps to
                 # a 404. Hence yield the `null` literal instead of skipping it.
                 while True:
-                    partition = await connection.fetch(
-                        f"FETCH {PARTITION_CHUNK} FROM my_cursor"
-                    )
+                    partition = await cursor.fetch(PARTITION_CHUNK)
                     if not partition:
                         break
                     raw = partition[0]["json"]
                     yield "null" if raw is None else str(raw)
-                await connection.execute("CLOSE my_cursor")
                 if current_user is not None:
                     await connection.execute("RESET ROLE")
                 return
@@ -323,6 +330,9 @@ async def asyncpg_stream_results(
             start_json = ""
             is_first_partition = True
             has_rows = False
+            fetched = 0
+            last_record = None
+            next_link = None
 
             if VERSIONING:
                 as_of_value = (
@@ -334,17 +344,20 @@ async def asyncpg_stream_results(
                 )
 
             while True:
-                partition = await connection.fetch(
-                    f"FETCH {PARTITION_CHUNK} FROM my_cursor"
-                )
+                partition = await cursor.fetch(PARTITION_CHUNK)
                 if not partition:
                     break
 
                 partition_len = len(partition)
+                fetched += partition_len
                 has_rows = True
 
-                if partition_len > top - 1:
+                # The query fetches one row past the page to detect a next
+                # page; it is the last row of the last partition.
+                if fetched > top - 1:
                     partition = partition[:-1]
+                if partition:
+                    last_record = partition[-1]
 
                 if (
                     VERSIONING
@@ -361,19 +374,21 @@ async def asyncpg_stream_results(
                         escape_forward_slashes=False,
                     )
                 else:
-                    processed_partition = [
-                        ujson.loads(record["json"]) for record in partition
-                    ]
-                    partition_json = ujson.dumps(
-                        processed_partition,
-                        escape_forward_slashes=False,
-                    )[1:-1]
+                    # The rows are already JSON text produced by Postgres:
+                    # pass them through instead of decoding and re-encoding.
+                    partition_json = ",".join(
+                        record["json"] for record in partition
+                    )
 
                 if is_first_partition:
                     if partition_len > 0 and not single_result:
                         start_json = "{"
 
-                    next_link = build_nextLink(full_path, partition_len)
+                    next_link = build_nextLink(
+                        full_path,
+                        partition_len,
+                        get_seek(last_record, keyset, fetched > top - 1),
+                    )
                     next_link_json = (
                         f'"@iot.nextLink": "{next_link}",'
                         if next_link and not single_result
@@ -396,7 +411,7 @@ async def asyncpg_stream_results(
 
                     yield start_json + partition_json
                     is_first_partition = False
-                else:
+                elif partition:
                     yield "," + partition_json
 
             if not has_rows and not single_result:
@@ -410,9 +425,100 @@ async def asyncpg_stream_results(
                 yield "{" + iot_count + '"value": []}'
 
             if has_rows and not single_result:
-                yield "]}"
+                if next_link is None and fetched > top - 1:
+                    # The page ended after the first partition, so its next
+                    # link is only known now; OData allows it after the value.
+                    next_link = build_nextLink(
+                        full_path,
+                        fetched,
+                        get_seek(last_record, keyset, True),
+                    )
+                    yield f'],"@iot.nextLink": "{next_link}"}}'
+                else:
+                    yield "]}"
+
+            if current_user is not None:
+                await connection.execute("RESET ROLE")
+
+
+async def columnar_response(data, pool, current_user):
+    """
+    Return the streamed response of a columnar result format.
+
+    Args:
+        data (dict): The translation of the request.
+        pool: The database connection pool.
+        current_user (dict): The authenticated user, or None.
+
+    Returns:
+        StreamingResponse: The response.
+    """
+    result_format = data["result_format"]
+    result = asyncpg_stream_columnar(
+        get_writer(result_format, data["columns"]),
+        data["main_query"],
+        pool,
+        current_user,
+        data["main_query_params"],
+    )
+    # Run the query before the response starts, so that its errors still
+    # get an error status
+    first_item = await anext(result)
+    filename = f"Observations.{FILE_EXTENSIONS[result_format]}"
+    return StreamingResponse(
+        wrapped_result_generator(first_item, result),
+        media_type=MEDIA_TYPES[result_format],
+        status_code=status.HTTP_200_OK,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+async def asyncpg_stream_columnar(
+    writer, query, pgpool, current_user, query_params=None
+):
+    """
+    Stream the typed rows of a query through a result format writer.
+
+    The rows are fetched in partitions of PARTITION_CHUNK rows, and each
+    partition is encoded as one batch.
+    """
+    async with pgpool.acquire() as connection:
+        async with connection.transaction():
+            if current_user is not None:
+                await set_role(connection, current_user)
+            else:
+                if ANONYMOUS_VIEWER:
+                    current_user = {"username": "guest"}
+                    await set_role(connection, current_user)
 
-            await connection.execute("CLOSE my_cursor")
+            cursor = await connection.cursor(query, *(query_params or []))
+            # The CSV header, or the Arrow schema
+            yield writer.drain()
+
+            while True:
+                partition = await cursor.fetch(PARTITION_CHUNK)
+                if not partition:
+                    break
+                yield writer.write(partition)
+
+            yield writer.close()
 
             if current_user is not None:
                 await connection.execute("RESET ROLE")
+
+
+def get_seek(record, keyset, has_next):
+    """
+    Return the seek key of the last row of a page, if it is keyset paged.
+
+    Args:
+        record (Record): The last row of the page, or None.
+        keyset (bool): Whether the query selects a seek key per row.
+        has_next (bool): Whether a row was fetched past the page.
+
+    Returns:
+        str: The JSON seek key, or None to page with $skip.
+    """
+    if keyset and has_next and record is not None:
+        return record["seek"]
+    return None
@@ -0,0 +1,200 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Writers of the columnar result formats of Observations.
+
+Each writer turns the partitions of typed rows fetched from the cursor into
+chunks of the encoded response, so a result is streamed in record batches
+without building any JSON. The Arrow and Parquet formats need pyarrow,
+which is not installed by default.
+"""
+
+import csv
+import io
+
+from app.v1.endpoints.exceptions import NotSupported
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pragma: no cover - depends on the installation
+    pyarrow = None
+
+MEDIA_TYPES = {
+    "CSV": "text/csv",
+    "Arrow": "application/vnd.apache.arrow.stream",
+    "Parquet": "application/vnd.apache.parquet",
+}
+
+FILE_EXTENSIONS = {
+    "CSV": "csv",
+    "Arrow": "arrows",
+    "Parquet": "parquet",
+}
+
+
+def get_arrow_schema(columns):
+    """
+    Return the Arrow schema of typed columns.
+
+    Args:
+        columns (list): (name, type) pairs of the columns.
+
+    Returns:
+        pyarrow.Schema: The schema.
+    """
+    types = {
+        "int64": pyarrow.int64(),
+        "float64": pyarrow.float64(),
+        "string": pyarrow.string(),
+        "timestamp": pyarrow.timestamp("us", tz="UTC"),
+    }
+    return pyarrow.schema(
+        [(name, types[column_type]) for name, column_type in columns]
+    )
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    A write-only file collecting the bytes written since the last drain.
+
+    The position keeps counting across drains, as the Parquet writer records
+    the offsets of the row groups in the file footer.
+    """
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        data = bytes(data)
+        self.chunks.append(data)
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks.clear()
+        return data
+
+
+class CSVWriter:
+    """
+    Write rows as CSV, with a header row and ISO 8601 timestamps.
+    """
+
+    def __init__(self, columns):
+        self.buffer = io.StringIO()
+        self.writer = csv.writer(self.buffer, lineterminator="\n")
+        self.writer.writerow([name for name, _ in columns])
+        self.timestamps = [
+            index
+            for index, (_, column_type) in enumerate(columns)
+            if column_type == "timestamp"
+        ]
+
+    def drain(self):
+        data = self.buffer.getvalue().encode()
+        self.buffer.seek(0)
+        self.buffer.truncate()
+        return data
+
+    def write(self, records):
+        if self.timestamps:
+            rows = []
+            for record in records:
+                row = list(record)
+                for index in self.timestamps:
+                    if row[index] is not None:
+                        row[index] = row[index].isoformat()
+                rows.append(row)
+            records = rows
+        self.writer.writerows(records)
+        return self.drain()
+
+    def close(self):
+        return self.drain()
+
+
+class ArrowWriter:
+    """
+    Write rows as an Arrow IPC stream, one record batch per partition.
+    """
+
+    def __init__(self, columns):
+        self.schema = get_arrow_schema(columns)
+        self.sink = ChunkSink()
+        self.writer = self.open()
+
+    def open(self):
+        return pyarrow.ipc.new_stream(self.sink, self.schema)
+
+    def drain(self):
+        return self.sink.drain()
+
+    def write(self, records):
+        arrays = [
+            pyarrow.array(values, type=field.type)
+            for values, field in zip(zip(*records), self.schema)
+        ]
+        self.writer.write_batch(
+            pyarrow.RecordBatch.from_arrays(arrays, schema=self.schema)
+        )
+        return self.drain()
+
+    def close(self):
+        self.writer.close()
+        return self.drain()
+
+
+class ParquetWriter(ArrowWriter):
+    """
+    Write rows as a Parquet file, one row group per partition.
+    """
+
+    def open(self):
+        return pyarrow.parquet.ParquetWriter(self.sink, self.schema)
+
+
+WRITERS = {
+    "CSV": CSVWriter,
+    "Arrow": ArrowWriter,
+    "Parquet": ParquetWriter,
+}
+
+
+def get_writer(result_format, columns):
+    """
+    Return the writer of a columnar result format.
+
+    Args:
+        result_format (str): The result format.
+        columns (list): (name, type) pairs of the columns.
+
+    Raises:
+        NotSupported: If the format needs pyarrow and it is missing.
+    """
+    if result_format != "CSV" and pyarrow is None:
+        raise NotSupported(
+            f"$resultFormat={result_format.lower()} is not "
+            "available on this server"
+        )
+    return WRITERS[result_format](columns)
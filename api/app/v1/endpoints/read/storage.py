@@ -0,0 +1,193 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from app import AUTHORIZATION
+from app.db.asyncpg_db import get_pool
+from app.v1.endpoints.exceptions import Forbidden
+from fastapi import APIRouter, Depends, Header, status
+from fastapi.responses import JSONResponse
+
+v1 = APIRouter()
+user = Header(default=None, include_in_schema=False)
+
+if AUTHORIZATION:
+    from app.oauth import get_current_user
+
+    user = Depends(get_current_user)
+
+HYPERTABLE = 'sensorthings."Observation"'
+
+
+@v1.api_route(
+    "/Storage",
+    methods=["GET"],
+    tags=["Storage"],
+    summary="Get the Observation storage",
+    description=(
+        "Get the size of the Observation hypertable and of each of its "
+        "chunks, their compression ratio and the compression and retention "
+        "policies."
+    ),
+    status_code=status.HTTP_200_OK,
+)
+async def get_observation_storage(
+    current_user=user,
+    pool=Depends(get_pool),
+):
+    check_administrator(current_user)
+
+    async with pool.acquire() as connection:
+        storage = await get_storage(connection)
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=storage)
+
+
+def check_administrator(current_user):
+    if current_user is not None and current_user["role"] != "administrator":
+        raise Forbidden()
+
+
+async def get_storage(connection):
+    """
+    Describe the storage of the Observation hypertable.
+
+    Args:
+        connection: The database connection.
+
+    Returns:
+        dict: The compression and retention settings, the sizes in bytes
+            of the hypertable and of each chunk, and the compression ratio
+            of the compressed chunks.
+    """
+    compression_enabled = await connection.fetchval("""
+            SELECT compression_enabled
+            FROM timescaledb_information.hypertables
+            WHERE hypertable_schema = 'sensorthings'
+            AND hypertable_name = 'Observation';
+        """)
+    policies = {
+        record["proc_name"]: record["interval"]
+        for record in await connection.fetch("""
+                SELECT
+                    proc_name,
+                    coalesce(
+                        config->>'compress_after', config->>'drop_after'
+                    ) AS interval
+                FROM timescaledb_information.jobs
+                WHERE hypertable_schema = 'sensorthings'
+                AND hypertable_name = 'Observation'
+                AND proc_name IN ('policy_compression', 'policy_retention');
+            """)
+    }
+    size = await connection.fetchrow(
+        f"SELECT * FROM hypertable_detailed_size('{HYPERTABLE}');"
+    )
+
+    compression = {
+        "enabled": bool(compression_enabled),
+        "segmentBy": None,
+        "orderBy": None,
+        "compressAfter": policies.get("policy_compression"),
+    }
+    if compression_enabled:
+        settings = await connection.fetchrow(f"""
+                SELECT segmentby, orderby
+                FROM timescaledb_information.hypertable_compression_settings
+                WHERE hypertable = '{HYPERTABLE}'::regclass;
+            """)
+        if settings is not None:
+            compression["segmentBy"] = settings["segmentby"]
+            compression["orderBy"] = settings["orderby"]
+
+    # The compression stats only exist once compression is enabled
+    compression_stats = (
+        f"""
+            LEFT JOIN chunk_compression_stats('{HYPERTABLE}') z
+            ON z.chunk_schema = c.chunk_schema
+            AND z.chunk_name = c.chunk_name
+        """
+        if compression_enabled
+        else ""
+    )
+    before, after = (
+        (
+            "z.before_compression_total_bytes",
+            "z.after_compression_total_bytes",
+        )
+        if compression_enabled
+        else ("NULL::bigint", "NULL::bigint")
+    )
+    chunks = await connection.fetch(f"""
+            SELECT
+                c.chunk_name,
+                c.range_start,
+                c.range_end,
+                c.is_compressed,
+                s.total_bytes,
+                {before} AS before_compression_bytes,
+                {after} AS after_compression_bytes
+            FROM timescaledb_information.chunks c
+            JOIN chunks_detailed_size('{HYPERTABLE}') s
+            ON s.chunk_schema = c.chunk_schema
+            AND s.chunk_name = c.chunk_name
+            {compression_stats}
+            WHERE c.hypertable_schema = 'sensorthings'
+            AND c.hypertable_name = 'Observation'
+            ORDER BY c.range_start;
+        """)
+
+    before_total = sum(
+        chunk["before_compression_bytes"] or 0
+        for chunk in chunks
+        if chunk["is_compressed"]
+    )
+    after_total = sum(
+        chunk["after_compression_bytes"] or 0
+        for chunk in chunks
+        if chunk["is_compressed"]
+    )
+
+    return {
+        "compression": compression,
+        "retention": {"dropAfter": policies.get("policy_retention")},
+        "size": {
+            "tableBytes": size["table_bytes"],
+            "indexBytes": size["index_bytes"],
+            "toastBytes": size["toast_bytes"],
+            "totalBytes": size["total_bytes"],
+        },
+        "compressionRatio": get_ratio(before_total, after_total),
+        "chunks": [
+            {
+                "name": chunk["chunk_name"],
+                "rangeStart": chunk["range_start"].isoformat(),
+                "rangeEnd": chunk["range_end"].isoformat(),
+                "compressed": chunk["is_compressed"],
+                "totalBytes": chunk["total_bytes"],
+                "beforeCompressionBytes": chunk["before_compression_bytes"],
+                "afterCompressionBytes": chunk["after_compression_bytes"],
+                "compressionRatio": get_ratio(
+                    chunk["before_compression_bytes"],
+                    chunk["after_compression_bytes"],
+                ),
+            }
+            for chunk in chunks
+        ],
+    }
+
+
+def get_ratio(before, after):
+    if not before or not after:
+        return None
+    return round(before / after, 2)
@@ -0,0 +1,211 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+import asyncio
+
+import ujson
+from app import ANONYMOUS_VIEWER, AUTHORIZATION
+from app.oauth import get_current_user
+from app.v1.endpoints.exceptions import BadRequest
+from fastapi import (
+    APIRouter,
+    Depends,
+    Header,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+    WebSocketException,
+    status,
+)
+from fastapi.responses import StreamingResponse
+
+from .live_observations import Subscription, observation_hub
+
+v1 = APIRouter()
+
+user = Header(default=None, include_in_schema=False)
+
+if AUTHORIZATION and not ANONYMOUS_VIEWER:
+    user = Depends(get_current_user)
+
+# The seconds after which an idle event stream sends a comment, so that
+# proxies keep it open
+KEEPALIVE_INTERVAL = 15
+
+
+@v1.api_route(
+    "/Subscriptions",
+    methods=["GET"],
+    tags=["Subscriptions"],
+    summary="Subscribe to new Observations",
+    description=(
+        "Stream the Observations created from now on, as server-sent events, "
+        "for each SensorThings MQTT topic given, e.g. "
+        "v1.1/Datastreams(1)/Observations or "
+        "v1.1/Observations?$select=result,phenomenonTime. Each event is a "
+        'JSON object with the "topic" and the Observation as "message".'
+    ),
+    status_code=status.HTTP_200_OK,
+)
+async def subscribe_event_stream(
+    request: Request,
+    topic: list[str] = Query(),
+    current_user=user,
+):
+    # Without authentication the user is the raw header, which is not a
+    # user the Observations can be read as
+    if not isinstance(current_user, dict):
+        current_user = None
+    subscription = Subscription(current_user)
+    try:
+        for name in topic:
+            observation_hub.subscribe(subscription, name)
+    except BadRequest:
+        observation_hub.unsubscribe(subscription)
+        raise
+
+    return StreamingResponse(
+        stream_events(request, subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def stream_events(request, subscription):
+    try:
+        yield ": subscribed\n\n"
+        while True:
+            try:
+                message = await asyncio.wait_for(
+                    subscription.queue.get(), KEEPALIVE_INTERVAL
+                )
+            except asyncio.TimeoutError:
+                if await request.is_disconnected():
+                    return
+                yield ": keepalive\n\n"
+                continue
+            yield f"data: {message}\n\n"
+    finally:
+        observation_hub.unsubscribe(subscription)
+
+
+async def get_websocket_user(websocket: WebSocket):
+    """
+    Authenticate a WebSocket with the bearer token of its Authorization
+    header or its access_token query parameter, as browsers cannot set
+    headers on a WebSocket.
+    """
+    if not AUTHORIZATION or ANONYMOUS_VIEWER:
+        return None
+
+    token = websocket.query_params.get("access_token")
+    authorization = websocket.headers.get("authorization", "")
+    if authorization.lower().startswith("bearer "):
+        token = authorization[len("bearer ") :]
+    if not token:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION,
+            reason="Not authenticated",
+        )
+    try:
+        return await get_current_user(token)
+    except HTTPException as e:
+        raise WebSocketException(
+            code=status.WS_1008_POLICY_VIOLATION, reason=e.detail
+        )
+
+
+@v1.websocket("/Subscriptions")
+async def subscribe_websocket(
+    websocket: WebSocket,
+    current_user=Depends(get_websocket_user),
+):
+    """
+    Push the Observations created from now on to a WebSocket.
+
+    The client subscribes with {"subscribe": topic} and unsubscribes with
+    {"unsubscribe": topic}, a topic or a list of them, or with the topic
+    query parameters. Each request is acknowledged with the "subscribed" or
+    "unsubscribed" topics, or with an "error". The Observations are sent as
+    {"topic": topic, "message": Observation}.
+    """
+    await websocket.accept()
+    subscription = Subscription(current_user)
+    sender = asyncio.create_task(send_messages(websocket, subscription))
+    try:
+        topics = websocket.query_params.getlist("topic")
+        if topics:
+            await websocket.send_text(
+                handle_request(subscription, {"subscribe": topics})
+            )
+        while True:
+            try:
+                request = ujson.loads(await websocket.receive_text())
+            except ValueError:
+                request = None
+            await websocket.send_text(handle_request(subscription, request))
+    except WebSocketDisconnect:
+        pass
+    finally:
+        sender.cancel()
+        observation_hub.unsubscribe(subscription)
+
+
+async def send_messages(websocket, subscription):
+    while True:
+        await websocket.send_text(await subscription.queue.get())
+
+
+def handle_request(subscription, request):
+    """
+    Apply a subscribe or unsubscribe request of a WebSocket.
+
+    Args:
+        subscription (Subscription): The subscription of the WebSocket.
+        request: The decoded request.
+
+    Returns:
+        str: The JSON acknowledgement.
+    """
+    if not isinstance(request, dict) or len(request) != 1:
+        return ujson.dumps(
+            {"error": 'Expected {"subscribe": ...} or {"unsubscribe": ...}'}
+        )
+    action, topics = next(iter(request.items()))
+    if action not in ("subscribe", "unsubscribe"):
+        return ujson.dumps({"error": f"Unknown request: {action}"})
+    if isinstance(topics, str):
+        topics = [topics]
+    if not isinstance(topics, list) or not all(
+        isinstance(topic, str) for topic in topics
+    ):
+        return ujson.dumps({"error": "Topics must be strings"})
+
+    handled = []
+    try:
+        for topic in topics:
+            if action == "subscribe":
+                handled.append(observation_hub.subscribe(subscription, topic))
+            else:
+                handled.append(
+                    observation_hub.unsubscribe(subscription, topic)
+                )
+    except BadRequest as e:
+        return ujson.dumps(
+            {f"{action}d": handled, "error": e.message},
+            escape_forward_slashes=False,
+        )
+    return ujson.dumps({f"{action}d": handled}, escape_forward_slashes=False)
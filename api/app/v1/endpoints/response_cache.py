@@ -0,0 +1,421 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Cache of GET responses in Redis, invalidated by the write requests.
+
+A response depends on a set of tags: one per table its queries read, and,
+when it is a single entity addressed by id, "<table>:<id>" for that entity
+instead of its table. Every tag has a version counter in Redis. A response
+is stored with the versions its tags had before it was read, and is served
+only while they are unchanged.
+
+A successful write increments the versions of the tags it affects: the
+entity it addresses (its table, and its id tag if it has one), the entities
+created in the same request, and the tables the write changes through
+triggers and cascades, whose id tags are all invalidated through the
+"<table>:*" tag.
+
+Each cached response carries an ETag, so a client polling with
+If-None-Match gets 304 Not Modified without any database work.
+"""
+
+import hashlib
+import logging
+import re
+
+import ujson
+from app import (
+    REDIS,
+    RESPONSE_CACHE,
+    RESPONSE_CACHE_MAX_SIZE,
+    RESPONSE_CACHE_TTL,
+    VERSIONING,
+)
+from app.db.redis_db import redis_client
+from app.sta2rest import sta2rest
+from fastapi import status
+from fastapi.responses import Response, StreamingResponse
+from redis.exceptions import RedisError
+
+logger = logging.getLogger(__name__)
+
+ENTRY_PREFIX = "response_cache:entry:"
+VERSION_PREFIX = "response_cache:version:"
+
+# The tag every response depends on
+GLOBAL_TAG = "*"
+
+TABLE_PATTERN = re.compile(r'sensorthings\."(\w+)"')
+SEGMENT_PATTERN = re.compile(r"/(\w+)(?:\((\d+)\))?")
+
+# Tables a write to an entity changes besides its own row, through
+# triggers, the maintenance of the Datastream ranges and the cascading
+# deletes of the schema.
+AFFECTED_TABLES = {
+    "Thing": {
+        "Thing_Location",
+        "HistoricalLocation",
+        "Location_HistoricalLocation",
+        "Datastream",
+        "Observation",
+    },
+    "Location": {
+        "Thing_Location",
+        "HistoricalLocation",
+        "Location_HistoricalLocation",
+    },
+    "HistoricalLocation": {"Location_HistoricalLocation"},
+    "Sensor": {"Datastream", "Observation"},
+    "ObservedProperty": {"Datastream", "Observation"},
+    "Network": {"Datastream", "Observation"},
+    "Datastream": {"Observation"},
+    "FeaturesOfInterest": {"Datastream", "Observation"},
+    "Observation": {"Datastream", "FeaturesOfInterest"},
+}
+
+# Write endpoints that are not addressed by an entity name
+WRITE_ENTITIES = {
+    "BulkObservations": "Observation",
+    "CreateObservations": "Observation",
+}
+
+# Write endpoints whose payload is not scanned for created entities
+UNSCANNED_ENTITIES = set(WRITE_ENTITIES)
+
+# Write endpoints that change what every user is allowed to read
+AUTHORIZATION_ENTITIES = {"Users", "Policies"}
+
+# The continuous aggregates of Observations, tagged as Observation so that
+# writes to it invalidate the aggregates read from them
+ROLLUP_TABLES = {
+    "Observation_hourly": "Observation",
+    "Observation_daily": "Observation",
+}
+
+# Write endpoints that do not change any entity
+SESSION_ENTITIES = {"Login", "Logout", "Refresh"}
+
+
+def get_table(name):
+    """
+    Return the table tag of a table, traveltime tables and the rollups of
+    Observations included.
+
+    Args:
+        name (str): The table or model name.
+
+    Returns:
+        str: The table tag.
+    """
+    return ROLLUP_TABLES.get(name) or name.removesuffix(
+        "_traveltime"
+    ).removesuffix("TravelTime")
+
+
+def get_read_tags(full_path, data):
+    """
+    Return the tags a GET response depends on.
+
+    Args:
+        full_path (str): The request path, including the query.
+        data (dict): The translation of the request.
+
+    Returns:
+        list: The sorted tags of the response.
+    """
+    queries = [data["main_query"]] + [
+        query for query, _ in data.get("count_queries") or []
+    ]
+    tables = {
+        get_table(table)
+        for query in queries
+        for table in TABLE_PATTERN.findall(query)
+    }
+    tags = {GLOBAL_TAG}
+
+    main_table = get_table(data["main_entity"])
+    if data.get("single_result"):
+        segments = SEGMENT_PATTERN.findall(full_path.split("?", 1)[0])
+        entities = [
+            (sta2rest.STA2REST.ENTITY_MAPPING[name], entity_id)
+            for name, entity_id in segments
+            if name in sta2rest.STA2REST.ENTITY_MAPPING
+        ]
+        # The id tag applies when the last entity of the path is the one
+        # returned, e.g. not for Datastreams(1)/Thing
+        table, entity_id = entities[-1] if entities else (None, None)
+        if table == main_table and entity_id:
+            tables.discard(main_table)
+            tags.update([f"{table}:{entity_id}", f"{table}:*"])
+
+    tags.update(tables)
+    return sorted(tags)
+
+
+def get_payload_tables(payload):
+    """
+    Return the tables of the entities created or changed by a deep insert.
+
+    A related entity given only by its @iot.id is linked, not changed.
+
+    Args:
+        payload: The decoded request payload.
+
+    Returns:
+        set: The tables.
+    """
+    tables = set()
+    if isinstance(payload, list):
+        for item in payload:
+            tables |= get_payload_tables(item)
+        return tables
+    if not isinstance(payload, dict):
+        return tables
+
+    for key, value in payload.items():
+        table = sta2rest.STA2REST.ENTITY_MAPPING.get(key)
+        if table is None:
+            continue
+        for item in value if isinstance(value, list) else [value]:
+            if isinstance(item, dict) and set(item) - {"@iot.id"}:
+                tables.add(table)
+                tables |= AFFECTED_TABLES.get(table, set())
+                tables |= get_payload_tables(item)
+    return tables
+
+
+def get_write_tags(path, body=b""):
+    """
+    Return the tags whose cached responses a successful write invalidates.
+
+    Args:
+        path (str): The request path.
+        body (bytes): The request body.
+
+    Returns:
+        list: The sorted tags.
+    """
+    segments = [
+        (name, entity_id)
+        for name, entity_id in SEGMENT_PATTERN.findall(path)
+        if name in sta2rest.STA2REST.ENTITY_MAPPING
+        or name in WRITE_ENTITIES
+        or name in AUTHORIZATION_ENTITIES
+        or name in SESSION_ENTITIES
+    ]
+    if not segments:
+        return [GLOBAL_TAG]
+
+    name, entity_id = segments[-1]
+    if name in SESSION_ENTITIES:
+        return []
+    if name in AUTHORIZATION_ENTITIES:
+        return [GLOBAL_TAG]
+
+    table = WRITE_ENTITIES.get(name) or sta2rest.STA2REST.ENTITY_MAPPING[name]
+    tags = {table}
+    if entity_id:
+        tags.add(f"{table}:{entity_id}")
+
+    tables = set(AFFECTED_TABLES.get(table, set()))
+    if VERSIONING:
+        tables.add("Commit")
+    if body and name not in UNSCANNED_ENTITIES:
+        try:
+            tables |= get_payload_tables(ujson.loads(body))
+        except ValueError:
+            pass
+    for changed_table in tables:
+        tags.update([changed_table, f"{changed_table}:*"])
+    return sorted(tags)
+
+
+async def invalidate(tags):
+    """
+    Increment the versions of the given tags.
+
+    Args:
+        tags (list): The tags to invalidate.
+    """
+    if not tags:
+        return
+    try:
+        async with redis_client() as client:
+            async with client.pipeline(transaction=False) as pipe:
+                for tag in tags:
+                    pipe.incr(VERSION_PREFIX + tag)
+                await pipe.execute()
+    except RedisError:
+        logger.exception("Could not invalidate the cached responses")
+
+
+async def wrapped_result_generator(first_item, result):
+    try:
+        yield first_item
+        async for item in result:
+            yield item
+    finally:
+        await result.aclose()
+
+
+class ResponseCache:
+    """
+    The cached response of a GET request.
+
+    Attributes:
+        enabled (bool): Whether the response can be cached.
+        key (str): The Redis key of the response.
+        tags (list): The tags the response depends on.
+        versions (list): The versions of the tags before the response is
+            read, or None if they are unknown.
+    """
+
+    def __init__(self, request, full_path, data, current_user):
+        self.request = request
+        # Without $as_of a versioned response reports the current time
+        self.enabled = bool(
+            RESPONSE_CACHE
+            and REDIS
+            and not (VERSIONING and data.get("as_of_value") is None)
+        )
+        self.versions = None
+        if not self.enabled:
+            return
+
+        # Row level security makes a response depend on the user
+        user = (
+            current_user.get("username")
+            if isinstance(current_user, dict)
+            else current_user
+        )
+        self.key = (
+            ENTRY_PREFIX
+            + hashlib.sha256(
+                f"{user or ''}\x00{full_path}".encode()
+            ).hexdigest()
+        )
+        self.tags = get_read_tags(full_path, data)
+
+    async def lookup(self):
+        """
+        Return the cached response, if it is still valid.
+
+        Returns:
+            Response: The cached response, or None on a miss.
+        """
+        if not self.enabled:
+            return None
+        try:
+            async with redis_client() as client:
+                async with client.pipeline(transaction=False) as pipe:
+                    pipe.get(self.key)
+                    pipe.mget([VERSION_PREFIX + tag for tag in self.tags])
+                    entry, versions = await pipe.execute()
+        except RedisError:
+            logger.exception("Could not read the cached response")
+            return None
+
+        self.versions = [
+            version.decode() if version is not None else None
+            for version in versions
+        ]
+        if entry is None:
+            return None
+        entry = ujson.loads(entry)
+        if entry["versions"] != self.versions:
+            return None
+        return self.build(entry["body"], entry["etag"], entry["media_type"])
+
+    async def response(self, first_item, result, media_type):
+        """
+        Return the response of a streamed result and cache it.
+
+        A result larger than RESPONSE_CACHE_MAX_SIZE is streamed as is.
+
+        Args:
+            first_item (str): The first chunk of the result.
+            result: The async generator of the remaining chunks.
+            media_type (str): The media type of the response.
+
+        Returns:
+            Response: The response.
+        """
+        if self.versions is None:
+            return StreamingResponse(
+                wrapped_result_generator(first_item, result),
+                media_type=media_type,
+                status_code=status.HTTP_200_OK,
+            )
+
+        chunks = [first_item]
+        size = len(first_item)
+        async for chunk in result:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size > RESPONSE_CACHE_MAX_SIZE:
+                return StreamingResponse(
+                    wrapped_result_generator("".join(chunks), result),
+                    media_type=media_type,
+                    status_code=status.HTTP_200_OK,
+                )
+
+        body = "".join(chunks)
+        etag = (
+            f'"{hashlib.blake2b(body.encode(), digest_size=16).hexdigest()}"'
+        )
+        try:
+            async with redis_client() as client:
+                await client.set(
+                    self.key,
+                    ujson.dumps(
+                        {
+                            "versions": self.versions,
+                            "etag": etag,
+                            "media_type": media_type,
+                            "body": body,
+                        }
+                    ),
+                    ex=RESPONSE_CACHE_TTL,
+                )
+        except RedisError:
+            logger.exception("Could not cache the response")
+        return self.build(body, etag, media_type)
+
+    def build(self, body, etag, media_type):
+        """
+        Build the response of a body, or 304 if the client has it.
+
+        Args:
+            body (str): The response body.
+            etag (str): The ETag of the body.
+            media_type (str): The media type of the response.
+
+        Returns:
+            Response: The response.
+        """
+        headers = {"ETag": etag, "Cache-Control": "no-cache"}
+        if_none_match = self.request.headers.get("if-none-match", "")
+        if if_none_match.strip() == "*" or etag in [
+            tag.strip().removeprefix("W/") for tag in if_none_match.split(",")
+        ]:
+            return Response(
+                status_code=status.HTTP_304_NOT_MODIFIED, headers=headers
+            )
+        return Response(
+            content=body,
+            media_type=media_type,
+            status_code=status.HTTP_200_OK,
+            headers=headers,
+        )
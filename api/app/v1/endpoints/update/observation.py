@@ -12,9 +12,15 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
-from app import AUTHORIZATION, POSTGRES_PORT_WRITE, VERSIONING
+from app import (
+    AUTHORIZATION,
+    DEFERRED_RANGES,
+    POSTGRES_PORT_WRITE,
+    VERSIONING,
+)
 from app.db.asyncpg_db import get_pool, get_pool_w
 from app.utils.utils import validate_payload_keys
+from app.v1.endpoints.create.functions import update_datastream_time_ranges
 from app.v1.endpoints.error_response import error_response
 from app.v1.endpoints.functions import set_role, update_datastream_observedArea
 from fastapi import APIRouter, Depends, Header, Request, status
@@ -115,88 +121,9 @@ async def update_observation(
                 connection, observation_id, payload
             )
 
-            if updated:
-                obs_phenomenon_start = updated["phenomenonTimeStart"]
-                obs_phenomenon_end = updated["phenomenonTimeEnd"]
-                obs_result_time = updated["resultTime"]
-                datastream_id = updated["datastream_id"]
-
-                datastream_query = """
-                    SELECT "phenomenonTime", "resultTime"
-                    FROM sensorthings."Datastream"
-                    WHERE id = $1;
-                """
-                datastream_times = await connection.fetchrow(
-                    datastream_query, datastream_id
-                )
-                datastream_phenomenon_time = datastream_times[
-                    "phenomenonTime"
-                ]
-                datastream_result_time = datastream_times["resultTime"]
-                if datastream_phenomenon_time and (
-                    obs_phenomenon_start is not None
-                    and obs_phenomenon_end is not None
-                ):
-                    obs_lower = obs_phenomenon_start
-                    obs_upper = obs_phenomenon_end
-                    datastream_lower = datastream_phenomenon_time.lower
-                    datastream_upper = datastream_phenomenon_time.upper
-                    if (
-                        obs_lower < datastream_lower
-                        or obs_upper > datastream_upper
-                    ):
-                        new_lower_bound = min(
-                            obs_lower,
-                            datastream_lower,
-                        )
-                        new_upper_bound = max(
-                            obs_upper,
-                            datastream_upper,
-                        )
-                        update_datastream_query = """
-                            UPDATE sensorthings."Datastream"
-                            SET "phenomenonTime" = tstzrange($1, $2, '[]')
-                            WHERE id = $3;
-                        """
-                        await connection.execute(
-                            update_datastream_query,
-                            new_lower_bound,
-                            new_upper_bound,
-                            datastream_id,
-                        )
-
-                if datastream_result_time and obs_result_time:
-                    obs_rt = obs_result_time
-                    datastream_rt_lower = datastream_result_time.lower
-                    datastream_rt_upper = datastream_result_time.upper
-                    if (
-                        obs_rt < datastream_rt_lower
-                        or obs_rt > datastream_rt_upper
-                    ):
-                        new_rt_lower_bound = min(
-                            obs_rt,
-                            datastream_rt_lower,
-                        )
-                        new_rt_upper_bound = max(
-                            obs_rt,
-                            datastream_rt_upper,
-                        )
-                        update_datastream_query = """
-                            UPDATE sensorthings."Datastream"
-                            SET "resultTime" = tstzrange($1, $2, '[]')
-                            WHERE id = $3;
-                        """
-                        await connection.execute(
-                            update_datastream_query,
-                            new_rt_lower_bound,
-                            new_rt_upper_bound,
-                            datastream_id,
-                        )
-
-            if payload.get("featuresofinterest_id"):
-                await update_datastream_observedArea(
-                    connection, datastream_id
-                )
+            await post_update_observation(
+                connection, observation_id, payload, updated
+            )
 
             if current_user is not None:
                 await connection.execute("RESET ROLE;")
@@ -219,8 +146,9 @@ async def post_update_observation(
 ):
     """Re-expand the parent Datastream's phenomenonTime/resultTime/observedArea.
 
-    Mirrors the PATCH handler so a PUT maintains the same derived Datastream
-    state (req/create-update-delete/update-entity-put).
+    Shared by PATCH and PUT so both maintain the same derived Datastream
+    state (req/create-update-delete/update-entity-put). With DEFERRED_RANGES
+    the bounds of the Observation are appended to the pending ranges.
     """
     datastream_id = None
     if updated:
@@ -229,6 +157,16 @@ async def post_update_observation(
         obs_result_time = updated["resultTime"]
         datastream_id = updated["datastream_id"]
 
+    if updated and DEFERRED_RANGES:
+        await update_datastream_time_ranges(
+            connection,
+            datastream_id,
+            obs_phenomenon_start,
+            obs_phenomenon_end,
+            obs_result_time,
+            obs_result_time,
+        )
+    elif updated:
         datastream_times = await connection.fetchrow(
             """
                 SELECT "phenomenonTime", "resultTime"
@@ -0,0 +1,212 @@
+# Copyright 2025 SUPSI
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+from app import AUTHORIZATION, POSTGRES_PORT_WRITE
+from app.db.asyncpg_db import get_pool, get_pool_w
+from app.utils.utils import validate_payload_keys
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.read.storage import (
+    HYPERTABLE,
+    check_administrator,
+    get_storage,
+)
+from asyncpg.exceptions import DataError, FeatureNotSupportedError
+from fastapi import APIRouter, Body, Depends, Header, status
+from fastapi.responses import JSONResponse
+
+v1 = APIRouter()
+user = Header(default=None, include_in_schema=False)
+
+if AUTHORIZATION:
+    from app.oauth import get_current_user
+
+    user = Depends(get_current_user)
+
+PAYLOAD_EXAMPLE = {"compressAfter": "P30D", "dropAfter": "P10Y"}
+
+ALLOWED_KEYS = ["compressAfter", "dropAfter"]
+
+# The compressed Observations are grouped by Datastream and ordered by time,
+# which is how the reads scan them. TimescaleDB requires the columns of the
+# unique constraints in the segmentby or orderby columns.
+COMPRESS_SEGMENTBY = "datastream_id"
+COMPRESS_ORDERBY = '"phenomenonTimeStart" DESC, "phenomenonTimeEnd" DESC, id'
+
+# Recomputes the Datastreams of the chunks dropped by the retention policy
+RECOMPUTE_JOB = "recompute_retained_datastreams"
+
+# The rollups, with the end offset and schedule of their refresh policy and
+# the shortest refresh window TimescaleDB accepts, three buckets
+ROLLUP_POLICIES = [
+    ('sensorthings."Observation_hourly"', "1 hour", "15 minutes", "3 hours"),
+    ('sensorthings."Observation_daily"', "1 day", "1 hour", "3 days"),
+]
+
+
+@v1.api_route(
+    "/Storage",
+    methods=["PATCH"],
+    tags=["Storage"],
+    summary="Update the Observation storage policies",
+    description=(
+        "Set the age after which the chunks of Observations are compressed "
+        "(compressAfter) or dropped (dropAfter), as ISO 8601 durations. A "
+        "null value removes the policy; chunks already compressed stay "
+        "compressed."
+    ),
+    status_code=status.HTTP_200_OK,
+)
+async def update_observation_storage(
+    payload: dict = Body(examples=[PAYLOAD_EXAMPLE]),
+    current_user=user,
+    pool=Depends(get_pool_w) if POSTGRES_PORT_WRITE else Depends(get_pool),
+):
+    check_administrator(current_user)
+    validate_payload_keys(payload, ALLOWED_KEYS)
+    for key, value in payload.items():
+        if value is not None and not isinstance(value, str):
+            raise BadRequest(f"{key} must be an ISO 8601 duration or null.")
+
+    # The policies are owned by the owner of the hypertable, so they are
+    # managed by the API user rather than the role of the request
+    async with pool.acquire() as connection:
+        try:
+            async with connection.transaction():
+                if "compressAfter" in payload:
+                    await set_compression_policy(
+                        connection, payload["compressAfter"]
+                    )
+                if "dropAfter" in payload:
+                    await set_retention_policy(
+                        connection, payload["dropAfter"]
+                    )
+        except DataError:
+            raise BadRequest(
+                "compressAfter and dropAfter must be ISO 8601 durations."
+            )
+        except FeatureNotSupportedError as e:
+            raise BadRequest(f"Cannot compress the Observations: {e}")
+
+        storage = await get_storage(connection)
+
+    return JSONResponse(status_code=status.HTTP_200_OK, content=storage)
+
+
+async def set_compression_policy(connection, compress_after):
+    """
+    Replace the compression policy of the Observations.
+
+    Compression is enabled the first time a policy is set.
+
+    Args:
+        connection: The database connection.
+        compress_after (str): The age of the chunks to compress, or None
+            to stop compressing new chunks.
+    """
+    await connection.execute(
+        f"SELECT remove_compression_policy('{HYPERTABLE}', if_exists => TRUE);"
+    )
+    if compress_after is None:
+        return
+
+    compression_enabled = await connection.fetchval("""
+            SELECT compression_enabled
+            FROM timescaledb_information.hypertables
+            WHERE hypertable_schema = 'sensorthings'
+            AND hypertable_name = 'Observation';
+        """)
+    if not compression_enabled:
+        await connection.execute(f"""
+                ALTER TABLE {HYPERTABLE} SET (
+                    timescaledb.compress,
+                    timescaledb.compress_segmentby = '{COMPRESS_SEGMENTBY}',
+                    timescaledb.compress_orderby = '{COMPRESS_ORDERBY}'
+                );
+            """)
+    await connection.execute(
+        f"""
+            SELECT add_compression_policy(
+                '{HYPERTABLE}', compress_after => $1::interval
+            );
+        """,
+        compress_after,
+    )
+
+
+async def set_retention_policy(connection, drop_after):
+    """
+    Replace the retention policy of the Observations.
+
+    The continuous aggregates keep the rollups of the dropped chunks: their
+    refresh policies stop at the retention window. A job scheduled with the
+    policy recomputes the phenomenonTime, resultTime and observedArea of the
+    Datastreams that lost Observations.
+
+    Args:
+        connection: The database connection.
+        drop_after (str): The age of the chunks to drop, or None to keep
+            them.
+    """
+    await connection.execute(f"""
+            SELECT remove_retention_policy('{HYPERTABLE}', if_exists => TRUE);
+            SELECT delete_job(job_id)
+            FROM timescaledb_information.jobs
+            WHERE proc_schema = 'sensorthings'
+            AND proc_name = '{RECOMPUTE_JOB}';
+        """)
+    if drop_after is not None:
+        await connection.execute(
+            f"""
+                SELECT add_retention_policy(
+                    '{HYPERTABLE}', drop_after => $1::interval
+                );
+            """,
+            drop_after,
+        )
+        await connection.execute(
+            f"SELECT add_job('sensorthings.{RECOMPUTE_JOB}', "
+            "INTERVAL '1 day');"
+        )
+    await set_rollup_refresh_window(connection, drop_after)
+
+
+async def set_rollup_refresh_window(connection, drop_after):
+    """
+    Replace the refresh policies of the rollups, so that they do not refresh
+    the buckets older than the retention window.
+
+    Args:
+        connection: The database connection.
+        drop_after (str): The age of the chunks to drop, or None to refresh
+            back to the first bucket.
+    """
+    for rollup, end_offset, schedule, shortest in ROLLUP_POLICIES:
+        await connection.execute(f"""
+                SELECT remove_continuous_aggregate_policy(
+                    '{rollup}', if_exists => TRUE
+                );
+            """)
+        await connection.execute(
+            f"""
+                SELECT add_continuous_aggregate_policy(
+                    '{rollup}',
+                    start_offset => CASE WHEN $1::interval IS NOT NULL THEN
+                        GREATEST($1::interval, INTERVAL '{shortest}')
+                    END,
+                    end_offset => INTERVAL '{end_offset}',
+                    schedule_interval => INTERVAL '{schedule}'
+                );
+            """,
+            drop_after,
+        )
@@ -0,0 +1,67 @@
+import os
+import sys
+from pathlib import Path
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+# Ensure api/ is on sys.path so "app" resolves to api/app.
+API_DIR = str(Path(__file__).resolve().parents[1])
+if API_DIR not in sys.path:
+    sys.path.insert(0, API_DIR)
+
+# Supply the minimum application configuration before importing app modules.
+os.environ.setdefault("DEBUG", "0")
+os.environ.setdefault("ISTSOS_ADMIN", "admin")
+os.environ.setdefault("ISTSOS_ADMIN_PASSWORD", "secret")
+os.environ.setdefault("POSTGRES_HOST", "localhost")
+os.environ.setdefault("POSTGRES_PORT", "5432")
+os.environ.setdefault("POSTGRES_DB", "istsos")
+os.environ.setdefault("POSTGRES_USER", "admin")
+
+
+@pytest.fixture
+def conn():
+    """
+    A fake asyncpg connection whose transactions do nothing.
+
+    Its queries are AsyncMocks that return no rows, so each test sets what
+    they return.
+    """
+    tx = MagicMock()
+    tx.__aenter__ = AsyncMock(return_value=None)
+    tx.__aexit__ = AsyncMock(return_value=None)
+
+    conn = MagicMock()
+    conn.transaction = MagicMock(return_value=tx)
+    conn.execute = AsyncMock()
+    conn.fetch = AsyncMock(return_value=[])
+    conn.fetchrow = AsyncMock(return_value=None)
+    conn.fetchval = AsyncMock(return_value=None)
+    conn.copy_records_to_table = AsyncMock()
+    return conn
+
+
+@pytest.fixture
+def cursor(conn):
+    """
+    The cursor opened by conn. Each test sets the partitions it fetches.
+    """
+    cursor = MagicMock()
+    cursor.fetch = AsyncMock(return_value=[])
+    conn.cursor = AsyncMock(return_value=cursor)
+    return cursor
+
+
+@pytest.fixture
+def pool(conn):
+    """
+    A fake asyncpg pool that hands out conn.
+    """
+    acq = MagicMock()
+    acq.__aenter__ = AsyncMock(return_value=conn)
+    acq.__aexit__ = AsyncMock(return_value=None)
+
+    pool = MagicMock()
+    pool.acquire = MagicMock(return_value=acq)
+    return pool
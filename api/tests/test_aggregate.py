@@ -0,0 +1,158 @@
+import pytest
+
+from app import COUNT_MODE, VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.sta2rest import visitors  # isort: skip
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.response_cache import get_read_tags
+
+BUCKET = (
+    "time_bucket(CAST('PT30M' AS INTERVAL), sensorthings.\"Observation\"."
+    '"phenomenonTimeStart")'
+)
+
+
+def convert(path: str) -> dict:
+    return STA2REST.translate_query(f"{VERSION}{path}")
+
+
+def test_aggregate_groups_by_datastream_and_time_bucket():
+    result = convert(
+        "/Observations?$aggregate=avg,min,max,count&$interval=PT30M"
+        "&$filter=phenomenonTime ge 2020-01-01T00:00:00Z"
+    )
+    sql = result["main_query"]
+
+    assert (
+        f'GROUP BY sensorthings."Observation".datastream_id, {BUCKET}' in sql
+    )
+    assert (
+        f'ORDER BY sensorthings."Observation".datastream_id ASC, {BUCKET} ASC'
+        in sql
+    )
+    for name in ("avg", "min", "max", "count"):
+        assert (
+            f'{name}(sensorthings."Observation"."resultNumber") AS {name}'
+            in sql
+        )
+    assert 'AS "Datastream@iot.id"' in sql
+    assert 'AS "phenomenonTime"' in sql
+    assert '"phenomenonTimeStart" >= $1' in sql
+    # Buckets are paged with $skip, as they have no seek key
+    assert result["keyset"] is False
+
+
+def test_aggregate_of_a_datastream_keeps_the_navigation_filter():
+    result = convert(
+        "/Datastreams(3)/Observations?$interval=PT15M&$aggregate=avg&$top=10"
+    )
+
+    assert "time_bucket(CAST('PT15M' AS INTERVAL)" in result["main_query"]
+    assert result["main_query_params"] == [3, 11, 0]
+
+
+@pytest.mark.parametrize(
+    "interval, query, table",
+    [
+        ("P1D", "", "Observation_daily"),
+        ("P1W", "", "Observation_daily"),
+        (
+            "P1M",
+            "&$filter=phenomenonTime ge 2020-01-01T00:00:00Z",
+            "Observation_daily",
+        ),
+        ("PT6H", "&$filter=Datastream/name eq 'a'", "Observation_hourly"),
+        ("PT90M", "", "Observation"),
+        ("P1D", "&$filter=result gt 3", "Observation"),
+        ("P1D", "&$filter=ceiling(result) eq 4", "Observation"),
+        ("P1D", "&$as_of=2020-01-01T00:00:00Z", "Observation_traveltime"),
+    ],
+)
+def test_aggregate_reads_the_coarsest_matching_rollup(interval, query, table):
+    path = f"/Observations?$aggregate=avg,count&$interval={interval}{query}"
+    result = convert(path)
+
+    assert f'FROM sensorthings."{table}"' in result["main_query"]
+    assert result["main_entity"] in ("Observation", "ObservationTravelTime")
+    # Writes to Observations invalidate the cached rollup reads
+    assert "Observation" in get_read_tags(f"{VERSION}{path}", result)
+
+
+def test_rollup_buckets_are_re_aggregated():
+    sql = convert(
+        "/Datastreams(3)/Observations?$aggregate=avg,min,max,sum,count"
+        "&$interval=P1D"
+    )["main_query"]
+
+    rollup = 'sensorthings."Observation_daily"'
+    assert f'sum({rollup}."resultSum") / ' in sql
+    assert f'min({rollup}."resultMin") AS min' in sql
+    assert f'max({rollup}."resultMax") AS max' in sql
+    assert f'CAST(sum({rollup}."resultCount") AS BIGINT) AS count' in sql
+    assert f'{rollup}.datastream_id = sensorthings."Datastream".id' in sql
+
+
+def test_rollups_can_be_disabled(monkeypatch):
+    monkeypatch.setattr(visitors, "AGGREGATE_ROLLUPS", 0)
+
+    sql = convert("/Observations?$aggregate=avg&$interval=P1D")["main_query"]
+
+    assert 'FROM sensorthings."Observation" ' in sql
+
+
+def test_rollups_are_not_read_with_authorization(monkeypatch):
+    # The rollups would bypass the row level security of the Observations
+    monkeypatch.setattr(visitors, "AUTHORIZATION", 1)
+
+    sql = convert("/Observations?$aggregate=avg&$interval=P1D")["main_query"]
+
+    assert 'FROM sensorthings."Observation" ' in sql
+
+
+def test_translation_errors_of_rollup_reads_are_not_hidden(monkeypatch):
+    visit_filter = visitors.NodeVisitor.visit_FilterNode
+
+    def fail_on_rollups(self, node, entity):
+        if entity == "ObservationDaily":
+            raise RuntimeError("translation bug")
+        return visit_filter(self, node, entity)
+
+    monkeypatch.setattr(
+        visitors.NodeVisitor, "visit_FilterNode", fail_on_rollups
+    )
+
+    with pytest.raises(RuntimeError):
+        convert(
+            "/Observations?$aggregate=avg&$interval=P1D"
+            "&$filter=Datastream/id eq 1"
+        )
+
+
+@pytest.mark.skipif(COUNT_MODE != "FULL", reason="exact count mode only")
+def test_aggregate_count_counts_the_buckets():
+    result = convert("/Observations?$aggregate=avg&$interval=P1M&$count=true")
+    ((count_query, _),) = result["count_queries"]
+
+    assert count_query.startswith("SELECT count(*)")
+    assert "GROUP BY" in count_query
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/Observations?$aggregate=avg",
+        "/Observations?$interval=P1D",
+        "/Observations?$aggregate=median&$interval=P1D",
+        "/Observations?$aggregate=avg&$interval=P1MT1H",
+        "/Observations?$aggregate=avg&$interval=PT0S",
+        "/Observations?$aggregate=avg&$interval=P1DT",
+        "/Observations?$aggregate=avg&$interval=P1D&$orderby=result",
+        "/Observations?$aggregate=avg&$interval=P1D&$resultFormat=csv",
+        "/Observations?$aggregate=avg&$interval=P1D&$expand=Datastream",
+        "/Observations(1)?$aggregate=avg&$interval=P1D",
+        "/Datastreams?$aggregate=avg&$interval=P1D",
+    ],
+)
+def test_invalid_aggregates_are_bad_requests(path):
+    with pytest.raises(BadRequest):
+        convert(path)
@@ -0,0 +1,83 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+from app.v1.endpoints.create.bulk_observation import (
+    insertBulkObservation,
+)
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+
+
+def test_bulk_rows_are_copied_past_the_parameter_limit(conn):
+    # 5000 rows of 11 columns would need 55000 query parameters
+    rows = [
+        [
+            i / 10,
+            (START + timedelta(minutes=i)).isoformat(),
+            (START + timedelta(minutes=i)).isoformat(),
+            "100",
+        ]
+        for i in range(5000)
+    ]
+
+    asyncio.run(
+        insertBulkObservation(
+            rows,
+            conn,
+            7,
+            datastream_id=3,
+            components=[
+                "result",
+                "phenomenonTime",
+                "resultTime",
+                "resultQuality",
+            ],
+        )
+    )
+
+    conn.copy_records_to_table.assert_awaited_once()
+    kwargs = conn.copy_records_to_table.await_args.kwargs
+    assert kwargs["columns"] == [
+        "resultBoolean",
+        "resultString",
+        "resultJSON",
+        "resultNumber",
+        "phenomenonTimeStart",
+        "phenomenonTimeEnd",
+        "resultTime",
+        "resultQuality",
+        "resultType",
+        "datastream_id",
+        "featuresofinterest_id",
+    ]
+    records = kwargs["records"]
+    assert len(records) == 5000
+    assert records[1] == [
+        None,
+        "0.1",
+        None,
+        0.1,
+        START + timedelta(minutes=1),
+        START + timedelta(minutes=1),
+        START + timedelta(minutes=1),
+        "100",
+        0,
+        3,
+        7,
+    ]
+
+    statements = [call.args[0] for call in conn.execute.await_args_list]
+    assert "CREATE TEMP TABLE observation_copy" in statements[0]
+    assert 'INSERT INTO sensorthings."Observation"' in statements[1]
+    assert (
+        "SELECT " in statements[1] and "FROM observation_copy" in statements[1]
+    )
+    # The Datastream ranges are widened once, to the bounds of the rows
+    range_update = conn.execute.await_args_list[2].args
+    assert range_update[1:] == (
+        START,
+        START + timedelta(minutes=4999),
+        START,
+        START + timedelta(minutes=4999),
+        3,
+    )
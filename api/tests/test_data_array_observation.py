@@ -0,0 +1,175 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncpg.exceptions import UniqueViolationError
+
+from app.utils.utils import build_self_link
+from app.v1.endpoints.create import data_array_observation
+from app.v1.endpoints.create import functions
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+COMPONENTS = ["result", "phenomenonTime", "resultTime", "resultQuality"]
+
+
+async def fetch(query, *args):
+    if "generate_series" in query:
+        return [{"id": 100 + i} for i in range(args[0])]
+    if '"Datastream"' in query:
+        return [{"id": i} for i in args[0] if i != 9]
+    return [{"id": i} for i in args[0] if i != 404]
+
+
+@pytest.fixture
+def conn(conn):
+    conn.fetch.side_effect = fetch
+    return conn
+
+
+def link(observation_id):
+    return build_self_link("Observation", observation_id)
+
+
+def row(i, result=None):
+    time = (START + timedelta(minutes=i)).isoformat()
+    return [i if result is None else result, time, time, "100"]
+
+
+def test_rows_are_copied_once_with_per_row_links(monkeypatch, conn):
+    generated = AsyncMock(
+        side_effect=lambda payload, *args, **kwargs: payload.update(
+            featuresofinterest_id=7
+        )
+    )
+    monkeypatch.setattr(functions, "generate_feature_of_interest", generated)
+    update_ranges = AsyncMock()
+    monkeypatch.setattr(
+        functions, "update_datastream_time_ranges", update_ranges
+    )
+    observation_sets = [
+        (3, COMPONENTS, [row(i) for i in range(1000)] + [row(5, [])]),
+        (9, COMPONENTS, [row(0)]),
+        (
+            4,
+            COMPONENTS + ["FeatureOfInterest/id"],
+            [row(0) + [5], row(1) + [404], row(2) + [6], row(3) + [5]],
+        ),
+    ]
+
+    response = asyncio.run(
+        data_array_observation.insert_data_array_observations(
+            conn, observation_sets
+        )
+    )
+
+    # Bad results, unknown Datastreams and FoIs fail only their own row
+    assert response[:2] == [link(100), link(101)]
+    assert response[1000:] == [
+        "error",
+        "error",
+        link(1100),
+        "error",
+        link(1101),
+        link(1102),
+    ]
+    # The generated FoI is resolved once for the whole Datastream
+    generated.assert_awaited_once()
+
+    conn.copy_records_to_table.assert_awaited_once()
+    kwargs = conn.copy_records_to_table.await_args.kwargs
+    columns = kwargs["columns"]
+    records = kwargs["records"]
+    assert len(records) == 1003
+    first = dict(zip(columns, records[0]))
+    assert first["id"] == 100
+    assert first["resultNumber"] == 0
+    assert first["phenomenonTimeStart"] == START
+    assert first["datastream_id"] == 3
+    assert first["featuresofinterest_id"] == 7
+    assert dict(zip(columns, records[-1]))["featuresofinterest_id"] == 5
+
+    # The ranges of each Datastream are widened once
+    assert [call.args[1:] for call in update_ranges.await_args_list] == [
+        (
+            3,
+            START,
+            START + timedelta(minutes=999),
+            START,
+            START + timedelta(minutes=999),
+        ),
+        (
+            4,
+            START,
+            START + timedelta(minutes=3),
+            START,
+            START + timedelta(minutes=3),
+        ),
+    ]
+
+    # The last FoI is the one of the last row
+    last_foi = [
+        call.args[1:]
+        for call in conn.execute.await_args_list
+        if "SET last_foi_id" in call.args[0]
+    ]
+    assert last_foi == [(6, 4), (5, 4)]
+
+
+def test_payload_without_valid_rows_inserts_nothing(conn):
+
+    response = asyncio.run(
+        data_array_observation.insert_data_array_observations(
+            conn, [(3, COMPONENTS, [row(0, []), ["1"]])]
+        )
+    )
+
+    assert response == ["error", "error"]
+    conn.copy_records_to_table.assert_not_awaited()
+
+
+def test_rows_rejected_by_the_database_fail_alone(monkeypatch, conn):
+    monkeypatch.setattr(functions, "generate_feature_of_interest", AsyncMock())
+    update_ranges = AsyncMock()
+    monkeypatch.setattr(
+        functions, "update_datastream_time_ranges", update_ranges
+    )
+
+    async def execute(query, *args):
+        # The row at minute 2 duplicates an existing Observation
+        if "FROM observation_copy" in query:
+            raise UniqueViolationError()
+
+    async def fetchrow(query, *args):
+        if START + timedelta(minutes=2) in args:
+            raise UniqueViolationError()
+        return {"id": args[0], "inserted": True}
+
+    conn.execute.side_effect = execute
+    conn.fetchrow.side_effect = fetchrow
+
+    response = asyncio.run(
+        data_array_observation.insert_data_array_observations(
+            conn,
+            [
+                (
+                    3,
+                    COMPONENTS + ["FeatureOfInterest/id"],
+                    [row(i) + [5] for i in range(3)],
+                )
+            ],
+        )
+    )
+
+    assert response == [link(100), link(101), "error"]
+    # The rows are retried one at a time
+    assert conn.fetchrow.await_count == 3
+    assert "ON CONFLICT" not in conn.fetchrow.await_args.args[0]
+    # Only the stored rows widen the ranges
+    assert update_ranges.await_args.args[1:] == (
+        3,
+        START,
+        START + timedelta(minutes=1),
+        START,
+        START + timedelta(minutes=1),
+    )
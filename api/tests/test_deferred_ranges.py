@@ -0,0 +1,84 @@
+import asyncio
+from datetime import datetime, timezone
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.sta2rest import visitors  # isort: skip
+from app.v1.endpoints.create import functions as create
+from app.v1.endpoints.delete import functions as delete
+from app.v1.endpoints.update import observation as update
+
+START = datetime(2024, 1, 1, tzinfo=timezone.utc)
+END = datetime(2024, 1, 2, tzinfo=timezone.utc)
+
+
+def test_writes_append_the_bounds_to_the_pending_ranges(monkeypatch, conn):
+    monkeypatch.setattr(create, "DEFERRED_RANGES", 1)
+
+    asyncio.run(
+        create.update_datastream_time_ranges(conn, 3, START, END, START, END)
+    )
+
+    query, *params = conn.execute.await_args.args
+    assert 'INSERT INTO sensorthings."Datastream_pending_range"' in query
+    assert params == [START, END, START, END, 3]
+
+
+def test_writes_update_the_datastream_without_deferred_ranges(
+    monkeypatch, conn
+):
+    monkeypatch.setattr(create, "DEFERRED_RANGES", 0)
+
+    asyncio.run(create.update_datastream_time_ranges(conn, 3, START, END))
+
+    query, *params = conn.execute.await_args.args
+    assert 'UPDATE sensorthings."Datastream"' in query
+    assert params == [START, END, None, None, 3]
+
+
+def test_deletes_ask_to_recompute_the_ranges(monkeypatch, conn):
+    monkeypatch.setattr(delete, "DEFERRED_RANGES", 1)
+
+    asyncio.run(delete.update_datastream_phenomenon_time(conn, START, END, 3))
+    asyncio.run(delete.update_datastream_phenomenon_time_from_foi(conn, 4))
+
+    calls = conn.execute.await_args_list
+    assert [call.args[1:] for call in calls] == [(3,), (4,)]
+    for call in calls:
+        assert '"recompute"' in call.args[0]
+
+
+def test_updates_append_the_bounds_to_the_pending_ranges(monkeypatch, conn):
+    monkeypatch.setattr(update, "DEFERRED_RANGES", 1)
+    monkeypatch.setattr(create, "DEFERRED_RANGES", 1)
+    updated = {
+        "phenomenonTimeStart": START,
+        "phenomenonTimeEnd": END,
+        "resultTime": END,
+        "datastream_id": 3,
+    }
+
+    asyncio.run(update.post_update_observation(conn, 1, {}, updated))
+
+    conn.fetchrow.assert_not_awaited()
+    query, *params = conn.execute.await_args.args
+    assert 'INSERT INTO sensorthings."Datastream_pending_range"' in query
+    assert params == [START, END, END, END, 3]
+
+
+def test_datastream_ranges_include_the_pending_bounds(monkeypatch):
+    monkeypatch.setattr(visitors, "DEFERRED_RANGES", 1)
+    sql = STA2REST.translate_query(f"{VERSION}/Datastreams(1)")["main_query"]
+
+    for name in ("phenomenon_time", "result_time"):
+        assert (
+            f'sensorthings.pending_{name}(sensorthings."Datastream".id' in sql
+        )
+
+
+def test_datastream_ranges_are_read_from_the_row(monkeypatch):
+    monkeypatch.setattr(visitors, "DEFERRED_RANGES", 0)
+    sql = STA2REST.translate_query(f"{VERSION}/Datastreams(1)")["main_query"]
+
+    assert "pending_" not in sql
+    assert 'lower(sensorthings."Datastream"."phenomenonTime")' in sql
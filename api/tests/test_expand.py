@@ -0,0 +1,92 @@
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.sta2rest import visitors  # isort: skip
+
+
+def convert(path: str) -> dict:
+    return STA2REST.translate_query(f"{VERSION}{path}")
+
+
+def test_expand_is_a_correlated_subquery_of_the_page():
+    result = convert(
+        "/Things?$top=10&$expand=Datastreams($top=2;$expand=ObservedProperty)"
+    )
+    sql = result["main_query"]
+
+    assert "sensorthings.expand" not in sql
+    assert (
+        'WHERE sensorthings."Datastream".thing_id = sensorthings."Thing".id '
+        'ORDER BY sensorthings."Datastream".id ASC'
+    ) in sql
+    assert (
+        'WHERE sensorthings."ObservedProperty".id = '
+        'sensorthings."Datastream".observedproperty_id'
+    ) in sql
+    assert "'{}'::json) AS \"ObservedProperty\"" in sql
+    # The Datastreams page is sliced to $top, and one more row tells
+    # whether there is a next link
+    assert (
+        'array_agg(row_to_json("Datastreams")))[$1::INTEGER:$2::INTEGER]'
+    ) in sql
+    assert result["main_query_params"][:3] == [1, 2, 2]
+    assert "/Datastreams?$top=2' || '&$skip=2' || " in sql
+    assert "'&$expand=ObservedProperty'" in sql
+
+
+def test_expand_many_to_many_joins_the_link_table():
+    sql = convert("/Things(1)?$expand=Locations")["main_query"]
+
+    assert (
+        'JOIN sensorthings."Thing_Location" ON '
+        'sensorthings."Thing_Location".location_id = '
+        'sensorthings."Location".id \n'
+        'WHERE sensorthings."Thing_Location".thing_id = '
+        'sensorthings."Thing".id'
+    ) in sql
+
+
+def test_expand_count_and_filter_are_applied_per_parent():
+    result = convert(
+        "/Datastreams?$expand=Observations($filter=result gt 3;$count=true)"
+    )
+    sql = result["main_query"]
+
+    assert (
+        'SELECT sensorthings."Observation".datastream_id AS fk \n'
+        'FROM sensorthings."Observation" \n'
+        'WHERE sensorthings."Observation"."resultNumber" > $4::INTEGER) AS d '
+        '\nWHERE d.fk = sensorthings."Datastream".id'
+    ) in sql
+    assert "-> 'Observations@iot.count' AS \"Observations@iot.count\"" in sql
+    assert "'&$filter=result gt 3&$count=true'" in sql
+
+
+def test_expand_estimated_count_writes_the_parent_key(monkeypatch):
+    monkeypatch.setattr(visitors, "COUNT_MODE", "LIMIT_ESTIMATE")
+    monkeypatch.setattr(visitors, "COUNT_ESTIMATE_THRESHOLD", 500)
+
+    result = convert("/Things?$expand=Datastreams($count=true)")
+    sql = result["main_query"]
+
+    assert "sensorthings.count_estimate(concat('SELECT 1 " in sql
+    assert ') AS d WHERE d.fk = \', sensorthings."Thing".id)' in sql
+    assert 500 in result["main_query_params"]
+
+
+def test_expand_options_of_each_identifier_build_its_own_next_link():
+    sql = convert(
+        "/Things?$expand=Datastreams($orderby=name desc),Locations"
+        "($select=name)"
+    )["main_query"]
+
+    assert (
+        "/Datastreams?$top=100' || '&$skip=100' || '&$orderby=name desc'"
+    ) in sql
+    assert "/Locations?$top=100' || '&$skip=100' || '&$select=name'" in sql
+
+
+def test_expand_always_returns_the_id():
+    sql = convert("/Things?$expand=Datastreams($select=id,name)")["main_query"]
+
+    assert 'sensorthings."Datastream".id AS "@iot.id", ' in sql
+    assert 'sensorthings."Datastream".name AS name \n' in sql
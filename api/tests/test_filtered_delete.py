@@ -0,0 +1,190 @@
+import asyncio
+import json
+from datetime import datetime, timezone
+from unittest.mock import AsyncMock, MagicMock
+
+import pytest
+
+from app import VERSION
+from app.v1.endpoints.delete import filtered_delete_observation
+
+JAN = datetime(2020, 1, 1, tzinfo=timezone.utc)
+FEB = datetime(2020, 1, 31, tzinfo=timezone.utc)
+MAR = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+TIME_FILTER = (
+    "phenomenonTime ge 2020-01-01T00:00:00Z "
+    "and phenomenonTime lt 2020-03-01T00:00:00Z"
+)
+
+
+@pytest.mark.parametrize(
+    "expression, expected",
+    [
+        (
+            TIME_FILTER,
+            {
+                "lower": JAN,
+                "lower_inc": True,
+                "upper": MAR,
+                "upper_inc": False,
+                "datastreams": None,
+            },
+        ),
+        (
+            "Datastream/id in (3, 4) and phenomenonTime gt 2020-01-01T00:00:00Z",
+            {
+                "lower": JAN,
+                "lower_inc": False,
+                "upper": None,
+                "datastreams": [3, 4],
+            },
+        ),
+        ("Datastream/id eq 3", None),
+        ("result gt 3 and " + TIME_FILTER, None),
+        ("phenomenonTime ge 2020-01-01T00:00:00Z or Datastream/id eq 3", None),
+        (TIME_FILTER + " and phenomenonTime gt 2020-02-01T00:00:00Z", None),
+    ],
+)
+def test_chunk_filters_are_pure_time_and_datastream_filters(
+    expression, expected
+):
+    assert filtered_delete_observation.get_chunk_filter(expression) == (
+        expected
+    )
+
+
+def set_rows(conn, batches, chunks=(), chunk_rows=()):
+    batches = list(batches)
+    chunk_rows = list(chunk_rows)
+
+    async def fetch(query, *args):
+        if "DELETE FROM" in query:
+            return batches.pop(0)
+        if "timescaledb_information.chunks" in query:
+            return list(chunks)
+        return chunk_rows.pop(0)
+
+    conn.fetch.side_effect = fetch
+
+
+def make_request(expression):
+    request = MagicMock()
+    request.query_params = {"$filter": expression}
+    request.url.path = f"{VERSION}/Observations"
+    request.url.query = f"$filter={expression}"
+    return request
+
+
+def delete(pool, expression):
+    response = asyncio.run(
+        filtered_delete_observation.delete_observations_filtered(
+            make_request(expression), None, None, pool
+        )
+    )
+    return json.loads(response.body)
+
+
+@pytest.fixture
+def maintenance(monkeypatch):
+    monkeypatch.setattr(filtered_delete_observation, "DELETE_BATCH_SIZE", 2)
+    monkeypatch.setattr(filtered_delete_observation, "VERSIONING", 0)
+    phenomenon_time = AsyncMock()
+    monkeypatch.setattr(
+        filtered_delete_observation,
+        "update_datastream_phenomenon_time_from_foi",
+        phenomenon_time,
+    )
+    monkeypatch.setattr(
+        filtered_delete_observation,
+        "update_datastream_observedArea",
+        AsyncMock(),
+    )
+    return phenomenon_time
+
+
+def test_matches_are_deleted_in_sql_batches(maintenance, pool, conn):
+    set_rows(
+        conn,
+        [
+            [
+                {"datastream_id": 1, "deleted": 1},
+                {"datastream_id": 2, "deleted": 1},
+            ],
+            [{"datastream_id": 1, "deleted": 2}],
+            [{"datastream_id": 2, "deleted": 1}],
+        ],
+    )
+
+    assert delete(pool, "result gt 3") == {"deleted": 5}
+
+    assert conn.fetch.await_count == 3
+    query, batch_size = conn.fetch.await_args_list[0].args
+    assert 'SELECT id FROM (SELECT sensorthings."Observation".id' in query
+    assert "LIMIT $1::bigint" in query
+    assert "DISTINCT" not in query
+    assert batch_size == 2
+    # The ranges are recomputed once per Datastream, after every batch
+    assert [call.args[1] for call in maintenance.await_args_list] == [1, 2]
+
+
+def test_empty_match_deletes_nothing(maintenance, pool, conn):
+    set_rows(conn, [[]])
+
+    assert delete(pool, "result gt 3") == {"deleted": 0}
+    maintenance.assert_not_awaited()
+
+
+def test_whole_chunks_are_dropped(maintenance, monkeypatch, pool, conn):
+    monkeypatch.setattr(filtered_delete_observation, "AGGREGATE_ROLLUPS", 1)
+    chunks = [
+        {
+            "chunk_schema": "_timescaledb_internal",
+            "chunk_name": f"_hyper_1_{n}_chunk",
+            "range_start": start,
+            "range_end": end,
+        }
+        for n, (start, end) in enumerate([(JAN, FEB), (FEB, MAR)])
+    ]
+    set_rows(
+        conn,
+        [[{"datastream_id": 2, "deleted": 1}]],
+        chunks,
+        [
+            [{"datastream_id": 1, "deleted": 500, "matched": True}],
+            [
+                {"datastream_id": 1, "deleted": 5, "matched": True},
+                {"datastream_id": 2, "deleted": 1, "matched": False},
+            ],
+        ],
+    )
+
+    assert delete(pool, TIME_FILTER) == {"deleted": 501}
+
+    statements = [call.args[0] for call in conn.execute.await_args_list]
+    drops = [
+        call
+        for call in conn.execute.await_args_list
+        if "drop_chunks" in call.args[0]
+    ]
+    # Only the chunk holding nothing but matches is dropped
+    assert [call.args[1:] for call in drops] == [(JAN, FEB)]
+    assert any(
+        'LOCK TABLE "_timescaledb_internal"."_hyper_1_0_chunk"' in statement
+        for statement in statements
+    )
+    refreshes = [s for s in statements if "refresh_continuous_aggregate" in s]
+    assert len(refreshes) == 2
+    assert JAN.isoformat() in refreshes[0]
+    assert FEB.isoformat() in refreshes[0]
+
+
+def test_versioned_deletes_never_drop_chunks(
+    maintenance, monkeypatch, pool, conn
+):
+    monkeypatch.setattr(filtered_delete_observation, "VERSIONING", 1)
+    set_rows(conn, [[]])
+
+    delete(pool, TIME_FILTER)
+
+    assert conn.fetch.await_count == 1
@@ -0,0 +1,203 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncpg.exceptions import UniqueViolationError
+
+from app.v1.endpoints.create import ingest_queue
+from app.v1.endpoints.exceptions import (
+    BadRequest,
+    ServiceUnavailable,
+)
+
+PAYLOAD = {
+    "phenomenonTime": "2015-03-03T00:00:00Z",
+    "result": 3,
+    "Datastream": {"@iot.id": 1},
+}
+
+
+@pytest.fixture
+def enabled(monkeypatch):
+    monkeypatch.setattr(ingest_queue, "INGEST_QUEUE", 1)
+    monkeypatch.setattr(ingest_queue, "VERSIONING", 0)
+    monkeypatch.setattr(ingest_queue, "AUTHORIZATION", 0)
+
+
+def test_linked_observations_are_prepared_for_the_queue(enabled):
+    observation = ingest_queue.get_queued_observation(
+        {**PAYLOAD, "FeatureOfInterest": {"@iot.id": 4}}, None, None
+    )
+
+    assert observation["datastream_id"] == 1
+    assert observation["featuresofinterest_id"] == 4
+    assert observation["resultNumber"] == 3
+    assert "Datastream" not in observation
+    # The payload itself is left to the synchronous path
+    assert "Datastream" in PAYLOAD
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        {**PAYLOAD, "Datastream": {"name": "new", "@iot.id": 1}},
+        {**PAYLOAD, "FeatureOfInterest": {"name": "new"}},
+        {**PAYLOAD, "@iot.id": 5},
+        {**PAYLOAD, "Datastream": {"@iot.id": "1"}},
+    ],
+)
+def test_observations_creating_entities_are_not_queued(enabled, payload):
+    assert ingest_queue.get_queued_observation(payload, None, None) is None
+
+
+def test_queue_is_disabled_by_default():
+    assert ingest_queue.get_queued_observation(PAYLOAD, None, None) is None
+
+
+def test_requests_without_a_valid_commit_are_not_queued(enabled, monkeypatch):
+    monkeypatch.setattr(ingest_queue, "VERSIONING", 1)
+    sensor = {"id": 2, "role": "sensor"}
+    editor = {"id": 3, "role": "editor"}
+
+    assert ingest_queue.get_queued_observation(PAYLOAD, None, sensor)
+    assert ingest_queue.get_queued_observation(PAYLOAD, "m", editor)
+    assert ingest_queue.get_queued_observation(PAYLOAD, "m", sensor) is None
+    assert ingest_queue.get_queued_observation(PAYLOAD, None, editor) is None
+
+
+def test_batches_are_written_per_user_and_resolved_after_commit(
+    monkeypatch, pool
+):
+    monkeypatch.setattr(ingest_queue, "get_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(ingest_queue, "set_role", AsyncMock())
+    monkeypatch.setattr(
+        ingest_queue, "set_commit", AsyncMock(return_value=None)
+    )
+    written = []
+
+    async def insert_observation_batch(connection, observations, commit_id):
+        written.append([obs["n"] for obs in observations])
+        return [None if obs["n"] == 2 else obs["n"] for obs in observations]
+
+    monkeypatch.setattr(
+        ingest_queue, "insert_observation_batch", insert_observation_batch
+    )
+    user = {"id": 7, "role": "sensor"}
+
+    async def ingest():
+        queue = ingest_queue.IngestQueue(10, 3, 0.01)
+        futures = [
+            queue.submit({"n": n}, user if n == 1 else None, None, wait=True)
+            for n in range(4)
+        ]
+        queue.start()
+        await queue.stop()
+        return futures
+
+    futures = asyncio.run(ingest())
+
+    # One batch of three, split by user, then the last Observation
+    assert written == [[0, 2], [1], [3]]
+    assert [f.result() for f in futures if f.exception() is None] == [0, 1, 3]
+    assert isinstance(futures[2].exception(), BadRequest)
+    assert ingest_queue.set_role.await_count == 1
+
+
+def test_failed_groups_are_retried_one_observation_at_a_time(
+    monkeypatch, pool
+):
+    monkeypatch.setattr(ingest_queue, "get_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(
+        ingest_queue, "set_commit", AsyncMock(return_value=None)
+    )
+    written = []
+
+    async def insert_observation_batch(connection, observations, commit_id):
+        # The second Observation repeats the key of an existing one
+        if any(obs["n"] == 1 for obs in observations):
+            raise UniqueViolationError("duplicate key value")
+        written.extend(obs["n"] for obs in observations)
+        return [obs["n"] for obs in observations]
+
+    monkeypatch.setattr(
+        ingest_queue, "insert_observation_batch", insert_observation_batch
+    )
+
+    async def ingest():
+        queue = ingest_queue.IngestQueue(10, 4, 0.01)
+        futures = [
+            queue.submit({"n": n}, None, None, wait=True) for n in range(4)
+        ]
+        queue.start()
+        await queue.stop()
+        return futures
+
+    futures = asyncio.run(ingest())
+
+    assert written == [0, 2, 3]
+    assert [f.result() for f in futures if f.exception() is None] == [0, 2, 3]
+    assert isinstance(futures[1].exception(), UniqueViolationError)
+
+
+def test_header_users_are_written_without_a_role(monkeypatch, pool):
+    monkeypatch.setattr(ingest_queue, "get_pool", AsyncMock(return_value=pool))
+    monkeypatch.setattr(ingest_queue, "set_role", AsyncMock())
+    monkeypatch.setattr(
+        ingest_queue, "set_commit", AsyncMock(return_value=None)
+    )
+    written = []
+
+    async def insert_observation_batch(connection, observations, commit_id):
+        written.append([obs["n"] for obs in observations])
+        return [obs["n"] for obs in observations]
+
+    monkeypatch.setattr(
+        ingest_queue, "insert_observation_batch", insert_observation_batch
+    )
+
+    async def ingest():
+        queue = ingest_queue.IngestQueue(10, 2, 0.01)
+        # Without AUTHORIZATION the user is the raw header value
+        futures = [
+            queue.submit({"n": 0}, None, None, wait=True),
+            queue.submit({"n": 1}, "alice", None, wait=True),
+        ]
+        queue.start()
+        await queue.stop()
+        return futures
+
+    futures = asyncio.run(ingest())
+
+    assert written == [[0, 1]]
+    assert [f.result() for f in futures] == [0, 1]
+    ingest_queue.set_role.assert_not_awaited()
+
+
+def test_failed_batches_resolve_every_future(monkeypatch):
+    monkeypatch.setattr(
+        ingest_queue,
+        "get_pool",
+        AsyncMock(side_effect=ConnectionError("database is down")),
+    )
+
+    async def ingest():
+        queue = ingest_queue.IngestQueue(10, 2, 0.01)
+        futures = [
+            queue.submit({"n": n}, None, None, wait=True) for n in range(2)
+        ]
+        queue.start()
+        await queue.stop()
+        return futures
+
+    for future in asyncio.run(ingest()):
+        assert isinstance(future.exception(), ConnectionError)
+
+
+def test_full_queue_is_unavailable():
+    async def submit():
+        queue = ingest_queue.IngestQueue(1, 10, 0.01)
+        queue.submit({}, None, None)
+        queue.submit({}, None, None)
+
+    with pytest.raises(ServiceUnavailable):
+        asyncio.run(submit())
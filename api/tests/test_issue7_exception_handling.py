@@ -25,6 +25,7 @@ os.environ.setdefault("ACCESS_TOKEN_EXPIRE_MINUTES", "30")
 
 from app import main as app_main
 from app.v1.endpoints.create import user as user_ep
+from app.v1.endpoints import response_cache
 from app.v1.endpoints.read import read as read_ep
 
 
@@ -171,7 +172,7 @@ class TestIssue7ExceptionHandling:
                 closed = True
 
         inner = inner_generator()
-        wrapped = read_ep.wrapped_result_generator("first", inner)
+        wrapped = response_cache.wrapped_result_generator("first", inner)
 
         assert await anext(wrapped) == "first"
         assert await anext(wrapped) == "second"
@@ -0,0 +1,172 @@
+import json
+from datetime import datetime, timezone
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.utils.utils import (
+    build_nextLink,
+    decode_skiptoken,
+    encode_skiptoken,
+)
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.read import read as read_ep
+
+
+def convert(path: str) -> dict:
+    return STA2REST.translate_query(f"{VERSION}{path}")
+
+
+def token(*values) -> str:
+    return encode_skiptoken(json.dumps(list(values)))
+
+
+def test_collection_selects_the_seek_key_outside_the_row_json():
+    result = convert("/Observations?$orderby=phenomenonTime desc")
+    sql = result["main_query"]
+
+    assert result["keyset"] is True
+    assert sql.startswith(
+        "SELECT row_to_json(main_query) AS json, keyset_query.seek"
+    )
+    assert "JOIN LATERAL" in sql
+    assert (
+        'json_build_array(sensorthings."Observation"."phenomenonTimeStart", '
+        'sensorthings."Observation".id) AS seek'
+    ) in sql
+    # The id breaks ties in the same direction as the last order
+    assert 'sensorthings."Observation".id DESC' in sql
+
+
+def test_skiptoken_becomes_a_row_comparison_seek_predicate():
+    result = convert(
+        "/Datastreams(7)/Observations?$orderby=phenomenonTime desc&$top=2"
+        f"&$skiptoken={token('2020-01-01T00:00:00+00:00', 2000000)}"
+    )
+
+    assert (
+        '(sensorthings."Observation"."phenomenonTimeStart", '
+        'sensorthings."Observation".id) < ($2::TIMESTAMP WITH TIME ZONE, '
+        "$3::BIGINT)"
+    ) in result["main_query"]
+    assert result["main_query_params"] == [
+        7,
+        datetime(2020, 1, 1, tzinfo=timezone.utc),
+        2000000,
+        3,
+        0,
+    ]
+
+
+def test_nullable_ascending_key_keeps_null_rows_after_the_seek():
+    result = convert(
+        "/Observations?$orderby=resultTime"
+        f"&$skiptoken={token('2020-01-01T00:00:00+00:00', 5)}"
+    )
+
+    assert '"resultTime" IS NULL' in result["main_query"]
+
+
+def test_non_scalar_orderby_and_data_array_page_with_skip():
+    assert convert("/Observations?$orderby=result")["keyset"] is False
+    assert convert("/Observations?$resultFormat=dataArray")["keyset"] is False
+    assert convert("/Things(1)")["keyset"] is False
+
+    with pytest.raises(BadRequest):
+        convert(f"/Observations?$orderby=result&$skiptoken={token(1, 2)}")
+
+
+@pytest.mark.parametrize(
+    "skiptoken",
+    ["abc", encode_skiptoken("{}"), token(1), token("x", 1), token(True)],
+)
+def test_invalid_skiptoken_is_a_bad_request(skiptoken):
+    with pytest.raises(BadRequest):
+        convert(
+            f"/Observations?$orderby=phenomenonTime&$skiptoken={skiptoken}"
+        )
+
+
+def test_next_link_carries_the_seek_key_instead_of_skip():
+    seek = '["2020-01-01T00:00:00+00:00", 42]'
+
+    link = build_nextLink(
+        "/istsos4/v1.1/Observations?$top=2&$skip=4&$count=true", 3, seek
+    )
+    params = parse_qs(urlparse(link).query)
+
+    assert "$skip" not in params
+    assert params["$top"] == ["2"]
+    assert params["$count"] == ["true"]
+    assert decode_skiptoken(params["$skiptoken"][0]) == json.loads(seek)
+    assert build_nextLink("/istsos4/v1.1/Observations?$top=2", 2, seek) is None
+
+
+def partition(rows, chunk):
+    return [rows[i : i + chunk] for i in range(0, len(rows), chunk)] + [[]]
+
+
+async def collect(pool, top, full_path):
+    chunks = []
+    async for chunk in read_ep.asyncpg_stream_results(
+        "Observation",
+        "SELECT 1",
+        pool,
+        top,
+        False,
+        [],
+        None,
+        None,
+        False,
+        full_path,
+        None,
+        keyset=True,
+    ):
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+def rows(count):
+    return [
+        {"json": f'{{"@iot.id" : {i}}}', "seek": f'["k{i}", {i}]'}
+        for i in range(count)
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="function")
+@pytest.mark.parametrize("chunk", [10, 2, 3])
+async def test_stream_links_the_seek_key_of_the_last_row_of_the_page(
+    monkeypatch, pool, cursor, chunk
+):
+    monkeypatch.setattr(read_ep, "PARTITION_CHUNK", chunk)
+    monkeypatch.setattr(read_ep, "ANONYMOUS_VIEWER", 0)
+    cursor.fetch.side_effect = partition(rows(4), chunk)
+
+    body = json.loads(
+        await collect(
+            pool, 4, "/istsos4/v1.1/Observations?$top=3&$orderby=name"
+        )
+    )
+    link = urlparse(body["@iot.nextLink"])
+
+    assert [o["@iot.id"] for o in body["value"]] == [0, 1, 2]
+    assert decode_skiptoken(parse_qs(link.query)["$skiptoken"][0]) == [
+        "k2",
+        2,
+    ]
+
+
+@pytest.mark.asyncio(loop_scope="function")
+async def test_last_page_has_no_next_link(monkeypatch, pool, cursor):
+    monkeypatch.setattr(read_ep, "PARTITION_CHUNK", 2)
+    monkeypatch.setattr(read_ep, "ANONYMOUS_VIEWER", 0)
+    cursor.fetch.side_effect = partition(rows(3), 2)
+
+    body = json.loads(
+        await collect(pool, 4, "/istsos4/v1.1/Observations?$top=3")
+    )
+
+    assert [o["@iot.id"] for o in body["value"]] == [0, 1, 2]
+    assert "@iot.nextLink" not in body
@@ -0,0 +1,54 @@
+import pytest
+
+from app.sta2rest.sta_parser.lexer import Lexer
+
+
+def tokens(text):
+    return [(token.type, token.value) for token in Lexer(text).tokens]
+
+
+def test_token_types_are_tried_in_order():
+    assert tokens("$orderby=ascending asc,descTime desc") == [
+        ("ORDERBY", "$orderby="),
+        ("EXPAND_IDENTIFIER", "ascending"),
+        ("WHITESPACE", " "),
+        ("ORDER", "asc"),
+        ("VALUE_SEPARATOR", ","),
+        ("EXPAND_IDENTIFIER", "descTime"),
+        ("WHITESPACE", " "),
+        ("ORDER", "desc"),
+    ]
+
+
+def test_literals_and_separators():
+    assert tokens(
+        "$filter=result gt -1.5 and phenomenonTime lt "
+        "2020-01-01T00:00:00.000%2B01:00;$top=10&$resultFormat=dataArray"
+    ) == [
+        ("FILTER", "$filter="),
+        ("EXPAND_IDENTIFIER", "result"),
+        ("WHITESPACE", " "),
+        ("EXPAND_IDENTIFIER", "gt"),
+        ("WHITESPACE", " "),
+        ("MINUS", "-"),
+        ("DECIMAL", "1.5"),
+        ("WHITESPACE", " "),
+        ("EXPAND_IDENTIFIER", "and"),
+        ("WHITESPACE", " "),
+        ("EXPAND_IDENTIFIER", "phenomenonTime"),
+        ("WHITESPACE", " "),
+        ("EXPAND_IDENTIFIER", "lt"),
+        ("WHITESPACE", " "),
+        ("DATETIME", "2020-01-01T00:00:00.000+01:00"),
+        ("SUBQUERY_SEPARATOR", ";"),
+        ("TOP", "$top="),
+        ("INTEGER", "10"),
+        ("OPTIONS_SEPARATOR", "&"),
+        ("RESULT_FORMAT", "$resultFormat="),
+        ("RESULT_FORMAT_VALUE", "dataArray"),
+    ]
+
+
+def test_invalid_character_reports_its_position():
+    with pytest.raises(Exception, match="position 6: !"):
+        Lexer("$top=1!")
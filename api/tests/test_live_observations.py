@@ -0,0 +1,183 @@
+import asyncio
+from unittest.mock import AsyncMock
+
+import pytest
+import ujson
+
+from app import VERSION
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.read import live_observations
+from app.v1.endpoints.read import subscription
+
+PREFIX = VERSION.strip("/")
+
+
+@pytest.mark.parametrize(
+    "topic, expected",
+    [
+        (
+            f"{PREFIX}/Datastreams(3)/Observations",
+            ("Datastreams(3)/Observations", ("Datastreams", 3)),
+        ),
+        (
+            "FeaturesOfInterest(2)/Observations",
+            ("FeaturesOfInterest(2)/Observations", ("FeaturesOfInterest", 2)),
+        ),
+        (
+            f"/{PREFIX}/Observations?$select=result,phenomenonTime",
+            ("Observations?$select=result,phenomenonTime", (None, None)),
+        ),
+    ],
+)
+def test_topics_are_parsed(topic, expected):
+    assert live_observations.parse_topic(topic) == expected
+
+
+@pytest.mark.parametrize(
+    "topic",
+    [
+        f"{PREFIX}/Things(1)/Observations",
+        f"{PREFIX}/Datastreams(1)/Observations?$filter=result gt 3",
+        f"{PREFIX}/Observations?$select=unknown",
+    ],
+)
+def test_unsupported_topics_are_rejected(topic):
+    with pytest.raises(BadRequest):
+        live_observations.parse_topic(topic)
+
+
+def test_ids_are_padded_to_a_power_of_two():
+    path = live_observations.get_query_path(
+        "Observations?$select=result", [4, 5, 6]
+    )
+
+    assert path == (
+        f"{VERSION}/Observations?$select=result"
+        "&$filter=id in (4,5,6,6)&$orderby=id&$top=4"
+    )
+
+
+def make_hub(monkeypatch, observations):
+    read = AsyncMock(
+        side_effect=lambda pool, topic, ids, user: [
+            observations[i] for i in ids
+        ]
+    )
+    monkeypatch.setattr(live_observations, "read_observations", read)
+    monkeypatch.setattr(live_observations, "get_pool", AsyncMock())
+    return live_observations.ObservationHub(0), read
+
+
+def drain(subscription):
+    messages = []
+    while not subscription.queue.empty():
+        messages.append(ujson.loads(subscription.queue.get_nowait()))
+    return messages
+
+
+def test_observations_are_pushed_to_their_topics(monkeypatch):
+    hub, read = make_hub(monkeypatch, {1: '{"result": 1}', 2: '{"a": 2}'})
+    alice = live_observations.Subscription({"username": "alice"})
+    bob = live_observations.Subscription({"username": "bob"})
+    bob_again = live_observations.Subscription({"username": "bob"})
+    hub.subscribe(alice, "Datastreams(3)/Observations")
+    hub.subscribe(bob, "Datastreams(3)/Observations")
+    hub.subscribe(bob_again, "Datastreams(3)/Observations")
+
+    hub.notify(None, 0, live_observations.CHANNEL, "1,3,7")
+    hub.notify(None, 0, live_observations.CHANNEL, "2,4,7")
+    assert hub.pending == [(1, 3, 7)]
+
+    asyncio.run(hub.push(hub.pending))
+
+    # The Observations are read once per role
+    users = [call.args[3]["username"] for call in read.await_args_list]
+    assert sorted(users) == ["alice", "bob"]
+    for subscriber in (alice, bob, bob_again):
+        assert drain(subscriber) == [
+            {
+                "topic": f"{PREFIX}/Datastreams(3)/Observations",
+                "message": {"result": 1},
+            }
+        ]
+
+
+def test_a_failed_read_only_skips_its_group(monkeypatch):
+    hub, read = make_hub(monkeypatch, {1: "1"})
+
+    async def read_or_fail(pool, topic, ids, user):
+        if user["username"] == "alice":
+            raise RuntimeError("permission denied")
+        return ["1"]
+
+    read.side_effect = read_or_fail
+    alice = live_observations.Subscription({"username": "alice"})
+    bob = live_observations.Subscription({"username": "bob"})
+    hub.subscribe(alice, "Observations")
+    hub.subscribe(bob, "Observations")
+
+    asyncio.run(hub.push([(1, 3, 7)]))
+
+    assert drain(alice) == []
+    assert [message["message"] for message in drain(bob)] == [1]
+
+
+def test_header_users_subscribe_anonymously(monkeypatch):
+    hub = live_observations.ObservationHub(0)
+    monkeypatch.setattr(subscription, "observation_hub", hub)
+
+    asyncio.run(
+        subscription.subscribe_event_stream(None, ["Observations"], "alice")
+    )
+
+    ((_, subscriber),) = hub.subscriptions[(None, None)]
+    assert subscriber.current_user is None
+
+
+def test_full_queues_drop_observations(monkeypatch):
+    hub, _ = make_hub(monkeypatch, {1: "1", 2: "2"})
+    subscriber = live_observations.Subscription(None, size=1)
+    hub.subscribe(subscriber, "Observations")
+
+    asyncio.run(hub.push([(1, 3, 7), (2, 3, 7)]))
+
+    assert [message["message"] for message in drain(subscriber)] == [1]
+    assert subscriber.dropped == 1
+
+
+def test_unsubscribed_topics_are_forgotten():
+    hub = live_observations.ObservationHub(0)
+    subscriber = live_observations.Subscription(None)
+    hub.subscribe(subscriber, "Datastreams(3)/Observations")
+    hub.subscribe(subscriber, "Observations")
+
+    assert hub.unsubscribe(subscriber, "Observations") == (
+        f"{PREFIX}/Observations"
+    )
+    assert set(hub.subscriptions) == {("Datastreams", 3)}
+    hub.unsubscribe(subscriber)
+    assert hub.subscriptions == {}
+    assert subscriber.topics == {}
+
+
+def test_websocket_requests_are_acknowledged(monkeypatch):
+    hub = live_observations.ObservationHub(0)
+    monkeypatch.setattr(subscription, "observation_hub", hub)
+    subscriber = live_observations.Subscription(None)
+
+    def handle(request):
+        return ujson.loads(subscription.handle_request(subscriber, request))
+
+    assert handle({"subscribe": "Datastreams(3)/Observations"}) == {
+        "subscribed": [f"{PREFIX}/Datastreams(3)/Observations"]
+    }
+    assert handle({"subscribe": ["Observations", "Things"]}) == {
+        "subscribed": [f"{PREFIX}/Observations"],
+        "error": "Unsupported topic: Things",
+    }
+    assert handle({"unsubscribe": "Observations"}) == {
+        "unsubscribed": [f"{PREFIX}/Observations"]
+    }
+    assert "error" in handle({"publish": "Observations"})
+    assert "error" in handle(None)
+    assert set(hub.subscriptions) == {("Datastreams", 3)}
@@ -0,0 +1,143 @@
+import asyncio
+from datetime import datetime, timedelta, timezone
+from unittest.mock import AsyncMock
+
+import pytest
+from asyncpg.exceptions import InvalidColumnReferenceError
+
+from app.utils.utils import build_self_link
+from app.v1.endpoints.create import data_array_observation
+from app.v1.endpoints.create import functions
+from app.v1.endpoints.exceptions import BadRequest
+
+START = datetime(2023, 1, 1, tzinfo=timezone.utc)
+COMPONENTS = ["result", "phenomenonTime", "FeatureOfInterest/id"]
+
+
+def at(minutes):
+    return START + timedelta(minutes=minutes)
+
+
+def set_rows(conn, written, existing=None):
+    async def fetch(query, *args):
+        if "generate_series" in query:
+            return [{"id": 100 + i} for i in range(args[0])]
+        if "ON CONFLICT" in query:
+            return written
+        if "unnest" in query:
+            return existing or []
+        return [{"id": i} for i in args[0]]
+
+    conn.fetch.side_effect = fetch
+    conn.fetchval.return_value = 5
+
+
+def record(observation_id, minutes, inserted=True):
+    return {
+        "id": observation_id,
+        "phenomenonTimeStart": at(minutes),
+        "phenomenonTimeEnd": at(minutes),
+        "datastream_id": 3,
+        "inserted": inserted,
+    }
+
+
+def insert(conn, on_conflict, counts):
+    rows = [[i, at(i).isoformat(), 5] for i in range(3)]
+    return asyncio.run(
+        data_array_observation.insert_data_array_observations(
+            conn,
+            [(3, COMPONENTS, rows)],
+            on_conflict=on_conflict,
+            counts=counts,
+        )
+    )
+
+
+def get_upsert(conn):
+    return next(
+        call.args[0]
+        for call in conn.fetch.await_args_list
+        if "ON CONFLICT" in call.args[0]
+    )
+
+
+def test_skipped_rows_are_linked_to_the_existing_observations(
+    monkeypatch, conn
+):
+    monkeypatch.setattr(
+        functions, "update_datastream_time_ranges", AsyncMock()
+    )
+    set_rows(conn, [record(100, 0), record(102, 2)], [record(42, 1)])
+    counts = {}
+
+    response = insert(conn, "skip", counts)
+
+    assert response == [
+        build_self_link("Observation", observation_id)
+        for observation_id in (100, 42, 102)
+    ]
+    assert counts == {"inserted": 2, "updated": 0, "skipped": 1}
+    sql = get_upsert(conn)
+    assert (
+        'ON CONFLICT ("phenomenonTimeStart", "phenomenonTimeEnd", '
+        '"datastream_id") DO NOTHING' in sql
+    )
+    assert "RETURNING id" in sql
+
+
+def test_updates_overwrite_all_but_the_key(monkeypatch, conn):
+    monkeypatch.setattr(
+        functions, "update_datastream_time_ranges", AsyncMock()
+    )
+    set_rows(
+        conn,
+        [record(100, 0), record(42, 1, inserted=False), record(102, 2)],
+    )
+    counts = {}
+
+    insert(conn, "update", counts)
+
+    assert counts == {"inserted": 2, "updated": 1, "skipped": 0}
+    sql = get_upsert(conn)
+    assert "SELECT DISTINCT ON" in sql
+    assert '"resultNumber" = EXCLUDED."resultNumber"' in sql
+    assert '"id" = EXCLUDED' not in sql
+    assert '"datastream_id" = EXCLUDED' not in sql
+    # Every row was written, so none is looked up
+    assert not any(
+        "unnest" in call.args[0] for call in conn.fetch.await_args_list
+    )
+
+
+def test_plain_inserts_do_not_handle_conflicts(conn):
+    written = asyncio.run(functions.copy_observations(conn, ["id"], [[1]]))
+
+    assert written is None
+    conn.fetch.assert_not_awaited()
+    assert "ON CONFLICT" not in conn.execute.await_args.args[0]
+
+
+def test_conflicts_require_the_unique_constraint(conn):
+    conn.fetch.side_effect = InvalidColumnReferenceError()
+
+    with pytest.raises(BadRequest):
+        asyncio.run(functions.copy_observations(conn, ["id"], [[1]], "skip"))
+
+
+def test_on_conflict_modes_are_validated():
+    functions.check_on_conflict(None)
+    functions.check_on_conflict("update")
+    with pytest.raises(BadRequest):
+        functions.check_on_conflict("replace")
+
+
+def test_counts_are_reported_in_headers():
+    assert functions.get_conflict_headers({}) == {}
+    assert functions.get_conflict_headers(
+        {"inserted": 2, "updated": 0, "skipped": 1}
+    ) == {
+        "Observations-Inserted": "2",
+        "Observations-Updated": "0",
+        "Observations-Skipped": "1",
+    }
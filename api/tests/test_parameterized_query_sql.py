@@ -0,0 +1,60 @@
+from datetime import datetime, timezone
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+
+
+def convert(path: str) -> dict:
+    return STA2REST.convert_query(f"{VERSION}{path}")
+
+
+def test_same_url_shape_produces_the_same_statement_text():
+    first = convert(
+        "/Datastreams(42)/Observations?$top=100"
+        "&$filter=phenomenonTime ge 2020-01-01T00:00:00Z"
+    )
+    second = convert(
+        "/Datastreams(7)/Observations?$top=10"
+        "&$filter=phenomenonTime ge 2024-06-01T00:00:00Z"
+    )
+
+    assert first["main_query"] == second["main_query"]
+    assert first["main_query_params"] != second["main_query_params"]
+
+
+def test_literals_are_lifted_out_as_positional_parameters():
+    result = convert(
+        "/Observations?$filter=result gt 3.5 and "
+        "phenomenonTime ge 2020-01-01T00:00:00Z&$top=5&$skip=20"
+    )
+    sql = result["main_query"]
+    params = result["main_query_params"]
+
+    assert "3.5" not in sql
+    assert "2020-01-01" not in sql
+    assert "LIMIT $" in sql and "OFFSET $" in sql
+    assert 3.5 in params
+    assert datetime(2020, 1, 1, tzinfo=timezone.utc) in params
+    assert params[-2:] == [6, 20]
+    assert f"${len(params)}" in sql
+
+
+def test_string_literals_stay_inline_for_postgres_type_inference():
+    result = convert(
+        "/Observations?$filter=phenomenonTime ge '2026-06-10T05:00:00Z'"
+    )
+
+    assert (
+        "\"phenomenonTimeStart\" >= '2026-06-10T05:00:00Z'"
+        in result["main_query"]
+    )
+    assert "::VARCHAR" not in result["main_query"]
+
+
+def test_count_query_is_parameterized():
+    result = convert("/Things?$filter=id gt 17&$count=true")
+
+    [[count_sql, count_params]] = result["count_queries"]
+
+    assert "17" not in count_sql
+    assert count_params == [17]
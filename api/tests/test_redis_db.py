@@ -0,0 +1,91 @@
+import asyncio
+
+import pytest
+
+from app import oauth
+from app.db import redis_db
+from fastapi import HTTPException
+from redis.exceptions import TimeoutError
+
+
+class FailingRedis:
+    def __init__(self):
+        self.calls = 0
+
+    async def get(self, key):
+        self.calls += 1
+        raise TimeoutError("Timeout reading from redis")
+
+
+@pytest.fixture
+def failing_redis(monkeypatch):
+    client = FailingRedis()
+    monkeypatch.setattr(redis_db, "get_redis", lambda: client)
+    monkeypatch.setattr(
+        redis_db, "breaker", redis_db.CircuitBreaker(threshold=2, cooldown=30)
+    )
+    return client
+
+
+async def get(key):
+    async with redis_db.redis_client() as client:
+        return await client.get(key)
+
+
+def test_breaker_stops_calling_redis_after_repeated_failures(failing_redis):
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            asyncio.run(get("token"))
+
+    with pytest.raises(redis_db.RedisUnavailable):
+        asyncio.run(get("token"))
+    assert failing_redis.calls == 2
+
+
+def test_breaker_lets_one_call_through_after_the_cooldown(
+    failing_redis, monkeypatch
+):
+    breaker = redis_db.breaker
+    breaker.failure()
+    breaker.failure()
+    assert not breaker.allow()
+
+    breaker.opened_at -= breaker.cooldown
+    assert breaker.allow()
+    # Only one trial call is let through
+    assert not breaker.allow()
+    breaker.failure()
+    assert not breaker.allow()
+
+    breaker.opened_at -= breaker.cooldown
+    assert breaker.allow()
+    breaker.success()
+    assert breaker.allow() and breaker.failures == 0
+
+
+def test_trial_ended_by_another_error_lets_the_next_call_try(
+    failing_redis,
+):
+    breaker = redis_db.breaker
+    breaker.failure()
+    breaker.failure()
+    breaker.opened_at -= breaker.cooldown
+
+    async def fail():
+        async with redis_db.redis_client():
+            raise ValueError("not a Redis error")
+
+    with pytest.raises(ValueError):
+        asyncio.run(fail())
+    assert breaker.allow()
+
+
+def test_unreachable_revocation_list_rejects_the_token(
+    failing_redis, monkeypatch
+):
+    monkeypatch.setattr(oauth, "REDIS", 1)
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(oauth.is_token_revoked("token"))
+
+    assert error.value.status_code == 503
@@ -0,0 +1,191 @@
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock
+
+import pytest
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.v1.endpoints import response_cache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.data = {}
+        self.commands = []
+
+    def pipeline(self, transaction=True):
+        return self
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        return False
+
+    def get(self, key):
+        self.commands.append(self.data.get(key))
+
+    def mget(self, keys):
+        self.commands.append([self.data.get(key) for key in keys])
+
+    def incr(self, key):
+        value = int(self.data.get(key, b"0")) + 1
+        self.data[key] = str(value).encode()
+        self.commands.append(value)
+
+    async def execute(self):
+        commands, self.commands = self.commands, []
+        return commands
+
+    async def set(self, key, value, ex=None):
+        self.data[key] = value.encode()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    fake = FakeRedis()
+
+    @asynccontextmanager
+    async def redis_client():
+        yield fake
+
+    monkeypatch.setattr(response_cache, "redis_client", redis_client)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE", 1)
+    monkeypatch.setattr(response_cache, "REDIS", 1)
+    monkeypatch.setattr(response_cache, "VERSIONING", 0)
+    return fake
+
+
+def read_tags(path):
+    full_path = f"{VERSION}{path}"
+    return response_cache.get_read_tags(
+        full_path, STA2REST.convert_query(full_path)
+    )
+
+
+def request(if_none_match=None):
+    req = MagicMock()
+    req.headers = {"if-none-match": if_none_match} if if_none_match else {}
+    return req
+
+
+async def chunks(*items):
+    for item in items:
+        yield item
+
+
+def test_read_tags_of_a_collection_are_the_tables_it_reads():
+    assert read_tags("/Datastreams(1)/Observations") == [
+        "*",
+        "Datastream",
+        "Observation",
+    ]
+    assert read_tags("/Things?$expand=Locations") == [
+        "*",
+        "Location",
+        "Thing",
+        "Thing_Location",
+    ]
+
+
+def test_read_tags_of_an_entity_replace_its_table_with_its_id():
+    assert read_tags("/Things(1)") == ["*", "Thing:*", "Thing:1"]
+    assert read_tags("/Datastreams(1)/Thing") == ["*", "Datastream", "Thing"]
+
+
+def test_write_tags_of_an_observation_do_not_touch_things_and_locations(
+    monkeypatch,
+):
+    monkeypatch.setattr(response_cache, "VERSIONING", 0)
+    tags = response_cache.get_write_tags(
+        f"{VERSION}/Observations",
+        b'{"result": 1, "Datastream": {"@iot.id": 1}}',
+    )
+
+    assert tags == [
+        "Datastream",
+        "Datastream:*",
+        "FeaturesOfInterest",
+        "FeaturesOfInterest:*",
+        "Observation",
+    ]
+    assert (
+        response_cache.get_write_tags(f"{VERSION}/CreateObservations", b"[]")
+        == tags
+    )
+
+
+def test_write_tags_of_a_deep_insert_include_the_created_entities(
+    monkeypatch,
+):
+    monkeypatch.setattr(response_cache, "VERSIONING", 0)
+    body = json.dumps(
+        {"name": "t", "Locations": [{"name": "l", "location": {}}]}
+    ).encode()
+
+    assert "Location" in response_cache.get_write_tags(
+        f"{VERSION}/Things", body
+    )
+    assert "Thing:1" in response_cache.get_write_tags(f"{VERSION}/Things(1)")
+    assert response_cache.get_write_tags(f"{VERSION}/Users") == ["*"]
+    assert response_cache.get_write_tags(f"{VERSION}/Login") == []
+
+
+def test_response_is_served_until_a_write_invalidates_it(redis):
+    full_path = f"{VERSION}/Things(1)"
+    data = STA2REST.convert_query(full_path)
+
+    cache = response_cache.ResponseCache(request(), full_path, data, None)
+    assert asyncio.run(cache.lookup()) is None
+    response = asyncio.run(
+        cache.response('{"@iot.id": 1', chunks("}"), "application/json")
+    )
+    assert response.body == b'{"@iot.id": 1}'
+    etag = response.headers["etag"]
+
+    cache = response_cache.ResponseCache(request(), full_path, data, None)
+    assert asyncio.run(cache.lookup()).body == b'{"@iot.id": 1}'
+
+    cache = response_cache.ResponseCache(request(etag), full_path, data, None)
+    assert asyncio.run(cache.lookup()).status_code == 304
+
+    # Another user has its own entry
+    cache = response_cache.ResponseCache(
+        request(), full_path, data, {"username": "bob"}
+    )
+    assert asyncio.run(cache.lookup()) is None
+
+    asyncio.run(
+        response_cache.invalidate(
+            response_cache.get_write_tags(f"{VERSION}/Things(2)")
+        )
+    )
+    cache = response_cache.ResponseCache(request(), full_path, data, None)
+    assert asyncio.run(cache.lookup()) is not None
+
+    asyncio.run(
+        response_cache.invalidate(
+            response_cache.get_write_tags(f"{VERSION}/Things(1)")
+        )
+    )
+    cache = response_cache.ResponseCache(request(), full_path, data, None)
+    assert asyncio.run(cache.lookup()) is None
+
+
+def test_large_response_is_streamed_and_not_cached(redis, monkeypatch):
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_MAX_SIZE", 4)
+    full_path = f"{VERSION}/Things"
+    data = STA2REST.convert_query(full_path)
+
+    cache = response_cache.ResponseCache(request(), full_path, data, None)
+    asyncio.run(cache.lookup())
+    response = asyncio.run(
+        cache.response("{", chunks('"value"', ": []}"), "application/json")
+    )
+
+    assert "etag" not in response.headers
+    assert not any(
+        key.startswith(response_cache.ENTRY_PREFIX) for key in redis.data
+    )
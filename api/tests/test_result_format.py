@@ -0,0 +1,163 @@
+import asyncio
+import io
+from datetime import datetime, timezone
+
+import pytest
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.v1.endpoints.exceptions import BadRequest
+from app.v1.endpoints.read import read as read_ep
+from app.v1.endpoints.read import result_format
+
+COLUMNS = [
+    ["@iot.id", "int64"],
+    ["phenomenonTimeStart", "timestamp"],
+    ["result", "float64"],
+    ["resultText", "string"],
+]
+TIME = datetime(2020, 1, 1, tzinfo=timezone.utc)
+PARTITIONS = [
+    [(1, TIME, 1.5, None), (2, None, None, "x")],
+    [(3, TIME, 3.0, None)],
+]
+
+
+def convert(path: str) -> dict:
+    return STA2REST.translate_query(f"{VERSION}{path}")
+
+
+def test_columnar_format_selects_typed_columns_without_json():
+    result = convert(
+        "/Observations?$resultFormat=csv&$filter=result gt 3"
+        "&$orderby=phenomenonTime desc"
+    )
+    sql = result["main_query"]
+
+    assert result["result_format"] == "CSV"
+    assert "row_to_json" not in sql and "json_agg" not in sql
+    assert 'sensorthings."Observation"."resultNumber" AS result' in sql
+    assert [name for name, _ in result["columns"]] == [
+        "@iot.id",
+        "phenomenonTimeStart",
+        "phenomenonTimeEnd",
+        "resultTime",
+        "result",
+        "resultText",
+        "Datastream@iot.id",
+        "FeatureOfInterest@iot.id",
+    ]
+    # The whole collection, without a page sentinel row
+    assert result["top_value"] is None
+    assert "LIMIT ALL" in sql
+
+
+def test_columnar_format_on_a_datastream_honours_select_and_top():
+    result = convert(
+        "/Datastreams(3)/Observations?$resultFormat=parquet"
+        "&$select=phenomenonTime,result&$top=5"
+    )
+
+    assert result["columns"] == [
+        ["phenomenonTimeStart", "timestamp"],
+        ["phenomenonTimeEnd", "timestamp"],
+        ["result", "float64"],
+        ["resultText", "string"],
+    ]
+    assert result["main_query_params"] == [3, 5, 0]
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        "/Observations?$resultFormat=arrow&$expand=Datastream",
+        "/Observations?$resultFormat=arrow&$count=true",
+        "/Observations?$resultFormat=csv&$select=Datastream/name",
+        "/Things?$resultFormat=csv",
+        "/Datastreams(1)/Sensor?$resultFormat=parquet",
+    ],
+)
+def test_unsupported_options_are_bad_requests(path):
+    with pytest.raises(BadRequest):
+        convert(path)
+
+
+def test_format_names_are_still_identifiers_elsewhere():
+    result = convert("/Observations?$filter=parameters/arrow eq 'csv'")
+
+    assert result["result_format"] is None
+    assert "row_to_json" in result["main_query"]
+
+
+def encode(name):
+    writer = result_format.get_writer(name, COLUMNS)
+    data = writer.drain()
+    for partition in PARTITIONS:
+        data += writer.write(partition)
+    return data + writer.close()
+
+
+def test_csv_writes_a_header_and_iso_timestamps():
+    assert encode("CSV").decode() == (
+        "@iot.id,phenomenonTimeStart,result,resultText\n"
+        "1,2020-01-01T00:00:00+00:00,1.5,\n"
+        "2,,,x\n"
+        "3,2020-01-01T00:00:00+00:00,3.0,\n"
+    )
+
+
+@pytest.mark.parametrize("name", ["Arrow", "Parquet"])
+def test_arrow_and_parquet_write_one_batch_per_partition(name):
+    pyarrow = pytest.importorskip("pyarrow")
+    import pyarrow.parquet
+
+    data = encode(name)
+    if name == "Arrow":
+        reader = pyarrow.ipc.open_stream(data)
+        batches = list(reader)
+        table = pyarrow.Table.from_batches(batches)
+    else:
+        batches = range(
+            pyarrow.parquet.ParquetFile(io.BytesIO(data)).num_row_groups
+        )
+        table = pyarrow.parquet.read_table(io.BytesIO(data))
+
+    assert len(batches) == 2
+    assert table.schema.field("phenomenonTimeStart").type == pyarrow.timestamp(
+        "us", tz="UTC"
+    )
+    assert table.column("result").to_pylist() == [1.5, None, 3.0]
+    assert table.column("resultText").to_pylist() == [None, "x", None]
+
+
+def test_arrow_without_pyarrow_is_not_supported(monkeypatch):
+    monkeypatch.setattr(result_format, "pyarrow", None)
+
+    with pytest.raises(result_format.NotSupported):
+        result_format.get_writer("Arrow", COLUMNS)
+    assert result_format.get_writer("CSV", COLUMNS) is not None
+
+
+def test_columnar_response_streams_the_cursor_partitions(
+    monkeypatch, pool, conn, cursor
+):
+    monkeypatch.setattr(read_ep, "ANONYMOUS_VIEWER", 0)
+    cursor.fetch.side_effect = PARTITIONS + [[]]
+    data = {
+        "result_format": "CSV",
+        "columns": COLUMNS,
+        "main_query": "SELECT 1",
+        "main_query_params": [7],
+    }
+
+    async def collect():
+        response = await read_ep.columnar_response(data, pool, None)
+        chunks = [chunk async for chunk in response.body_iterator]
+        return response, b"".join(chunks)
+
+    response, body = asyncio.run(collect())
+
+    assert response.media_type == "text/csv"
+    assert "Observations.csv" in response.headers["content-disposition"]
+    conn.cursor.assert_awaited_once_with("SELECT 1", 7)
+    assert body == encode("CSV")
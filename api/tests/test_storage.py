@@ -0,0 +1,160 @@
+import asyncio
+from datetime import datetime, timezone
+
+import pytest
+from asyncpg.exceptions import InvalidDatetimeFormatError
+
+from app.v1.endpoints.exceptions import BadRequest, Forbidden
+from app.v1.endpoints.read import storage as read_storage
+from app.v1.endpoints.update import storage as update_storage
+
+JAN = datetime(2020, 1, 1, tzinfo=timezone.utc)
+FEB = datetime(2020, 1, 31, tzinfo=timezone.utc)
+MAR = datetime(2020, 3, 1, tzinfo=timezone.utc)
+
+
+@pytest.fixture
+def conn(conn):
+    async def fetch(query, *args):
+        if "timescaledb_information.jobs" in query:
+            return [{"proc_name": "policy_retention", "interval": "3650 days"}]
+        return [
+            {
+                "chunk_name": "_hyper_1_1_chunk",
+                "range_start": JAN,
+                "range_end": FEB,
+                "is_compressed": True,
+                "total_bytes": 100,
+                "before_compression_bytes": 1000,
+                "after_compression_bytes": 100,
+            },
+            {
+                "chunk_name": "_hyper_1_2_chunk",
+                "range_start": FEB,
+                "range_end": MAR,
+                "is_compressed": False,
+                "total_bytes": 900,
+                "before_compression_bytes": None,
+                "after_compression_bytes": None,
+            },
+        ]
+
+    async def fetchrow(query, *args):
+        if "hypertable_detailed_size" in query:
+            return {
+                "table_bytes": 600,
+                "index_bytes": 300,
+                "toast_bytes": 100,
+                "total_bytes": 1000,
+            }
+        return {"segmentby": ["datastream_id"], "orderby": ["x"]}
+
+    conn.fetch.side_effect = fetch
+    conn.fetchrow.side_effect = fetchrow
+    # Compression is enabled
+    conn.fetchval.return_value = True
+    return conn
+
+
+def test_storage_reports_chunk_sizes_and_compression(conn):
+    storage = asyncio.run(read_storage.get_storage(conn))
+
+    assert storage["compression"] == {
+        "enabled": True,
+        "segmentBy": ["datastream_id"],
+        "orderBy": ["x"],
+        "compressAfter": None,
+    }
+    assert storage["retention"] == {"dropAfter": "3650 days"}
+    assert storage["size"]["totalBytes"] == 1000
+    assert storage["compressionRatio"] == 10
+    assert [chunk["compressionRatio"] for chunk in storage["chunks"]] == [
+        10,
+        None,
+    ]
+    assert storage["chunks"][0]["rangeStart"] == JAN.isoformat()
+    chunks_query = conn.fetch.await_args_list[-1].args[0]
+    assert "chunk_compression_stats" in chunks_query
+
+
+def test_storage_without_compression_skips_its_stats(conn):
+    conn.fetchval.return_value = False
+
+    storage = asyncio.run(read_storage.get_storage(conn))
+
+    assert storage["compression"]["enabled"] is False
+    conn.fetchrow.assert_awaited_once()
+    assert "chunk_compression_stats" not in (
+        conn.fetch.await_args_list[-1].args[0]
+    )
+
+
+def test_compression_is_enabled_with_its_first_policy(conn):
+    conn.fetchval.return_value = False
+
+    asyncio.run(update_storage.set_compression_policy(conn, "P30D"))
+
+    statements = [call.args[0] for call in conn.execute.await_args_list]
+    assert "remove_compression_policy" in statements[0]
+    assert "timescaledb.compress_segmentby = 'datastream_id'" in statements[1]
+    assert "add_compression_policy" in statements[2]
+    assert conn.execute.await_args_list[2].args[1] == "P30D"
+
+
+def test_null_policies_are_removed(conn):
+    asyncio.run(update_storage.set_compression_policy(conn, None))
+    asyncio.run(update_storage.set_retention_policy(conn, None))
+
+    statements = [call.args[0] for call in conn.execute.await_args_list]
+    assert len(statements) == 6
+    assert "remove_compression_policy" in statements[0]
+    assert "remove_retention_policy" in statements[1]
+    # The rollups are refreshed back to their first bucket again
+    assert "add_continuous_aggregate_policy" in statements[3]
+    assert conn.execute.await_args_list[3].args[1] is None
+
+
+def test_retention_policy_schedules_the_datastream_recompute(conn):
+    asyncio.run(update_storage.set_retention_policy(conn, "P10Y"))
+
+    statements = [call.args[0] for call in conn.execute.await_args_list]
+    assert "remove_retention_policy" in statements[0]
+    assert "recompute_retained_datastreams" in statements[0]
+    assert "add_retention_policy" in statements[1]
+    assert conn.execute.await_args_list[1].args[1] == "P10Y"
+    assert (
+        "add_job('sensorthings.recompute_retained_datastreams'"
+        in statements[2]
+    )
+    # The rollups are not refreshed beyond the retention window
+    for index in (4, 6):
+        assert "add_continuous_aggregate_policy" in statements[index]
+        assert conn.execute.await_args_list[index].args[1] == "P10Y"
+
+
+def test_storage_is_managed_by_administrators(pool):
+    with pytest.raises(Forbidden):
+        asyncio.run(
+            update_storage.update_observation_storage(
+                {"dropAfter": "P1Y"},
+                {"id": 2, "role": "sensor"},
+                pool,
+            )
+        )
+
+
+@pytest.mark.parametrize(
+    "payload", [{"dropAfter": 3}, {"keepFor": "P1Y"}, {"dropAfter": "1 x"}]
+)
+def test_invalid_policies_are_rejected(payload, pool, conn):
+    async def execute(query, *args):
+        # PostgreSQL rejects the intervals it cannot parse
+        if args:
+            raise InvalidDatetimeFormatError()
+
+    conn.execute.side_effect = execute
+
+    with pytest.raises((BadRequest, ValueError)):
+        asyncio.run(
+            update_storage.update_observation_storage(payload, None, pool)
+        )
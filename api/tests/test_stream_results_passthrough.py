@@ -0,0 +1,68 @@
+import json
+
+import pytest
+
+from app.v1.endpoints.read import read as read_ep
+
+pytestmark = pytest.mark.asyncio(loop_scope="function")
+
+
+def partition(rows, chunk):
+    return [rows[i : i + chunk] for i in range(0, len(rows), chunk)] + [[]]
+
+
+async def collect(pool, top, full_path="/istsos4/v1.1/Observations"):
+    chunks = []
+    async for chunk in read_ep.asyncpg_stream_results(
+        "Observation",
+        "SELECT 1",
+        pool,
+        top,
+        False,
+        [],
+        None,
+        None,
+        False,
+        full_path,
+        None,
+    ):
+        chunks.append(chunk)
+    return "".join(chunks)
+
+
+async def test_rows_are_streamed_as_the_database_json_text(
+    monkeypatch, pool, cursor
+):
+    monkeypatch.setattr(read_ep, "PARTITION_CHUNK", 2)
+    monkeypatch.setattr(read_ep, "ANONYMOUS_VIEWER", 0)
+    # Postgres formatting (spaces, key order, escapes) is kept verbatim
+    rows = [
+        {"json": '{"@iot.id" : 1, "result" : 1.50, "url" : "a/b"}'},
+        {"json": '{"@iot.id" : 2, "result" : null}'},
+        {"json": '{"@iot.id" : 3, "result" : "\\u00e9"}'},
+    ]
+
+    cursor.fetch.side_effect = partition(rows, 2)
+
+    body = await collect(pool, top=101)
+
+    assert body == (
+        '{"value": [' + ",".join(row["json"] for row in rows) + "]}"
+    )
+    assert [o["@iot.id"] for o in json.loads(body)["value"]] == [1, 2, 3]
+
+
+async def test_extra_row_fetched_for_the_next_link_is_dropped(
+    monkeypatch, pool, cursor
+):
+    monkeypatch.setattr(read_ep, "PARTITION_CHUNK", 10)
+    monkeypatch.setattr(read_ep, "ANONYMOUS_VIEWER", 0)
+    rows = [{"json": f'{{"@iot.id" : {i}}}'} for i in range(3)]
+    cursor.fetch.side_effect = partition(rows, 10)
+
+    body = json.loads(
+        await collect(pool, 3, "/istsos4/v1.1/Observations?$top=2")
+    )
+
+    assert [o["@iot.id"] for o in body["value"]] == [0, 1]
+    assert "@iot.nextLink" in body
@@ -0,0 +1,162 @@
+import json
+
+import pytest
+
+from app import VERSION
+from app.sta2rest.sta2rest import STA2REST
+from app.sta2rest.translation_cache import (
+    QueryShape,
+    TranslationCache,
+)
+from app.utils.utils import encode_skiptoken
+
+
+def translate(cache: TranslationCache, path: str) -> dict:
+    return cache.translate(f"{VERSION}{path}", STA2REST.translate_query)
+
+
+def uncached(path: str) -> dict:
+    return STA2REST.translate_query(f"{VERSION}{path}")
+
+
+def test_same_shape_is_served_from_the_cache():
+    cache = TranslationCache(16)
+    first = (
+        "/Datastreams(42)/Observations?$top=10"
+        "&$filter=result gt 3.5 and phenomenonTime ge 2020-01-01T00:00:00Z"
+        "&$skip=20"
+    )
+    second = (
+        "/Datastreams(7)/Observations?$skip=40"
+        "&$filter=result gt 7.25 and phenomenonTime ge 2024-06-01T12:30:00Z"
+        "&$top=10"
+    )
+
+    assert translate(cache, first) == uncached(first)
+    assert translate(cache, second) == uncached(second)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_count_queries_are_rebound_on_a_hit():
+    cache = TranslationCache(16)
+    translate(cache, "/Things?$filter=id gt 17&$count=true")
+
+    result = translate(cache, "/Things?$filter=id gt 3&$count=true")
+
+    assert cache.hits == 1
+    assert result == uncached("/Things?$filter=id gt 3&$count=true")
+    assert result["count_queries"][0][1] == [3]
+
+
+def test_string_literals_and_top_are_part_of_the_shape():
+    assert (
+        QueryShape("/Things?$filter=name eq 'a&b'").key
+        != QueryShape("/Things?$filter=name eq 'c'").key
+    )
+    assert QueryShape("/Things?$top=1").key != QueryShape("/Things?$top=2").key
+    assert (
+        QueryShape("/Things(1)?$filter=id gt 2").key
+        == QueryShape("/Things(3)?$filter=id gt 4").key
+    )
+
+
+def test_value_dependent_shape_is_marked_uncacheable():
+    cache = TranslationCache(16)
+    # The DataArray navigation path renders the parent id into the SQL text
+    first = "/Datastreams(1)/Observations?$resultFormat=dataArray"
+    second = "/Datastreams(2)/Observations?$resultFormat=dataArray"
+
+    translate(cache, first)
+    result = translate(cache, second)
+
+    assert result == uncached(second)
+    assert cache.hits == 0
+    assert cache.uncacheable == 1
+
+
+def test_uncacheable_shape_is_probed_again_after_a_while():
+    def value_dependent(full_path):
+        # Renders a zero $skip inline, like a shape that is only
+        # uncacheable for some literal values
+        data = STA2REST.translate_query(full_path)
+        if "skip%3D0" in full_path:
+            data = dict(data, main_query=data["main_query"] + " -- 0")
+        return data
+
+    cache = TranslationCache(16, retry_after=3600)
+    cache.translate(f"{VERSION}/Things?$skip=0", value_dependent)
+    cache.translate(f"{VERSION}/Things?$skip=5", value_dependent)
+    assert cache.uncacheable == 1
+    assert cache.hits == 0
+
+    cache.retry_after = 0
+    next(iter(cache.entries.values())).retry_at = 0
+    cache.translate(f"{VERSION}/Things?$skip=5", value_dependent)
+    result = cache.translate(f"{VERSION}/Things?$skip=7", value_dependent)
+
+    assert result == uncached("/Things?$skip=7")
+    assert cache.hits == 1
+
+
+@pytest.mark.parametrize(
+    "small, large",
+    [
+        ("/Observations(5)", "/Observations(3000000000)"),
+        (
+            "/Observations?$filter=result gt 3",
+            "/Observations?$filter=result gt 3000000000",
+        ),
+    ],
+)
+def test_integers_bound_as_bigint_have_their_own_shape(small, large):
+    cache = TranslationCache(16)
+    translate(cache, small)
+
+    assert translate(cache, large) == uncached(large)
+    assert "::BIGINT" in translate(cache, large)["main_query"]
+    assert cache.hits == 1
+
+
+def test_least_recently_used_shape_is_evicted():
+    cache = TranslationCache(2)
+    translate(cache, "/Things")
+    translate(cache, "/Sensors")
+    translate(cache, "/Things")
+    translate(cache, "/Locations")
+
+    assert cache.stats()["evictions"] == 1
+    assert list(cache.entries) == [
+        QueryShape(f"{VERSION}/Things").key,
+        QueryShape(f"{VERSION}/Locations").key,
+    ]
+
+
+def test_skiptoken_pages_share_one_shape():
+    cache = TranslationCache(16)
+
+    def page(*seek):
+        token = encode_skiptoken(json.dumps(list(seek)))
+        return (
+            "/Datastreams(7)/Observations?$orderby=phenomenonTime desc"
+            f"&$top=100&$skiptoken={token}"
+        )
+
+    first = page("2020-01-01T00:00:00+00:00", 2000000)
+    second = page("2019-06-30T23:59:59.5+00:00", 1999900)
+
+    assert translate(cache, first) == uncached(first)
+    assert translate(cache, second) == uncached(second)
+    assert cache.stats()["misses"] == 1
+    assert cache.stats()["hits"] == 1
+
+
+def test_skiptoken_with_a_string_key_is_not_cached():
+    cache = TranslationCache(16)
+    first = "/Things?$orderby=name&$skiptoken=" + encode_skiptoken('["a", 1]')
+    second = "/Things?$orderby=name&$skiptoken=" + encode_skiptoken('["b", 1]')
+
+    translate(cache, first)
+
+    assert translate(cache, second) == uncached(second)
+    assert cache.uncacheable == 1
@@ -429,6 +429,7 @@ BEGIN
         GRANT INSERT, UPDATE, DELETE ON TABLE sensorthings."Observation" TO "sensor";
         GRANT INSERT ON TABLE sensorthings."FeaturesOfInterest" TO "sensor";
         GRANT INSERT ON TABLE sensorthings."Commit" TO "sensor";
+        GRANT INSERT ON TABLE sensorthings."Datastream_pending_range" TO "sensor";
         GRANT UPDATE ("phenomenonTime", "resultTime", "last_foi_id", "observedArea") ON sensorthings."Datastream" TO "sensor";
         GRANT UPDATE ("gen_foi_id") ON sensorthings."Location" TO "sensor";
         REVOKE SELECT ON sensorthings."User" FROM "sensor";
@@ -441,8 +442,13 @@ BEGIN
         GRANT USAGE, SELECT ON ALL SEQUENCES IN SCHEMA sensorthings TO "qc";
         GRANT UPDATE ON TABLE sensorthings."Observation" TO "qc";
         GRANT INSERT ON TABLE sensorthings."Commit" TO "qc";
+        GRANT INSERT ON TABLE sensorthings."Datastream_pending_range" TO "qc";
         GRANT "qc" TO "administrator" WITH ADMIN OPTION;
 
+        -- The rollups have no row level security; the API does not read
+        -- them with AUTHORIZATION
+        REVOKE SELECT ON sensorthings."Observation_hourly", sensorthings."Observation_daily" FROM "user", "guest", "sensor", "qc";
+
         SET ROLE "administrator";
         
         -- Enable row level security
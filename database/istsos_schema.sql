@@ -234,6 +234,242 @@ SELECT create_hypertable(
     by_range('phenomenonTimeStart', INTERVAL '30 days')
 );
 
+-- Hourly and daily rollups of the numeric results of each Datastream, read
+-- by the API for $aggregate intervals that are multiples of their bucket.
+-- They keep sums and counts so that coarser buckets can re-aggregate them.
+-- Real-time aggregation (materialized_only = false) merges the raw rows of
+-- the buckets not materialized yet, so reads include the newest data.
+-- TimescaleDB indexes each rollup on its datastream_id and bucket.
+CREATE MATERIALIZED VIEW sensorthings."Observation_hourly"
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    "datastream_id",
+    time_bucket(INTERVAL '1 hour', "phenomenonTimeStart") AS "phenomenonTimeStart",
+    sum("resultNumber") AS "resultSum",
+    count("resultNumber") AS "resultCount",
+    min("resultNumber") AS "resultMin",
+    max("resultNumber") AS "resultMax"
+FROM sensorthings."Observation"
+GROUP BY "datastream_id", time_bucket(INTERVAL '1 hour', "phenomenonTimeStart")
+WITH NO DATA;
+
+-- The daily rollup aggregates the hourly one
+CREATE MATERIALIZED VIEW sensorthings."Observation_daily"
+WITH (timescaledb.continuous, timescaledb.materialized_only = false) AS
+SELECT
+    "datastream_id",
+    time_bucket(INTERVAL '1 day', "phenomenonTimeStart") AS "phenomenonTimeStart",
+    sum("resultSum") AS "resultSum",
+    sum("resultCount") AS "resultCount",
+    min("resultMin") AS "resultMin",
+    max("resultMax") AS "resultMax"
+FROM sensorthings."Observation_hourly"
+GROUP BY "datastream_id", time_bucket(INTERVAL '1 day', "phenomenonTimeStart")
+WITH NO DATA;
+
+-- The policies refresh the buckets changed since their last run, back to the
+-- first one (start_offset NULL), so that late and backfilled Observations
+-- are rolled up too. The open bucket is left to real-time aggregation.
+-- With DROP_AFTER they stop at the retention window, so that a late
+-- Observation in a dropped range does not replace the buckets rolled up
+-- from the dropped chunks. The window spans at least three buckets, as
+-- TimescaleDB requires two between start_offset and end_offset.
+SELECT add_continuous_aggregate_policy(
+    'sensorthings."Observation_hourly"',
+    start_offset => CASE
+        WHEN coalesce(current_setting('custom.drop_after', true), '') <> '' THEN
+            GREATEST(current_setting('custom.drop_after')::interval, INTERVAL '3 hours')
+    END,
+    end_offset => INTERVAL '1 hour',
+    schedule_interval => INTERVAL '15 minutes'
+);
+
+SELECT add_continuous_aggregate_policy(
+    'sensorthings."Observation_daily"',
+    start_offset => CASE
+        WHEN coalesce(current_setting('custom.drop_after', true), '') <> '' THEN
+            GREATEST(current_setting('custom.drop_after')::interval, INTERVAL '3 days')
+    END,
+    end_offset => INTERVAL '1 day',
+    schedule_interval => INTERVAL '1 hour'
+);
+
+-- Pending changes of the phenomenonTime and resultTime of the Datastreams.
+-- Writers append the bounds of the Observations they insert, or ask for a
+-- recomputation after a delete, instead of updating the Datastream row, so
+-- concurrent writers to a Datastream do not serialize on its row lock. The
+-- apply_datastream_ranges job merges them into the Datastreams, at most once
+-- per schedule interval, and reads overlay the bounds still pending.
+CREATE TABLE IF NOT EXISTS sensorthings."Datastream_pending_range" (
+    "datastream_id" BIGINT NOT NULL,
+    "phenomenonTimeStart" TIMESTAMPTZ,
+    "phenomenonTimeEnd" TIMESTAMPTZ,
+    "resultTimeStart" TIMESTAMPTZ,
+    "resultTimeEnd" TIMESTAMPTZ,
+    "recompute" BOOLEAN NOT NULL DEFAULT FALSE
+);
+
+CREATE INDEX IF NOT EXISTS "idx_datastream_pending_range_datastream_id" ON sensorthings."Datastream_pending_range" USING btree ("datastream_id" ASC NULLS LAST) TABLESPACE pg_default;
+
+CREATE OR REPLACE PROCEDURE sensorthings.apply_datastream_ranges(job_id INT DEFAULT NULL, config JSONB DEFAULT NULL) AS $$
+    WITH pending AS (
+        DELETE FROM sensorthings."Datastream_pending_range"
+        RETURNING *
+    ),
+    merged AS (
+        SELECT
+            "datastream_id",
+            min("phenomenonTimeStart") AS ph_start,
+            max("phenomenonTimeEnd") AS ph_end,
+            min("resultTimeStart") AS rt_start,
+            max("resultTimeEnd") AS rt_end,
+            bool_or("recompute") AS recompute
+        FROM pending
+        GROUP BY "datastream_id"
+    )
+    UPDATE sensorthings."Datastream" d
+    SET "phenomenonTime" =
+        CASE
+            WHEN m.recompute THEN
+                CASE WHEN o.ph_start IS NOT NULL THEN tstzrange(o.ph_start, o.ph_end, '[]') END
+            WHEN m.ph_start IS NOT NULL THEN
+                tstzrange(LEAST(m.ph_start, lower(d."phenomenonTime")), GREATEST(m.ph_end, upper(d."phenomenonTime")), '[]')
+            ELSE d."phenomenonTime"
+        END,
+        "resultTime" =
+        CASE
+            WHEN m.recompute THEN
+                CASE WHEN o.rt_start IS NOT NULL THEN tstzrange(o.rt_start, o.rt_end, '[]') END
+            WHEN m.rt_start IS NOT NULL THEN
+                tstzrange(LEAST(m.rt_start, lower(d."resultTime")), GREATEST(m.rt_end, upper(d."resultTime")), '[]')
+            ELSE d."resultTime"
+        END
+    FROM merged m
+    LEFT JOIN LATERAL (
+        SELECT
+            min("phenomenonTimeStart") AS ph_start,
+            max("phenomenonTimeEnd") AS ph_end,
+            min("resultTime") AS rt_start,
+            max("resultTime") AS rt_end
+        FROM sensorthings."Observation"
+        WHERE "datastream_id" = m."datastream_id"
+    ) o ON m.recompute
+    WHERE d.id = m."datastream_id";
+$$ LANGUAGE SQL;
+
+SELECT add_job('sensorthings.apply_datastream_ranges', INTERVAL '5 seconds');
+
+-- The retention policy drops whole chunks of Observations, which leaves the
+-- phenomenonTime, resultTime and observedArea of their Datastreams stale.
+-- This job, scheduled with the retention policy, recomputes them for the
+-- Datastreams whose phenomenonTime starts before the oldest chunk kept.
+-- observedArea follows custom.st_aggregate as ST_AGGREGATE does in the API.
+CREATE OR REPLACE PROCEDURE sensorthings.recompute_retained_datastreams(job_id INT DEFAULT NULL, config JSONB DEFAULT NULL) AS $$
+    UPDATE sensorthings."Datastream" d
+    SET "phenomenonTime" = (
+            SELECT
+                CASE WHEN min(o."phenomenonTimeStart") IS NOT NULL THEN
+                    tstzrange(min(o."phenomenonTimeStart"), max(o."phenomenonTimeEnd"), '[]')
+                END
+            FROM sensorthings."Observation" o
+            WHERE o."datastream_id" = d.id
+        ),
+        "resultTime" = (
+            SELECT
+                CASE WHEN min(o."resultTime") IS NOT NULL THEN
+                    tstzrange(min(o."resultTime"), max(o."resultTime"), '[]')
+                END
+            FROM sensorthings."Observation" o
+            WHERE o."datastream_id" = d.id
+        ),
+        "observedArea" = (
+            SELECT
+                CASE WHEN coalesce(current_setting('custom.st_aggregate', true), 'CONVEX_HULL') = 'CONVEX_HULL' THEN
+                    ST_ConvexHull(ST_Collect(f.feature))
+                ELSE
+                    ST_Envelope(ST_Collect(f.feature))
+                END
+            FROM (
+                SELECT DISTINCT ON (foi.id) foi.feature
+                FROM sensorthings."Observation" o, sensorthings."FeaturesOfInterest" foi
+                WHERE o.featuresofinterest_id = foi.id AND o.datastream_id = d.id
+            ) f
+        )
+    WHERE lower(d."phenomenonTime") < coalesce((
+        SELECT min(range_start)
+        FROM timescaledb_information.chunks
+        WHERE hypertable_schema = 'sensorthings'
+        AND hypertable_name = 'Observation'
+    ), 'infinity');
+$$ LANGUAGE SQL;
+
+-- Native compression and retention of the Observations, after the ages set
+-- by COMPRESS_AFTER and DROP_AFTER (intervals, empty to disable). They can be
+-- changed later with PATCH /Storage. The Datastreams of the dropped chunks
+-- are recomputed by recompute_retained_datastreams. Compressed chunks are
+-- grouped by Datastream and ordered by time; the columns of the unique
+-- constraints have to be among them. TimescaleDB does not compress tables
+-- with row level security, which AUTHORIZATION enables on the Observations.
+DO $$
+BEGIN
+    IF coalesce(current_setting('custom.compress_after', true), '') <> '' THEN
+        IF current_setting('custom.authorization')::boolean THEN
+            RAISE WARNING 'Observations are not compressed with AUTHORIZATION';
+        ELSE
+            ALTER TABLE sensorthings."Observation" SET (
+                timescaledb.compress,
+                timescaledb.compress_segmentby = 'datastream_id',
+                timescaledb.compress_orderby = '"phenomenonTimeStart" DESC, "phenomenonTimeEnd" DESC, id'
+            );
+            PERFORM add_compression_policy('sensorthings."Observation"', compress_after => current_setting('custom.compress_after')::interval);
+        END IF;
+    END IF;
+
+    IF coalesce(current_setting('custom.drop_after', true), '') <> '' THEN
+        PERFORM add_retention_policy('sensorthings."Observation"', drop_after => current_setting('custom.drop_after')::interval);
+        PERFORM add_job('sensorthings.recompute_retained_datastreams', INTERVAL '1 day');
+    END IF;
+END $$;
+
+-- The ranges of a Datastream as the next apply_datastream_ranges will merge
+-- them: recomputed from its Observations when a delete or an update asked
+-- for it, else widened with the bounds still pending.
+CREATE OR REPLACE FUNCTION sensorthings.pending_phenomenon_time(ds_id BIGINT, stored tstzrange) RETURNS tstzrange AS $$
+    SELECT
+        CASE
+            WHEN bool_or(p."recompute") THEN (
+                SELECT
+                    CASE WHEN min(o."phenomenonTimeStart") IS NOT NULL THEN
+                        tstzrange(min(o."phenomenonTimeStart"), max(o."phenomenonTimeEnd"), '[]')
+                    END
+                FROM sensorthings."Observation" o
+                WHERE o."datastream_id" = ds_id
+            )
+            WHEN min(p."phenomenonTimeStart") IS NULL THEN stored
+            ELSE tstzrange(LEAST(min(p."phenomenonTimeStart"), lower(stored)), GREATEST(max(p."phenomenonTimeEnd"), upper(stored)), '[]')
+        END
+    FROM sensorthings."Datastream_pending_range" p
+    WHERE p."datastream_id" = ds_id;
+$$ LANGUAGE SQL STABLE;
+
+CREATE OR REPLACE FUNCTION sensorthings.pending_result_time(ds_id BIGINT, stored tstzrange) RETURNS tstzrange AS $$
+    SELECT
+        CASE
+            WHEN bool_or(p."recompute") THEN (
+                SELECT
+                    CASE WHEN min(o."resultTime") IS NOT NULL THEN
+                        tstzrange(min(o."resultTime"), max(o."resultTime"), '[]')
+                    END
+                FROM sensorthings."Observation" o
+                WHERE o."datastream_id" = ds_id
+            )
+            WHEN min(p."resultTimeStart") IS NULL THEN stored
+            ELSE tstzrange(LEAST(min(p."resultTimeStart"), lower(stored)), GREATEST(max(p."resultTimeEnd"), upper(stored)), '[]')
+        END
+    FROM sensorthings."Datastream_pending_range" p
+    WHERE p."datastream_id" = ds_id;
+$$ LANGUAGE SQL STABLE;
+
 CREATE OR REPLACE FUNCTION "@iot.selfLink"(sensorthings."Observation") RETURNS text AS $$
     SELECT '/Observations(' || $1.id || ')';
 $$ LANGUAGE SQL;
@@ -340,6 +576,30 @@ BEFORE DELETE ON sensorthings."Location"
 FOR EACH ROW
 EXECUTE FUNCTION sensorthings.delete_related_historical_locations();
 
+-- Notify the API workers of every new Observation when LIVE_OBSERVATIONS is
+-- enabled, so that they push it to the clients subscribed to it. Only the ids
+-- are sent: each worker reads the Observations with the role of its
+-- subscribers.
+CREATE OR REPLACE FUNCTION sensorthings.notify_observation() RETURNS TRIGGER AS $$
+BEGIN
+    PERFORM pg_notify(
+        'sensorthings_observation',
+        concat_ws(',', NEW.id, NEW.datastream_id, NEW.featuresofinterest_id)
+    );
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DO $$
+BEGIN
+    IF coalesce(current_setting('custom.live_observations', true), '0')::boolean THEN
+        CREATE TRIGGER after_observation_insert
+        AFTER INSERT ON sensorthings."Observation"
+        FOR EACH ROW
+        EXECUTE FUNCTION sensorthings.notify_observation();
+    END IF;
+END $$;
+
 CREATE OR REPLACE FUNCTION sensorthings.count_estimate(
 	query text)
     RETURNS integer
@@ -366,321 +626,6 @@ return rows;
 end
 $$;
 
-CREATE OR REPLACE FUNCTION sensorthings.expand(
-    query_ text,
-    fk_field_ text,
-    fk_id_ integer,
-    limit_ integer DEFAULT 101,
-    offset_ integer DEFAULT 0,
-    one_to_many_ boolean DEFAULT true,
-	show_id boolean DEFAULT false,
-    table_ text DEFAULT ''::text,
-    base_url_ text DEFAULT ''::text,
-    is_count boolean DEFAULT false,
-    count_mode_ text DEFAULT 'FULL'::text,
-	count_estimate_threshold_ integer DEFAULT 10000,
-    select_node text DEFAULT ''::text,
-    filter_node text DEFAULT ''::text,
-    orderby_node text DEFAULT ''::text,
-    expand_node text DEFAULT ''::text)
-    RETURNS json
-    LANGUAGE 'plpgsql'
-    COST 100
-    VOLATILE PARALLEL UNSAFE
-AS $$
-DECLARE
-    result jsonb;
-    next_link text;
-    where_clause text;
-	id_column text := CASE WHEN show_id THEN 'id' ELSE 'id as "@iot.id"' END;
-    preliminary_count integer;
-	total_count integer;
-BEGIN
-
-    IF one_to_many_ THEN
-        EXECUTE format(
-			'SELECT COALESCE
-				(
-					(
-						SELECT jsonb_agg(row_to_json(%I)::jsonb - %L - %L)
-						FROM (
-							SELECT %s, *
-							FROM (%s) d
-							WHERE d.%s = %s
-							LIMIT %s OFFSET %s
-						) %I
-					), ''[]''
-				)',
-			table_, fk_field_, 'id', id_column, query_, fk_field_, fk_id_, limit_, offset_, table_
-		) INTO result;
-
-        IF jsonb_array_length(result) > limit_ - 1 THEN
-            result := result - (limit_ - 1);
-            next_link := base_url_ || table_ 
-                || '?$top=' || (limit_ - 1) 
-                || '&$skip=' || (offset_ + limit_ - 1)
-                || CASE 
-                    WHEN filter_node <> '' THEN '&$filter=' || filter_node 
-                    ELSE '' 
-                END
-                || CASE 
-                    WHEN select_node <> '' THEN '&$select=' || select_node 
-                    ELSE '' 
-                END
-                || CASE 
-                    WHEN orderby_node <> '' THEN '&$orderby=' || orderby_node 
-                    ELSE '' 
-                END
-                || CASE 
-                    WHEN is_count THEN '&$count=true' 
-                    ELSE '' 
-                END
-                || CASE 
-                    WHEN expand_node <> '' THEN '&$expand=' || expand_node 
-                    ELSE '' 
-                END;
-        ELSE
-            next_link := NULL;
-        END IF;
-
-        IF is_count THEN
-            -- Handle count based on count_mode_
-            IF count_mode_ = 'FULL' THEN
-                -- Full count mode: get the exact count
-                EXECUTE format(
-                    'SELECT COUNT(*) FROM (%s) d WHERE d.%s = %s',
-                    query_, fk_field_, fk_id_
-                ) INTO total_count;
-            
-            ELSIF count_mode_ = 'LIMIT_ESTIMATE' THEN
-                -- Limit estimate mode: get preliminary count with a limit
-                EXECUTE format(
-                    'SELECT COUNT(*) FROM (%s) d WHERE d.%s = %s LIMIT %s',
-                    query_, fk_field_, fk_id_, count_estimate_threshold_
-                ) INTO preliminary_count;
-
-                IF preliminary_count == count_estimate_threshold_ THEN
-                    -- Use count estimate if preliminary count exceeds threshold
-                    EXECUTE format(
-                        'SELECT sensorthings.count_estimate(
-                            ''SELECT 1 FROM (%s) d WHERE d.%s = %s'')',
-                        replace(query_, '''', ''''''), fk_field_, fk_id_
-                    ) INTO total_count;
-                ELSE
-                    -- Use preliminary count if below threshold
-                    total_count := preliminary_count;
-                END IF;
-
-            ELSIF count_mode_ = 'ESTIMATE_LIMIT' THEN
-                -- Estimate limit mode: perform count estimate first
-                EXECUTE format(
-                    'SELECT sensorthings.count_estimate(
-                        ''SELECT 1 FROM (%s) d WHERE d.%s = %s'')',
-                    replace(query_, '''', ''''''), fk_field_, fk_id_
-                ) INTO total_count;
-
-                -- Perform a precise count with limit if the estimate is below threshold
-                IF total_count < count_estimate_threshold_ THEN
-                    EXECUTE format(
-                        'SELECT COUNT(*) FROM (%s) d WHERE d.%s = %s LIMIT %s',
-                        query_, fk_field_, fk_id_, count_estimate_threshold_
-                    ) INTO total_count;
-                END IF;
-            END IF;
-            RETURN json_build_object(table_, result, table_ || '@iot.nextLink', next_link, table_ || '@iot.count', total_count);
-        END IF;
-        
-        RETURN json_build_object(table_, result, table_ || '@iot.nextLink', next_link);
-
-    ELSE
-		-- Adjust where_clause based on whether fk_id_ is NULL
-		IF fk_id_ IS NULL THEN
-			where_clause := format('d.%s IS NULL', fk_field_);
-		ELSE
-			where_clause := format('d.%s = %s', fk_field_, fk_id_);
-		END IF;
-
-        EXECUTE format(
-			'SELECT COALESCE
-				(
-					(
-						SELECT row_to_json(%I)::jsonb - %L
-						FROM (
-							SELECT %s, * 
-							FROM (%s) d 
-							WHERE %s
-							LIMIT %s OFFSET %s
-						) %I
-					), ''{}''::jsonb
-				)',
-			table_, 'id', id_column, query_, where_clause, limit_ - 1, offset_, table_
-		) INTO result;
-		
-        RETURN result;
-	END IF;
-
-END;
-$$;
-
-CREATE OR REPLACE FUNCTION sensorthings.expand_many2many(
-	query_ text,
-	join_table_ text,
-	fk_id_ integer,
-	related_fk_field1_ text,
-	related_fk_field2_ text,
-	limit_ integer DEFAULT 101,
-	offset_ integer DEFAULT 0,
-    show_id boolean DEFAULT false,
-    table_ text DEFAULT ''::text,
-    base_url_ text DEFAULT ''::text,
-    is_count boolean DEFAULT false,
-    count_mode_ text DEFAULT 'FULL'::text,
-	count_estimate_threshold_ integer DEFAULT 10000,
-    select_node text DEFAULT ''::text,
-    filter_node text DEFAULT ''::text,
-    orderby_node text DEFAULT ''::text,
-    expand_node text DEFAULT ''::text)
-    RETURNS json
-    LANGUAGE 'plpgsql'
-    COST 100
-    VOLATILE PARALLEL UNSAFE
-AS $$
-DECLARE
-    result jsonb;
-    next_link text;
-    id_column text := CASE WHEN show_id THEN 'm.id' ELSE 'm.id as "@iot.id"' END;
-    preliminary_count integer;
-	total_count integer;
-BEGIN
-    EXECUTE format(
-        'SELECT COALESCE
-			(
-				(
-					SELECT jsonb_agg(row_to_json(%I)::jsonb - %L)
-			        FROM (
-						SELECT %s, m.* 
-				      	FROM (%s) m
-				      	JOIN %s jt ON m.id = jt.%s
-				      	WHERE jt.%s = %s
-				      	LIMIT %s OFFSET %s
-					) %I
-				), ''[]''
-			)',
-			table_, 'id', id_column, query_, join_table_, related_fk_field1_, related_fk_field2_, fk_id_, limit_, offset_, table_
-    ) INTO result;
-
-    IF jsonb_array_length(result) > limit_ - 1 THEN
-        result := result - (limit_ - 1);
-        next_link := base_url_ || table_ 
-            || '?$top=' || (limit_ - 1) 
-            || '&$skip=' || (offset_ + limit_ - 1)
-            || CASE 
-                WHEN filter_node <> '' THEN '&$filter=' || filter_node 
-                ELSE '' 
-            END
-            || CASE 
-                WHEN select_node <> '' THEN '&$select=' || select_node 
-                ELSE '' 
-            END
-            || CASE 
-                WHEN orderby_node <> '' THEN '&$orderby=' || orderby_node 
-                ELSE '' 
-            END
-            || CASE 
-                WHEN is_count THEN '&$count=true' 
-                ELSE '' 
-            END
-            || CASE 
-                WHEN expand_node <> '' THEN '&$expand=' || expand_node 
-                ELSE '' 
-            END;
-    ELSE
-        next_link := NULL;
-    END IF;
-
-    IF is_count THEN
-        -- Handle count based on count_mode_
-        IF count_mode_ = 'FULL' THEN
-            -- Full count mode: get the exact count
-            EXECUTE format(
-                'SELECT COUNT(*) FROM (%s) m 
-                JOIN %s jt ON m.id = jt.%s
-                WHERE jt.%s = %s',
-                query_,
-                join_table_,
-                related_fk_field1_,
-                related_fk_field2_,
-                fk_id_
-            ) INTO total_count;
-
-        ELSIF count_mode_ = 'LIMIT_ESTIMATE' THEN
-            -- Limit estimate mode: get preliminary count with a limit
-            EXECUTE format(
-                'SELECT COUNT(*) FROM (%s) m 
-                JOIN %s jt ON m.id = jt.%s
-                WHERE jt.%s = %s
-                LIMIT %s',
-                query_,
-                join_table_,
-                related_fk_field1_,
-                related_fk_field2_,
-                fk_id_,
-                count_estimate_threshold_
-            ) INTO preliminary_count;
-
-            IF preliminary_count = count_estimate_threshold_ THEN
-                -- Use count estimate if preliminary count exceeds threshold
-                EXECUTE format(
-                    'SELECT sensorthings.count_estimate(''SELECT 1 FROM (%s) m 
-                    JOIN %s jt ON m.id = jt.%s
-                    WHERE jt.%s = %s'')',
-                    replace(query_, '''', ''''''),
-                    join_table_,
-                    related_fk_field1_,
-                    related_fk_field2_,
-                    fk_id_
-                ) INTO total_count;
-            ELSE
-                -- Use preliminary count if below threshold
-                total_count := preliminary_count;
-            END IF;
-
-        ELSIF count_mode_ = 'ESTIMATE_LIMIT' THEN
-            -- Estimate limit mode: perform count estimate first
-            EXECUTE format(
-                'SELECT sensorthings.count_estimate(''SELECT 1 FROM (%s) m 
-                JOIN %s jt ON m.id = jt.%s
-                WHERE jt.%s = %s'')',
-                replace(query_, '''', ''''''),
-                join_table_,
-                related_fk_field1_,
-                related_fk_field2_,
-                fk_id_
-            ) INTO total_count;
-
-            -- Perform a precise count with limit if the estimate is below threshold
-            IF total_count < count_estimate_threshold_ THEN
-                EXECUTE format(
-                    'SELECT COUNT(*) FROM (%s) m 
-                    JOIN %s jt ON m.id = jt.%s
-                    WHERE jt.%s = %s
-                    LIMIT %s',
-                    query_,
-                    join_table_,
-                    related_fk_field1_,
-                    related_fk_field2_,
-                    fk_id_,
-                    count_estimate_threshold_
-                ) INTO total_count;
-            END IF;
-        END IF;
-        RETURN json_build_object(table_, result, table_ || '@iot.nextLink', next_link, table_ || '@iot.count', total_count);
-    END IF;
-    
-    RETURN json_build_object(table_, result, table_ || '@iot.nextLink', next_link);
-END;
-$$;
-
 RESET ROLE;
 GRANT ALL PRIVILEGES ON ALL TABLES IN SCHEMA sensorthings TO "administrator";
 GRANT ALL PRIVILEGES ON ALL SEQUENCES IN SCHEMA sensorthings TO "administrator";
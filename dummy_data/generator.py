@@ -13,13 +13,17 @@
 # limitations under the License.
 
 import asyncio
+import io
 import json
+import multiprocessing
 import os
 import random
-from datetime import datetime, time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, time, timedelta, timezone
 
 import asyncpg
 import isodate
+import numpy as np
 
 hostname = os.getenv("HOSTNAME", "http://localhost:8018")
 subpath = os.getenv("SUBPATH", "/istsos4")
@@ -47,6 +51,15 @@ chunk = isodate.parse_duration(os.getenv("CHUNK_INTERVAL", "P1Y"))
 epsg = int(os.getenv("EPSG", 4326))
 authorization = int(os.getenv("AUTHORIZATION", 0))
 st_aggregate = os.getenv("ST_AGGREGATE", "CONVEX_HULL")
+seed = os.getenv("SEED")
+seed = int(seed) if seed else None
+workers = int(os.getenv("WORKERS") or 0) or os.cpu_count() or 1
+n_observations = int(os.getenv("N_OBSERVATIONS") or 0)
+n_featuresofinterest = (
+    int(os.getenv("N_FEATURES_OF_INTEREST") or 0) or n_things
+)
+foi_per_datastream = int(os.getenv("FOI_PER_DATASTREAM") or 0)
+n_datastreams = n_things * n_observed_properties
 
 pgpool = None
 network = int(os.getenv("NETWORK", 0))
@@ -54,6 +67,11 @@ network = int(os.getenv("NETWORK", 0))
 observedProperties = []
 
 
+def get_dsn():
+    port = pg_write_port or pg_port
+    return f"postgresql://{pg_user}:{pg_password}@{pg_host}:{port}/{pg_db}"
+
+
 async def get_pool():
     """
     Retrieves or creates a connection pool to the PostgreSQL database.
@@ -62,13 +80,7 @@ async def get_pool():
         asyncpg.pool.Pool: The connection pool object.
     """
 
-    if pg_write_port:
-        return await asyncpg.create_pool(
-            dsn=f"postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_write_port}/{pg_db}"
-        )
-    return await asyncpg.create_pool(
-        dsn=f"postgresql://{pg_user}:{pg_password}@{pg_host}:{pg_port}/{pg_db}"
-    )
+    return await asyncpg.create_pool(dsn=get_dsn())
 
 
 async def get_user(conn):
@@ -455,7 +467,7 @@ async def generate_featuresofinterest(conn, commit_id):
     """
 
     featuresofinterest = []
-    for i in range(1, n_things + 1):
+    for i in range(1, n_featuresofinterest + 1):
         lon = random.uniform(-180, 180)
         lat = random.uniform(-90, 90)
         # elevation = random.uniform(0, 1000)
@@ -486,44 +498,63 @@ async def generate_featuresofinterest(conn, commit_id):
     await conn.executemany(insert_sql, featuresofinterest)
 
 
-async def insert_observations(conn, observations, commit_id):
-    cols = [
-        "phenomenonTimeStart",
-        "phenomenonTimeEnd",
-        "resultTime",
-        "resultNumber",
-        "resultType",
-        "datastream_id",
-        "featuresofinterest_id",
-    ]
+OBSERVATION_COLUMNS = [
+    "phenomenonTimeStart",
+    "phenomenonTimeEnd",
+    "resultTime",
+    "resultNumber",
+    "resultType",
+    "datastream_id",
+    "featuresofinterest_id",
+]
 
-    if commit_id is not None:
-        cols.append("commit_id")
 
-    column_names = ", ".join(f'"{col}"' for col in cols)
+def microseconds(duration):
+    """
+    Return the microseconds of a duration from the start date, so that
+    durations in months or years are supported.
+    """
+    return ((date + duration) - date) // timedelta(microseconds=1)
 
-    values_placeholders = ", ".join(
-        f"({', '.join(['$' + str(i + 1 + j * len(observations[0])) for i in range(len(observations[0]))])})"
-        for j in range(len(observations))
-    )
 
-    query = f"""
-        INSERT INTO sensorthings."Observation"
-        ({column_names})
-        VALUES {values_placeholders};
+def count_observations(datastream_id):
     """
+    Return the number of observations of a datastream: N_OBSERVATIONS
+    spread over the datastreams, or one every FREQUENCY over INTERVAL.
+    """
+    if n_observations:
+        rows, extra = divmod(n_observations, n_datastreams)
+        return rows + (datastream_id <= extra)
+    return -(-microseconds(interval) // microseconds(frequency))
 
-    flattened_values = [
-        item for observation in observations for item in observation
-    ]
 
-    await conn.execute(query, *flattened_values)
+def observations_csv(times, results, datastream_id, foi_ids, commit_id):
+    """
+    Format observations as CSV with vectorized string operations.
+
+    Args:
+        times (numpy.ndarray): The phenomenon times, as datetime64[us] in UTC.
+        results (numpy.ndarray): The results.
+        datastream_id (int): The datastream ID.
+        foi_ids (numpy.ndarray): The feature of interest ID of each result.
+        commit_id: The commit ID, or None.
+
+    Returns:
+        bytes: The CSV rows in the order of OBSERVATION_COLUMNS.
+    """
+    timestamps = np.datetime_as_string(times, unit="us", timezone="UTC")
+    lines = np.char.add(timestamps, ",")
+    lines = np.char.add(np.char.add(lines, timestamps), ",")
+    lines = np.char.add(np.char.add(lines, timestamps), ",")
+    lines = np.char.add(lines, results.astype(str))
+    lines = np.char.add(lines, f",0,{datastream_id},")
+    lines = np.char.add(lines, foi_ids.astype(str))
+    if commit_id is not None:
+        lines = np.char.add(lines, f",{commit_id}")
+    return ("\n".join(lines.tolist()) + "\n").encode()
 
 
-async def update_datastream_phenomenon_time(conn, observations, datastream_id):
-    phenomenon_starts = [record[0] for record in observations]
-    phenomenon_ends = [record[1] for record in observations]
-    result_times = [record[2] for record in observations]
+async def update_datastream_phenomenon_time(conn, datastream_id, start, end):
     update_sql = """
         UPDATE sensorthings."Datastream"
         SET "phenomenonTime" = tstzrange(
@@ -532,135 +563,145 @@ async def update_datastream_phenomenon_time(conn, observations, datastream_id):
             '[]'
         ),
         "resultTime" = tstzrange(
-            LEAST($3::timestamptz, lower("resultTime")),
-            GREATEST($4::timestamptz, upper("resultTime")),
+            LEAST($1::timestamptz, lower("resultTime")),
+            GREATEST($2::timestamptz, upper("resultTime")),
             '[]'
         )
-        WHERE id = $5::bigint
-    """
-    await conn.execute(
-        update_sql,
-        min(phenomenon_starts),
-        max(phenomenon_ends),
-        min(result_times),
-        max(result_times),
-        datastream_id,
+        WHERE id = $3::bigint
+    """
+    await conn.execute(update_sql, start, end, datastream_id)
+
+
+async def update_datastream_observed_area(conn, datastream_id, foi_ids):
+    aggregate = (
+        "ST_ConvexHull" if st_aggregate == "CONVEX_HULL" else "ST_Envelope"
     )
+    query = f"""
+        UPDATE sensorthings."Datastream"
+        SET "observedArea" = (
+            SELECT {aggregate}(ST_Collect(feature))
+            FROM sensorthings."FeaturesOfInterest"
+            WHERE id = ANY($2::bigint[])
+        )
+        WHERE id = $1;
+    """
+    await conn.execute(query, datastream_id, foi_ids)
 
 
-async def update_datastream_observed_area(conn):
-    query = 'SELECT DISTINCT id FROM sensorthings."Datastream";'
-    datastream_ids = await conn.fetch(query)
-    for ds in datastream_ids:
-        ds = ds["id"]
-        # Fetch distinct featuresofinterest IDs associated with the datastream
-        query = 'SELECT DISTINCT featuresofinterest_id FROM sensorthings."Observation" WHERE "datastream_id" = $1;'
-        featuresofinterest_ids = await conn.fetch(query, ds)
-
-        # Collect the geometries for each feature of interest
-        geometries = []
-        for foi in featuresofinterest_ids:
-            foi_id = foi["featuresofinterest_id"]
-
-            # Fetch the actual geometry associated with the feature of interest
-            query = 'SELECT feature FROM sensorthings."FeaturesOfInterest" WHERE id = $1;'
-            geometry = await conn.fetchval(query, foi_id)
-
-            if geometry:
-                geometries.append(geometry)
-
-        if geometries:
-            if st_aggregate == "CONVEX_HULL":
-                query = f"""
-                UPDATE sensorthings."Datastream"
-                SET "observedArea" = ST_ConvexHull(
-                    ST_Collect(
-                        ARRAY[{', '.join(f"'{g}'::geometry" for g in geometries)}]
-                    )
-                )
-                WHERE id = $1;
-                """
-            else:
-                query = f"""
-                UPDATE sensorthings."Datastream"
-                SET "observedArea" = ST_Envelope(
-                    ST_Collect(
-                        ARRAY[{', '.join(f"'{g}'::geometry" for g in geometries)}]
-                    )
+async def copy_datastream_observations(conn, datastream_id, commit_id, seed):
+    """
+    Generate the observations of a datastream and COPY them into the
+    database, CHUNK_INTERVAL at a time.
+
+    The values depend only on the seed and the datastream ID, so a dataset
+    is rebuilt exactly whatever the number of workers.
+
+    Returns:
+        int: The number of observations.
+    """
+    rng = np.random.default_rng([seed, datastream_id])
+    if foi_per_datastream:
+        foi_choices = rng.choice(
+            np.arange(1, n_featuresofinterest + 1),
+            size=min(foi_per_datastream, n_featuresofinterest),
+            replace=False,
+        )
+    else:
+        foi_choices = np.arange(1, n_featuresofinterest + 1)
+
+    start = np.datetime64(
+        date.astimezone(timezone.utc).replace(tzinfo=None), "us"
+    )
+    step = np.timedelta64(microseconds(frequency), "us")
+    rows = count_observations(datastream_id)
+    block_rows = max(1, microseconds(chunk) // microseconds(frequency))
+
+    used_foi_ids = set()
+    for offset in range(0, rows, block_rows):
+        size = min(block_rows, rows - offset)
+        times = start + step * np.arange(offset + 1, offset + size + 1)
+        results = rng.integers(1, 101, size=size)
+        foi_ids = rng.choice(foi_choices, size=size)
+        used_foi_ids.update(np.unique(foi_ids).tolist())
+        await conn.copy_to_table(
+            "Observation",
+            schema_name="sensorthings",
+            source=io.BytesIO(
+                observations_csv(
+                    times, results, datastream_id, foi_ids, commit_id
                 )
-                WHERE id = $1;
-                """
+            ),
+            columns=OBSERVATION_COLUMNS
+            + (["commit_id"] if commit_id is not None else []),
+            format="csv",
+        )
 
-            # Execute the update query, passing the datastream_id
-            await conn.execute(query, ds)
+    if rows:
+        first = date + timedelta(microseconds=microseconds(frequency))
+        last = date + timedelta(microseconds=microseconds(frequency) * rows)
+        await update_datastream_phenomenon_time(
+            conn, datastream_id, first, last
+        )
+        await update_datastream_observed_area(
+            conn, datastream_id, sorted(used_foi_ids)
+        )
+    return rows
+
+
+async def copy_observations(datastream_ids, commit_id, seed):
+    conn = await asyncpg.connect(dsn=get_dsn())
+    try:
+        count = 0
+        for datastream_id in datastream_ids:
+            count += await copy_datastream_observations(
+                conn, datastream_id, commit_id, seed
+            )
+        return count
+    finally:
+        await conn.close()
 
 
-async def generate_observations(conn, commit_id):
+def observations_worker(datastream_ids, commit_id, seed):
+    return asyncio.run(copy_observations(datastream_ids, commit_id, seed))
+
+
+async def generate_observations(commit_id, seed):
     """
-    Generates observations and inserts them into the database.
+    Generates observations and copies them into the database, splitting
+    the datastreams among WORKERS processes.
 
     Args:
-        cur: The database cursor object.
+        commit_id: The commit ID, or None.
+        seed (int): The seed of the generated values.
 
     Returns:
         None
     """
 
-    observations = []
-    for j in range(1, n_things * n_observed_properties + 1):
-        phenomenonTime = date
-        check_date = date
-
-        while phenomenonTime < (date + interval):
-            phenomenonTime += frequency
-            phenomenonTimeStart = phenomenonTime
-            phenomenonTimeEnd = phenomenonTime
-            resultTime = phenomenonTime
-            resultNumber = random.randint(1, 100)
-            resultType = 0
-            datastream_id = j
-            featuresofinterest_id = random.randint(1, n_things)
-
-            if commit_id is not None:
-                observations.append(
-                    (
-                        phenomenonTimeStart,
-                        phenomenonTimeEnd,
-                        resultTime,
-                        resultNumber,
-                        resultType,
-                        datastream_id,
-                        featuresofinterest_id,
-                        commit_id,
-                    )
-                )
-            else:
-                observations.append(
-                    (
-                        phenomenonTimeStart,
-                        phenomenonTimeEnd,
-                        resultTime,
-                        resultNumber,
-                        resultType,
-                        datastream_id,
-                        featuresofinterest_id,
-                    )
-                )
-            if phenomenonTime >= (check_date + chunk):
-                await insert_observations(conn, observations, commit_id)
-                await update_datastream_phenomenon_time(
-                    conn, observations, datastream_id
+    datastream_ids = list(range(1, n_datastreams + 1))
+    groups = [
+        datastream_ids[i::workers]
+        for i in range(workers)
+        if datastream_ids[i::workers]
+    ]
+    loop = asyncio.get_running_loop()
+    # Spawned workers do not inherit the running event loop
+    with ProcessPoolExecutor(
+        max_workers=len(groups),
+        mp_context=multiprocessing.get_context("spawn"),
+    ) as executor:
+        counts = await asyncio.gather(
+            *(
+                loop.run_in_executor(
+                    executor, observations_worker, group, commit_id, seed
                 )
-                check_date = phenomenonTime
-                observations = []
-
-    if observations:
-        await insert_observations(conn, observations, commit_id)
-        await update_datastream_phenomenon_time(
-            conn, observations, datastream_id
+                for group in groups
+            )
         )
-
-    await update_datastream_observed_area(conn)
+    print(
+        f"Copied {sum(counts)} observations of {n_datastreams} datastreams "
+        f"with {len(groups)} workers"
+    )
 
 
 async def create_data():
@@ -674,6 +715,11 @@ async def create_data():
 
     After the creation is complete, the database connection is closed.
     """
+    data_seed = seed
+    if data_seed is None:
+        data_seed = random.SystemRandom().getrandbits(32)
+    print(f"Generating dummy data with SEED={data_seed}")
+    random.seed(data_seed)
     pool = await get_pool()
     try:
         async with pool.acquire() as conn:
@@ -703,7 +749,7 @@ async def create_data():
                 await generate_sensors(conn, commit_id)
                 await generate_datastreams(conn, commit_id, network_ids)
                 await generate_featuresofinterest(conn, commit_id)
-                await generate_observations(conn, commit_id)
+                await generate_observations(commit_id, data_seed)
             except Exception as e:
                 print(f"An error occured: {e}")
     finally:
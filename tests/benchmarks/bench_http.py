@@ -0,0 +1,685 @@
+"""
+bench_http.py -- end-to-end HTTP benchmark of the read and ingest workloads.
+
+Seeds a known dataset through the API, then drives each workload with a fixed
+number of requests at a fixed concurrency and writes the p50/p95/p99 latency
+and the rows per second of every workload to a JSON report, tagged with the
+commit it was run on. Two reports are compared with the `compare` command.
+
+The API is either the one at --url (a uvicorn or docker compose deployment),
+or, with --in-process, the ASGI app of api/ driven in this process with the
+database configured by the usual POSTGRES_* environment variables.
+
+The dataset is `--things` Things with `--datastreams` Datastreams each and
+`--observations` Observations per Datastream, every `--step` seconds from
+2020-01-01T00:00:00Z, with results drawn from --seed. Its entities are named
+after a unique tag and deleted at the end of the run, unless --keep is given.
+
+Usage:
+    python tests/benchmarks/bench_http.py run [--url URL | --in-process]
+        [--output report.json] [--requests N] [--concurrency N] ...
+    python tests/benchmarks/bench_http.py compare base.json head.json
+"""
+
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from dataclasses import dataclass
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, "..", "..")
+
+DEFAULT_BASE_URL = "http://localhost:8018/istsos4/v1.1"
+
+START = datetime(2020, 1, 1, tzinfo=timezone.utc)
+
+# The Observations sent with one request while seeding
+SEED_BATCH_SIZE = 10000
+
+# The Observations of a Datastream whose ids are sampled for the by-id reads
+SAMPLED_IDS = 100
+
+COMMIT_MESSAGE = {"commit-message": "benchmark"}
+
+CLEANUP_COLLECTIONS = [
+    "Things",
+    "FeaturesOfInterest",
+    "Locations",
+    "Sensors",
+    "ObservedProperties",
+]
+
+
+@dataclass
+class Dataset:
+    """The seeded entities the workloads address."""
+
+    tag: str
+    observations: int
+    step: int
+    thing_ids: list
+    datastream_ids: list
+    observation_ids: list
+    ingest_datastream_ids: list
+
+    def time(self, index):
+        return format_time(START + timedelta(seconds=index * self.step))
+
+
+@dataclass
+class Workload:
+    """
+    A request shape.
+
+    `request` returns the method, path and JSON body of the i-th request,
+    `rows` the rows a response returned or inserted.
+    """
+
+    name: str
+    kind: str
+    request: Callable
+    rows: Callable
+
+
+def format_time(value):
+    return value.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+
+def percentile(values, fraction):
+    """Linear interpolation between the closest ranks of sorted values."""
+    if not values:
+        return None
+    position = (len(values) - 1) * fraction
+    lower = int(position)
+    upper = min(lower + 1, len(values) - 1)
+    return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+
+def count_rows(response):
+    """The entities of a JSON response, counting the dataArray rows."""
+    body = response.json()
+    if "value" not in body:
+        return 1
+    rows = 0
+    for item in body["value"]:
+        if isinstance(item, dict) and "dataArray" in item:
+            rows += len(item["dataArray"])
+        else:
+            rows += 1
+    return rows
+
+
+def inserted_rows(size):
+    def rows(response):
+        inserted = response.headers.get("Observations-Inserted")
+        return int(inserted) if inserted is not None else size
+
+    return rows
+
+
+def created_rows(response):
+    """The Observations /CreateObservations created, skipping the errors."""
+    return sum(1 for link in response.json() if link != "error")
+
+
+def observation_rows(rng, dataset, datastream_id, first, size):
+    return {
+        "Datastream": {"@iot.id": datastream_id},
+        "components": ["result", "phenomenonTime", "resultTime"],
+        "dataArray": [
+            [round(rng.gauss(20, 5), 3), dataset.time(i), dataset.time(i)]
+            for i in range(first, first + size)
+        ],
+    }
+
+
+def read_workloads(dataset, seed, window):
+    """
+    The read request shapes. Each draws its entities from its own generator,
+    so that the requests of a workload are the same in every run.
+    """
+    thing = random.Random(f"{seed}-thing_by_id").choice
+    observation = random.Random(f"{seed}-observation_by_id").choice
+    time_filtered = random.Random(f"{seed}-observations_time_filter")
+    expanded = random.Random(f"{seed}-deep_expand").choice
+    counted = random.Random(f"{seed}-observations_count").choice
+    array = random.Random(f"{seed}-data_array").choice
+
+    def time_filter(i):
+        datastream = time_filtered.choice(dataset.datastream_ids)
+        first = time_filtered.randrange(max(dataset.observations - window, 1))
+        return (
+            "GET",
+            f"/Datastreams({datastream})/Observations"
+            f"?$filter=phenomenonTime ge {dataset.time(first)} and "
+            f"phenomenonTime lt {dataset.time(first + window)}"
+            f"&$orderby=phenomenonTime asc&$top={window}",
+            None,
+        )
+
+    return [
+        Workload(
+            "thing_by_id",
+            "read",
+            lambda i: (
+                "GET",
+                f"/Things({thing(dataset.thing_ids)})",
+                None,
+            ),
+            count_rows,
+        ),
+        Workload(
+            "observation_by_id",
+            "read",
+            lambda i: (
+                "GET",
+                f"/Observations({observation(dataset.observation_ids)})",
+                None,
+            ),
+            count_rows,
+        ),
+        Workload("observations_time_filter", "read", time_filter, count_rows),
+        Workload(
+            "deep_expand",
+            "read",
+            lambda i: (
+                "GET",
+                f"/Things({expanded(dataset.thing_ids)})"
+                "?$expand=Locations,Datastreams($expand=Sensor,"
+                "ObservedProperty,Observations($orderby=phenomenonTime desc;"
+                "$top=10))",
+                None,
+            ),
+            count_rows,
+        ),
+        Workload(
+            "observations_count",
+            "read",
+            lambda i: (
+                "GET",
+                f"/Datastreams({counted(dataset.datastream_ids)})/Observations"
+                "?$count=true&$top=1",
+                None,
+            ),
+            count_rows,
+        ),
+        Workload(
+            "data_array",
+            "read",
+            lambda i: (
+                "GET",
+                f"/Datastreams({array(dataset.datastream_ids)})/Observations"
+                f"?$resultFormat=dataArray&$orderby=phenomenonTime asc"
+                f"&$top={window * 10}",
+                None,
+            ),
+            count_rows,
+        ),
+    ]
+
+
+def ingest_workloads(dataset, seed, batch_size):
+    """
+    The ingest request shapes, each on its own Datastream and writing
+    Observations after the seeded ones, so that no request conflicts.
+    """
+    single, bulk, data_array = dataset.ingest_datastream_ids
+    first = dataset.observations
+    rng = random.Random(f"{seed}-ingest")
+
+    def post_observation(i):
+        return (
+            "POST",
+            "/Observations",
+            {
+                "result": round(rng.gauss(20, 5), 3),
+                "phenomenonTime": dataset.time(first + i),
+                "Datastream": {"@iot.id": single},
+            },
+        )
+
+    def batch(path, datastream_id):
+        def request(i):
+            return (
+                "POST",
+                path,
+                [
+                    observation_rows(
+                        rng,
+                        dataset,
+                        datastream_id,
+                        first + i * batch_size,
+                        batch_size,
+                    )
+                ],
+            )
+
+        return request
+
+    return [
+        Workload("post_observation", "ingest", post_observation, lambda r: 1),
+        Workload(
+            "bulk_observations",
+            "ingest",
+            batch("/BulkObservations", bulk),
+            inserted_rows(batch_size),
+        ),
+        Workload(
+            "create_observations",
+            "ingest",
+            batch("/CreateObservations", data_array),
+            created_rows,
+        ),
+    ]
+
+
+async def run_workload(client, workload, requests, concurrency, warmup):
+    """
+    Issue the requests of a workload from `concurrency` tasks.
+
+    Returns:
+        dict: The latency percentiles in milliseconds, the throughput and
+            the failed requests.
+    """
+    counter = iter(range(warmup + requests))
+    latencies = []
+    rows = 0
+    errors = []
+
+    async def worker():
+        nonlocal rows
+        for i in counter:
+            method, path, body = workload.request(i)
+            started = time.perf_counter()
+            response = await client.request(
+                method,
+                path,
+                json=body,
+                headers=COMMIT_MESSAGE if method != "GET" else None,
+            )
+            await response.aread()
+            elapsed = time.perf_counter() - started
+            if i < warmup:
+                continue
+            if response.is_success:
+                latencies.append(elapsed)
+                rows += workload.rows(response)
+            else:
+                errors.append(f"{response.status_code} {response.text[:200]}")
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    result = {
+        "kind": workload.kind,
+        "requests": requests,
+        "concurrency": concurrency,
+        "errors": len(errors),
+        "seconds": round(elapsed, 3),
+        "requests_per_second": round(len(latencies) / elapsed, 1),
+        "rows": rows,
+        "rows_per_second": round(rows / elapsed, 1),
+    }
+    for name, fraction in (("p50", 0.5), ("p95", 0.95), ("p99", 0.99)):
+        value = percentile(latencies, fraction)
+        result[f"{name}_ms"] = (
+            round(value * 1000, 3) if value is not None else None
+        )
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def check(response):
+    if not response.is_success:
+        raise RuntimeError(
+            f"{response.request.method} {response.request.url} failed: "
+            f"{response.status_code} {response.text[:400]}"
+        )
+    return response
+
+
+def thing_payload(name, datastreams, longitude):
+    return {
+        "name": name,
+        "description": "Benchmark thing",
+        "Locations": [
+            {
+                "name": name,
+                "description": "Benchmark location",
+                "encodingType": "application/vnd.geo+json",
+                "location": {
+                    "type": "Point",
+                    "coordinates": [longitude, 46.0],
+                },
+            }
+        ],
+        "Datastreams": [
+            {
+                "name": f"{name} {j}",
+                "description": "Benchmark datastream",
+                "unitOfMeasurement": {
+                    "name": "Degree Celsius",
+                    "symbol": "degC",
+                    "definition": "http://www.qudt.org/qudt/owl/1.0.0/"
+                    "unit/Instances.html#DegreeCelsius",
+                },
+                "observationType": "http://www.opengis.net/def/"
+                "observationType/OGC-OM/2.0/OM_Measurement",
+                "Sensor": {
+                    "name": f"{name} {j}",
+                    "description": "Benchmark sensor",
+                    "encodingType": "application/pdf",
+                    "metadata": "https://example.org/sensor.pdf",
+                },
+                "ObservedProperty": {
+                    "name": f"{name} {j}",
+                    "definition": "https://example.org/temperature",
+                    "description": "Benchmark property",
+                },
+            }
+            for j in range(datastreams)
+        ],
+    }
+
+
+async def create_thing(client, name, datastreams, longitude):
+    response = check(
+        await client.post(
+            "/Things",
+            json=thing_payload(name, datastreams, longitude),
+            headers=COMMIT_MESSAGE,
+        )
+    )
+    location = response.headers["location"]
+    thing_id = int(location.rstrip(")").rsplit("(", 1)[1])
+    body = check(
+        await client.get(
+            f"/Things({thing_id})/Datastreams",
+            params={"$select": "id", "$orderby": "id asc"},
+        )
+    ).json()
+    return thing_id, [datastream["@iot.id"] for datastream in body["value"]]
+
+
+async def seed_dataset(client, args):
+    """
+    Create the benchmark entities and load their Observations.
+
+    Returns:
+        Dataset: The ids of the seeded entities.
+    """
+    tag = f"bench-{uuid.uuid4().hex[:12]}"
+    thing_ids = []
+    datastream_ids = []
+    for index in range(args.things):
+        thing_id, ids = await create_thing(
+            client, f"{tag} {index}", args.datastreams, 8.9 + index * 0.01
+        )
+        thing_ids.append(thing_id)
+        datastream_ids.extend(ids)
+    _, ingest_datastream_ids = await create_thing(
+        client, f"{tag} ingest", 3, 8.89
+    )
+
+    dataset = Dataset(
+        tag=tag,
+        observations=args.observations,
+        step=args.step,
+        thing_ids=thing_ids,
+        datastream_ids=datastream_ids,
+        observation_ids=[],
+        ingest_datastream_ids=ingest_datastream_ids,
+    )
+
+    rng = random.Random(args.seed)
+    for datastream_id in datastream_ids:
+        for first in range(0, args.observations, SEED_BATCH_SIZE):
+            size = min(SEED_BATCH_SIZE, args.observations - first)
+            check(
+                await client.post(
+                    "/BulkObservations",
+                    json=[
+                        observation_rows(
+                            rng, dataset, datastream_id, first, size
+                        )
+                    ],
+                    headers=COMMIT_MESSAGE,
+                )
+            )
+        body = check(
+            await client.get(
+                f"/Datastreams({datastream_id})/Observations",
+                params={"$select": "id", "$top": SAMPLED_IDS},
+            )
+        ).json()
+        dataset.observation_ids.extend(
+            observation["@iot.id"] for observation in body["value"]
+        )
+    return dataset
+
+
+async def delete_dataset(client, tag):
+    """
+    Delete the entities named after the tag. The Things go first, with
+    their Datastreams and Observations.
+    """
+    for collection in CLEANUP_COLLECTIONS:
+        while True:
+            body = check(
+                await client.get(
+                    f"/{collection}",
+                    params={
+                        "$filter": f"startswith(name,'{tag}')",
+                        "$select": "id",
+                        "$top": 1000,
+                    },
+                )
+            ).json()
+            if not body["value"]:
+                break
+            for entity in body["value"]:
+                check(
+                    await client.delete(
+                        f"/{collection}({entity['@iot.id']})",
+                        headers=COMMIT_MESSAGE,
+                    )
+                )
+
+
+async def login(client, username, password):
+    response = check(
+        await client.post(
+            "/Login", data={"username": username, "password": password}
+        )
+    )
+    client.headers["Authorization"] = (
+        f"Bearer {response.json()['access_token']}"
+    )
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(
+            ["git", "-C", ROOT, *args],
+            capture_output=True,
+            text=True,
+            check=False,
+        ).stdout.strip()
+
+    return {
+        "commit": git("rev-parse", "HEAD") or None,
+        "dirty": bool(git("status", "--porcelain", "--untracked-files=no")),
+    }
+
+
+async def benchmark(client, args):
+    if args.username:
+        await login(client, args.username, args.password)
+
+    started = time.perf_counter()
+    dataset = await seed_dataset(client, args)
+    seed_seconds = time.perf_counter() - started
+    print(
+        f"Seeded {len(dataset.datastream_ids)} datastreams x "
+        f"{args.observations} observations in {seed_seconds:.1f} s "
+        f"({dataset.tag})"
+    )
+
+    workloads = []
+    if "read" in args.kinds:
+        workloads += read_workloads(dataset, args.seed, args.window)
+    if "ingest" in args.kinds:
+        workloads += ingest_workloads(dataset, args.seed, args.batch_size)
+    if args.only:
+        workloads = [w for w in workloads if w.name in args.only]
+
+    results = {}
+    try:
+        for workload in workloads:
+            results[workload.name] = result = await run_workload(
+                client,
+                workload,
+                args.requests,
+                args.concurrency,
+                args.warmup,
+            )
+            print_result(workload.name, result)
+    finally:
+        if not args.keep:
+            await delete_dataset(client, dataset.tag)
+
+    return {
+        **git_revision(),
+        "created": datetime.now(timezone.utc).isoformat(),
+        "target": "in-process" if args.in_process else args.url,
+        "dataset": {
+            "things": args.things,
+            "datastreams": args.datastreams,
+            "observations": args.observations,
+            "step": args.step,
+            "seed": args.seed,
+            "seed_seconds": round(seed_seconds, 3),
+        },
+        "workloads": results,
+    }
+
+
+def print_result(name, result):
+    print(
+        f"{name:>26}: p50 {result['p50_ms'] or 0:8.2f} ms  "
+        f"p95 {result['p95_ms'] or 0:8.2f} ms  "
+        f"p99 {result['p99_ms'] or 0:8.2f} ms  "
+        f"{result['rows_per_second']:10.1f} rows/s  "
+        f"{result['errors']} errors"
+    )
+
+
+async def run_in_process(args):
+    sys.path.insert(0, os.path.join(ROOT, "api"))
+    from app import SUBPATH, VERSION
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(
+            transport=httpx.ASGITransport(app=app),
+            base_url=f"http://benchmark{SUBPATH}{VERSION}",
+            timeout=args.timeout,
+        ) as client:
+            return await benchmark(client, args)
+
+
+async def run_remote(args):
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(
+        base_url=args.url, timeout=args.timeout, limits=limits
+    ) as client:
+        return await benchmark(client, args)
+
+
+def run(args):
+    runner = run_in_process if args.in_process else run_remote
+    report = asyncio.run(runner(args))
+    with open(args.output, "w") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+
+def compare(args):
+    with open(args.base) as file:
+        base = json.load(file)
+    with open(args.head) as file:
+        head = json.load(file)
+
+    print(f"base {base.get('commit')}  head {head.get('commit')}")
+    for name, result in head["workloads"].items():
+        before = base["workloads"].get(name)
+        if before is None:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "rows_per_second"):
+            if before.get(key) and result.get(key) is not None:
+                change = (result[key] / before[key] - 1) * 100
+                changes.append(f"{key} {result[key]:>10} ({change:+6.1f}%)")
+        print(f"{name:>26}: " + "  ".join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    parser_run = commands.add_parser("run", help="run the benchmark")
+    target = parser_run.add_mutually_exclusive_group()
+    target.add_argument(
+        "--url", default=os.environ.get("STA_BASE_URL", DEFAULT_BASE_URL)
+    )
+    target.add_argument("--in-process", action="store_true")
+    parser_run.add_argument("--output", default="benchmark.json")
+    parser_run.add_argument("--things", type=int, default=10)
+    parser_run.add_argument("--datastreams", type=int, default=2)
+    parser_run.add_argument("--observations", type=int, default=10000)
+    parser_run.add_argument("--step", type=int, default=600)
+    parser_run.add_argument("--seed", type=int, default=42)
+    parser_run.add_argument("--requests", type=int, default=500)
+    parser_run.add_argument("--warmup", type=int, default=20)
+    parser_run.add_argument("--concurrency", type=int, default=8)
+    parser_run.add_argument("--window", type=int, default=100)
+    parser_run.add_argument("--batch-size", type=int, default=1000)
+    parser_run.add_argument(
+        "--kinds",
+        nargs="+",
+        choices=["read", "ingest"],
+        default=["read", "ingest"],
+    )
+    parser_run.add_argument("--only", nargs="+", help="workload names")
+    parser_run.add_argument("--timeout", type=float, default=60)
+    parser_run.add_argument("--username")
+    parser_run.add_argument("--password")
+    parser_run.add_argument("--keep", action="store_true")
+    parser_run.set_defaults(handler=run)
+
+    parser_compare = commands.add_parser("compare", help="compare reports")
+    parser_compare.add_argument("base")
+    parser_compare.add_argument("head")
+    parser_compare.set_defaults(handler=compare)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+bench_lexer.py -- micro-benchmark of the STA query Lexer.
+
+Tokenizes the query strings of the conformance URL corpus with the Lexer and
+with the previous tokenizer, which tried each token type in turn with its own
+re.compile/match, checks that both produce the same tokens and reports the
+time per query of each.
+
+Usage:
+    python tests/benchmarks/bench_lexer.py [--repeat N]
+"""
+
+from __future__ import annotations
+
+import argparse
+import os
+import re
+import sys
+import timeit
+import urllib.parse
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "api"))
+
+from corpus import CONFORMANCE_URLS, query_string  # noqa: E402
+
+from app.sta2rest.sta_parser.lexer import (  # noqa: E402
+    TOKEN_TYPES,
+    Lexer,
+)
+
+
+def tokenize_per_type(text):
+    """The tokenizer before the single alternation, for comparison."""
+    text = urllib.parse.unquote_plus(text)
+    tokens = []
+    position = 0
+    while position < len(text):
+        for token_type, pattern in TOKEN_TYPES.items():
+            match = re.compile(pattern).match(text, position)
+            if match:
+                tokens.append((token_type, match.group(0)))
+                position = match.end(0)
+                break
+        else:
+            raise Exception(f"Invalid character at position {position}")
+    return tokens
+
+
+def tokenize(text):
+    return [(token.type, token.value) for token in Lexer(text).tokens]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    queries = [
+        query
+        for query in map(query_string, CONFORMANCE_URLS)
+        if query is not None
+    ]
+    for query in queries:
+        if tokenize(query) != tokenize_per_type(query):
+            sys.exit(f"Token mismatch for {query!r}")
+
+    results = {}
+    for name, function in (
+        ("per-type", tokenize_per_type),
+        ("alternation", tokenize),
+    ):
+        seconds = min(
+            timeit.repeat(
+                lambda: [function(query) for query in queries],
+                number=args.repeat,
+                repeat=5,
+            )
+        )
+        results[name] = seconds / args.repeat / len(queries)
+
+    print(f"{len(queries)} queries, identical tokens")
+    for name, seconds in results.items():
+        print(f"{name:>12}: {seconds * 1e6:8.1f} us/query")
+    print(
+        f"{'speedup':>12}: {results['per-type'] / results['alternation']:8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
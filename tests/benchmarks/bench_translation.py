@@ -0,0 +1,340 @@
+"""
+bench_translation.py -- per-stage micro-benchmark of the STA to SQL translator.
+
+Translates the conformance and synthetic URL corpus with
+STA2REST.translate_query, bypassing the translation cache, and attributes the
+time of every translation to the stage it is spent in:
+
+    lexer           the STA query Lexer
+    parser          the STA query Parser
+    odata           the sly-based ODataLexer and ODataParser of each $filter
+    filter_visitor  the FilterVisitor turning a $filter into SQLAlchemy
+    node_visitor    the rest of the NodeVisitor building the SQLAlchemy query
+    sql_compile     the compilation of the SQLAlchemy queries to SQL text
+    other           the rest of translate_query: the path and AST rewriting
+
+Each stage is timed exclusive of the stages it calls. A separate pass under
+tracemalloc records the peak memory each stage allocates above its start.
+The time of a translation served by the translation cache is reported too.
+No database is needed.
+
+The report can be written to JSON and compared against a previous one; the
+exit status is 1 when a stage got slower than --max-regression percent.
+
+Usage:
+    python tests/benchmarks/bench_translation.py [--repeat N] [--top N]
+        [--output report.json] [--baseline base.json] [--max-regression P]
+"""
+
+from __future__ import annotations
+
+import argparse
+import functools
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+sys.path.insert(0, os.path.join(HERE, "..", "..", "api"))
+
+# The translator reads its settings at import; none of them needs a database
+os.environ.setdefault("DEBUG", "0")
+
+from corpus import CONFORMANCE_URLS, SYNTHETIC_URLS  # noqa: E402
+
+from app import VERSION  # noqa: E402
+
+# sta2rest first: the visitors import it back
+from app.sta2rest.sta2rest import STA2REST  # noqa: E402, I001
+from app.sta2rest import visitors  # noqa: E402
+from app.sta2rest.filter_visitor import FilterVisitor  # noqa: E402
+from app.sta2rest.odata_query.grammar import ODataParser  # noqa: E402
+from app.sta2rest.sta_parser.lexer import Lexer  # noqa: E402
+from app.sta2rest.sta_parser.parser import Parser  # noqa: E402
+
+STAGES = [
+    "lexer",
+    "parser",
+    "odata",
+    "filter_visitor",
+    "node_visitor",
+    "sql_compile",
+    "other",
+]
+
+
+class StageTimer:
+    """
+    Attributes the time and the peak memory of the running translation to
+    the stages on its call stack.
+
+    Attributes:
+        seconds (dict): The exclusive time of each stage.
+        peak (dict): The most bytes each stage had allocated above its start,
+            when tracemalloc is tracing.
+    """
+
+    def __init__(self):
+        self.stack = []
+        self.reset()
+
+    def reset(self):
+        self.seconds = dict.fromkeys(STAGES, 0.0)
+        self.peak = dict.fromkeys(STAGES, 0)
+
+    def wrap(self, stage, function):
+        @functools.wraps(function)
+        def timed(*args, **kwargs):
+            # Recursive calls of a stage belong to its outermost call
+            if self.stack and self.stack[-1][0] == stage:
+                return function(*args, **kwargs)
+            self.enter(stage)
+            try:
+                return function(*args, **kwargs)
+            finally:
+                self.exit()
+
+        return timed
+
+    def enter(self, stage):
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            current, peak = tracemalloc.get_traced_memory()
+            if self.stack:
+                # Keep the peak of the caller before resetting it
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+            tracemalloc.reset_peak()
+        else:
+            current = 0
+        # stage, start, time spent in the stages it called, peak, base
+        self.stack.append([stage, time.perf_counter(), 0.0, 0, current])
+
+    def exit(self):
+        stage, start, nested, peak, base = self.stack.pop()
+        elapsed = time.perf_counter() - start
+        self.seconds[stage] += elapsed - nested
+        if self.stack:
+            self.stack[-1][2] += elapsed
+        if tracemalloc.is_tracing():
+            peak = max(peak, tracemalloc.get_traced_memory()[1])
+            self.peak[stage] = max(self.peak[stage], peak - base)
+            if self.stack:
+                self.stack[-1][3] = max(self.stack[-1][3], peak)
+
+
+def instrument(timer):
+    """
+    Wrap the entry point of each stage with the timer. The wrappers stay in
+    place for the rest of the process.
+    """
+    Lexer.__init__ = timer.wrap("lexer", Lexer.__init__)
+    Parser.parse = timer.wrap("parser", Parser.parse)
+    ODataParser.parse = timer.wrap("odata", ODataParser.parse)
+    FilterVisitor.visit = timer.wrap("filter_visitor", FilterVisitor.visit)
+    visitors.NodeVisitor.visit = timer.wrap(
+        "node_visitor", visitors.NodeVisitor.visit
+    )
+    visitors.compile_query = timer.wrap("sql_compile", visitors.compile_query)
+    visitors.get_query_compiled = timer.wrap(
+        "sql_compile", visitors.get_query_compiled
+    )
+
+
+def translate(timer, url):
+    timer.reset()
+    timer.enter("other")
+    try:
+        STA2REST.translate_query(f"{VERSION}{url}")
+    finally:
+        timer.exit()
+    return timer.seconds, timer.peak
+
+
+def measure(timer, urls, repeat):
+    """
+    Time each translation `repeat` times and keep the fastest run of every
+    stage.
+
+    Returns:
+        tuple: The stage times and peaks by URL, and the URLs that failed to
+            translate with their error.
+    """
+    results = {}
+    failed = {}
+    for url in urls:
+        try:
+            translate(timer, url)
+        except Exception as e:
+            failed[url] = f"{type(e).__name__}: {e}"
+            continue
+
+        best = dict.fromkeys(STAGES, float("inf"))
+        for _ in range(repeat):
+            seconds, _ = translate(timer, url)
+            for stage in STAGES:
+                best[stage] = min(best[stage], seconds[stage])
+
+        tracemalloc.start()
+        try:
+            _, peak = translate(timer, url)
+        finally:
+            tracemalloc.stop()
+        results[url] = {"seconds": best, "peak": dict(peak)}
+    return results, failed
+
+
+def measure_cache_hits(urls, repeat):
+    """The time of a translation served from the cache, by URL."""
+    results = {}
+    for url in urls:
+        path = f"{VERSION}{url}"
+        STA2REST.convert_query(path)
+        best = float("inf")
+        for _ in range(repeat):
+            start = time.perf_counter()
+            STA2REST.convert_query(path)
+            best = min(best, time.perf_counter() - start)
+        results[url] = best
+    return results
+
+
+def summarize(results, cache_hits):
+    count = len(results)
+    stages = {}
+    for stage in STAGES:
+        seconds = sum(r["seconds"][stage] for r in results.values())
+        stages[stage] = {
+            "us_per_query": round(seconds / count * 1e6, 3),
+            "peak_kib": round(
+                max(r["peak"][stage] for r in results.values()) / 1024, 1
+            ),
+        }
+    total = sum(stage["us_per_query"] for stage in stages.values())
+    return {
+        "queries": count,
+        "total_us_per_query": round(total, 3),
+        "cache_hit_us_per_query": round(
+            sum(cache_hits.values()) / len(cache_hits) * 1e6, 3
+        ),
+        "stages": stages,
+    }
+
+
+def print_summary(summary, baseline=None):
+    def change(key, stage=None):
+        if baseline is None:
+            return ""
+        before = (
+            baseline["stages"][stage][key]
+            if stage is not None
+            else baseline[key]
+        )
+        now = (
+            summary["stages"][stage][key]
+            if stage is not None
+            else summary[key]
+        )
+        return f"  ({(now / before - 1) * 100:+6.1f}%)" if before else ""
+
+    print(f"{summary['queries']} queries")
+    total = summary["total_us_per_query"]
+    for stage, values in summary["stages"].items():
+        share = values["us_per_query"] / total * 100 if total else 0
+        print(
+            f"{stage:>15}: {values['us_per_query']:9.1f} us/query "
+            f"{share:5.1f}%  peak {values['peak_kib']:8.1f} KiB"
+            + change("us_per_query", stage)
+        )
+    print(
+        f"{'total':>15}: {total:9.1f} us/query" + change("total_us_per_query")
+    )
+    print(
+        f"{'cache hit':>15}: {summary['cache_hit_us_per_query']:9.1f} "
+        "us/query" + change("cache_hit_us_per_query")
+    )
+
+
+def regressions(summary, baseline, threshold):
+    """Return the stages slower than the baseline by over threshold %."""
+    slower = []
+    for stage, values in summary["stages"].items():
+        before = baseline["stages"].get(stage, {}).get("us_per_query")
+        now = values["us_per_query"]
+        if before and (now / before - 1) * 100 > threshold:
+            slower.append(stage)
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument(
+        "--top", type=int, default=5, help="slowest queries to list"
+    )
+    parser.add_argument("--output", help="write the report to this file")
+    parser.add_argument("--baseline", help="a previous report to compare")
+    parser.add_argument("--max-regression", type=float, default=10)
+    args = parser.parse_args()
+
+    timer = StageTimer()
+    instrument(timer)
+
+    urls = CONFORMANCE_URLS + SYNTHETIC_URLS
+    results, failed = measure(timer, urls, args.repeat)
+    cache_hits = measure_cache_hits(results, args.repeat)
+    summary = summarize(results, cache_hits)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as file:
+            baseline = json.load(file)["summary"]
+    print_summary(summary, baseline)
+
+    slowest = sorted(
+        results, key=lambda url: sum(results[url]["seconds"].values())
+    )[::-1][: args.top]
+    if slowest:
+        print("\nSlowest queries:")
+    for url in slowest:
+        seconds = results[url]["seconds"]
+        stage = max(seconds, key=seconds.get)
+        print(f"{sum(seconds.values()) * 1e6:9.1f} us ({stage}) {url[:100]}")
+    for url, error in failed.items():
+        print(f"Not translated: {url[:100]} -- {error[:100]}")
+
+    if args.output:
+        report = {
+            "summary": summary,
+            "queries": {
+                url: {
+                    "us": {
+                        stage: round(seconds * 1e6, 3)
+                        for stage, seconds in result["seconds"].items()
+                    },
+                    "peak_kib": {
+                        stage: round(peak / 1024, 1)
+                        for stage, peak in result["peak"].items()
+                    },
+                    "cache_hit_us": round(cache_hits[url] * 1e6, 3),
+                }
+                for url, result in results.items()
+            },
+            "failed": failed,
+        }
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+
+    if baseline is not None:
+        slower = regressions(summary, baseline, args.max_regression)
+        if slower:
+            sys.exit(
+                f"Slower than the baseline by over {args.max_regression}%: "
+                + ", ".join(slower)
+            )
+
+
+if __name__ == "__main__":
+    main()
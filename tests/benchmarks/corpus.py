@@ -0,0 +1,221 @@
+"""
+Query URLs issued by the conformance suites, with the seed ids and literals
+resolved to representative values.
+
+The paths are relative to the API version root, e.g. "/v1.1".
+"""
+
+THING = 1
+DATASTREAM = 2
+LOCATION = 3
+FEATURE = 4
+
+THING_SCOPE = f"Datastream/Thing/@iot.id eq {THING}"
+POINT = "geography'POINT(8.96 46.0)'"
+POLYGON = (
+    "geography'POLYGON((8.9 45.9, 9.0 45.9, 9.0 46.1, 8.9 46.1, 8.9 45.9))'"
+)
+
+FILTER_PREDICATES = [
+    "result eq 4",
+    "result ne 4",
+    "result gt 4",
+    "result ge 4",
+    "result lt 5",
+    "result le 5",
+    "result gt 3 and result lt 6",
+    "result lt 4 or result gt 5",
+    "(result gt 5 or result gt 3) and result lt 5",
+    "not (result ge 5)",
+    "result add 1 eq 5",
+    "result sub 1 eq 4",
+    "result mul 2 eq 8",
+    "result div 2 eq 2",
+    "result mod 2 eq 0",
+    "ceiling(result) eq 4",
+    "floor(result) eq 4",
+    "round(result) eq 4",
+    "year(phenomenonTime) eq 2015",
+    "month(phenomenonTime) eq 3",
+    "day(phenomenonTime) ge 5",
+    "hour(phenomenonTime) eq 0",
+    "minute(phenomenonTime) eq 0",
+    "second(phenomenonTime) eq 0",
+    "fractionalseconds(phenomenonTime) eq 0",
+    "date(phenomenonTime) eq date(phenomenonTime)",
+    "phenomenonTime gt now()",
+    "phenomenonTime lt maxdatetime()",
+    "phenomenonTime gt mindatetime()",
+    "phenomenonTime ge 2015-03-03T00:00:00Z "
+    "and phenomenonTime le 2015-03-05T00:00:00.000%2B01:00",
+    "phenomenonTime eq 2015-03-04T00:00:00Z",
+]
+
+STRING_PREDICATES = [
+    "name eq 'datastream name 1'",
+    "substringof('name',name)",
+    "startswith(name,'datastream')",
+    "endswith(name,'name 1')",
+    "substring(name,0,10) eq 'datastream'",
+    "length(name) eq 17",
+    "indexof(name,'name') eq 12",
+    "tolower(name) eq 'datastream name 1'",
+    "toupper(name) eq 'DATASTREAM NAME 1'",
+    "trim(name) eq 'datastream name 1'",
+    "concat(name,'!') eq 'datastream name 1!'",
+    "substring(name,1) eq 'atastream name 1'",
+]
+
+GEO_PREDICATES = [
+    f"geo.intersects(location,{POLYGON})",
+    f"geo.distance(location,{POINT}) lt 1",
+    "geo.length(geography'LINESTRING(0 0, 0 1)') gt 0",
+    f"st_within(location,{POLYGON})",
+    f"st_intersects(location,{POLYGON})",
+    f"st_contains(location,{POINT})",
+    f"st_disjoint(location,{POINT})",
+    f"st_equals(location,{POINT})",
+]
+
+EXPANDS = [
+    ("Things", "Datastreams"),
+    ("Things", "Locations,Datastreams"),
+    (
+        "Things",
+        "Locations,Datastreams($expand=Sensor,ObservedProperty,Observations)",
+    ),
+    ("Things", "Datastreams/Observations"),
+    ("Datastreams", "Observations($filter=result gt 3;$orderby=result asc)"),
+    (
+        "Datastreams",
+        "Observations($orderby=result desc;$top=1;$select=result)",
+    ),
+    (
+        "Datastreams",
+        "Observations($top=1;$orderby=phenomenonTime desc;$select=result)",
+    ),
+    ("Datastreams", "Thing,Sensor,ObservedProperty"),
+    ("Observations", "FeatureOfInterest,Datastream"),
+]
+
+CONFORMANCE_URLS = (
+    [
+        "/Things",
+        f"/Things({THING})",
+        f"/Things({THING})/Locations",
+        f"/Things({THING})/Datastreams",
+        f"/Datastreams({DATASTREAM})/Observations",
+        f"/Datastreams({DATASTREAM})/Thing/Locations",
+        f"/Datastreams({DATASTREAM})/name",
+        f"/Datastreams({DATASTREAM})/name/$value",
+        f"/Locations({LOCATION})/HistoricalLocations",
+        f"/FeaturesOfInterest({FEATURE})/Observations",
+        "/Observations?$top=1",
+        "/Observations?$count=true&$top=100",
+        "/Things?$select=name,Datastreams",
+        "/Observations?$select=result,phenomenonTime",
+        "/Observations?$orderby=phenomenonTime asc,id asc&$top=2&$skip=2",
+        "/Datastreams?$orderby=name desc",
+        f"/Things({THING})/Datastreams?$expand=Sensor,ObservedProperty",
+        "/Observations?$resultFormat=dataArray",
+        f"/Datastreams({DATASTREAM})/Observations"
+        "?$resultFormat=dataArray&$orderby=phenomenonTime asc",
+        f"/Observations?$filter=Datastream/@iot.id eq {DATASTREAM}",
+        "/Observations?$filter=Datastream/ObservedProperty/name eq "
+        "'observedProperty name 1'",
+        "/Datastreams?$filter=Sensor/name eq 'sensor name 1'",
+        "/Datastreams?$filter=Thing/name eq 'thing name 1'",
+    ]
+    + [f"/{entity}?$expand={expand}" for entity, expand in EXPANDS]
+    + [
+        f"/Observations?$filter={THING_SCOPE} and ({predicate})"
+        "&$orderby=result asc&$select=result"
+        for predicate in FILTER_PREDICATES
+    ]
+    + [
+        f"/Datastreams?$filter=Thing/@iot.id eq {THING} and {predicate}"
+        for predicate in STRING_PREDICATES
+    ]
+    + [
+        f"/Locations?$filter=id eq {LOCATION} and {predicate}"
+        for predicate in GEO_PREDICATES
+    ]
+)
+
+
+def query_string(url):
+    """
+    Return the query string of a corpus URL, or None if it has none.
+    """
+    _, _, query = url.partition("?")
+    return query or None
+
+
+# Synthetic queries that stress the translator beyond the conformance shapes
+
+EXPAND_CHAIN = [
+    "Datastreams",
+    "Observations",
+    "FeatureOfInterest",
+    "Observations",
+    "Datastream",
+]
+
+
+def deep_expand(depth, options=""):
+    """
+    A Things query expanding the first `depth` levels of EXPAND_CHAIN, with
+    `options` on each level.
+    """
+    expand = ""
+    for level in reversed(range(depth)):
+        entity = EXPAND_CHAIN[level]
+        inner = ";".join(
+            option
+            for option in (options, expand and f"$expand={expand}")
+            if option
+        )
+        expand = f"{entity}({inner})" if inner else entity
+    return f"/Things?$expand={expand}"
+
+
+def and_chain(size):
+    """A $filter of `size` alternating result and phenomenonTime bounds."""
+    predicates = [
+        (
+            f"result gt {i}"
+            if i % 2
+            else f"phenomenonTime ge 2015-03-{i % 28 + 1:02d}T00:00:00Z"
+        )
+        for i in range(size)
+    ]
+    return f"/Observations?$filter={' and '.join(predicates)}"
+
+
+def nested_filter(depth):
+    """A $filter nesting `depth` parenthesized or/and groups."""
+    expression = "result eq 0"
+    for i in range(1, depth + 1):
+        expression = f"(result gt {i} or ({expression} and result lt {i}))"
+    return f"/Observations?$filter={expression}"
+
+
+SYNTHETIC_URLS = (
+    [deep_expand(depth) for depth in (1, 2, 3, 4, 5)]
+    + [deep_expand(depth, "$top=5;$orderby=id desc") for depth in (2, 3, 4)]
+    + [
+        "/Locations?$expand=Things($expand=Datastreams($expand=Sensor,"
+        "ObservedProperty,Observations($filter=result gt 3;$top=10;"
+        "$select=result,phenomenonTime)))",
+        f"/Datastreams({DATASTREAM})/Observations?$expand=FeatureOfInterest"
+        "&$filter=result gt 3 and phenomenonTime ge 2015-03-03T00:00:00Z"
+        "&$orderby=phenomenonTime desc&$top=50&$count=true",
+    ]
+    + [and_chain(size) for size in (8, 32, 128)]
+    + [nested_filter(depth) for depth in (4, 16)]
+    + [
+        "/Observations?$filter=id in "
+        f"({','.join(str(i) for i in range(size))})&$orderby=id"
+        for size in (16, 256)
+    ]
+)
@@ -1,7 +1,7 @@
 import logging
 
-from ..observations import post_observations, sensor_things_observations
-from ..remote import read_remote_text_file, remote_file_path
+from ..observations import post_observation_stream, sensor_things_observations
+from ..remote import open_remote_text_file, remote_file_path
 from .common import import_result, source_log
 
 
@@ -18,9 +18,14 @@ def configured_ufam_files(item):
     return files
 
 
-def print_remote_file(path, text):
+def print_remote_lines(path, lines):
     print(f"\n--- {path} ---")
-    print(text, end="" if text.endswith("\n") else "\n")
+    line = "\n"
+    for line in lines:
+        print(line, end="")
+        yield line
+    if not line.endswith("\n"):
+        print()
 
 
 def process_ufam(item, client):
@@ -46,32 +51,25 @@ def process_ufam(item, client):
 
         full_path = remote_file_path(item, file_path)
         try:
-            source_log(item, f"read remote file {full_path}")
-            text = read_remote_text_file(item, file_path)
-            if client.dry_run:
-                print_remote_file(full_path, text)
-                result["printed"] += 1
-
-            source_log(item, f"parse {full_path}")
-            observations, skipped_existing = sensor_things_observations(
-                client, text, file_config, tz_name
-            )
+            source_log(item, f"read and parse remote file {full_path}")
+            counts = {}
+            with open_remote_text_file(item, file_path) as lines:
+                if client.dry_run:
+                    lines = print_remote_lines(full_path, lines)
+                    result["printed"] += 1
+                observations = sensor_things_observations(
+                    client, lines, file_config, tz_name, counts
+                )
+                posted, skipped_duplicates, updated = post_observation_stream(
+                    client, observations, full_path
+                )
             source_log(
                 item,
-                f"observations parsed from {full_path}: "
-                f"{len(observations)}",
+                f"observations parsed from {full_path}: {counts['parsed']}",
             )
-            if not observations and not skipped_existing:
+            if not counts["parsed"] and not counts["skipped_existing"]:
                 raise ValueError(f"{full_path} produced 0 observations")
-            if not observations:
-                posted = 0
-                updated = 0
-                skipped_duplicates = skipped_existing
-            else:
-                posted, skipped_duplicates, updated = post_observations(
-                    client, observations, full_path
-                )
-                skipped_duplicates += skipped_existing
+            skipped_duplicates += counts["skipped_existing"]
 
         except Exception as exc:
             result["error"] += 1
@@ -3,12 +3,13 @@ import posixpath
 import zipfile
 
 from ..observations import (
-    post_observations,
+    post_observation_stream,
     sensor_things_observations,
 )
 from ..remote import (
     archive_ftp_item,
     connect_ftp,
+    decode_remote_lines,
     download_ftp_file,
     ensure_ftp_dir,
     ftp_name,
@@ -16,16 +17,6 @@ from ..remote import (
 from .common import import_result, source_log
 
 
-def read_text_from_zip(zip_file, member):
-    raw = zip_file.read(member)
-    for encoding in ("utf-8-sig", "utf-8", "latin-1"):
-        try:
-            return raw.decode(encoding)
-        except UnicodeDecodeError:
-            continue
-    return raw.decode("utf-8", errors="replace")
-
-
 def filename_suffixes(item):
     files = item.get("files") or []
     suffixes = []
@@ -90,22 +81,22 @@ def post_vulink_varese_zip(client, zip_buffer, files_config, suffixes, tz_name):
                 continue
 
             print(f"  parse {member}", flush=True)
-            text = read_text_from_zip(zip_file, member)
-            observations, skipped_existing = sensor_things_observations(
-                client, text, file_config, tz_name
-            )
-            print(f"  observations parsed: {len(observations)}", flush=True)
-            if observations:
+            counts = {}
+            with zip_file.open(member) as stream:
+                observations = sensor_things_observations(
+                    client,
+                    decode_remote_lines(stream),
+                    file_config,
+                    tz_name,
+                    counts,
+                )
                 member_posted, member_skipped, member_updated = (
-                    post_observations(client, observations, member)
+                    post_observation_stream(client, observations, member)
                 )
-            else:
-                member_posted = 0
-                member_skipped = 0
-                member_updated = 0
+            print(f"  observations parsed: {counts['parsed']}", flush=True)
             posted += member_posted
             updated += member_updated
-            skipped_duplicates += member_skipped + skipped_existing
+            skipped_duplicates += member_skipped + counts["skipped_existing"]
 
     if posted == 0 and updated == 0 and skipped_duplicates == 0:
         raise ValueError("Zip produced 0 posted or updated observations")
@@ -147,10 +138,10 @@ def process_vulink_varese(item, client):
         )
 
         try:
-            zip_buffer = download_ftp_file(item, zip_name)
-            posted, skipped_duplicates, updated = post_vulink_varese_zip(
-                client, zip_buffer, files_config, suffixes, tz_name
-            )
+            with download_ftp_file(item, zip_name) as zip_buffer:
+                posted, skipped_duplicates, updated = post_vulink_varese_zip(
+                    client, zip_buffer, files_config, suffixes, tz_name
+                )
         except Exception as exc:
             result["error"] += 1
             source_log(item, f"ERROR processing {zip_name}: {exc}")
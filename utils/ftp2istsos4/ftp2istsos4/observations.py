@@ -1,5 +1,5 @@
 import csv
-import io
+import itertools
 import math
 from datetime import datetime, timezone
 from zoneinfo import ZoneInfo
@@ -8,6 +8,7 @@ from .errors import DuplicateObservationError
 
 
 BULK_OBSERVATION_BATCH_SIZE = 5000
+SNIFF_SIZE = 4096
 QC_NOT_EXECUTED = 0b00
 QC_REMAINING = 0b01
 QC_PROBLEM = 0b10
@@ -147,16 +148,39 @@ def parse_value(value, column_config):
 
 def sniff_dialect(text):
     try:
-        return csv.Sniffer().sniff(text[:4096], delimiters="\t;,")
+        return csv.Sniffer().sniff(text[:SNIFF_SIZE], delimiters="\t;,")
     except csv.Error:
         return csv.excel
 
 
-def sensor_things_observations(client, text, file_config, tz_name):
+def csv_rows(lines):
+    """Read CSV rows from lines, sniffing the dialect from the first ones."""
+    lines = iter(lines)
+    head = []
+    size = 0
+    for line in lines:
+        head.append(line)
+        size += len(line)
+        if size >= SNIFF_SIZE:
+            break
+    dialect = sniff_dialect("".join(head))
+    return csv.reader(itertools.chain(head, lines), dialect)
+
+
+def sensor_things_observations(client, lines, file_config, tz_name, counts):
+    """
+    Yield the observations of CSV lines as they are read.
+
+    counts["parsed"] and counts["skipped_existing"] are incremented with
+    the observations yielded and those already covered by the datastream
+    range. The ranges are those from before the first batch is posted.
+    """
+    counts.setdefault("parsed", 0)
+    counts.setdefault("skipped_existing", 0)
     dt_column = datetime_column(file_config)
     values_config = value_columns(file_config)
     if not values_config:
-        return [], 0
+        return
 
     datastream_ids = {}
     for column in values_config:
@@ -165,12 +189,13 @@ def sensor_things_observations(client, text, file_config, tz_name):
         if datastream_id is None:
             continue
         datastream_ids[key] = datastream_id
+    latest_times = {
+        datastream_id: client.datastream_phenomenon_time_end(datastream_id)
+        for datastream_id in datastream_ids.values()
+    }
 
-    observations = []
     skipped_existing = 0
-    reader = csv.reader(io.StringIO(text, newline=""), sniff_dialect(text))
-
-    for row in reader:
+    for row in csv_rows(lines):
         if not row or not any(cell.strip() for cell in row):
             continue
 
@@ -191,7 +216,7 @@ def sensor_things_observations(client, text, file_config, tz_name):
             if datastream_id is None:
                 continue
             if not client.update:
-                latest = client.datastream_phenomenon_time_end(datastream_id)
+                latest = latest_times[datastream_id]
                 observed = parse_observation_time(phenomenon_time)
                 if (
                     latest is not None
@@ -199,15 +224,15 @@ def sensor_things_observations(client, text, file_config, tz_name):
                     and observed <= latest
                 ):
                     skipped_existing += 1
+                    counts["skipped_existing"] += 1
                     continue
-            observations.append(
-                {
-                    "Datastream": {"@iot.id": datastream_id},
-                    "phenomenonTime": phenomenon_time,
-                    "result": result,
-                    "resultQuality": str(result_quality),
-                }
-            )
+            counts["parsed"] += 1
+            yield {
+                "Datastream": {"@iot.id": datastream_id},
+                "phenomenonTime": phenomenon_time,
+                "result": result,
+                "resultQuality": str(result_quality),
+            }
 
     if skipped_existing:
         print(
@@ -215,7 +240,6 @@ def sensor_things_observations(client, text, file_config, tz_name):
             f"{skipped_existing}",
             flush=True,
         )
-    return observations, skipped_existing
 
 
 def bulk_observations_payload(observations):
@@ -341,6 +365,12 @@ def chunks(items, size):
         yield items[start : start + size]
 
 
+def batches(items, size):
+    items = iter(items)
+    while batch := list(itertools.islice(items, size)):
+        yield batch
+
+
 def post_observations_individually(client, observations, label):
     posted = 0
     skipped = 0
@@ -495,3 +525,35 @@ def post_observations(client, observations, label, apply_range_filter=True):
             flush=True,
         )
     return posted, skipped_duplicates, updated
+
+
+def post_observation_stream(
+    client, observations, label, batch_size=BULK_OBSERVATION_BATCH_SIZE
+):
+    """
+    Post observations batch by batch as they are parsed, so that only one
+    batch is held in memory.
+
+    In append mode the observations were already filtered by datastream
+    range while parsing, so the ranges extended by the previous batches do
+    not filter the next ones.
+    """
+    apply_range_filter = client.update or (
+        getattr(client, "observation_mode", "append") == "backfill"
+    )
+    posted = 0
+    skipped_duplicates = 0
+    updated = 0
+    for batch_index, batch in enumerate(
+        batches(observations, batch_size), start=1
+    ):
+        batch_posted, batch_skipped, batch_updated = post_observations(
+            client,
+            batch,
+            f"{label} part {batch_index}",
+            apply_range_filter=apply_range_filter,
+        )
+        posted += batch_posted
+        skipped_duplicates += batch_skipped
+        updated += batch_updated
+    return posted, skipped_duplicates, updated
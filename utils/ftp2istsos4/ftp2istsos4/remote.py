@@ -1,6 +1,8 @@
+import codecs
 import getpass
-import io
 import posixpath
+import tempfile
+from contextlib import contextmanager
 from datetime import datetime
 from ftplib import FTP
 from pathlib import Path
@@ -80,23 +82,34 @@ def remote_file_path(item, file_path):
     return posixpath.join(directory, file_path)
 
 
-def decode_remote_text(raw):
-    for encoding in ("utf-8-sig", "utf-8", "latin-1"):
+def decode_remote_lines(stream):
+    for index, raw in enumerate(stream):
+        if index == 0 and raw.startswith(codecs.BOM_UTF8):
+            raw = raw[len(codecs.BOM_UTF8) :]
         try:
-            return raw.decode(encoding)
+            yield raw.decode("utf-8")
         except UnicodeDecodeError:
-            continue
-    return raw.decode("utf-8", errors="replace")
+            yield raw.decode("latin-1")
 
 
-def read_ftp_file(item, file_path):
-    with connect_ftp(item) as ftp:
-        buffer = io.BytesIO()
-        ftp.retrbinary(f"RETR {file_path}", buffer.write)
-        return buffer.getvalue()
+@contextmanager
+def open_ftp_file(item, file_path):
+    ftp = connect_ftp(item)
+    try:
+        ftp.voidcmd("TYPE I")
+        with ftp.transfercmd(f"RETR {file_path}") as conn:
+            with conn.makefile("rb") as stream:
+                yield stream
+        ftp.voidresp()
+        ftp.quit()
+    finally:
+        # An interrupted transfer leaves a pending reply, so the control
+        # connection is closed rather than quit
+        ftp.close()
 
 
-def read_sftp_file(item, file_path):
+@contextmanager
+def open_sftp_file(item, file_path):
     paramiko = import_paramiko()
     host = require_value(item, "host")
     username = require_value(item, "username")
@@ -120,21 +133,25 @@ def read_sftp_file(item, file_path):
         )
         with paramiko.SFTPClient.from_transport(transport) as sftp:
             with sftp.open(path, "rb") as handle:
-                return handle.read()
+                handle.prefetch()
+                yield handle
     finally:
         transport.close()
 
 
-def read_remote_text_file(item, file_path):
+@contextmanager
+def open_remote_text_file(item, file_path):
+    """Yield the decoded lines of a remote file while it is downloaded."""
     protocol = (item.get("protocol") or "ftp").lower()
     if protocol == "ftp":
-        raw = read_ftp_file(item, file_path)
+        opener = open_ftp_file
     elif protocol == "sftp":
-        raw = read_sftp_file(item, file_path)
+        opener = open_sftp_file
     else:
         name = item.get("type", "unnamed")
         raise ValueError(f"{name}: unsupported protocol '{protocol}'")
-    return decode_remote_text(raw)
+    with opener(item, file_path) as stream:
+        yield decode_remote_lines(stream)
 
 
 def ensure_ftp_dir(ftp, directory):
@@ -166,8 +183,12 @@ def archive_ftp_file(ftp, source, directory):
 
 def download_ftp_file(item, filename):
     with connect_ftp(item) as ftp:
-        zip_buffer = io.BytesIO()
-        ftp.retrbinary(f"RETR {filename}", zip_buffer.write)
+        zip_buffer = tempfile.TemporaryFile()
+        try:
+            ftp.retrbinary(f"RETR {filename}", zip_buffer.write)
+        except BaseException:
+            zip_buffer.close()
+            raise
         zip_buffer.seek(0)
         return zip_buffer
 
@@ -4,6 +4,7 @@ from __future__ import annotations
 
 import json
 import logging
+import threading
 import time
 from datetime import datetime, timezone
 from typing import Any, Iterator
@@ -15,9 +16,9 @@ logger = logging.getLogger(__name__)
 DEFAULT_TIMEOUT = 30
 
 
-ASYNCPG_MAX_ARGS = 32767
-SERVER_ROW_OVERHEAD = 8
-BULK_SAFETY = 0.9
+# Rows per /BulkObservations request. The server copies any number of rows
+# into the database, so this only bounds the size of a request body.
+BULK_ROWS = 50000
 
 OVERSIZE_STATUS_CODES = frozenset({413, 500})
 
@@ -29,13 +30,6 @@ OBSERVATION_COMPONENTS = [
 ]
 
 
-def max_rows_per_bulk(component_count: int) -> int:
-    """Largest row count per request that stays under asyncpg's parameter limit."""
-    fields_per_row = component_count + SERVER_ROW_OVERHEAD
-    usable = int(ASYNCPG_MAX_ARGS * BULK_SAFETY)
-    return max(1, usable // fields_per_row)
-
-
 def format_entity_id(entity_id: Any) -> str:
     if isinstance(entity_id, bool):
         raise TypeError("Entity ID cannot be a boolean")
@@ -86,6 +80,23 @@ def observation_query_params(
     return params
 
 
+class RateLimiter:
+    """Space requests out to at most `rate` per second across threads."""
+
+    def __init__(self, rate: float) -> None:
+        self.interval = 1 / rate
+        self.lock = threading.Lock()
+        self.next_time = time.monotonic()
+
+    def wait(self) -> None:
+        with self.lock:
+            now = time.monotonic()
+            slot = max(self.next_time, now)
+            self.next_time = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
 class IstSOS2Client:
     def __init__(
         self,
@@ -141,12 +152,14 @@ class IstSOS4Client:
         password: str,
         timeout: int = DEFAULT_TIMEOUT,
         refresh_margin_seconds: int = 300,
+        rate_limiter: RateLimiter | None = None,
     ) -> None:
         self.base_url = base_url.rstrip("/")
         self.username = username
         self.password = password
         self.timeout = timeout
         self.refresh_margin_seconds = refresh_margin_seconds
+        self.rate_limiter = rate_limiter
         self.session = requests.Session()
         self.access_token: str | None = None
         self.expires_at: datetime | None = None
@@ -244,6 +257,8 @@ class IstSOS4Client:
             "Authorization": f"Bearer {self.access_token}",
             **supplied_headers,
         }
+        if self.rate_limiter is not None:
+            self.rate_limiter.wait()
         response = self.session.request(method, url, headers=headers, **kwargs)
         if response.status_code == 401:
             logger.debug("401 on %s %s, re-authenticating", method, url)
@@ -360,10 +375,9 @@ class IstSOS4Client:
     ) -> int:
         if not data_array:
             return 0
-        batch_limit = max_rows_per_bulk(len(OBSERVATION_COMPONENTS))
         inserted = 0
-        for offset in range(0, len(data_array), batch_limit):
-            batch = data_array[offset : offset + batch_limit]
+        for offset in range(0, len(data_array), BULK_ROWS):
+            batch = data_array[offset : offset + BULK_ROWS]
             inserted += self.post_bulk_batch(datastream_id, batch)
         return inserted
 
@@ -374,8 +388,8 @@ class IstSOS4Client:
     ) -> int:
         """Post one batch; halve and retry if the server rejects it for size.
 
-        This is insurance against the per-row column count changing on the
-        server side. On an oversize rejection (413/500) we split the batch and
+        This is insurance against a proxy or server limit on the size of a
+        request body. On an oversize rejection (413/500) we split the batch and
         retry each half, down to a single row. A single-row failure is treated
         as a real error (bad data, auth, missing datastream, ...) and re-raised.
         """
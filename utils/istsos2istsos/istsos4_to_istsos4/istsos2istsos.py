@@ -2,24 +2,33 @@
 
 from __future__ import annotations
 
+import json
 import logging
 import os
+import queue
 import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import date, datetime, timedelta, timezone
 from itertools import islice
 from pathlib import Path
-from typing import Any, Iterable, Iterator
+from typing import Any, Callable, Iterable, Iterator, TypeVar
 
 SHARED_DIR = Path(__file__).resolve().parent.parent
 if str(SHARED_DIR) not in sys.path:
     sys.path.insert(0, str(SHARED_DIR))
 
-from client import OBSERVATION_COMPONENTS, IstSOS4Client, max_rows_per_bulk
+from client import BULK_ROWS, IstSOS4Client, RateLimiter
 
 HERE = Path(__file__).resolve().parent
 
 logger = logging.getLogger(__name__)
 
+T = TypeVar("T")
+
+# Blocks read from the source ahead of the one being written to the target.
+PREFETCH_BLOCKS = 1
+
 
 def load_env(path: Path = HERE / ".env") -> None:
     """Load a small dotenv file without requiring python-dotenv."""
@@ -116,6 +125,112 @@ def chunked(
         yield chunk
 
 
+def parse_number(name: str, default: str) -> float:
+    raw_value = os.getenv(name, default).strip() or default
+    try:
+        value = float(raw_value)
+    except ValueError as exc:
+        raise ValueError(f"{name} must be a number: {raw_value}") from exc
+    if value < 0:
+        raise ValueError(f"{name} must not be negative: {raw_value}")
+    return value
+
+
+def rate_limiter(name: str) -> RateLimiter | None:
+    rate = parse_number(name, "0")
+    return RateLimiter(rate) if rate else None
+
+
+def prefetch(iterable: Iterable[T], depth: int) -> Iterator[T]:
+    """Iterate in a background thread, up to `depth` items ahead.
+
+    The source is read while the caller writes the previous items. An
+    exception of the source is raised to the caller.
+    """
+    items: queue.Queue[tuple[str, Any]] = queue.Queue(maxsize=depth)
+    stopped = threading.Event()
+
+    def put(kind: str, value: Any) -> bool:
+        while not stopped.is_set():
+            try:
+                items.put((kind, value), timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def read() -> None:
+        try:
+            for item in iterable:
+                if not put("item", item):
+                    return
+        except BaseException as exc:
+            put("error", exc)
+            return
+        put("end", None)
+
+    thread = threading.Thread(target=read, daemon=True)
+    thread.start()
+    try:
+        while True:
+            kind, value = items.get()
+            if kind == "end":
+                return
+            if kind == "error":
+                raise value
+            yield value
+    finally:
+        stopped.set()
+        thread.join()
+
+
+class Checkpoint:
+    """The last UTC day copied completely for each datastream, in a JSON file.
+
+    The file is rewritten atomically after every block, so an interrupted
+    run resumes from the day after the checkpoint. The day being copied is
+    copied again, and the observations already in the target are skipped.
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+        self.lock = threading.Lock()
+        self.days: dict[str, dict[str, str]] = {}
+        if path.is_file():
+            self.days = json.loads(path.read_text(encoding="utf-8"))
+
+    def last_day(self, source_name: str, target_name: str) -> date | None:
+        entry = self.days.get(source_name)
+        if not entry or entry.get("target") != target_name:
+            return None
+        return date.fromisoformat(entry["last_day"])
+
+    def save(self, source_name: str, target_name: str, day: date) -> None:
+        with self.lock:
+            self.days[source_name] = {
+                "target": target_name,
+                "last_day": day.isoformat(),
+            }
+            temporary = self.path.with_name(f"{self.path.name}.tmp")
+            temporary.write_text(
+                json.dumps(self.days, indent=2, sort_keys=True),
+                encoding="utf-8",
+            )
+            os.replace(temporary, self.path)
+
+
+def resume_start(start: str | None, last_day: date | None) -> str | None:
+    """Return the later of `start` and the day after a checkpoint."""
+    if last_day is None:
+        return start
+    resumed, _ = utc_day_interval(last_day + timedelta(days=1))
+    if start is None:
+        return resumed
+    start_dt = datetime.fromisoformat(start.replace("Z", "+00:00"))
+    resumed_dt = datetime.fromisoformat(resumed.replace("Z", "+00:00"))
+    return resumed if resumed_dt > start_dt else start
+
+
 def index_datastreams(
     datastreams: list[dict[str, Any]], label: str
 ) -> dict[str, dict[str, Any]]:
@@ -140,17 +255,19 @@ def copy_datastream_observations(
     import_nodata: bool,
     nodata_value: float | None,
     chunk_size: int,
+    on_day_copied: Callable[[date], None] | None = None,
 ) -> tuple[int, int, int]:
     copied = 0
     skipped_existing = 0
     skipped_nodata = 0
+    last_copied_day: date | None = None
     observations = source.get_observations(
         source_datastream["@iot.id"], start, end
     )
     # Process one insert's worth of observations at a time. For each block we run
     # a single anti-duplicate query over the block's day span, then send what is
-    # missing as one bulk request.
-    for block in chunked(observations, chunk_size):
+    # missing as one bulk request. The next block is read meanwhile.
+    for block in prefetch(chunked(observations, chunk_size), PREFETCH_BLOCKS):
         days = [
             phenomenon_time_day(observation["phenomenonTime"])
             for observation in block
@@ -182,6 +299,15 @@ def copy_datastream_observations(
         if to_send:
             target.post_observations(target_datastream["@iot.id"], to_send)
             copied += len(to_send)
+
+        # The observations are ordered by time, so the days before the last
+        # one of the block are complete
+        complete_day = max(days) - timedelta(days=1)
+        if on_day_copied is not None and (
+            last_copied_day is None or complete_day > last_copied_day
+        ):
+            on_day_copied(complete_day)
+            last_copied_day = complete_day
     return copied, skipped_existing, skipped_nodata
 
 
@@ -228,16 +354,38 @@ def run() -> None:
                 f"NODATA_VALUE must be a number: {raw_nodata}"
             ) from exc
 
-    source = IstSOS4Client(
+    workers = int(parse_number("WORKERS", "4")) or 1
+    source_settings = (
         required_env("ISTSOS4_FROM_URL"),
         required_env("ISTSOS4_FROM_USER"),
         required_env("ISTSOS4_FROM_PASSWORD"),
     )
-    target = IstSOS4Client(
+    target_settings = (
         required_env("ISTSOS4_TO_URL"),
         required_env("ISTSOS4_TO_USER"),
         required_env("ISTSOS4_TO_PASSWORD"),
     )
+    source_limiter = rate_limiter("ISTSOS4_FROM_MAX_REQUESTS_PER_SECOND")
+    target_limiter = rate_limiter("ISTSOS4_TO_MAX_REQUESTS_PER_SECOND")
+    checkpoint = Checkpoint(
+        Path(
+            os.getenv("CHECKPOINT_FILE", "").strip()
+            or HERE / "checkpoint.json"
+        )
+    )
+
+    # A requests session is not thread-safe, so each worker has its clients
+    local = threading.local()
+
+    def clients() -> tuple[IstSOS4Client, IstSOS4Client]:
+        if not hasattr(local, "clients"):
+            local.clients = (
+                IstSOS4Client(*source_settings, rate_limiter=source_limiter),
+                IstSOS4Client(*target_settings, rate_limiter=target_limiter),
+            )
+        return local.clients
+
+    source, target = clients()
     network_from = os.getenv("NETWORK_FROM", "").strip()
     network_to = os.getenv("NETWORK_TO", "").strip()
     datastream_mapping = datastream_name_mapping()
@@ -284,50 +432,79 @@ def run() -> None:
 
     start = start_dt.isoformat().replace("+00:00", "Z") if start_dt else None
     end = end_dt.isoformat().replace("+00:00", "Z") if end_dt else None
-    chunk_size = max_rows_per_bulk(len(OBSERVATION_COMPONENTS))
+    chunk_size = BULK_ROWS
     total = 0
     total_skipped_existing = 0
     total_skipped_nodata = 0
     interval = f"from {start or 'the beginning'} to {end or 'the end'}"
     logger.info(
-        "Copying %d datastreams %s in blocks of up to %d observations",
+        "Copying %d datastreams %s in blocks of up to %d observations "
+        "with %d workers",
         len(source_datastreams),
         interval,
         chunk_size,
+        workers,
     )
     if not import_nodata:
         logger.info(
             "Discarding no-data observations equal to %s", nodata_value
         )
-    for name, source_datastream in source_datastreams.items():
+
+    def copy(name: str) -> tuple[int, int, int]:
         target_name = datastream_mapping[name]
-        count, skipped_existing, skipped_nodata = copy_datastream_observations(
-            source,
-            target,
-            source_datastream,
+        last_day = checkpoint.last_day(name, target_name)
+        if last_day is not None:
+            logger.info("%s: resuming after %s", name, last_day.isoformat())
+        worker_source, worker_target = clients()
+        return copy_datastream_observations(
+            worker_source,
+            worker_target,
+            source_datastreams[name],
             target_datastreams[target_name],
-            start,
+            resume_start(start, last_day),
             end,
             import_nodata,
             nodata_value,
             chunk_size,
+            lambda day: checkpoint.save(name, target_name, day),
         )
-        total += count
-        total_skipped_existing += skipped_existing
-        total_skipped_nodata += skipped_nodata
-        label = name if name == target_name else f"{name} -> {target_name}"
-        message = (
-            f"{label}: copied {count}, skipped {skipped_existing} existing"
-        )
-        if skipped_nodata:
-            message += f", {skipped_nodata} no-data"
-        logger.info(message)
+
+    failed = []
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(copy, name): name for name in source_datastreams
+        }
+        for done, future in enumerate(as_completed(futures), start=1):
+            name = futures[future]
+            target_name = datastream_mapping[name]
+            label = name if name == target_name else f"{name} -> {target_name}"
+            try:
+                count, skipped_existing, skipped_nodata = future.result()
+            except Exception:
+                logger.exception("%s: copy failed", label)
+                failed.append(label)
+                continue
+            total += count
+            total_skipped_existing += skipped_existing
+            total_skipped_nodata += skipped_nodata
+            message = (
+                f"[{done}/{len(futures)}] {label}: copied {count}, "
+                f"skipped {skipped_existing} existing"
+            )
+            if skipped_nodata:
+                message += f", {skipped_nodata} no-data"
+            logger.info(message)
     summary = (
         f"Completed: copied {total}, skipped {total_skipped_existing} existing"
     )
     if total_skipped_nodata:
         summary += f", {total_skipped_nodata} no-data"
     logger.info(summary)
+    if failed:
+        raise RuntimeError(
+            "Copy failed for datastreams, rerun to resume them: "
+            + ", ".join(failed)
+        )
 
 
 if __name__ == "__main__":
@@ -1,14 +1,16 @@
 from __future__ import annotations
 
+import asyncio
 import logging
 import math
 import os
-import queue
 import signal
 import threading
 import time
-from dataclasses import dataclass
+from collections.abc import Awaitable, Callable
+from dataclasses import dataclass, field
 from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from pathlib import Path
 from typing import Any
 from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
@@ -22,6 +24,7 @@ NULL_RESULT_VALUE = -999
 NULL_RESULT_QUALITY = "00"
 DEFAULT_RESULT_QUALITY = "11"
 SKIP_DATASTREAM_NAMES = {"skip"}
+BULK_COMPONENTS = ["result", "phenomenonTime", "resultTime", "resultQuality"]
 SUCCESS_LEVEL = 35
 NOTICE_LEVEL = 60
 RESET = "\033[0m"
@@ -84,12 +87,21 @@ class Config:
     payload_tz: str
     reconnect_delay_sec: float
     queue_maxsize: int
+    queue_put_timeout_sec: float
 
     istsos_url: str
     istsos_username: str
     istsos_password: str
     istsos_timeout_sec: int
     commit_message: str | None
+    batch_size: int
+    flush_interval_sec: float
+    flush_concurrency: int
+    max_buffered: int
+    on_conflict: str | None
+
+    metrics_port: int | None
+    metrics_log_interval_sec: float
 
     mapping: dict[str, list[str]]
     dry_run: bool
@@ -197,6 +209,26 @@ def load_mapping(data: Any) -> dict[str, list[str]]:
     return mapping
 
 
+def parse_on_conflict(value: Any) -> str | None:
+    on_conflict = clean_text(value)
+    if on_conflict is None or on_conflict.lower() == "error":
+        return None
+    if on_conflict.lower() not in {"skip", "update"}:
+        raise RuntimeError(
+            "Set istsos.on_conflict to skip, update or error in config.yaml"
+        )
+    return on_conflict.lower()
+
+
+def positive_int(
+    values: dict[str, Any], key: str, section: str, default: int
+) -> int:
+    value = int(values.get(key, default))
+    if value < 1:
+        raise RuntimeError(f"Set {section}.{key} to a positive integer")
+    return value
+
+
 def load_config() -> Config:
     config_path = Path(os.getenv(CONFIG_PATH_ENV, "config.yaml"))
     data = read_config_file(config_path)
@@ -204,8 +236,11 @@ def load_config() -> Config:
 
     mqtt = data.get("mqtt") or {}
     istsos = data.get("istsos") or {}
-    if not isinstance(mqtt, dict) or not isinstance(istsos, dict):
-        raise RuntimeError("mqtt and istsos must be YAML objects")
+    metrics = data.get("metrics") or {}
+    if not all(
+        isinstance(section, dict) for section in (mqtt, istsos, metrics)
+    ):
+        raise RuntimeError("mqtt, istsos and metrics must be YAML objects")
 
     dry_run = as_bool(data.get("dry_run"), False)
     mapping = load_mapping(data.get("mapping"))
@@ -227,17 +262,29 @@ def load_config() -> Config:
         payload_date_format=clean_text(mqtt.get("date_format")),
         payload_tz=parse_payload_timezone(mqtt.get("tz")),
         reconnect_delay_sec=float(mqtt.get("reconnect_delay_sec", 10.0)),
-        queue_maxsize=int(mqtt.get("queue_maxsize", 1000)),
+        queue_maxsize=positive_int(mqtt, "queue_maxsize", "mqtt", 1000),
+        queue_put_timeout_sec=float(mqtt.get("queue_put_timeout_sec", 5.0)),
         istsos_url=required_text(istsos, "url", "istsos", dry_run),
         istsos_username=required_text(istsos, "username", "istsos", dry_run),
         istsos_password=required_text(istsos, "password", "istsos", dry_run),
         istsos_timeout_sec=int(istsos.get("timeout_sec", 15)),
         commit_message=clean_text(istsos.get("commit_message")),
+        batch_size=positive_int(istsos, "batch_size", "istsos", 1000),
+        flush_interval_sec=float(istsos.get("flush_interval_sec", 1.0)),
+        flush_concurrency=positive_int(
+            istsos, "flush_concurrency", "istsos", 4
+        ),
+        max_buffered=positive_int(istsos, "max_buffered", "istsos", 20000),
+        on_conflict=parse_on_conflict(istsos.get("on_conflict", "skip")),
+        metrics_port=(
+            int(metrics["port"]) if metrics.get("port") is not None else None
+        ),
+        metrics_log_interval_sec=float(metrics.get("log_interval_sec", 60.0)),
         mapping=mapping,
         dry_run=dry_run,
     )
     LOGGER.notice(
-        "Loaded configuration: path=%s, mqtt=%s:%s, topics=%d, mappings=%d, dry_run=%s, istsos_url=%s",
+        "Loaded configuration: path=%s, mqtt=%s:%s, topics=%d, mappings=%d, dry_run=%s, istsos_url=%s, batch_size=%d, flush_interval_sec=%.1f, flush_concurrency=%d",
         config_path,
         config.mqtt_host,
         config.mqtt_port,
@@ -245,6 +292,9 @@ def load_config() -> Config:
         len(config.mapping),
         config.dry_run,
         config.istsos_url,
+        config.batch_size,
+        config.flush_interval_sec,
+        config.flush_concurrency,
     )
 
     return config
@@ -299,9 +349,7 @@ def parse_payload(
     date_format: str | None = None,
     tz_name: str = "UTC",
 ) -> tuple[list[str], str]:
-    parts = [
-        part.strip() for part in payload.decode("utf-8").split(separator)
-    ]
+    parts = [part.strip() for part in payload.decode("utf-8").split(separator)]
     if len(parts) < 2:
         raise ValueError(
             f"Expected payload: timestamp{separator}value1{separator}value2..."
@@ -362,13 +410,181 @@ def build_observation(
     }
 
 
+@dataclass
+class Metrics:
+    received: int = 0
+    dropped: int = 0
+    intake_waits: int = 0
+    buffer_waits: int = 0
+    parse_errors: int = 0
+    skipped_values: int = 0
+    buffered: int = 0
+    inserted: int = 0
+    duplicates: int = 0
+    failed: int = 0
+    requests: int = 0
+    request_seconds: float = 0.0
+
+    def render(self, queue_depth: int, inflight: int) -> str:
+        values = {
+            "messages_received_total": self.received,
+            "messages_dropped_total": self.dropped,
+            "intake_waits_total": self.intake_waits,
+            "buffer_waits_total": self.buffer_waits,
+            "parse_errors_total": self.parse_errors,
+            "values_skipped_total": self.skipped_values,
+            "queue_depth": queue_depth,
+            "observations_buffered": self.buffered,
+            "observations_inserted_total": self.inserted,
+            "observations_duplicate_total": self.duplicates,
+            "observations_failed_total": self.failed,
+            "requests_inflight": inflight,
+            "requests_total": self.requests,
+            "request_seconds_total": round(self.request_seconds, 6),
+        }
+        return "".join(
+            f"mqtt2istsos_{name} {value}\n" for name, value in values.items()
+        )
+
+
+@dataclass
+class DatastreamBuffer:
+    datastream_id: int | None
+    rows: list[list[Any]] = field(default_factory=list)
+    since: float = 0.0
+
+
+class BatchBuffer:
+    """Observations waiting to be inserted, grouped by datastream.
+
+    A batch takes the datastreams that waited longest first, up to
+    batch_size observations, once that many are waiting or the oldest has
+    waited flush_interval_sec. Up to flush_concurrency batches are posted
+    at once, and a datastream is never in two of them, so its observations
+    are inserted in the order they arrived. Adding waits while max_buffered
+    observations are buffered or being posted.
+    """
+
+    def __init__(
+        self,
+        config: Config,
+        post: Callable[[list[tuple[str, int | None, list]]], Awaitable[None]],
+        metrics: Metrics,
+    ):
+        self.batch_size = config.batch_size
+        self.flush_interval = config.flush_interval_sec
+        self.concurrency = config.flush_concurrency
+        self.max_buffered = config.max_buffered
+        self.post = post
+        self.metrics = metrics
+        self.buffers: dict[str, DatastreamBuffer] = {}
+        self.inflight: set[str] = set()
+        self.waiting = 0
+        self.tasks: set[asyncio.Task] = set()
+        self.changed = asyncio.Condition()
+        self.stopping = False
+
+    async def add(
+        self, name: str, datastream_id: int | None, row: list[Any]
+    ) -> None:
+        async with self.changed:
+            if self.metrics.buffered >= self.max_buffered:
+                self.metrics.buffer_waits += 1
+                await self.changed.wait_for(
+                    lambda: self.metrics.buffered < self.max_buffered
+                )
+
+            buffer = self.buffers.get(name)
+            if buffer is None:
+                buffer = self.buffers[name] = DatastreamBuffer(datastream_id)
+            if not buffer.rows:
+                buffer.since = time.monotonic()
+            buffer.rows.append(row)
+            self.metrics.buffered += 1
+            self.waiting += 1
+            # Wake the scheduler only when a batch may have become due
+            if len(buffer.rows) == 1 or self.waiting >= self.batch_size:
+                self.changed.notify_all()
+
+    def take_batch(
+        self,
+    ) -> tuple[list[tuple[str, int | None, list]] | None, float | None]:
+        ready = [
+            (name, buffer)
+            for name, buffer in self.buffers.items()
+            if buffer.rows and name not in self.inflight
+        ]
+        if not ready:
+            return None, None
+
+        ready.sort(key=lambda item: item[1].since)
+        due_at = ready[0][1].since + self.flush_interval
+        now = time.monotonic()
+        if (
+            not self.stopping
+            and now < due_at
+            and sum(len(buffer.rows) for _, buffer in ready) < self.batch_size
+        ):
+            return None, due_at - now
+
+        batch = []
+        size = 0
+        for name, buffer in ready:
+            rows = buffer.rows[: self.batch_size - size]
+            del buffer.rows[: len(rows)]
+            batch.append((name, buffer.datastream_id, rows))
+            self.inflight.add(name)
+            size += len(rows)
+            if size >= self.batch_size:
+                break
+        self.waiting -= size
+        return batch, None
+
+    async def run(self) -> None:
+        async with self.changed:
+            while not (self.stopping and not self.waiting and not self.tasks):
+                batch = timeout = None
+                if len(self.tasks) < self.concurrency:
+                    batch, timeout = self.take_batch()
+                if batch:
+                    task = asyncio.create_task(self.flush(batch))
+                    self.tasks.add(task)
+                    continue
+                try:
+                    await asyncio.wait_for(self.changed.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def flush(self, batch: list[tuple[str, int | None, list]]) -> None:
+        try:
+            await self.post(batch)
+        except Exception:
+            LOGGER.exception("Could not post a batch of observations")
+        finally:
+            async with self.changed:
+                for name, _, rows in batch:
+                    self.inflight.discard(name)
+                    self.metrics.buffered -= len(rows)
+                self.tasks.discard(asyncio.current_task())
+                self.changed.notify_all()
+
+    async def stop(self) -> None:
+        async with self.changed:
+            self.stopping = True
+            self.changed.notify_all()
+
+
 class Processor:
-    def __init__(self, config: Config, istsos_client: Any | None):
+    def __init__(
+        self, config: Config, istsos_client: Any | None, metrics: Metrics
+    ):
         self.config = config
         self.istsos_client = istsos_client
+        self.metrics = metrics
         self.datastream_ids: dict[str, int] = {}
+        self.buffer = BatchBuffer(config, self.post, metrics)
 
-    def process(self, message: MqttMessage) -> None:
+    async def process(self, message: MqttMessage) -> None:
         datastreams = datastreams_for_topic(message.topic, self.config.mapping)
         if not datastreams:
             LOGGER.warning(
@@ -384,13 +600,14 @@ class Processor:
                 self.config.payload_tz,
             )
         except Exception:
+            self.metrics.parse_errors += 1
             LOGGER.exception(
                 "Could not parse MQTT payload on %s", message.topic
             )
             return
 
         result_time = now_utc_iso()
-        inserted = 0
+        buffered = 0
         skipped = 0
 
         if len(values) > len(datastreams):
@@ -432,68 +649,95 @@ class Processor:
                     skipped += 1
                     continue
 
-            if self.config.dry_run:
-                observation = build_observation(
-                    {"name": datastream_name},
-                    phenomenon_time,
-                    result_time,
-                    result,
-                    result_quality,
-                )
-                LOGGER.info("DRY_RUN %s -> %s", datastream_name, observation)
-                inserted += 1
-                continue
-
-            datastream_id = self.datastream_id(datastream_name)
-            if datastream_id is None:
-                LOGGER.warning(
-                    "Skipping %s: datastream was not found", datastream_name
-                )
-                skipped += 1
-                continue
+            datastream_id = None
+            if not self.config.dry_run:
+                datastream_id = await self.datastream_id(datastream_name)
+                if datastream_id is None:
+                    LOGGER.warning(
+                        "Skipping %s: datastream was not found",
+                        datastream_name,
+                    )
+                    skipped += 1
+                    continue
 
-            observation = build_observation(
-                {"@iot.id": datastream_id},
-                phenomenon_time,
-                result_time,
-                result,
-                result_quality,
+            await self.buffer.add(
+                datastream_name,
+                datastream_id,
+                [result, phenomenon_time, result_time, result_quality],
             )
+            buffered += 1
 
-            try:
-                self.istsos_client.insert_observation(
-                    observation,
-                    datastream_name,
-                    commit_message=self.config.commit_message,
-                )
-                inserted += 1
-                LOGGER.success(
-                    "Inserted %s at %s: result=%s",
-                    datastream_name,
-                    phenomenon_time,
-                    result,
-                )
-            except Exception:
-                skipped += 1
-                LOGGER.exception(
-                    "Could not insert observation for %s", datastream_name
-                )
-
-        LOGGER.info(
-            "Processed %s at %s: inserted=%d skipped=%d",
+        self.metrics.skipped_values += skipped
+        LOGGER.debug(
+            "Processed %s at %s: buffered=%d skipped=%d",
             message.topic,
             phenomenon_time,
-            inserted,
+            buffered,
             skipped,
         )
 
-    def datastream_id(self, name: str) -> int | None:
+    async def post(self, batch: list[tuple[str, int | None, list]]) -> None:
+        size = sum(len(rows) for _, _, rows in batch)
+        if self.config.dry_run:
+            for datastream_name, _, rows in batch:
+                for result, phenomenon_time, result_time, quality in rows:
+                    observation = build_observation(
+                        {"name": datastream_name},
+                        phenomenon_time,
+                        result_time,
+                        result,
+                        quality,
+                    )
+                    LOGGER.info(
+                        "DRY_RUN %s -> %s", datastream_name, observation
+                    )
+            self.metrics.inserted += size
+            return
+
+        payload = [
+            {
+                "Datastream": {"@iot.id": datastream_id},
+                "components": BULK_COMPONENTS,
+                "dataArray": rows,
+            }
+            for _, datastream_id, rows in batch
+        ]
+        started = time.monotonic()
+        try:
+            response = await self.istsos_client.insert_bulk_observations(
+                payload,
+                commit_message=self.config.commit_message,
+                on_conflict=self.config.on_conflict,
+            )
+        except Exception:
+            self.metrics.failed += size
+            LOGGER.exception(
+                "Could not insert %d observations of %d datastreams",
+                size,
+                len(batch),
+            )
+            return
+        finally:
+            self.metrics.requests += 1
+            self.metrics.request_seconds += time.monotonic() - started
+
+        duplicates = int(response.headers.get("Observations-Skipped", 0))
+        self.metrics.inserted += size - duplicates
+        self.metrics.duplicates += duplicates
+        LOGGER.success(
+            "Inserted %d observations of %d datastreams (%d duplicates)",
+            size - duplicates,
+            len(batch),
+            duplicates,
+        )
+
+    async def datastream_id(self, name: str) -> int | None:
         cached = self.datastream_ids.get(name)
         if cached is not None:
             return cached
 
         try:
-            datastream_id = self.istsos_client.get_datastream_id(name)
+            datastream_id = await self.istsos_client.get_datastream_id(name)
         except Exception:
             LOGGER.exception("Could not resolve datastream %s", name)
             return None
@@ -503,22 +747,122 @@ class Processor:
         return datastream_id
 
 
-def worker(
-    messages: queue.Queue[MqttMessage | None], processor: Processor
-) -> None:
-    while True:
-        message = messages.get()
-        try:
-            if message is None:
+class Bridge:
+    """Hands the MQTT messages to an asyncio loop in its own thread.
+
+    The MQTT network thread blocks for up to queue_put_timeout_sec while
+    queue_maxsize messages are waiting, which throttles the broker
+    connection, and drops the message after that.
+    """
+
+    def __init__(self, config: Config, metrics: Metrics):
+        self.config = config
+        self.metrics = metrics
+        self.intake = threading.BoundedSemaphore(config.queue_maxsize)
+        self.messages: asyncio.Queue[MqttMessage | None] = asyncio.Queue()
+        self.loop = asyncio.new_event_loop()
+        self.processor: Processor | None = None
+        self.thread = threading.Thread(
+            target=self.loop.run_until_complete, args=(self.run(),)
+        )
+
+    def start(self) -> None:
+        self.thread.start()
+
+    def submit(self, message: MqttMessage) -> None:
+        self.metrics.received += 1
+        if not self.intake.acquire(blocking=False):
+            self.metrics.intake_waits += 1
+            if not self.intake.acquire(
+                timeout=self.config.queue_put_timeout_sec
+            ):
+                self.metrics.dropped += 1
+                LOGGER.error(
+                    "Queue full; dropping MQTT message on %s", message.topic
+                )
                 return
-            processor.process(message)
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, message)
+
+    def close(self, timeout: float | None = None) -> None:
+        """Insert the queued messages and stop the loop."""
+        self.loop.call_soon_threadsafe(self.messages.put_nowait, None)
+        self.thread.join(timeout)
+
+    def render_metrics(self) -> str:
+        inflight = len(self.processor.buffer.tasks) if self.processor else 0
+        return self.metrics.render(self.messages.qsize(), inflight)
+
+    async def run(self) -> None:
+        istsos_client = None
+        if not self.config.dry_run:
+            from utils.istsosClient import IstsosAsyncClient
+
+            istsos_client = IstsosAsyncClient(
+                self.config.istsos_url,
+                self.config.istsos_username,
+                self.config.istsos_password,
+                timeout_sec=self.config.istsos_timeout_sec,
+                pool_size=self.config.flush_concurrency,
+            )
+
+        self.processor = Processor(self.config, istsos_client, self.metrics)
+        scheduler = asyncio.create_task(self.processor.buffer.run())
+        reporter = None
+        if self.config.metrics_log_interval_sec > 0:
+            reporter = asyncio.create_task(self.log_metrics())
+        try:
+            while True:
+                message = await self.messages.get()
+                if message is None:
+                    break
+                self.intake.release()
+                try:
+                    await self.processor.process(message)
+                except Exception:
+                    LOGGER.exception(
+                        "Could not process MQTT message on %s", message.topic
+                    )
         finally:
-            messages.task_done()
+            await self.processor.buffer.stop()
+            await scheduler
+            if reporter is not None:
+                reporter.cancel()
+            if istsos_client is not None:
+                await istsos_client.aclose()
+
+    async def log_metrics(self) -> None:
+        while True:
+            await asyncio.sleep(self.config.metrics_log_interval_sec)
+            LOGGER.notice(
+                "Metrics: %s", ", ".join(self.render_metrics().splitlines())
+            )
+
+
+def serve_metrics(port: int, render: Callable[[], str]) -> ThreadingHTTPServer:
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self) -> None:
+            if self.path.split("?", 1)[0] != "/metrics":
+                self.send_error(404)
+                return
+            body = render().encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format: str, *args: Any) -> None:
+            return
+
+    server = ThreadingHTTPServer(("", port), MetricsHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    LOGGER.info("Serving metrics on port %d at /metrics", port)
+    return server
 
 
 def build_mqtt_client(
     config: Config,
-    messages: queue.Queue[MqttMessage | None],
+    bridge: Bridge,
     stop_event: threading.Event,
 ) -> Any:
     from paho.mqtt import client as mqtt
@@ -590,21 +934,17 @@ def build_mqtt_client(
 
     def on_message(client: Any, userdata: Any, mqtt_message: Any) -> None:
         payload_text = mqtt_message.payload.decode("utf-8", errors="replace")
-        LOGGER.info(
+        LOGGER.debug(
             "Received MQTT message: topic=%s payload=%s",
             mqtt_message.topic,
             payload_text[:300],
         )
-        message = MqttMessage(
-            topic=mqtt_message.topic,
-            payload=bytes(mqtt_message.payload),
-        )
-        try:
-            messages.put_nowait(message)
-        except queue.Full:
-            LOGGER.error(
-                "Queue full; dropping MQTT message on %s", mqtt_message.topic
+        bridge.submit(
+            MqttMessage(
+                topic=mqtt_message.topic,
+                payload=bytes(mqtt_message.payload),
             )
+        )
 
     client.on_connect = on_connect
     client.on_disconnect = on_disconnect
@@ -614,28 +954,18 @@ def build_mqtt_client(
 
 
 def run(config: Config) -> None:
-    istsos_client = None
-    if not config.dry_run:
-        from utils.istsosClient import IstsosClient
-
-        istsos_client = IstsosClient(
-            config.istsos_url,
-            config.istsos_username,
-            config.istsos_password,
-            timeout_sec=config.istsos_timeout_sec,
+    metrics = Metrics()
+    bridge = Bridge(config, metrics)
+    bridge.start()
+
+    metrics_server = None
+    if config.metrics_port is not None:
+        metrics_server = serve_metrics(
+            config.metrics_port, bridge.render_metrics
         )
 
-    messages: queue.Queue[MqttMessage | None] = queue.Queue(
-        maxsize=config.queue_maxsize
-    )
     stop_event = threading.Event()
-    processor = Processor(config, istsos_client)
-    thread = threading.Thread(
-        target=worker, args=(messages, processor), daemon=True
-    )
-    thread.start()
-
-    mqtt_client = build_mqtt_client(config, messages, stop_event)
+    mqtt_client = build_mqtt_client(config, bridge, stop_event)
 
     def stop(signum: int, frame: Any) -> None:
         LOGGER.info("Stopping on signal %s", signum)
@@ -671,12 +1001,12 @@ def run(config: Config) -> None:
     finally:
         stop_event.set()
         mqtt_client.disconnect()
-        messages.join()
-        messages.put(None)
-        messages.join()
-        thread.join(timeout=5)
-        if istsos_client is not None:
-            istsos_client.close()
+        bridge.close()
+        if metrics_server is not None:
+            metrics_server.shutdown()
+        LOGGER.notice(
+            "Stopped: %s", ", ".join(bridge.render_metrics().splitlines())
+        )
 
 
 def main() -> None:
@@ -653,6 +653,26 @@ class IstsosAsyncClient:
         ]
         return await self.request("POST", "/BulkObservations", json=payload)
 
+    async def insert_bulk_observations(
+        self,
+        payload: List[Dict[str, Any]],
+        commit_message: Optional[str] = None,
+        on_conflict: Optional[str] = None,
+    ) -> httpx.Response:
+        if self.debug:
+            logger.info(
+                "About to POST BulkObservations: %d datastreams", len(payload)
+            )
+        headers = {"commit-message": commit_message} if commit_message else {}
+        params = {"onConflict": on_conflict} if on_conflict else {}
+        return await self.request(
+            "POST",
+            "/BulkObservations",
+            json=payload,
+            headers=headers,
+            params=params,
+        )
+
     async def get_datastreams(self, filter: str | None = None) -> list[dict]:
         params = {"$select": "@iot.id,name,properties"}
         resp = await self.request(